@@ -1,13 +1,24 @@
 import cv2
 import numpy as np
 from insightface.app import FaceAnalysis
+from insightface.app.common import Face
+from insightface.utils import face_align, ensure_available
+from insightface.model_zoo import model_zoo
 import time
+import asyncio
 import os
 import onnxruntime as ort
 import tempfile
+import glob
 import random
 import string
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, FIRST_COMPLETED, wait, as_completed
+import hashlib
+import zipfile
+import struct
+import copy
+import multiprocessing
+import zlib
 import subprocess
 import sys
 import tkinter as tk
@@ -15,8 +26,21 @@ from tkinter import filedialog, ttk, messagebox, scrolledtext
 import threading
 import shutil
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional, Any, Union
+from typing import List, Dict, Tuple, Optional, Any, Union, Iterator, Callable, AsyncIterator, AsyncIterable, Iterable
 import io
+import queue
+import argparse
+import collections
+import platform
+import csv
+import json
+import re
+import sqlite3
+from contextlib import contextmanager, asynccontextmanager
+from fractions import Fraction
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from multiprocessing import shared_memory
 
 # 新增：用于处理Word和PDF的库
 try:
@@ -26,10 +50,23 @@ try:
 except ImportError:
     DOCX_SUPPORTED = False
 
+# Pillow用于读取图片头信息和编码GIF
+try:
+    from PIL import Image as PILImage
+    PIL_SUPPORTED = True
+except ImportError:
+    PIL_SUPPORTED = False
+
+# tifffile用于按窗口读写超大TIFF图片（可选）
+try:
+    import tifffile
+    TIFFFILE_SUPPORTED = True
+except ImportError:
+    TIFFFILE_SUPPORTED = False
+
 # 修正PDF依赖检查 - 现在正确检查PyMuPDF(fitz)而不是PyPDF2
 try:
     import fitz  # PyMuPDF
-    from PIL import Image as PILImage
     PDF_SUPPORTED = True
 except ImportError:
     PDF_SUPPORTED = False
@@ -66,7 +103,7 @@ FILE_TYPE_MAP: Dict[str, str] = {
 # 新增：文件类型对应的扩展名
 FILE_EXTENSIONS: Dict[str, List[str]] = {
     "video": ["*.mp4", "*.avi", "*.mov", "*.mkv", "*.flv"],
-    "image": ["*.jpg", "*.jpeg", "*.png", "*.bmp", "*.gif"],
+    "image": ["*.jpg", "*.jpeg", "*.png", "*.bmp", "*.gif", "*.tif", "*.tiff", "*.webp"],
     "word": ["*.docx"],
     "pdf": ["*.pdf"]
 }
@@ -93,6 +130,747 @@ def generate_random_suffix(length: int = 6) -> str:
     letters = string.ascii_lowercase + string.digits
     return ''.join(random.choice(letters) for _ in range(length))
 
+# 图片预筛选默认参数：文档中的图标、项目符号、标志、图表、线条图等不可能包含人脸，跳过检测
+PREFILTER_DEFAULTS: Dict[str, Any] = {
+    "enabled": True,
+    "min_image_size": 24,   # 宽或高小于该像素数的图片（0表示不检查）
+    # 颜色数、信息熵和1位图检查默认关闭：低对比度或色调分离的照片可能被误判，漏掉真实人脸
+    "min_colors": 0,        # 缩略图中颜色数少于该值视为图标/图表（0表示不检查）
+    "min_entropy": 0.0,     # 缩略图灰度信息熵低于该值视为线条图/纯色（0表示不检查）
+    "skip_bilevel": False,  # 跳过PDF中的1位图（扫描线稿/蒙版）
+}
+
+# 人脸检测结果过滤默认参数（在识别之前执行，被过滤的人脸不计算特征、也不打码）
+FACE_FILTER_DEFAULTS: Dict[str, Any] = {
+    "min_face_size": 0,   # 人脸框短边下限：不小于1时为像素，小于1时为占画面短边的比例（0表示不检查）
+    "min_score": 0.0,     # 检测置信度下限（不高于检测模型阈值时不起作用）
+    "max_faces": 0,       # 每帧最多保留的人脸数，按人脸框面积从大到小保留（0表示不限制）
+}
+
+def filter_face_detections(bboxes: np.ndarray, face_filter: Dict[str, Any], frame_short_side: int,
+                           scale: float = 1.0) -> np.ndarray:
+    """按尺寸、置信度和数量过滤检测框，返回保留的行号（保持原顺序）。
+    
+    bboxes为检测模型输出的N×5数组；检测输入是缩小后的画面时，scale为其相对原画面的缩放比，
+    frame_short_side为原画面的短边，像素下限和比例下限都按原画面计算。
+    """
+    keep = np.ones(len(bboxes), dtype=bool)
+    widths = (bboxes[:, 2] - bboxes[:, 0]) / scale
+    heights = (bboxes[:, 3] - bboxes[:, 1]) / scale
+    min_size = face_filter.get("min_face_size") or 0
+    if min_size > 0:
+        threshold = min_size * frame_short_side if min_size < 1 else min_size
+        keep &= np.minimum(widths, heights) >= threshold
+    min_score = face_filter.get("min_score") or 0
+    if min_score > 0:
+        keep &= bboxes[:, 4] >= min_score
+    indices = np.flatnonzero(keep)
+    max_faces = face_filter.get("max_faces") or 0
+    if 0 < max_faces < len(indices):
+        areas = widths[indices] * heights[indices]
+        indices = np.sort(indices[np.argsort(-areas, kind="stable")[:max_faces]])
+    return indices
+
+# 预筛选跳过原因
+PREFILTER_REASONS: Dict[str, str] = {
+    "size": "尺寸过小",
+    "colors": "颜色过少",
+    "entropy": "信息熵过低",
+    "bilevel": "1位图",
+}
+
+def image_prefilter_reason(config: Dict[str, Any], width: int = 0, height: int = 0,
+                           data: Optional[bytes] = None, img: Optional[np.ndarray] = None) -> Optional[str]:
+    """判断图片是否不可能包含人脸，返回跳过原因（None表示需要检测）。
+    
+    尺寸来自图片元数据，不需要解码；颜色和信息熵在缩略图上计算，
+    JPEG数据以1/8尺寸解码，已解码的图片直接缩小。
+    """
+    if not config.get("enabled"):
+        return None
+    min_size = config.get("min_image_size", 0)
+    if min_size and width and height and min(width, height) < min_size:
+        return "size"
+    if not (config.get("min_colors") or config.get("min_entropy")):
+        return None
+    if img is None and data is not None:
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_COLOR_8)
+    if img is None or img.ndim != 3:
+        return None  # 无法快速解码时交给完整流程
+    if min_size and min(img.shape[:2]) * (8 if data is not None else 1) < min_size:
+        return "size"
+    scale = 64 / max(img.shape[:2])
+    thumb = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else img
+    if config.get("min_colors"):
+        quantized = (thumb >> 2).astype(np.uint32)
+        codes = (quantized[..., 0] << 12) | (quantized[..., 1] << 6) | quantized[..., 2]
+        if len(np.unique(codes)) < config["min_colors"]:
+            return "colors"
+    if config.get("min_entropy"):
+        gray = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+        hist = np.bincount(gray.ravel(), minlength=256) / gray.size
+        hist = hist[hist > 0]
+        if -(hist * np.log2(hist)).sum() < config["min_entropy"]:
+            return "entropy"
+    return None
+
+def format_prefilter_summary(skip_counts: Dict[str, int]) -> str:
+    """生成预筛选跳过统计"""
+    total = sum(skip_counts.values())
+    details = "，".join(f"{PREFILTER_REASONS[reason]} {count} 张"
+                       for reason, count in skip_counts.items() if count)
+    return f"预筛选跳过 {total} 张不可能包含人脸的图片" + (f"（{details}）" if details else "")
+
+# libjpeg标准亮度量化表（质量50），用于估计JPEG的原始质量
+JPEG_STD_LUMINANCE_SUM = sum([
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99,
+])
+
+def estimate_jpeg_quality(data: bytes) -> Optional[int]:
+    """根据JPEG的亮度量化表(DQT)估计编码质量，无法识别时返回None"""
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        length = int.from_bytes(data[pos + 2:pos + 4], "big")
+        if marker == 0xDB:
+            segment = data[pos + 4:pos + 2 + length]
+            offset = 0
+            while offset < len(segment):
+                precision, table_id = segment[offset] >> 4, segment[offset] & 0x0F
+                size = 128 if precision else 64
+                table = segment[offset + 1:offset + 1 + size]
+                if table_id == 0:
+                    values = (np.frombuffer(table, dtype=">u2") if precision
+                              else np.frombuffer(table, dtype=np.uint8))
+                    scale = values.astype(np.float64).sum() * 100 / JPEG_STD_LUMINANCE_SUM
+                    quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+                    return int(min(100, max(1, round(quality))))
+                offset += 1 + size
+        if marker == 0xDA:  # 图像数据开始，之后不再有量化表
+            break
+        pos += 2 + length
+    return None
+
+def image_blob_size(data: bytes) -> Tuple[int, int]:
+    """只读取图片头信息获取尺寸，不解码像素；无法识别时返回(0, 0)"""
+    if PIL_SUPPORTED:
+        try:
+            with PILImage.open(io.BytesIO(data)) as pil_img:
+                return pil_img.size
+        except Exception:
+            pass
+    return 0, 0
+
+# 按文件头判断图片格式（返回扩展名，不含点）
+IMAGE_BLOB_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF8", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+)
+
+def image_blob_format(data: bytes) -> Optional[str]:
+    """根据文件头判断内存中图片的格式，无法识别时返回None"""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    for signature, ext in IMAGE_BLOB_SIGNATURES:
+        if data.startswith(signature):
+            return ext
+    return None
+
+def decode_image_blob(data: bytes) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], bool]:
+    """在内存中解码图片，返回(BGR图像, 透明通道, 是否灰度图)，编码时据此还原通道"""
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        return None, None, False
+    if img.dtype != np.uint8:
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return img, None, False
+    if img.ndim == 2:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR), None, True
+    if img.shape[2] == 4:
+        return np.ascontiguousarray(img[:, :, :3]), img[:, :, 3], False
+    return img, None, False
+
+def jpeg_metadata_segments(data: bytes) -> bytes:
+    """取出JPEG中的EXIF(APP1)和ICC色彩配置(APP2)段，原样返回拼接后的字节"""
+    segments = []
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        length = int.from_bytes(data[pos + 2:pos + 4], "big")
+        segment = data[pos:pos + 2 + length]
+        if (marker == 0xE1 and segment[4:10] == b"Exif\x00\x00") or \
+                (marker == 0xE2 and segment[4:16] == b"ICC_PROFILE\x00"):
+            segments.append(segment)
+        if marker == 0xDA:  # 图像数据开始
+            break
+        pos += 2 + length
+    return b"".join(segments)
+
+def copy_jpeg_metadata(source_data: bytes, encoded: bytes) -> bytes:
+    """把原图的EXIF和ICC段插入重新编码的JPEG（紧跟SOI及JFIF段之后）。
+    
+    解码时未按EXIF方向旋转像素（IMREAD_UNCHANGED），原方向标记仍然适用。
+    """
+    metadata = jpeg_metadata_segments(source_data)
+    if not metadata:
+        return encoded
+    pos = 2
+    if encoded[2:4] == b"\xff\xe0":  # 保持JFIF段在最前
+        pos += 2 + int.from_bytes(encoded[4:6], "big")
+    return encoded[:pos] + metadata + encoded[pos:]
+
+def encode_image_like(img: np.ndarray, ext: str, source_data: bytes,
+                      alpha: Optional[np.ndarray] = None, gray: bool = False) -> bytes:
+    """按原始格式编码处理后的图片：JPEG沿用原质量并保留EXIF/ICC，保留透明通道和灰度"""
+    ext = ext.lower()
+    if gray:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    elif alpha is not None:
+        img = np.dstack([img, alpha])
+    if ext in ("jpg", "jpeg"):
+        encoded = encode_image_bytes(img, ext, estimate_jpeg_quality(source_data) or 95)
+        return copy_jpeg_metadata(source_data, encoded)
+    if ext == "gif" and PIL_SUPPORTED:
+        rgb = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB if gray else
+                           (cv2.COLOR_BGRA2RGBA if alpha is not None else cv2.COLOR_BGR2RGB))
+        buffer = io.BytesIO()
+        PILImage.fromarray(rgb).convert("P", palette=PILImage.ADAPTIVE).save(buffer, format="GIF")
+        return buffer.getvalue()
+    if ext in ("png", "bmp", "tif", "tiff", "webp"):
+        success, buffer = cv2.imencode(f".{ext}", img)
+        if success:
+            return buffer.tobytes()
+    return encode_image_bytes(img, "png")
+
+# 动画帧近似重复判定：缩小到该边长的灰度图逐像素比较，最大差值不超过阈值时复用人脸框
+ANIMATION_SIGNATURE_SIZE = 32
+ANIMATION_NEAR_DUPLICATE_DIFF = 2
+# 支持逐帧处理的动画格式
+ANIMATION_EXTENSIONS = (".gif", ".webp")
+# 写出GIF时透明色使用的调色板索引（各帧其余颜色占用0~254）
+GIF_TRANSPARENT_INDEX = 255
+
+def is_animated_blob(data: bytes) -> bool:
+    """判断图片数据是否为多帧动画（GIF/WebP）"""
+    if not PIL_SUPPORTED:
+        return False
+    try:
+        with PILImage.open(io.BytesIO(data)) as pil_img:
+            return getattr(pil_img, "n_frames", 1) > 1
+    except Exception:
+        return False
+
+def read_animation_frames(data: bytes) -> Tuple[List[np.ndarray], List[int], Dict[str, Any]]:
+    """解码动画的全部帧，返回(合成后的RGBA帧, 每帧时长ms, 写出所需的动画参数)。
+    
+    Pillow逐帧定位时已按处置方式合成完整画面，因此每帧都是完整画布，写出时不依赖前一帧。
+    GIF的各帧可能使用各自的局部调色板，因此逐帧记录合成画面实际使用的颜色作为该帧的调色板，
+    并记录是否有透明像素，写出时据此逐帧还原调色板。
+    """
+    frames: List[np.ndarray] = []
+    durations: List[int] = []
+    with PILImage.open(io.BytesIO(data)) as pil_img:
+        params: Dict[str, Any] = {"format": pil_img.format}
+        if "loop" in pil_img.info:
+            params["loop"] = pil_img.info["loop"]
+        for index in range(pil_img.n_frames):
+            pil_img.seek(index)
+            frames.append(np.array(pil_img.convert("RGBA")))
+            durations.append(int(pil_img.info.get("duration", 100)))
+    if params["format"] == "GIF":
+        transparent = any(bool((frame[:, :, 3] == 0).any()) for frame in frames)
+        params["transparency"] = GIF_TRANSPARENT_INDEX if transparent else None
+        limit = GIF_TRANSPARENT_INDEX if transparent else 256
+        params["palettes"] = [animation_frame_palette(frame, limit) for frame in frames]
+    # WebP中出现VP8L块说明包含无损编码的帧，此时按无损写出
+    params["lossless"] = params["format"] == "WEBP" and b"VP8L" in data
+    return frames, durations, params
+
+def animation_frame_palette(rgba: np.ndarray, limit: int) -> Optional[np.ndarray]:
+    """帧中不透明像素实际使用的颜色（K×3），超过limit种时返回None"""
+    rgb = rgba[:, :, :3][rgba[:, :, 3] > 0]
+    codes = np.unique((rgb[:, 0].astype(np.uint32) << 16) | (rgb[:, 1].astype(np.uint32) << 8) | rgb[:, 2])
+    if len(codes) > limit:
+        return None
+    return np.stack([codes >> 16, (codes >> 8) & 0xFF, codes & 0xFF], axis=1).astype(np.uint8)
+
+def map_to_palette(rgb: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    """把RGB像素映射为调色板中最接近颜色的索引，调色板中已有的颜色精确对应"""
+    codes = (rgb[..., 0].astype(np.uint32) << 16) | (rgb[..., 1].astype(np.uint32) << 8) | rgb[..., 2]
+    unique, inverse = np.unique(codes.ravel(), return_inverse=True)
+    colors = np.stack([unique >> 16, (unique >> 8) & 0xFF, unique & 0xFF], axis=1).astype(np.int32)
+    nearest = np.empty(len(unique), dtype=np.uint8)
+    for start in range(0, len(unique), 4096):
+        chunk = colors[start:start + 4096]
+        distances = ((chunk[:, None, :] - palette[None, :, :].astype(np.int32)) ** 2).sum(axis=2)
+        nearest[start:start + 4096] = distances.argmin(axis=1)
+    return nearest[inverse].reshape(codes.shape)
+
+def animation_frame_signature(rgba: np.ndarray) -> np.ndarray:
+    """近似重复帧比较用的缩略灰度图"""
+    gray = cv2.cvtColor(rgba, cv2.COLOR_RGBA2GRAY)
+    return cv2.resize(gray, (ANIMATION_SIGNATURE_SIZE, ANIMATION_SIGNATURE_SIZE),
+                      interpolation=cv2.INTER_AREA).astype(np.int16)
+
+def encode_animation(frames: List[np.ndarray], durations: List[int], params: Dict[str, Any], ext: str) -> bytes:
+    """把处理后的RGBA帧编码为GIF或WebP动画，保留帧时长和循环次数。
+    
+    源文件为GIF时每帧按该帧原有的颜色量化（不抖动），人脸以外的像素与原图颜色完全一致；
+    原帧颜色超过调色板容量时改为自适应量化。
+    """
+    images = [PILImage.fromarray(frame, "RGBA") for frame in frames]
+    options: Dict[str, Any] = {"save_all": True, "duration": durations}
+    if "loop" in params:
+        options["loop"] = params["loop"]
+    buffer = io.BytesIO()
+    if ext == ".gif":
+        palettes, transparency = params.get("palettes"), params.get("transparency")
+        if palettes is not None:
+            limit = GIF_TRANSPARENT_INDEX if transparency is not None else 256
+            quantized = []
+            for frame, image, palette in zip(frames, images, palettes):
+                if palette is not None:
+                    indices = map_to_palette(frame[:, :, :3], palette)
+                else:
+                    adaptive = image.convert("RGB").quantize(colors=limit, dither=PILImage.Dither.NONE)
+                    indices = np.array(adaptive)
+                    palette = np.array(adaptive.getpalette()[:limit * 3], dtype=np.uint8).reshape(-1, 3)
+                if transparency is not None:
+                    indices[frame[:, :, 3] == 0] = transparency
+                indexed = PILImage.fromarray(indices, "P")
+                full_palette = np.zeros((256, 3), dtype=np.uint8)
+                full_palette[:len(palette)] = palette
+                if transparency is not None:
+                    # Pillow按颜色比较相邻帧来裁剪写出区域，透明色须与帧中的颜色都不同，
+                    # 否则与透明背景同色的像素会被裁掉，处置后变成透明
+                    used = set(((palette[:, 0].astype(np.uint32) << 16) | (palette[:, 1].astype(np.uint32) << 8)
+                                | palette[:, 2]).tolist())
+                    unused = next(code for code in range(1 << 24) if code not in used)
+                    full_palette[transparency] = (unused >> 16, (unused >> 8) & 0xFF, unused & 0xFF)
+                indexed.putpalette(full_palette.ravel().tolist())
+                quantized.append(indexed)
+            images = quantized
+            if transparency is not None:
+                # 每帧都是完整画布，透明区域须先清除上一帧
+                options.update(transparency=transparency, disposal=2)
+        images[0].save(buffer, format="GIF", append_images=images[1:], optimize=False, **options)
+    else:
+        images[0].save(buffer, format="WEBP", append_images=images[1:], lossless=params.get("lossless", False),
+                       quality=90, **options)
+    return buffer.getvalue()
+
+# 像素数超过该值的图片按窗口分块处理
+IMAGE_WINDOWED_MIN_PIXELS = 64 * 1024 * 1024
+# 分块检测的窗口边长和相邻窗口的重叠（重叠应大于图片中最大的人脸）
+IMAGE_WINDOW_SIZE = 2048
+IMAGE_WINDOW_OVERLAP = 256
+# 解码压缩TIFF时每批读入的压缩数据上限
+TIFF_DECODE_BUFFER = 16 * 1024 * 1024
+# 分块写出TIFF时的图块边长（TIFF要求为16的倍数）
+IMAGE_OUTPUT_TILE = 512
+
+def merge_window_boxes(boxes: np.ndarray, containment: float = 0.5) -> np.ndarray:
+    """合并相邻窗口重叠区内重复检测的人脸框。
+    
+    按面积从大到小保留，与已保留框的交集超过自身面积containment比例的框视为同一张人脸
+    （窗口边缘被截断的框面积较小，会被完整的框吸收）。
+    """
+    if len(boxes) < 2:
+        return boxes
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    kept: List[int] = []
+    for index in np.argsort(-areas):
+        box = boxes[index]
+        duplicate = False
+        for kept_index in kept:
+            other = boxes[kept_index]
+            inter_w = min(box[2], other[2]) - max(box[0], other[0])
+            inter_h = min(box[3], other[3]) - max(box[1], other[1])
+            if inter_w > 0 and inter_h > 0 and inter_w * inter_h > containment * areas[index]:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(index)
+    return boxes[sorted(kept)]
+
+class WindowedImage:
+    """按窗口读取超大图片，不把整幅图片解码到内存。
+    
+    有tifffile时，未压缩的TIFF直接内存映射，压缩的TIFF逐块解码到磁盘上的临时映射文件；
+    其他格式只能整幅解码（内存占用与图片大小相同）。窗口统一返回BGR(uint8)，
+    写回时按原图的通道（灰度、RGB、RGBA）还原。
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.mapped = False
+        self.rgb_order = False
+        self.array: Optional[np.ndarray] = None
+        self._tiff: Any = None
+        if TIFFFILE_SUPPORTED and path.lower().endswith((".tif", ".tiff")):
+            self._tiff = tifffile.TiffFile(path)
+            page = self._tiff.pages[0]
+            try:
+                self.array = tifffile.memmap(path)
+            except ValueError:
+                # 压缩的TIFF：解码到临时映射文件，每次只读入buffersize大小的压缩数据
+                self.array = page.asarray(out="memmap", buffersize=TIFF_DECODE_BUFFER)
+            self.mapped = True
+            self.rgb_order = True
+        else:
+            self.array = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+            if self.array is None:
+                raise Exception(f"无法读取图片: {path}")
+        if self.array.dtype != np.uint8 or not (self.array.ndim == 2 or
+                                                (self.array.ndim == 3 and self.array.shape[2] in (3, 4))):
+            raise ValueError(f"不支持的图片数据: {self.array.shape} {self.array.dtype}")
+        self.height, self.width = self.array.shape[:2]
+    
+    def read_bgr(self, y1: int, y2: int, x1: int, x2: int) -> np.ndarray:
+        """读取窗口并转为BGR"""
+        window = np.asarray(self.array[y1:y2, x1:x2])
+        if window.ndim == 2:
+            return cv2.cvtColor(window, cv2.COLOR_GRAY2BGR)
+        if window.shape[2] == 4:
+            return cv2.cvtColor(window, cv2.COLOR_RGBA2BGR if self.rgb_order else cv2.COLOR_BGRA2BGR)
+        return cv2.cvtColor(window, cv2.COLOR_RGB2BGR) if self.rgb_order else window.copy()
+    
+    def to_native(self, bgr: np.ndarray, y1: int, y2: int, x1: int, x2: int) -> np.ndarray:
+        """把打码后的BGR窗口还原为原图的通道排列（透明通道取自原图）"""
+        channels = 1 if self.array.ndim == 2 else self.array.shape[2]
+        if channels == 1:
+            return cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+        native = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB) if self.rgb_order else bgr
+        if channels == 4:
+            native = np.dstack([native, np.asarray(self.array[y1:y2, x1:x2, 3])])
+        return native
+    
+    def close(self) -> None:
+        self.array = None
+        if self._tiff is not None:
+            self._tiff.close()
+
+def image_pixel_count(path: str) -> int:
+    """只读取文件头获取图片像素数，无法识别时返回0"""
+    try:
+        if TIFFFILE_SUPPORTED and path.lower().endswith((".tif", ".tiff")):
+            with tifffile.TiffFile(path) as tif:
+                shape = tif.pages[0].shape
+                return int(shape[0]) * int(shape[1])
+        if PIL_SUPPORTED:
+            with PILImage.open(path) as pil_img:
+                return pil_img.size[0] * pil_img.size[1]
+    except Exception:
+        pass
+    return 0
+
+# 批量处理目录时识别的图片扩展名
+BULK_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+def collect_bulk_images(input_root: str, output_root: str, list_path: Optional[str] = None,
+                        force: bool = False) -> Tuple[List[Tuple[str, str, str]], int]:
+    """列出批量处理的图片，返回([(输入路径, 输出路径, 相对路径)], 已是最新而跳过的数量)。
+    
+    默认递归遍历input_root；指定list_path时改为读取其中的路径（每行一个，相对路径以input_root为基准）。
+    输出保持相对input_root的目录结构；输出文件已存在且不早于输入时视为已是最新，force为True时全部重新处理。
+    """
+    if list_path:
+        with open(list_path, "r", encoding="utf-8-sig") as f:
+            sources = [os.path.join(input_root, line.strip()) for line in f if line.strip()]
+    else:
+        sources = []
+        for dir_path, dir_names, file_names in os.walk(input_root):
+            dir_names.sort()
+            sources.extend(os.path.join(dir_path, name) for name in sorted(file_names)
+                           if name.lower().endswith(BULK_IMAGE_EXTENSIONS))
+    jobs: List[Tuple[str, str, str]] = []
+    up_to_date = 0
+    output_abs = os.path.abspath(output_root)
+    for source in sources:
+        source_abs = os.path.abspath(source)
+        # 输出目录位于输入目录之内时不处理已有的输出
+        if source_abs.startswith(output_abs + os.sep):
+            continue
+        relative = os.path.relpath(source_abs, os.path.abspath(input_root))
+        if relative.startswith(".."):
+            raise ValueError(f"文件不在输入目录内: {source}")
+        target = os.path.join(output_root, relative)
+        if not force:
+            try:
+                if os.path.getmtime(target) >= os.path.getmtime(source_abs):
+                    up_to_date += 1
+                    continue
+            except OSError:
+                pass
+        jobs.append((source_abs, target, relative))
+    return jobs, up_to_date
+
+# Word压缩包中需要处理的图片条目
+DOCX_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tif", ".tiff", ".webp")
+
+def is_docx_image_entry(name: str) -> bool:
+    """是否为Word压缩包中的位图条目（正文、页眉页脚等引用的media图片及文档缩略图）"""
+    return (name.startswith("word/media/") or name.startswith("docProps/thumbnail")) \
+        and name.lower().endswith(DOCX_IMAGE_EXTENSIONS)
+
+# zip文件头中32位/16位字段的上限，大小、偏移量或条目数达到时改用zip64扩展字段
+ZIP_32BIT_LIMIT = 0xFFFFFFFF
+ZIP_16BIT_LIMIT = 0xFFFF
+ZIP_LOCAL_HEADER = struct.Struct("<4sHHHHHLLLHH")
+ZIP_CENTRAL_HEADER = struct.Struct("<4sBBHHHHHLLLHHHHHLL")
+
+class RawZipWriter:
+    """只用ZipInfo的公开字段写zip：未修改的条目原样复制压缩数据，不解压也不重新压缩。
+    
+    本地文件头在数据之前写出，其中已包含大小和CRC，因此不需要数据描述符；
+    大小、偏移量或条目数超出32位/16位字段时写入zip64扩展字段和zip64结束记录。
+    """
+    def __init__(self, path: str) -> None:
+        self.fp = open(path, "wb")
+        self.comment = b""
+        self._entries: List[Tuple[zipfile.ZipInfo, int, int, int, int, int]] = []
+    
+    def __enter__(self) -> "RawZipWriter":
+        return self
+    
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.fp.close()
+    
+    def copy_raw(self, source: Any, info: zipfile.ZipInfo) -> None:
+        """从源zip文件对象复制条目的压缩数据"""
+        source.seek(info.header_offset)
+        header = ZIP_LOCAL_HEADER.unpack(source.read(ZIP_LOCAL_HEADER.size))
+        if header[0] != b"PK\x03\x04":
+            raise zipfile.BadZipFile(f"zip条目文件头无效: {info.filename}")
+        source.seek(header[9] + header[10], io.SEEK_CUR)
+        self._write_header(info, info.CRC, info.compress_size, info.file_size)
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = source.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                raise zipfile.BadZipFile(f"zip条目数据不完整: {info.filename}")
+            self.fp.write(chunk)
+            remaining -= len(chunk)
+    
+    def writestr(self, info: zipfile.ZipInfo, data: bytes) -> None:
+        """按info.compress_type压缩并写入新数据（存储方式原样写入，其他压缩方式统一按deflate写入）"""
+        info = copy.copy(info)
+        if info.compress_type == zipfile.ZIP_STORED:
+            compressed = data
+        else:
+            info.compress_type = zipfile.ZIP_DEFLATED
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            compressed = compressor.compress(data) + compressor.flush()
+        self._write_header(info, zlib.crc32(data), len(compressed), len(data))
+        self.fp.write(compressed)
+    
+    def _write_header(self, info: zipfile.ZipInfo, crc: int, compress_size: int, file_size: int) -> None:
+        offset = self.fp.tell()
+        name = info.filename.encode("utf-8")
+        # 数据描述符标志清除；非ASCII文件名按UTF-8标记
+        flags = (info.flag_bits & ~0x08) | (0x800 if not info.filename.isascii() else 0)
+        zip64_sizes = compress_size >= ZIP_32BIT_LIMIT or file_size >= ZIP_32BIT_LIMIT
+        extra = strip_zip64_extra(info.extra)
+        if zip64_sizes:
+            extra = struct.pack("<HHQQ", 1, 16, file_size, compress_size) + extra
+        dos_time, dos_date = zip_dos_datetime(info.date_time)
+        self.fp.write(ZIP_LOCAL_HEADER.pack(
+            b"PK\x03\x04", max(info.extract_version, 45 if zip64_sizes else 20), flags, info.compress_type,
+            dos_time, dos_date, crc, 0xFFFFFFFF if zip64_sizes else compress_size,
+            0xFFFFFFFF if zip64_sizes else file_size, len(name), len(extra)))
+        self.fp.write(name + extra)
+        self._entries.append((info, flags, crc, compress_size, file_size, offset))
+    
+    def close(self) -> None:
+        """写出中央目录和结束记录并关闭文件"""
+        if self.fp.closed:
+            return
+        directory_offset = self.fp.tell()
+        for info, flags, crc, compress_size, file_size, offset in self._entries:
+            name = info.filename.encode("utf-8")
+            zip64_values = [value for value in (file_size, compress_size, offset) if value >= ZIP_32BIT_LIMIT]
+            extra = strip_zip64_extra(info.extra)
+            if zip64_values:
+                extra = struct.pack(f"<HH{len(zip64_values)}Q", 1, 8 * len(zip64_values), *zip64_values) + extra
+            dos_time, dos_date = zip_dos_datetime(info.date_time)
+            version = max(info.extract_version, 45 if zip64_values else 20)
+            self.fp.write(ZIP_CENTRAL_HEADER.pack(
+                b"PK\x01\x02", max(info.create_version, version), info.create_system, version, flags,
+                info.compress_type, dos_time, dos_date, crc, zip_field(compress_size, ZIP_32BIT_LIMIT, 0xFFFFFFFF),
+                zip_field(file_size, ZIP_32BIT_LIMIT, 0xFFFFFFFF), len(name), len(extra), len(info.comment), 0,
+                info.internal_attr, info.external_attr, zip_field(offset, ZIP_32BIT_LIMIT, 0xFFFFFFFF)))
+            self.fp.write(name + extra + info.comment)
+        directory_end = self.fp.tell()
+        count, directory_size = len(self._entries), directory_end - directory_offset
+        if count >= ZIP_16BIT_LIMIT or directory_offset >= ZIP_32BIT_LIMIT or directory_size >= ZIP_32BIT_LIMIT:
+            self.fp.write(struct.pack("<4sQHHLLQQQQ", b"PK\x06\x06", 44, 45, 45, 0, 0, count, count,
+                                      directory_size, directory_offset))
+            self.fp.write(struct.pack("<4sLQL", b"PK\x06\x07", 0, directory_end, 1))
+        self.fp.write(struct.pack("<4sHHHHLLH", b"PK\x05\x06", 0, 0, zip_field(count, ZIP_16BIT_LIMIT, 0xFFFF),
+                                  zip_field(count, ZIP_16BIT_LIMIT, 0xFFFF), zip_field(directory_size, ZIP_32BIT_LIMIT, 0xFFFFFFFF),
+                                  zip_field(directory_offset, ZIP_32BIT_LIMIT, 0xFFFFFFFF), len(self.comment)))
+        self.fp.write(self.comment)
+        self.fp.close()
+
+def zip_field(value: int, limit: int, full: int) -> int:
+    """zip文件头字段的取值：达到上限时写入全1（full），实际值放在zip64扩展字段或zip64结束记录中"""
+    return value if value < limit else full
+
+def strip_zip64_extra(extra: bytes) -> bytes:
+    """去掉扩展字段中的zip64字段（由写出方按需重建），保留其他扩展字段"""
+    kept = b""
+    pos = 0
+    while pos + 4 <= len(extra):
+        header_id, size = struct.unpack("<HH", extra[pos:pos + 4])
+        if header_id != 1:
+            kept += extra[pos:pos + 4 + size]
+        pos += 4 + size
+    return kept
+
+def zip_dos_datetime(date_time: Tuple[int, int, int, int, int, int]) -> Tuple[int, int]:
+    """把ZipInfo.date_time转换为zip文件头中的DOS时间和日期"""
+    year, month, day, hour, minute, second = date_time
+    return (hour << 11) | (minute << 5) | (second // 2), (max(year, 1980) - 1980) << 9 | (month << 5) | day
+
+def encode_image_bytes(img: np.ndarray, ext: str, jpeg_quality: int = 95) -> bytes:
+    """在内存中编码图片，JPEG保持JPEG，其余格式使用PNG"""
+    if ext.lower() in ("jpg", "jpeg"):
+        success, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+    else:
+        success, buffer = cv2.imencode(".png", img)
+    if not success:
+        raise Exception(f"图片编码失败: {ext}")
+    return buffer.tobytes()
+
+def encode_pdf_image_stream(img: np.ndarray, image_ext: str) -> Tuple[bytes, str]:
+    """把BGR图像编码为PDF图片流，返回(流数据, Filter)；JPEG保持DCT编码，其余使用Flate压缩的RGB"""
+    if image_ext.lower() in ("jpg", "jpeg"):
+        return encode_image_bytes(img, image_ext), "/DCTDecode"
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return zlib.compress(rgb.tobytes(), 6), "/FlateDecode"
+
+# PDF对象中的间接引用，如 "12 0 R"
+PDF_REFERENCE_PATTERN = re.compile(r"(\d+) (\d+) R")
+
+# PDF中的ICC色彩空间数组，如 "[/ICCBased 12 0 R]"
+PDF_ICC_COLORSPACE_PATTERN = re.compile(r"^\[\s*/ICCBased\s*(\d+) \d+ R\s*\]$")
+# 索引色彩空间的基础色彩空间（名称、数组或间接引用）
+PDF_INDEXED_BASE_PATTERN = re.compile(r"^\[\s*/Indexed\s*(\[[^\]]*\]|\d+ \d+ R|/\w+)")
+
+def pdf_image_rgb_colorspace(pdf_document: Any, xref: int) -> str:
+    """改写后的RGB数据应使用的色彩空间。
+    
+    解码得到的RGB数值仍是原ICC色彩空间（或索引色的ICC基础色彩空间）中的数值，
+    该ICC配置为3通道时保留它，颜色不会偏移；其他色彩空间在解码时已转换为RGB，使用DeviceRGB。
+    """
+    def resolve(value: str) -> str:
+        if PDF_REFERENCE_PATTERN.fullmatch(value):
+            return pdf_document.xref_object(int(value.split()[0]), compressed=True).strip()
+        return value
+    
+    colorspace = pdf_document.xref_get_key(xref, "ColorSpace")[1]
+    indexed = PDF_INDEXED_BASE_PATTERN.match(resolve(colorspace))
+    if indexed:
+        colorspace = indexed.group(1)
+    icc = PDF_ICC_COLORSPACE_PATTERN.match(resolve(colorspace))
+    if icc and pdf_document.xref_get_key(int(icc.group(1)), "N")[1] == "3":
+        return colorspace
+    return "/DeviceRGB"
+
+def write_pdf_image_stream(pdf_document: Any, xref: int, stream: bytes, stream_filter: str,
+                           width: int, height: int) -> None:
+    """原地改写图片对象的数据流，保留对象编号、3通道ICC色彩空间和软蒙版(SMask)，不修改页面内容。
+    
+    颜色键蒙版(Mask数组)基于原色彩空间的数值，改写前按原图算出透明区域，转换为软蒙版。
+    """
+    alpha = None
+    if pdf_document.xref_get_key(xref, "Mask")[0] == "array":
+        # PyMuPDF解码时已应用颜色键，透明度在alpha通道中
+        pix = fitz.Pixmap(pdf_document, xref)
+        if pix.alpha and (pix.width, pix.height) == (width, height):
+            alpha = np.frombuffer(pix.samples, dtype=np.uint8).reshape(height, width, pix.n)[:, :, -1].copy()
+    colorspace = pdf_image_rgb_colorspace(pdf_document, xref)
+    pdf_document.update_stream(xref, stream, compress=False)
+    for key, value in (("Filter", stream_filter), ("Width", str(width)), ("Height", str(height)),
+                       ("ColorSpace", colorspace), ("BitsPerComponent", "8"),
+                       ("Decode", "null"), ("DecodeParms", "null")):
+        pdf_document.xref_set_key(xref, key, value)
+    if pdf_document.xref_get_key(xref, "Mask")[0] == "array":
+        pdf_document.xref_set_key(xref, "Mask", "null")
+        if alpha is not None:
+            smask = pdf_document.get_new_xref()
+            pdf_document.update_object(smask, f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                                              f"/ColorSpace /DeviceGray /BitsPerComponent 8 >>")
+            pdf_document.update_stream(smask, alpha.tobytes())
+            pdf_document.xref_set_key(xref, "SMask", f"{smask} 0 R")
+
+def pdf_image_cache_material(pdf_document: Any, xref: int) -> bytes:
+    """生成PDF图片缓存键所需的内容：原始数据流加上影响解码的字典项。
+    
+    间接引用的颜色空间、调色板等对象展开一层，对象编号本身不参与计算，
+    因此同一图片出现在不同文档中也能命中缓存。
+    """
+    parts = [pdf_document.xref_stream_raw(xref)]
+    for key in ("Filter", "DecodeParms", "Width", "Height", "BitsPerComponent", "ColorSpace", "Decode", "ImageMask"):
+        _, value = pdf_document.xref_get_key(xref, key)
+        parts.append(f"/{key} {PDF_REFERENCE_PATTERN.sub('R', value)}".encode())
+        for match in PDF_REFERENCE_PATTERN.finditer(value):
+            ref = int(match.group(1))
+            parts.append(PDF_REFERENCE_PATTERN.sub("R", pdf_document.xref_object(ref, compressed=True)).encode())
+            if pdf_document.xref_is_stream(ref):
+                parts.append(pdf_document.xref_stream_raw(ref))
+    return b"\n".join(parts)
+
+def iter_prefetched(iterable: Any, depth: int = 2) -> Iterator[Any]:
+    """在后台线程中提前迭代（读取/解码），使其与调用方的处理重叠；队列长度有界"""
+    items: "queue.Queue[Any]" = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    sentinel = object()
+    errors: List[BaseException] = []
+    
+    def produce() -> None:
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        items.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            while not stop.is_set():
+                try:
+                    items.put(sentinel, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+    
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is sentinel:
+                break
+            yield item
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+
 # 获取资源路径（兼容PyInstaller打包）
 def get_resource_path(relative_path: str) -> str:
     """获取资源文件的绝对路径，兼容开发环境和打包后的EXE"""
@@ -109,117 +887,4739 @@ def get_resource_path(relative_path: str) -> str:
     
     return os.path.join(base_path, relative_path)
 
-class FaceBlurApp:
-    def __init__(self, root: tk.Tk) -> None:
-        self.root = root
-        self.root.title("人脸打码工具")
-        self.root.geometry("950x850")
-        self.root.resizable(True, True)
-        
-        # 设置中文字体支持
-        self.style = ttk.Style()
-        self.style.configure("TLabel", font=("SimHei", 10))
-        self.style.configure("TButton", font=("SimHei", 10))
-        self.style.configure("TCombobox", font=("SimHei", 10))
-        
-        # 资源路径初始化
-        self.insightface_dir = get_resource_path(".insightface")
-        self.ffmpeg_path = get_resource_path(os.path.join("ffmpeg", "ffmpeg.exe"))
-        
-        # 验证资源是否存在
-        self.validate_resources()
-        
-        # 变量初始化 - 使用中文作为显示值
-        self.input_path = tk.StringVar()
-        self.output_path = tk.StringVar()
-        self.whitelist_dir = tk.StringVar()
-        self.blur_type = tk.StringVar(value=REVERSE_BLUR_TYPE_MAP["circle"])  # 默认圆形模糊
-        self.similarity_threshold = tk.DoubleVar(value=0.5)
-        self.blur_strength = tk.IntVar(value=50)
-        self.feather_radius = tk.IntVar(value=8)
-        self.opacity = tk.DoubleVar(value=0.95)
-        self.start_time = tk.DoubleVar(value=0)
-        self.duration = tk.DoubleVar(value=0)
-        self.mosaic_block_size = tk.IntVar(value=15)
-        # 新增：文件类型选择
-        self.file_type = tk.StringVar(value="视频文件")
-        
-        # 用于直接输入的变量
-        self.similarity_threshold_str = tk.StringVar(value="0.5")
-        self.blur_strength_str = tk.StringVar(value="50")
-        self.feather_radius_str = tk.StringVar(value="8")
-        self.opacity_str = tk.StringVar(value="0.95")
-        self.start_time_str = tk.StringVar(value="0")
-        self.duration_str = tk.StringVar(value="0")
-        self.mosaic_block_size_str = tk.StringVar(value="15")
-        
-        # 绑定变量更新事件
-        self.bind_variable_updates()
-        
-        self.processing = False
-        self.process_thread: Optional[threading.Thread] = None
-        self.cancel_event = threading.Event()
-        
-        self.create_widgets()
-        self.initialize_log_messages()  # 初始化日志信息
+class BudgetedFaceAnalysis(FaceAnalysis):
+    """按指定的SessionOptions创建各模型会话的FaceAnalysis。
     
-    def bind_variable_updates(self):
-        """绑定变量更新事件，实现滑块和输入框的双向同步"""
-        # 相似度阈值
-        def update_similarity_from_scale(value):
-            self.similarity_threshold_str.set(f"{float(value):.2f}")
-        
-        def update_similarity_from_entry(*args):
-            try:
-                value = float(self.similarity_threshold_str.get())
-                if 0.1 <= value <= 0.9:
-                    self.similarity_threshold.set(value)
-            except:
-                pass
-        
-        self.similarity_threshold.trace_add("write", lambda *args: update_similarity_from_scale(self.similarity_threshold.get()))
-        self.similarity_threshold_str.trace_add("write", update_similarity_from_entry)
-        
-        # 模糊强度
-        def update_blur_from_scale(value):
-            self.blur_strength_str.set(str(int(float(value))))
-        
-        def update_blur_from_entry(*args):
-            try:
-                value = int(self.blur_strength_str.get())
-                if 5 <= value <= 100:
-                    self.blur_strength.set(value)
-            except:
-                pass
-        
-        self.blur_strength.trace_add("write", lambda *args: update_blur_from_scale(self.blur_strength.get()))
-        self.blur_strength_str.trace_add("write", update_blur_from_entry)
-        
-        # 马赛克块大小
-        def update_mosaic_from_scale(value):
-            self.mosaic_block_size_str.set(str(int(float(value))))
-        
-        def update_mosaic_from_entry(*args):
+    insightface不会透传SessionOptions，FaceAnalysis总是先按默认选项创建会话；
+    这里直接按线程预算创建每个模型，每个模型只加载一次。
+    """
+    def __init__(self, name: str, root: str, providers: List[str], sess_options: ort.SessionOptions,
+                 allowed_modules: Optional[List[str]] = None) -> None:
+        ort.set_default_logger_severity(3)
+        self.models = {}
+        self.model_dir = ensure_available('models', name, root=root)
+        for onnx_file in sorted(glob.glob(os.path.join(self.model_dir, '*.onnx'))):
+            model = model_zoo.ModelRouter(onnx_file).get_model(providers=providers, sess_options=sess_options)
+            if model is None or model.taskname in self.models or \
+                    (allowed_modules is not None and model.taskname not in allowed_modules):
+                continue
+            self.models[model.taskname] = model
+        if 'detection' not in self.models:
+            raise RuntimeError(f"模型目录中没有检测模型: {self.model_dir}")
+        self.det_model = self.models['detection']
+
+def create_face_analysis(insightface_dir: str, providers: List[str], intra_op_threads: int = 0,
+                         det_size: Tuple[int, int] = (640, 640),
+                         allowed_modules: Optional[List[str]] = None) -> FaceAnalysis:
+    """创建FaceAnalysis实例，可为其ORT会话指定独立的intra-op线程预算"""
+    if intra_op_threads > 0:
+        sess_options = ort.SessionOptions()
+        sess_options.intra_op_num_threads = intra_op_threads
+        sess_options.inter_op_num_threads = 1
+        app = BudgetedFaceAnalysis('buffalo_l', insightface_dir, providers, sess_options, allowed_modules)
+    else:
+        app = FaceAnalysis(providers=providers, name='buffalo_l', root=insightface_dir,
+                           allowed_modules=allowed_modules)
+    app.prepare(ctx_id=0, det_size=det_size)
+    return app
+
+class FaceSessionPool:
+    """人脸分析会话池：N个独立的检测/识别实例，每个实例拥有独立的ORT线程预算。
+    
+    对外提供与FaceAnalysis相同的get接口，调用时交给当前空闲的实例处理，
+    实例按需创建，最多创建size个。
+    """
+    # 打码只需要检测框和识别特征，不加载关键点、性别年龄等模型
+    ALLOWED_MODULES = ['detection', 'recognition']
+    
+    def __init__(self, insightface_dir: str, providers: List[str], size: Optional[int] = None,
+                 intra_op_threads: Optional[int] = None, det_size: Tuple[int, int] = (640, 640),
+                 log: Optional[Callable[[str], None]] = None) -> None:
+        cpu_count = os.cpu_count() or 4
+        self.insightface_dir = insightface_dir
+        self.providers = providers
+        self.size = max(1, size if size else min(cpu_count, 4))
+        if intra_op_threads is None:
+            # GPU推理不受CPU线程数影响，CPU推理时将核心平均分配给各实例
+            intra_op_threads = 0 if 'CUDAExecutionProvider' in providers else max(1, cpu_count // self.size)
+        self.intra_op_threads = intra_op_threads
+        self.det_size = det_size
+        self.log = log
+        self._free: "queue.Queue[FaceAnalysis]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._created = 0
+    
+    def _create_instance(self) -> FaceAnalysis:
+        """创建一个实例（调用方持有锁并已增加计数）；创建失败时撤回计数，避免acquire等待不存在的实例"""
+        try:
+            app = create_face_analysis(self.insightface_dir, self.providers, self.intra_op_threads,
+                                       self.det_size, self.ALLOWED_MODULES)
+        except BaseException:
+            self._created -= 1
+            raise
+        if self.log:
+            self.log(f"已创建推理实例 {self._created}/{self.size}（intra-op线程: {self.intra_op_threads or '默认'}）")
+        return app
+    
+    def warmup(self, count: Optional[int] = None) -> None:
+        """预先创建实例，避免首批帧等待模型加载"""
+        count = self.size if count is None else min(count, self.size)
+        with self._lock:
+            while self._created < count:
+                self._created += 1
+                self._free.put(self._create_instance())
+    
+    @contextmanager
+    def acquire(self) -> Iterator[FaceAnalysis]:
+        """获取一个空闲实例，使用完毕后归还"""
+        try:
+            app = self._free.get_nowait()
+        except queue.Empty:
+            app = None
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    app = self._create_instance()
+            if app is None:
+                app = self._free.get()
+        try:
+            yield app
+        finally:
+            self._free.put(app)
+    
+    def get(self, img: np.ndarray, max_num: int = 0) -> List[Any]:
+        with self.acquire() as app:
+            return app.get(img, max_num=max_num)
+    
+    @staticmethod
+    def _detect_faces(app: FaceAnalysis, img: np.ndarray, face_filter: Optional[Dict[str, Any]],
+                      frame_short_side: Optional[int], scale: float) -> List[Any]:
+        """运行检测模型并按face_filter过滤，返回未提取特征的人脸"""
+        bboxes, kpss = app.det_model.detect(img, max_num=0, metric='default')
+        indices = range(len(bboxes))
+        if face_filter:
+            indices = filter_face_detections(bboxes, face_filter, frame_short_side or min(img.shape[:2]), scale)
+        return [Face(bbox=bboxes[i, :4], kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+                for i in indices]
+    
+    def detect(self, img: np.ndarray, face_filter: Optional[Dict[str, Any]] = None, recognize: bool = True,
+               frame_short_side: Optional[int] = None, scale: float = 1.0) -> List[Any]:
+        """与get相同，但先按face_filter过滤检测框，只对保留的人脸提取特征；recognize为False时不运行识别模型"""
+        with self.acquire() as app:
+            faces = self._detect_faces(app, img, face_filter, frame_short_side, scale)
+            if recognize:
+                for face in faces:
+                    app.models['recognition'].get(img, face)
+            return faces
+    
+    def detect_batch(self, imgs: List[np.ndarray], face_filter: Optional[Dict[str, Any]] = None,
+                     recognize: bool = True) -> List[List[Any]]:
+        """批量检测：在同一个实例上依次检测各图片，再把所有保留的人脸对齐后一次送入识别模型"""
+        with self.acquire() as app:
+            results = [self._detect_faces(app, img, face_filter, None, 1.0) for img in imgs]
+            if recognize:
+                self._recognize(app, [(img, face) for img, faces in zip(imgs, results) for face in faces])
+            return results
+    
+    def recognize(self, pending: List[Tuple[np.ndarray, Any]]) -> None:
+        """为已检测的人脸提取识别特征，pending为[(图像, 人脸)]，人脸的关键点为该图像中的坐标"""
+        if pending:
+            with self.acquire() as app:
+                self._recognize(app, pending)
+    
+    @staticmethod
+    def _recognize(app: FaceAnalysis, pending: List[Tuple[np.ndarray, Any]]) -> None:
+        """把所有人脸对齐后一次送入识别模型"""
+        if not pending:
+            return
+        model = app.models['recognition']
+        crops = [face_align.norm_crop(img, landmark=face.kps, image_size=model.input_size[0])
+                 for img, face in pending]
+        for (_, face), feature in zip(pending, model.get_feat(crops)):
+            face.embedding = feature.flatten()
+    
+    def model_fingerprint(self) -> str:
+        """模型标识：模型文件的名称、大小和修改时间，以及检测尺寸和加载的模块"""
+        model_dir = os.path.join(self.insightface_dir, "models", "buffalo_l")
+        files = []
+        if os.path.isdir(model_dir):
+            for name in sorted(os.listdir(model_dir)):
+                if name.endswith(".onnx"):
+                    stat = os.stat(os.path.join(model_dir, name))
+                    files.append([name, stat.st_size, int(stat.st_mtime)])
+        return json.dumps({"files": files, "det_size": list(self.det_size), "modules": self.ALLOWED_MODULES})
+
+def load_benchmark_frames(input_path: str, frame_count: int) -> List[np.ndarray]:
+    """从视频或图片中读取用于基准测试的帧"""
+    frames: List[np.ndarray] = []
+    img = cv2.imread(input_path)
+    if img is not None:
+        return [img] * frame_count
+    cap = cv2.VideoCapture(input_path)
+    while len(frames) < frame_count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        raise Exception(f"无法读取基准测试输入: {input_path}")
+    # 视频过短时循环使用已读取的帧
+    read_count = len(frames)
+    while len(frames) < frame_count:
+        frames.append(frames[len(frames) % read_count])
+    return frames
+
+def measure_pool_throughput(insightface_dir: str, providers: List[str], frames: List[np.ndarray], workers: int,
+                            intra_op_threads: Optional[int] = None,
+                            det_size: Tuple[int, int] = (640, 640)) -> Dict[str, Any]:
+    """测量一种会话池配置的吞吐量（检测加识别，与实际处理相同）"""
+    pool = FaceSessionPool(insightface_dir, providers, size=workers, intra_op_threads=intra_op_threads,
+                           det_size=det_size)
+    pool.warmup()
+    # 预热：每个实例先跑一帧，排除首帧初始化开销
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(pool.get, frames[:workers]))
+        start = time.time()
+        face_counts = list(executor.map(lambda f: len(pool.get(f)), frames))
+        elapsed = time.time() - start
+    fps = len(frames) / elapsed if elapsed > 0 else 0.0
+    return {'workers': workers, 'intra_op_threads': pool.intra_op_threads, 'det_size': list(det_size),
+            'fps': fps, 'faces': sum(face_counts)}
+
+def benchmark_session_pool(insightface_dir: str, providers: List[str], frames: List[np.ndarray],
+                           worker_counts: List[int], log: Callable[[str], None] = print) -> List[Dict[str, Any]]:
+    """测量不同worker数量下会话池的吞吐量"""
+    results: List[Dict[str, Any]] = []
+    for workers in worker_counts:
+        results.append(measure_pool_throughput(insightface_dir, providers, frames, workers))
+        fps = results[-1]['fps']
+        baseline = results[0]['fps'] or 1.0
+        log(f"workers={workers:<3} intra-op线程={results[-1]['intra_op_threads'] or '默认':<4} "
+            f"吞吐量={fps:7.2f} 帧/秒  加速比={fps / baseline:5.2f}x")
+    return results
+
+# 硬件调优：检测尺寸候选（从大到小，越小越快但远处的小人脸越容易漏检；须为32的倍数）
+CALIBRATION_DET_SIZES = (640, 512, 416, 320)
+HARDWARE_PROFILE_VERSION = 1
+
+def default_hardware_profile_path() -> str:
+    return os.path.join(get_user_cache_dir(), "hardware_profile.json")
+
+def calibration_candidates(providers: List[str]) -> List[Tuple[int, Optional[int]]]:
+    """待测的(实例数, 每实例intra-op线程数)组合：实例数取1、2、4及核心数的一半和全部，
+    线程数取均分全部核心和均分一半核心两种；GPU推理只比较实例数"""
+    cpu_count = os.cpu_count() or 1
+    worker_counts = sorted({w for w in (1, 2, 4, cpu_count // 2, cpu_count) if 1 <= w <= min(cpu_count, 8)})
+    if 'CUDAExecutionProvider' in providers:
+        return [(workers, 0) for workers in (1, 2, 4)]
+    candidates = []
+    for workers in worker_counts:
+        for threads in sorted({max(1, cpu_count // workers), max(1, cpu_count // (2 * workers))}, reverse=True):
+            candidates.append((workers, threads))
+    return candidates
+
+def calibrate_hardware(insightface_dir: str, providers: List[str], frames: List[np.ndarray],
+                       target_fps: Optional[float] = None, log: Callable[[str], None] = print) -> Dict[str, Any]:
+    """在本机上测量各会话池配置的吞吐量，返回调优结果（可保存为硬件配置）。
+    
+    先在默认检测尺寸下比较实例数和线程数，取吞吐量最高的组合；指定目标帧率且达不到时，
+    再依次缩小检测尺寸，取能达到目标的最大尺寸（都达不到时取最快的尺寸）。
+    不指定目标帧率时不改变检测尺寸，不以检测效果换取速度。
+    """
+    results: List[Dict[str, Any]] = []
+    det_size = (CALIBRATION_DET_SIZES[0], CALIBRATION_DET_SIZES[0])
+    for workers, threads in calibration_candidates(providers):
+        result = measure_pool_throughput(insightface_dir, providers, frames, workers, threads, det_size)
+        results.append(result)
+        log(f"检测尺寸={det_size[0]:<4} workers={workers:<3} intra-op线程={threads or '默认':<4} "
+            f"吞吐量={result['fps']:7.2f} 帧/秒")
+    best = max(results, key=lambda r: r['fps'])
+    if target_fps and best['fps'] < target_fps:
+        for size in CALIBRATION_DET_SIZES[1:]:
+            result = measure_pool_throughput(insightface_dir, providers, frames, best['workers'],
+                                             best['intra_op_threads'], (size, size))
+            results.append(result)
+            log(f"检测尺寸={size:<4} workers={best['workers']:<3} "
+                f"intra-op线程={best['intra_op_threads'] or '默认':<4} 吞吐量={result['fps']:7.2f} 帧/秒")
+            if result['fps'] > best['fps']:
+                best = result
+            if result['fps'] >= target_fps:
+                break
+        if best['fps'] < target_fps:
+            log(f"警告: 本机无法达到目标 {target_fps:.1f} 帧/秒，使用最快的配置")
+    return {
+        "version": HARDWARE_PROFILE_VERSION,
+        "cpu_count": os.cpu_count(),
+        "providers": providers,
+        "processor": platform.processor() or platform.machine(),
+        "session_pool_size": best['workers'],
+        "intra_op_threads": best['intra_op_threads'],
+        "det_size": best['det_size'],
+        "fps": round(best['fps'], 2),
+        "target_fps": target_fps,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "results": [{**r, 'fps': round(r['fps'], 2)} for r in results],
+    }
+
+def load_hardware_profile(path: str, providers: List[str]) -> Optional[Dict[str, Any]]:
+    """读取硬件配置；文件不存在、版本不符或不是在本机（核心数、推理提供者相同）上测得时返回None"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if profile.get("version") != HARDWARE_PROFILE_VERSION or profile.get("cpu_count") != os.cpu_count() \
+            or profile.get("providers") != providers:
+        return None
+    return profile
+
+def save_hardware_profile(path: str, profile: Dict[str, Any]) -> None:
+    """先写临时文件再替换，避免并发运行的任务读到写了一半的配置"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.{generate_random_suffix()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+# 事件通道轮询间隔（毫秒）
+EVENT_POLL_INTERVAL_MS = 100
+
+class EventChannel:
+    """线程安全的日志/进度事件通道。
+    
+    工作线程通过post无阻塞地投递事件，消费者（GUI定时器或命令行日志线程）
+    调用drain批量取出：进度只保留最新值，带key的高频消息在时间窗口内只输出一次，
+    其余重复次数在窗口结束时汇总输出。
+    """
+    def __init__(self, repeat_window: float = 5.0) -> None:
+        self.repeat_window = repeat_window
+        self._queue: "queue.SimpleQueue[Tuple[str, Any, Optional[str]]]" = queue.SimpleQueue()
+        # key -> [窗口开始时间, 被省略的次数]，只在消费者线程中访问
+        self._repeats: Dict[str, List[Any]] = {}
+    
+    def post(self, kind: str, value: Any, key: Optional[str] = None) -> None:
+        self._queue.put((kind, value, key))
+    
+    def drain(self, final: bool = False) -> Tuple[List[str], Optional[float], List[Callable[[], None]]]:
+        """取出所有待处理事件，返回(日志行, 最新进度, 需在消费者线程执行的回调)"""
+        now = time.monotonic()
+        lines: List[str] = []
+        progress: Optional[float] = None
+        callbacks: List[Callable[[], None]] = []
+        while True:
             try:
-                value = int(self.mosaic_block_size_str.get())
-                if 5 <= value <= 50:
-                    self.mosaic_block_size.set(value)
-            except:
-                pass
-        
-        self.mosaic_block_size.trace_add("write", lambda *args: update_mosaic_from_scale(self.mosaic_block_size.get()))
-        self.mosaic_block_size_str.trace_add("write", update_mosaic_from_entry)
-        
-        # 羽化半径
-        def update_feather_from_scale(value):
-            self.feather_radius_str.set(str(int(float(value))))
-        
-        def update_feather_from_entry(*args):
+                kind, value, key = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                progress = value
+            elif kind == "call":
+                callbacks.append(value)
+            elif key is None:
+                lines.append(value)
+            else:
+                state = self._repeats.get(key)
+                if state is not None and now - state[0] < self.repeat_window:
+                    state[1] += 1
+                    continue
+                if state is not None and state[1]:
+                    lines.append(f"（“{key}”类消息重复 {state[1]} 次，已省略）")
+                self._repeats[key] = [now, 0]
+                lines.append(value)
+        # 汇总已过期（或结束时全部）窗口内省略的消息数
+        for key, state in list(self._repeats.items()):
+            if final or now - state[0] >= self.repeat_window:
+                if state[1]:
+                    lines.append(f"（“{key}”类消息重复 {state[1]} 次，已省略）")
+                del self._repeats[key]
+        return lines, progress, callbacks
+
+class ConsoleEventLogger:
+    """命令行模式下的事件消费者：后台线程定时取出事件并打印（管道模式下打印到stderr）"""
+    def __init__(self, events: EventChannel, interval: float = EVENT_POLL_INTERVAL_MS / 1000,
+                 output: Any = None) -> None:
+        self.events = events
+        self.interval = interval
+        self.output = output or sys.stdout
+        self._stop = threading.Event()
+        self._last_progress = -1
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def __enter__(self) -> "ConsoleEventLogger":
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc_info: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._flush(final=True)
+    
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._flush()
+    
+    def _flush(self, final: bool = False) -> None:
+        lines, progress, callbacks = self.events.drain(final=final)
+        for line in lines:
+            print(line, file=self.output, flush=True)
+        # 进度每变化5%打印一次
+        if progress is not None and (int(progress) >= self._last_progress + 5 or int(progress) == 100):
+            if int(progress) != self._last_progress:
+                print(f"进度: {int(progress)}%", file=self.output, flush=True)
+                self._last_progress = int(progress)
+        for callback in callbacks:
+            callback()
+
+# 结果缓存的默认容量上限（MB）
+RESULT_CACHE_DEFAULT_SIZE_MB = 1024
+
+def get_user_cache_dir() -> str:
+    """用户级缓存目录：Windows下位于%LOCALAPPDATA%，其他系统位于~/.cache"""
+    base_dir = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base_dir, "face-blur-tool")
+
+class ResultCache:
+    """按内容寻址的磁盘结果缓存，跨运行、跨文档复用图片的处理结果。
+    
+    键由图片数据和处理上下文（模型、白名单、打码参数）的哈希共同决定，值为处理后的
+    数据和人脸框等元信息。索引保存在SQLite中，数据文件按键的前两位分目录存放，
+    总大小超过上限时按最近访问时间淘汰。SQLite使用WAL模式，多个进程可同时读写。
+    """
+    def __init__(self, cache_dir: str, max_size_mb: int = RESULT_CACHE_DEFAULT_SIZE_MB) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_size_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), timeout=30,
+                                   check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, has_data INTEGER NOT NULL, "
+                         "size INTEGER NOT NULL, meta TEXT NOT NULL, last_access REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self._db.commit()
+        self._total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+    
+    @staticmethod
+    def make_key(context: str, *parts: Union[bytes, str]) -> str:
+        """计算缓存键，各部分带长度前缀以避免拼接歧义"""
+        digest = hashlib.sha256(context.encode())
+        for part in parts:
+            data = part if isinstance(part, bytes) else part.encode()
+            digest.update(struct.pack(">Q", len(data)))
+            digest.update(data)
+        return digest.hexdigest()
+    
+    def _data_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key[2:] + ".bin")
+    
+    def get(self, key: str) -> Optional[Tuple[Optional[bytes], Dict[str, Any]]]:
+        """查询缓存，命中时返回(处理后的数据, 元信息)，数据可能为None（表示保留原图）"""
+        with self._lock:
+            row = self._db.execute("SELECT has_data, meta FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        has_data, meta = row
+        data = None
+        if has_data:
             try:
-                value = int(self.feather_radius_str.get())
-                if 0 <= value <= 20:
-                    self.feather_radius.set(value)
-            except:
+                with open(self._data_path(key), "rb") as f:
+                    data = f.read()
+            except OSError:
+                # 数据文件已被其他进程淘汰或删除，按未命中处理
+                with self._lock:
+                    self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self._db.commit()
+                    self.misses += 1
+                return None
+        with self._lock:
+            self.hits += 1
+        return data, json.loads(meta)
+    
+    def put(self, key: str, data: Optional[bytes], meta: Dict[str, Any]) -> None:
+        """写入缓存；先写临时文件再重命名，读取方不会看到写了一半的数据"""
+        if data is not None:
+            path = self._data_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        meta_text = json.dumps(meta)
+        size = (len(data) if data is not None else 0) + len(meta_text)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                             (key, int(data is not None), size, meta_text, time.time()))
+            self._db.commit()
+            self._total += size
+            if self._total > self.max_bytes:
+                self._evict()
+    
+    def _evict(self) -> None:
+        """按最近访问时间淘汰，直到总大小降到上限的90%（调用方持有锁）"""
+        # 其他进程也可能写入，淘汰前重新统计实际大小
+        self._total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        target = self.max_bytes * 0.9
+        if self._total <= self.max_bytes:
+            return
+        evicted = []
+        for key, has_data, size in self._db.execute(
+                "SELECT key, has_data, size FROM entries ORDER BY last_access"):
+            if self._total <= target:
+                break
+            evicted.append((key, has_data))
+            self._total -= size
+        self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+        self._db.commit()
+        for key, has_data in evicted:
+            if has_data:
+                try:
+                    os.remove(self._data_path(key))
+                except OSError:
+                    pass
+    
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+# 人脸轨迹文件格式版本
+SIDECAR_VERSION = 1
+# CSV轨迹文件的列（frame和x1~y2必需，其余可选）
+SIDECAR_CSV_COLUMNS = ("frame", "x1", "y1", "x2", "y2", "score", "track_id", "whitelisted")
+
+def box_iou(box_a: np.ndarray, box_b: np.ndarray) -> float:
+    """两个x1, y1, x2, y2边界框的交并比"""
+    inter_w = min(box_a[2], box_b[2]) - max(box_a[0], box_b[0])
+    inter_h = min(box_a[3], box_b[3]) - max(box_a[1], box_b[1])
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    union = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1]) + (box_b[2] - box_b[0]) * (box_b[3] - box_b[1]) - inter
+    return float(inter / union) if union > 0 else 0.0
+
+def assign_track_ids(frames: np.ndarray, boxes: np.ndarray, max_gap: int = 5, min_iou: float = 0.3) -> np.ndarray:
+    """按相邻帧边界框的交并比贪心关联，为每个人脸框分配轨迹ID。
+    
+    轨迹最多允许中断max_gap帧（漏检），超过后结束；未匹配的人脸框开始新轨迹。
+    """
+    track_ids = np.zeros(len(frames), dtype=np.int32)
+    order = np.argsort(frames, kind="stable")
+    tracks: Dict[int, Tuple[int, np.ndarray]] = {}  # 轨迹ID -> (最后出现的帧, 最后的边界框)
+    next_id = 0
+    start = 0
+    while start < len(order):
+        frame = frames[order[start]]
+        end = start
+        while end < len(order) and frames[order[end]] == frame:
+            end += 1
+        current = order[start:end]
+        tracks = {track_id: value for track_id, value in tracks.items() if frame - value[0] <= max_gap}
+        
+        candidates = sorted(((box_iou(boxes[row, :4], box), n, track_id)
+                             for n, row in enumerate(current)
+                             for track_id, (_, box) in tracks.items()), reverse=True)
+        matched_rows: set = set()
+        matched_tracks: set = set()
+        for iou, n, track_id in candidates:
+            if iou < min_iou:
+                break
+            if n in matched_rows or track_id in matched_tracks:
+                continue
+            matched_rows.add(n)
+            matched_tracks.add(track_id)
+            track_ids[current[n]] = track_id
+        for n, row in enumerate(current):
+            if n not in matched_rows:
+                track_ids[row] = next_id
+                next_id += 1
+            tracks[int(track_ids[row])] = (frame, boxes[row, :4])
+        start = end
+    return track_ids
+
+class FFmpegFrameReader:
+    """通过FFmpeg管道顺序读取BGR帧，接口与cv2.VideoCapture的read/release一致。
+    
+    -ss放在输入之前：FFmpeg先跳到起始时间之前最近的关键帧，再向后解码并丢弃起始时间之前的帧，
+    因此定位精确到帧，耗时只与处理区间的长度有关，与起始位置无关。
+    """
+    def __init__(self, ffmpeg_path: str, input_path: str, width: int, height: int,
+                 start_time: float = 0.0, frame_count: Optional[int] = None,
+                 input_args: Tuple[str, ...] = (), pix_fmt: str = "bgr24") -> None:
+        self.width = width
+        self.height = height
+        self.shape = raw_frame_shape(pix_fmt, width, height)
+        self.frame_size = int(np.prod(self.shape))
+        cmd = [ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-nostdin', *input_args]
+        if start_time > 0:
+            cmd += ['-ss', f"{start_time:.6f}"]
+        cmd += ['-i', input_path, '-map', '0:v:0']
+        if frame_count:
+            cmd += ['-frames:v', str(frame_count)]
+        # 不补帧也不丢帧，与逐帧解码的帧序一致
+        cmd += ['-vsync', 'passthrough', '-f', 'rawvideo', '-pix_fmt', pix_fmt, '-']
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                        bufsize=self.frame_size)
+    
+    def isOpened(self) -> bool:
+        return self.process.stdout is not None and not self.process.stdout.closed
+    
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        buffer = bytearray(self.frame_size)
+        view = memoryview(buffer)
+        received = 0
+        while received < self.frame_size:
+            count = self.process.stdout.readinto(view[received:])
+            if not count:
+                return False, None
+            received += count
+        return True, np.frombuffer(buffer, dtype=np.uint8).reshape(self.shape)
+    
+    def read_into(self, frame: np.ndarray) -> bool:
+        """把下一帧直接读入调用方提供的数组（如共享内存中的帧槽），不分配也不复制"""
+        view = memoryview(frame).cast("B")
+        received = 0
+        while received < self.frame_size:
+            count = self.process.stdout.readinto(view[received:])
+            if not count:
+                return False
+            received += count
+        return True
+    
+    def release(self) -> None:
+        if self.process.stdout and not self.process.stdout.closed:
+            self.process.stdout.close()
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.process.wait()
+
+class FFmpegFrameWriter:
+    """通过FFmpeg管道编码原始帧，接口与cv2.VideoWriter的write/release一致。
+    
+    输入为yuv420p时直接编码，不经过颜色空间转换。
+    """
+    def __init__(self, ffmpeg_path: str, output_path: str, width: int, height: int, fps: float,
+                 pix_fmt: str = "yuv420p", codec: str = "libx264") -> None:
+        frame_rate = Fraction(fps).limit_denominator(1001)
+        cmd = [
+            ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', pix_fmt, '-s', f"{width}x{height}",
+            '-r', f"{frame_rate.numerator}/{frame_rate.denominator}", '-i', '-',
+            # 临时视频只用于合并音频（视频流直接复制），用较快的预设控制编码耗时
+            '-c:v', codec, '-preset', 'veryfast', '-crf', '18', '-pix_fmt', 'yuv420p', output_path
+        ]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    
+    def isOpened(self) -> bool:
+        return self.process.poll() is None
+    
+    def write(self, frame: np.ndarray) -> None:
+        self.process.stdin.write(memoryview(np.ascontiguousarray(frame)).cast("B"))
+    
+    def release(self) -> None:
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.wait()
+
+# 实时流模式：默认的端到端延迟目标（毫秒）
+STREAM_LATENCY_MS_DEFAULT = 200
+
+# 输出为网络地址时按协议选择封装格式
+STREAM_OUTPUT_FORMATS = {
+    "udp": "mpegts",
+    "tcp": "mpegts",
+    "srt": "mpegts",
+    "rtp": "rtp_mpegts",
+    "rtmp": "flv",
+    "rtsp": "rtsp",
+}
+
+class LatestFrameGrabber:
+    """后台线程持续读取视频源，只保留最新的一帧。
+    
+    处理跟不上时旧帧直接被新帧覆盖（计入丢帧），读取端拿到的总是最新画面，
+    因此处理速度不会让延迟越积越大。
+    """
+    def __init__(self, reader: Any) -> None:
+        self.reader = reader
+        self.dropped = 0
+        self.frames_read = 0
+        self._latest: Optional[Tuple[int, np.ndarray, float]] = None
+        self._finished = False
+        self._stop = threading.Event()
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def start(self) -> "LatestFrameGrabber":
+        self._thread.start()
+        return self
+    
+    def _run(self) -> None:
+        try:
+            while not self._stop.is_set():
+                ret, frame = self.reader.read()
+                if not ret:
+                    break
+                with self._condition:
+                    if self._latest is not None:
+                        self.dropped += 1
+                    self._latest = (self.frames_read, frame, time.perf_counter())
+                    self.frames_read += 1
+                    self._condition.notify()
+        finally:
+            with self._condition:
+                self._finished = True
+                self._condition.notify()
+    
+    def get(self, timeout: float = 1.0) -> Tuple[Optional[Tuple[int, np.ndarray, float]], bool]:
+        """取出最新帧(帧序号, 帧, 读取时刻)，返回(帧或None, 视频源是否已结束)"""
+        with self._condition:
+            if self._latest is None and not self._finished:
+                self._condition.wait(timeout)
+            latest, self._latest = self._latest, None
+            return latest, self._finished and latest is None
+    
+    def stop(self) -> None:
+        self._stop.set()
+        self.reader.release()
+        self._thread.join(timeout=5)
+
+class AsyncFaceDetector:
+    """后台线程运行人脸检测，同一时刻最多检测一帧。
+    
+    检测忙时submit直接返回False，调用方继续用上一次的检测结果打码，不会等待检测。
+    """
+    def __init__(self, detect: Callable[[np.ndarray], np.ndarray], on_error: Callable[[Exception], None]) -> None:
+        self.detect = detect
+        self.on_error = on_error
+        self.detections = 0
+        self.detect_seconds = 0.0
+        self._boxes = np.zeros((0, 6), dtype=np.float32)
+        self._boxes_index = -1
+        self._pending: Optional[Tuple[int, np.ndarray]] = None
+        self._busy = False
+        self._stop = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def submit(self, index: int, frame: np.ndarray) -> bool:
+        with self._condition:
+            if self._busy:
+                return False
+            self._busy = True
+            self._pending = (index, frame)
+            self._condition.notify()
+            return True
+    
+    def latest(self) -> Tuple[int, np.ndarray]:
+        """最近一次检测完成的(帧序号, 人脸框)"""
+        with self._condition:
+            return self._boxes_index, self._boxes
+    
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while self._pending is None and not self._stop:
+                    self._condition.wait()
+                if self._stop:
+                    return
+                index, frame = self._pending
+                self._pending = None
+            started = time.perf_counter()
+            try:
+                boxes = self.detect(frame)
+            except Exception as e:
+                self.on_error(e)
+                boxes = None
+            with self._condition:
+                if boxes is not None:
+                    self._boxes, self._boxes_index = boxes, index
+                    self.detections += 1
+                    self.detect_seconds += time.perf_counter() - started
+                self._busy = False
+    
+    def stop(self) -> None:
+        with self._condition:
+            self._stop = True
+            self._condition.notify()
+        self._thread.join(timeout=5)
+
+def expand_face_boxes(boxes: np.ndarray, ratio: float, width: int, height: int) -> np.ndarray:
+    """按框尺寸的比例向四周扩大人脸框，用于覆盖检测之后人脸的移动"""
+    if not len(boxes) or ratio <= 0:
+        return boxes
+    expanded = boxes.copy()
+    pad_x = (expanded[:, 2] - expanded[:, 0]) * ratio
+    pad_y = (expanded[:, 3] - expanded[:, 1]) * ratio
+    expanded[:, 0] = np.maximum(expanded[:, 0] - pad_x, 0)
+    expanded[:, 1] = np.maximum(expanded[:, 1] - pad_y, 0)
+    expanded[:, 2] = np.minimum(expanded[:, 2] + pad_x, width)
+    expanded[:, 3] = np.minimum(expanded[:, 3] + pad_y, height)
+    return expanded
+
+# 管道模式支持的原始帧像素格式（与FFmpeg的pix_fmt名称一致）
+PIPE_PIX_FMTS = ("bgr24", "rgb24", "gray", "yuv420p")
+
+def raw_frame_shape(pix_fmt: str, width: int, height: int) -> Tuple[int, ...]:
+    """原始帧在内存中的数组形状；yuv420p按I420排列（Y平面后接U、V平面）"""
+    if pix_fmt in ("bgr24", "rgb24"):
+        return (height, width, 3)
+    if pix_fmt == "gray":
+        return (height, width)
+    if pix_fmt == "yuv420p":
+        if width % 2 or height % 2:
+            raise ValueError("yuv420p的宽高必须为偶数")
+        return (height * 3 // 2, width)
+    raise ValueError(f"不支持的像素格式: {pix_fmt}")
+
+def raw_frame_to_bgr(raw: np.ndarray, pix_fmt: str) -> np.ndarray:
+    """bgr24/rgb24/gray原始帧转为检测和打码使用的BGR帧（总是返回新数组）"""
+    if pix_fmt == "bgr24":
+        return raw.copy()
+    if pix_fmt == "rgb24":
+        return cv2.cvtColor(raw, cv2.COLOR_RGB2BGR)
+    return cv2.cvtColor(raw, cv2.COLOR_GRAY2BGR)
+
+def write_back_face_regions(raw: np.ndarray, bgr: np.ndarray, boxes: np.ndarray, pix_fmt: str) -> np.ndarray:
+    """把打码后的BGR帧写回原始格式（yuv420p直接在平面上处理，不经过这里）。
+    
+    gray只转换并替换人脸框覆盖的区域，其余像素保持输入原样。
+    """
+    if pix_fmt == "bgr24":
+        return bgr
+    if pix_fmt == "rgb24":
+        return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+    output = raw.copy()
+    height, width = bgr.shape[:2]
+    for box in boxes:
+        x1, y1 = max(int(box[0]), 0), max(int(box[1]), 0)
+        x2, y2 = min(int(box[2]) + 1, width), min(int(box[3]) + 1, height)
+        if x2 > x1 and y2 > y1:
+            output[y1:y2, x1:x2] = cv2.cvtColor(bgr[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+    return output
+
+def parse_y4m_header(header: bytes) -> Tuple[int, int, float, str]:
+    """解析YUV4MPEG2文件头，返回(宽, 高, 帧率, 像素格式)"""
+    tokens = header.decode("ascii").split()
+    if not tokens or tokens[0] != "YUV4MPEG2":
+        raise ValueError("输入不是Y4M格式")
+    width = height = 0
+    fps = 25.0
+    colorspace = "420jpeg"
+    for token in tokens[1:]:
+        tag, value = token[0], token[1:]
+        if tag == "W":
+            width = int(value)
+        elif tag == "H":
+            height = int(value)
+        elif tag == "F":
+            numerator, denominator = value.split(":")
+            fps = int(numerator) / max(int(denominator), 1)
+        elif tag == "C":
+            colorspace = value
+    if colorspace.startswith("420"):
+        pix_fmt = "yuv420p"
+    elif colorspace == "mono":
+        pix_fmt = "gray"
+    else:
+        raise ValueError(f"不支持的Y4M色彩格式: C{colorspace}（仅支持420和mono）")
+    return width, height, fps, pix_fmt
+
+class PipeFrameReader:
+    """从二进制流读取原始帧（rawvideo或Y4M），接口与cv2.VideoCapture的read/release一致。
+    
+    后台线程提前读取，最多缓冲两帧（双缓冲）：处理当前帧时下一帧的管道读取同时进行。
+    """
+    def __init__(self, stream: Any, input_format: str = "rawvideo", width: int = 0, height: int = 0,
+                 pix_fmt: str = "bgr24") -> None:
+        self.stream = stream
+        self.y4m_header: Optional[bytes] = None
+        self.fps = 0.0
+        if input_format == "y4m":
+            self.y4m_header = stream.readline()
+            width, height, self.fps, pix_fmt = parse_y4m_header(self.y4m_header)
+        if width <= 0 or height <= 0:
+            raise ValueError("rawvideo输入需要指定帧尺寸")
+        self.width = width
+        self.height = height
+        self.pix_fmt = pix_fmt
+        self.shape = raw_frame_shape(pix_fmt, width, height)
+        self.frame_size = int(np.prod(self.shape))
+        self._frames: "queue.Queue[Optional[np.ndarray]]" = queue.Queue(maxsize=2)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def _read_exact(self, size: int) -> Optional[bytearray]:
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            count = self.stream.readinto(view[received:])
+            if not count:
+                return None
+            received += count
+        return buffer
+    
+    def _run(self) -> None:
+        try:
+            while not self._stop.is_set():
+                if self.y4m_header is not None:
+                    # 每帧以"FRAME[ 参数]\n"开头
+                    frame_header = self.stream.readline()
+                    if not frame_header.startswith(b"FRAME"):
+                        break
+                buffer = self._read_exact(self.frame_size)
+                if buffer is None:
+                    break
+                self._put(np.frombuffer(buffer, dtype=np.uint8).reshape(self.shape))
+        finally:
+            self._put(None)
+    
+    def _put(self, item: Optional[np.ndarray]) -> None:
+        while not self._stop.is_set():
+            try:
+                self._frames.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+    
+    def isOpened(self) -> bool:
+        return True
+    
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        if self._stop.is_set():
+            return False, None
+        frame = self._frames.get()
+        if frame is None:
+            self._stop.set()
+            return False, None
+        return True, frame
+    
+    def release(self) -> None:
+        self._stop.set()
+
+class PipeFrameWriter:
+    """把原始帧写到二进制流；Y4M输出沿用输入的文件头。
+    
+    后台线程写出，最多缓冲两帧，下游读取慢时不阻塞当前帧的处理。
+    """
+    def __init__(self, stream: Any, y4m_header: Optional[bytes] = None) -> None:
+        self.stream = stream
+        self.y4m = y4m_header is not None
+        self.error: Optional[Exception] = None
+        if y4m_header is not None:
+            stream.write(y4m_header)
+        self._frames: "queue.Queue[Optional[np.ndarray]]" = queue.Queue(maxsize=2)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def _run(self) -> None:
+        while True:
+            frame = self._frames.get()
+            if frame is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                if self.y4m:
+                    self.stream.write(b"FRAME\n")
+                self.stream.write(memoryview(np.ascontiguousarray(frame)).cast("B"))
+            except (BrokenPipeError, OSError) as e:
+                self.error = e
+    
+    def write(self, frame: np.ndarray) -> None:
+        if self.error is not None:
+            raise self.error
+        self._frames.put(frame)
+    
+    def close(self) -> None:
+        self._frames.put(None)
+        self._thread.join()
+        if self.error is None:
+            try:
+                self.stream.flush()
+            except (BrokenPipeError, OSError) as e:
+                self.error = e
+
+# 预览模式：默认取样帧数、缩略图宽度，以及低帧率预览视频的帧率
+PREVIEW_SAMPLES_DEFAULT = 12
+PREVIEW_THUMB_WIDTH = 480
+PREVIEW_VIDEO_FPS = 2
+
+def build_contact_sheet(thumbs: List[np.ndarray], labels: List[str], columns: Optional[int] = None) -> np.ndarray:
+    """把尺寸相同的缩略图按网格拼成一张预览图，每张左上角标注时间"""
+    columns = columns or max(1, int(np.ceil(np.sqrt(len(thumbs)))))
+    rows = (len(thumbs) + columns - 1) // columns
+    height, width = thumbs[0].shape[:2]
+    gap = 4
+    sheet = np.full((rows * (height + gap) + gap, columns * (width + gap) + gap, 3), 32, dtype=np.uint8)
+    for index, (thumb, label) in enumerate(zip(thumbs, labels)):
+        y = gap + (index // columns) * (height + gap)
+        x = gap + (index % columns) * (width + gap)
+        sheet[y:y + height, x:x + width] = thumb
+        cv2.putText(sheet, label, (x + 6, y + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.55, (0, 0, 0), 3, cv2.LINE_AA)
+        cv2.putText(sheet, label, (x + 6, y + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.55, (255, 255, 255), 1, cv2.LINE_AA)
+    return sheet
+
+# 近似重复帧判定：缩略图逐像素最大差值不超过该值时复用参考帧的人脸框
+VIDEO_REUSE_NEAR_DIFF = 2
+# 连续复用人脸框的最大帧数，超过后重新检测，避免缓慢移动的人脸逐渐偏出人脸框
+VIDEO_REUSE_MAX_RUN = 12
+VIDEO_REUSE_MODES = ("off", "exact", "near")
+
+def video_frame_signature(frame: np.ndarray) -> np.ndarray:
+    """帧缩略指纹：隔8像素取样后缩小到64×36，只占很少的读取时间"""
+    sampled = np.ascontiguousarray(frame[::8, ::8])
+    return cv2.resize(sampled, (64, 36), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+class VideoFrameReuse:
+    """按帧指纹识别与前一帧重复的帧，在读取线程中按帧顺序调用match。
+    
+    校验和与缩略指纹都与前一帧相同时为完全重复，直接复用前一帧的处理结果；
+    near模式下缩略指纹与最近一次检测的帧相差很小时为近似重复，沿用其人脸框只重新打码。
+    """
+    def __init__(self, near: bool = False) -> None:
+        self.near = near
+        self.frames = 0
+        self.exact_hits = 0
+        self.near_hits = 0
+        self._previous: Optional[Tuple[int, np.ndarray]] = None
+        self._reference: Optional[np.ndarray] = None
+        self._run = 0
+    
+    def match(self, frame: np.ndarray) -> Optional[str]:
+        """返回"exact"、"near"或None（需要检测）"""
+        self.frames += 1
+        checksum = zlib.crc32(frame)
+        signature = video_frame_signature(frame)
+        previous, self._previous = self._previous, (checksum, signature)
+        if previous is not None and previous[0] == checksum and np.array_equal(previous[1], signature):
+            self.exact_hits += 1
+            return "exact"
+        if self.near and self._reference is not None and self._run < VIDEO_REUSE_MAX_RUN and \
+                np.abs(signature - self._reference).max() <= VIDEO_REUSE_NEAR_DIFF:
+            self.near_hits += 1
+            self._run += 1
+            return "near"
+        self._reference = signature
+        self._run = 0
+        return None
+    
+    def miss(self, kind: str) -> None:
+        """复用失败（前一帧或参考帧处理出错），该帧改为重新检测，不计入命中"""
+        if kind == "exact":
+            self.exact_hits -= 1
+        elif kind == "near":
+            self.near_hits -= 1
+    
+    def summary(self) -> str:
+        frames = max(self.frames, 1)
+        text = f"重复帧复用: 完全重复 {self.exact_hits} 帧({self.exact_hits / frames:.1%})"
+        if self.near:
+            text += f"，近似重复 {self.near_hits} 帧({self.near_hits / frames:.1%})"
+        return text + f"，实际检测 {self.frames - self.exact_hits - self.near_hits}/{self.frames} 帧"
+
+class SharedFrameRing:
+    """共享内存中预分配的一组帧槽，各进程按名称映射为同一块内存上的numpy数组。
+    
+    解码器把帧直接读入空闲槽，工作进程原地打码，写出端按顺序读取，进程间只传递槽编号。
+    """
+    def __init__(self, slot_count: int, shape: Tuple[int, ...], name: Optional[str] = None) -> None:
+        self.slot_count = slot_count
+        self.shape = tuple(shape)
+        size = slot_count * int(np.prod(self.shape))
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.slots = np.ndarray((slot_count, *self.shape), dtype=np.uint8, buffer=self.shm.buf)
+    
+    @property
+    def name(self) -> str:
+        return self.shm.name
+    
+    def slot(self, index: int) -> np.ndarray:
+        return self.slots[index]
+    
+    def close(self) -> None:
+        """释放映射；创建者同时删除共享内存。仍有外部引用的帧视图时映射在其释放后回收"""
+        self.slots = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+        if self.owner:
+            self.shm.unlink()
+
+# 智能渲染支持的源视频编码 -> 重新编码使用的编码器
+SMART_RENDER_CODECS = {
+    "h264": "libx264",
+    "hevc": "libx265",
+}
+
+def plan_smart_render_segments(keyframes: List[int], start_frame: int, end_frame: int, total_frames: int,
+                               dirty_frames: set) -> List[Tuple[int, int, bool]]:
+    """按关键帧把[start_frame, end_frame)切分为GOP，返回合并后的片段列表[(起始帧, 结束帧, 是否需要重新编码)]。
+    
+    包含需打码人脸的GOP需要重新编码；区间首尾不在关键帧上的不完整GOP无法直接复制，也重新编码。
+    """
+    keyframe_set = set(keyframes)
+    bounds = sorted({frame for frame in keyframes if start_frame < frame < end_frame} | {start_frame, end_frame})
+    segments: List[Tuple[int, int, bool]] = []
+    for start, end in zip(bounds, bounds[1:]):
+        dirty = (start not in keyframe_set
+                 or (end not in keyframe_set and end < total_frames)
+                 or any(frame in dirty_frames for frame in range(start, end)))
+        if segments and segments[-1][2] == dirty:
+            segments[-1] = (segments[-1][0], end, dirty)
+        else:
+            segments.append((start, end, dirty))
+    return segments
+
+class FaceTrackSidecar:
+    """视频人脸轨迹文件：逐帧的人脸框、置信度、轨迹ID和白名单判定，按列存储。
+    
+    分析阶段写出.npz（每列一个数组，另附JSON元数据记录源视频、处理区间和处理上下文），
+    渲染阶段据此打码而无需推理。也可读取外部工具导出的CSV，表头为SIDECAR_CSV_COLUMNS
+    中的列名，缺少轨迹ID时自动关联。帧号为源视频中的绝对帧号。
+    """
+    def __init__(self, frames: np.ndarray, boxes: np.ndarray, track_ids: Optional[np.ndarray] = None,
+                 metadata: Optional[Dict[str, Any]] = None) -> None:
+        self.frames = np.asarray(frames, dtype=np.int64)
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 6)
+        self.track_ids = (assign_track_ids(self.frames, self.boxes) if track_ids is None
+                          else np.asarray(track_ids, dtype=np.int32))
+        self.metadata = metadata or {}
+    
+    @classmethod
+    def from_frame_boxes(cls, frame_boxes: List[Tuple[int, np.ndarray]],
+                         metadata: Dict[str, Any]) -> "FaceTrackSidecar":
+        """由逐帧的(帧号, 人脸框数组)构建"""
+        frames = [np.full(len(boxes), frame, dtype=np.int64) for frame, boxes in frame_boxes]
+        rows = [boxes for _, boxes in frame_boxes]
+        return cls(np.concatenate(frames) if frames else np.zeros(0, dtype=np.int64),
+                   np.concatenate(rows) if rows else np.zeros((0, 6), dtype=np.float32),
+                   metadata=metadata)
+    
+    def __len__(self) -> int:
+        return len(self.frames)
+    
+    @property
+    def track_count(self) -> int:
+        return len(np.unique(self.track_ids))
+    
+    @property
+    def whitelisted_count(self) -> int:
+        return int(np.count_nonzero(self.boxes[:, 5]))
+    
+    def boxes_by_frame(self) -> Dict[int, np.ndarray]:
+        """按帧号分组的人脸框"""
+        order = np.argsort(self.frames, kind="stable")
+        frames = self.frames[order]
+        boxes = self.boxes[order]
+        unique_frames, first_rows = np.unique(frames, return_index=True)
+        groups = np.split(boxes, first_rows[1:])
+        return {int(frame): group for frame, group in zip(unique_frames, groups)}
+    
+    def save(self, path: str) -> None:
+        """写出.npz轨迹文件"""
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                frame=self.frames,
+                x1=self.boxes[:, 0], y1=self.boxes[:, 1], x2=self.boxes[:, 2], y2=self.boxes[:, 3],
+                score=self.boxes[:, 4],
+                track_id=self.track_ids,
+                whitelisted=self.boxes[:, 5].astype(np.uint8),
+                metadata=np.array(json.dumps(self.metadata, ensure_ascii=False)),
+            )
+    
+    @classmethod
+    def load(cls, path: str) -> "FaceTrackSidecar":
+        """读取.npz轨迹文件或外部工具导出的CSV"""
+        if path.lower().endswith(".csv"):
+            return cls.load_csv(path)
+        with np.load(path, allow_pickle=False) as data:
+            boxes = np.stack([data["x1"], data["y1"], data["x2"], data["y2"],
+                              data["score"], data["whitelisted"].astype(np.float32)], axis=1)
+            return cls(data["frame"], boxes, data["track_id"], json.loads(str(data["metadata"])))
+    
+    @classmethod
+    def load_csv(cls, path: str) -> "FaceTrackSidecar":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            missing = [column for column in SIDECAR_CSV_COLUMNS[:5] if column not in (reader.fieldnames or [])]
+            if missing:
+                raise ValueError(f"CSV轨迹文件缺少列: {', '.join(missing)}")
+            rows = list(reader)
+        frames = np.array([int(row["frame"]) for row in rows], dtype=np.int64)
+        boxes = np.array([[float(row["x1"]), float(row["y1"]), float(row["x2"]), float(row["y2"]),
+                           float(row.get("score") or 1.0), float(row.get("whitelisted") or 0)]
+                          for row in rows], dtype=np.float32).reshape(-1, 6)
+        track_ids = None
+        if rows and all(row.get("track_id") not in (None, "") for row in rows):
+            track_ids = np.array([int(row["track_id"]) for row in rows], dtype=np.int32)
+        return cls(frames, boxes, track_ids)
+
+def render_params_fingerprint() -> str:
+    """当前打码参数的指纹"""
+    return hashlib.sha256(json.dumps(g_precomputed, sort_keys=True, default=str).encode()).hexdigest()
+
+def file_sha256(path: str) -> str:
+    """分块计算文件的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# 断点续传任务默认每段的时长（秒）
+VIDEO_JOB_SEGMENT_SECONDS = 60
+
+class VideoJob:
+    """可断点续传的视频任务目录。
+    
+    处理区间按固定帧数分段，每段输出一个无音频的视频和该段的人脸框(.npz)，
+    manifest.json记录已完成的段及文件的SHA-256。任务目录名由输入文件（路径、大小、
+    修改时间）、处理区间、分段长度和检测上下文决定，重新运行相同任务时会找到同一目录：
+    视频完整且打码参数未变的段直接复用；打码参数变化或视频损坏但人脸框完好的段只需重新渲染。
+    """
+    MANIFEST_NAME = "manifest.json"
+    
+    def __init__(self, job_dir: str, manifest: Dict[str, Any]) -> None:
+        self.job_dir = job_dir
+        self.manifest = manifest
+    
+    @classmethod
+    def open(cls, jobs_root: str, input_path: str, clip: Dict[str, Any], detection_context: str,
+             segment_frames: int) -> "VideoJob":
+        """打开或创建任务目录"""
+        stat = os.stat(input_path)
+        identity = {
+            "input": os.path.abspath(input_path),
+            "size": stat.st_size,
+            "mtime": int(stat.st_mtime),
+            "start_frame": clip["start_frame"],
+            "frame_count": clip["frame_count"],
+            "segment_frames": segment_frames,
+            "detection": detection_context,
+        }
+        key = hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+        job_dir = os.path.join(jobs_root, key[:16])
+        manifest_path = os.path.join(job_dir, cls.MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+                if manifest.get("key") == key:
+                    return cls(job_dir, manifest)
+            except (OSError, ValueError):
+                pass
+        os.makedirs(job_dir, exist_ok=True)
+        job = cls(job_dir, {"version": 1, "key": key, **identity, "fps": clip["fps"], "segments": {}})
+        job.save()
+        return job
+    
+    def segment_ranges(self) -> List[Tuple[int, int]]:
+        """所有段的(起始帧, 帧数)"""
+        start, count, size = self.manifest["start_frame"], self.manifest["frame_count"], self.manifest["segment_frames"]
+        return [(segment_start, min(size, start + count - segment_start))
+                for segment_start in range(start, start + count, size)]
+    
+    def _entry(self, index: int) -> Dict[str, Any]:
+        return self.manifest["segments"].get(str(index), {})
+    
+    def _verified_path(self, entry: Dict[str, Any], kind: str) -> Optional[str]:
+        name = entry.get(kind)
+        if not name:
+            return None
+        path = os.path.join(self.job_dir, name)
+        if not os.path.exists(path) or file_sha256(path) != entry.get(f"{kind}_sha256"):
+            return None
+        return path
+    
+    def completed_video(self, index: int, render_params: str) -> Optional[str]:
+        """该段已完成且可直接复用的视频文件（校验哈希和打码参数）"""
+        entry = self._entry(index)
+        if entry.get("render") != render_params:
+            return None
+        return self._verified_path(entry, "video")
+    
+    def cached_detections(self, index: int) -> Optional[Dict[int, np.ndarray]]:
+        """该段已保存的逐帧人脸框（校验哈希），没有时返回None"""
+        path = self._verified_path(self._entry(index), "detections")
+        if path is None:
+            return None
+        return FaceTrackSidecar.load(path).boxes_by_frame()
+    
+    def complete_segment(self, index: int, temp_video_path: str, frame_boxes: List[Tuple[int, np.ndarray]],
+                         render_params: str) -> None:
+        """把该段的视频和人脸框移入任务目录，并更新manifest"""
+        video_name = f"segment_{index:05d}.mp4"
+        detections_name = f"segment_{index:05d}.npz"
+        video_path = os.path.join(self.job_dir, video_name)
+        shutil.move(temp_video_path, video_path)
+        detections_path = os.path.join(self.job_dir, detections_name)
+        FaceTrackSidecar.from_frame_boxes(frame_boxes, {}).save(detections_path + ".tmp")
+        os.replace(detections_path + ".tmp", detections_path)
+        self.manifest["segments"][str(index)] = {
+            "video": video_name,
+            "video_sha256": file_sha256(video_path),
+            "detections": detections_name,
+            "detections_sha256": file_sha256(detections_path),
+            "render": render_params,
+            "faces": int(sum(len(boxes) for _, boxes in frame_boxes)),
+        }
+        self.save()
+    
+    def all_detections(self) -> FaceTrackSidecar:
+        """合并所有段的人脸框"""
+        frames, boxes = [], []
+        for index in range(len(self.segment_ranges())):
+            path = os.path.join(self.job_dir, self._entry(index).get("detections", ""))
+            if os.path.isfile(path):
+                segment = FaceTrackSidecar.load(path)
+                frames.append(segment.frames)
+                boxes.append(segment.boxes)
+        if not frames:
+            return FaceTrackSidecar(np.zeros(0, dtype=np.int64), np.zeros((0, 6), dtype=np.float32))
+        return FaceTrackSidecar(np.concatenate(frames), np.concatenate(boxes))
+    
+    def save(self) -> None:
+        """先写临时文件再替换，中断时manifest不会损坏"""
+        manifest_path = os.path.join(self.job_dir, self.MANIFEST_NAME)
+        with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(manifest_path + ".tmp", manifest_path)
+    
+    def remove(self) -> None:
+        shutil.rmtree(self.job_dir, ignore_errors=True)
+
+class FaceBlurEngine:
+    """人脸打码处理引擎，不依赖界面，日志和进度通过事件通道输出"""
+    def __init__(self, insightface_dir: str, ffmpeg_path: str, events: Optional[EventChannel] = None) -> None:
+        self.insightface_dir = insightface_dir
+        self.ffmpeg_path = ffmpeg_path
+        self.events = events or EventChannel()
+        self.cancel_event = threading.Event()
+        self.app: Optional[FaceSessionPool] = None
+        self.whitelist_data: Optional[Dict[str, Any]] = None
+        self.threshold = 0.5
+        # PDF并行处理的进程数（None表示自动）
+        self.pdf_workers: Optional[int] = None
+        # Word/PDF图片预筛选参数
+        self.prefilter: Dict[str, Any] = dict(PREFILTER_DEFAULTS)
+        self.face_filter: Dict[str, Any] = dict(FACE_FILTER_DEFAULTS)
+        # Word处理方式：zip直接处理压缩包条目；docx通过python-docx加载整个文档
+        self.word_mode = "zip"
+        # 结果缓存目录（None表示不使用缓存）及容量上限
+        self.cache_dir: Optional[str] = os.path.join(get_user_cache_dir(), "results")
+        self.cache_size_mb = RESULT_CACHE_DEFAULT_SIZE_MB
+        self.cache: Optional[ResultCache] = None
+        self.cache_context = ""
+        # 单次处理视频时同时保存人脸轨迹文件的路径（None表示不保存）
+        self.video_sidecar_path: Optional[str] = None
+        # 视频智能渲染：只重新编码包含人脸的GOP
+        self.smart_render = False
+        # 视频在yuv420p平面上处理，不做整帧的颜色空间转换
+        self.yuv_native = False
+        # 视频处理的进程数（None或1时在当前进程内用线程处理）
+        self.video_workers: Optional[int] = None
+        # 视频重复帧复用："off"不复用，"exact"复用完全重复帧的结果，"near"还对近似重复帧复用人脸框
+        self.video_reuse = "exact"
+        # 会话池的推理实例数（None时使用硬件配置，没有配置时按CPU核心数，最多4个）
+        self.session_pool_size: Optional[int] = None
+        # calibrate命令保存的硬件配置（实例数、线程数、检测尺寸），None表示不使用
+        self.hardware_profile_path: Optional[str] = default_hardware_profile_path()
+        # 超大图片按窗口处理：None按像素数自动判断，True总是，False从不
+        self.image_windowed: Optional[bool] = None
+        self.image_window_size = IMAGE_WINDOW_SIZE
+        # 视频断点续传：分段输出并记录任务进度，重新运行相同任务时从已完成的段继续
+        self.resumable = False
+        self.video_jobs_dir = os.path.join(get_user_cache_dir(), "jobs")
+        self.video_segment_seconds = VIDEO_JOB_SEGMENT_SECONDS
+    
+    def log(self, message: str, key: Optional[str] = None) -> None:
+        """投递日志消息；高频重复的消息传入key以便合并"""
+        self.events.post("log", message, key)
+    
+    def update_progress(self, value: float) -> None:
+        """投递进度"""
+        self.events.post("progress", value)
+    
+    def prepare_models(self, whitelist_dir: Optional[str], similarity_threshold: float, blur_type: str,
+                       blur_strength: int, feather_radius: int, opacity: float, mosaic_block_size: int) -> None:
+        """初始化模型、加载白名单并预计算打码参数"""
+        # 初始化FaceAnalysis模型
+        self.app = self.initialize_face_analysis()
+        if not self.app:
+            raise Exception("无法初始化人脸检测模型")
+        
+        # 加载白名单
+        self.whitelist_data, self.threshold = self.load_whitelist_faces(
+            self.app, whitelist_dir, similarity_threshold)
+        
+        # 预计算图像处理参数
+        self.precompute_image_processing_params(
+            blur_type, blur_strength, feather_radius, opacity, mosaic_block_size)
+        self.cache_context = self.result_cache_context()
+    
+    def run_file(self, file_type: str, input_path: str, output_path: str,
+                 start_time: float = 0, duration: Optional[float] = None) -> bool:
+        """根据文件类型调用不同的处理函数"""
+        if file_type == "video":
+            return self.blur_faces_in_video(
+                input_path=input_path,
+                output_path=output_path,
+                start_time=start_time,
+                duration=duration
+            )
+        
+        self.open_result_cache()
+        if file_type == "image":
+            success = self.blur_faces_in_image(
+                input_path=input_path,
+                output_path=output_path
+            )
+        elif file_type == "word":
+            success = self.blur_faces_in_word(
+                input_path=input_path,
+                output_path=output_path
+            )
+        elif file_type == "pdf":
+            success = self.blur_faces_in_pdf(
+                input_path=input_path,
+                output_path=output_path
+            )
+        else:
+            raise ValueError(f"不支持的文件类型: {file_type}")
+        if self.cache is not None and self.cache.hits + self.cache.misses > 0:
+            self.log(f"结果缓存: 命中 {self.cache.hits} 张，未命中 {self.cache.misses} 张")
+        return success
+    
+    def result_cache_context(self) -> str:
+        """处理上下文指纹：模型、白名单及阈值、打码参数任一变化，旧的缓存结果都不会被命中"""
+        context = {"detection": self.detection_context(), "blur": render_params_fingerprint()}
+        return hashlib.sha256(json.dumps(context, sort_keys=True).encode()).hexdigest()
+    
+    def detection_context(self) -> str:
+        """检测结果的指纹：只与模型、白名单及阈值、人脸过滤条件有关，与打码参数无关"""
+        whitelist = ""
+        if self.whitelist_data:
+            matrix = np.ascontiguousarray(self.whitelist_data['matrix'], dtype=np.float32)
+            whitelist = hashlib.sha256(matrix.tobytes()).hexdigest()
+        context = {
+            "model": self.app.model_fingerprint(),
+            "whitelist": whitelist,
+            "threshold": self.threshold,
+            "face_filter": self.face_filter,
+        }
+        return hashlib.sha256(json.dumps(context, sort_keys=True).encode()).hexdigest()
+    
+    def open_result_cache(self) -> None:
+        """按当前设置打开或关闭结果缓存，并清零命中统计"""
+        if self.cache is not None and self.cache.cache_dir != self.cache_dir:
+            self.cache.close()
+            self.cache = None
+        if self.cache_dir and self.cache is None:
+            try:
+                self.cache = ResultCache(self.cache_dir, self.cache_size_mb)
+            except (OSError, sqlite3.Error) as e:
+                self.log(f"警告: 无法打开结果缓存 {self.cache_dir}: {str(e)}，本次不使用缓存")
+                return
+        if self.cache is not None:
+            self.cache.max_bytes = self.cache_size_mb * 1024 * 1024
+            self.cache.hits = self.cache.misses = 0
+    
+    def cache_lookup(self, data: bytes, variant: str) -> Tuple[Optional[str], Optional[Tuple[Optional[bytes], Dict[str, Any]]]]:
+        """查询结果缓存，返回(缓存键, 缓存值)；variant区分同一图片的不同输出格式，未启用缓存时缓存键为None"""
+        if self.cache is None:
+            return None, None
+        key = ResultCache.make_key(self.cache_context, variant, data)
+        return key, self.cache.get(key)
+    
+    def cache_store(self, key: Optional[str], data: Optional[bytes], boxes: np.ndarray, **extra: Any) -> None:
+        """写入结果缓存：处理后的数据（无人脸时为None）、人脸框和附加元信息"""
+        if key is None or self.cache is None:
+            return
+        meta = {"face_count": len(boxes), "boxes": np.round(boxes, 2).tolist()}
+        meta.update(extra)
+        try:
+            self.cache.put(key, data, meta)
+        except (OSError, sqlite3.Error) as e:
+            self.log(f"警告: 写入结果缓存失败: {str(e)}", key="写入结果缓存失败")
+    
+    def initialize_face_analysis(self) -> Optional[FaceSessionPool]:
+        """初始化人脸分析模型"""
+        try:
+            # GPU检查与模型初始化
+            gpu_available = self.check_gpu_availability()
+            providers = ['CUDAExecutionProvider'] if gpu_available else ['CPUExecutionProvider']
+            self.log(f"使用提供者: {providers}")
+            
+            # 本机有calibrate保存的配置时使用调优后的参数；显式指定的实例数优先
+            size, intra_op_threads, det_size = self.session_pool_size, None, (640, 640)
+            profile = load_hardware_profile(self.hardware_profile_path, providers) if self.hardware_profile_path else None
+            if profile:
+                det_size = tuple(profile["det_size"])
+                if size is None:
+                    size, intra_op_threads = profile["session_pool_size"], profile["intra_op_threads"]
+                self.log(f"使用硬件配置（{profile['created']}）: 推理实例 {size or '默认'}，"
+                         f"检测尺寸 {det_size[0]}x{det_size[1]}")
+            
+            # 初始化会话池，使用本地模型；实例按需创建，视频处理时每个worker独占一个实例
+            pool = FaceSessionPool(self.insightface_dir, providers, size=size, intra_op_threads=intra_op_threads,
+                                   det_size=det_size, log=self.log)
+            pool.warmup(1)
+            return pool
+        except Exception as e:
+            self.log(f"初始化buffalo_l模型失败: {str(e)}")
+            return None
+    
+    def check_gpu_availability(self) -> bool:
+        """检查系统是否支持GPU加速"""
+        self.log("检查ONNX Runtime可用提供者...")
+        available_providers = ort.get_available_providers()
+        self.log(f"可用提供者: {available_providers}")
+        
+        if 'CUDAExecutionProvider' in available_providers:
+            self.log("✅ CUDA加速可用")
+            return True
+        else:
+            self.log("⚠️ CUDA加速不可用，将使用CPU")
+            self.log("提示: 请确保安装了onnxruntime-gpu和兼容的CUDA/cuDNN")
+            return False
+    
+    def load_whitelist_faces(self, app: FaceSessionPool, whitelist_dir: Optional[str], 
+                            similarity_threshold: float = 0.5) -> Tuple[Optional[Dict[str, Any]], float]:
+        """加载人脸白名单并返回特征向量矩阵"""
+        whitelist_features: List[Dict[str, Any]] = []
+        if whitelist_dir and os.path.exists(whitelist_dir):
+            self.log(f"正在加载人脸白名单，目录: {whitelist_dir}")
+            valid_files = [f for f in os.listdir(whitelist_dir) 
+                          if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+            
+            for filename in valid_files:
+                img_path = os.path.join(whitelist_dir, filename)
+                try:
+                    img = cv2.imread(img_path)
+                    if img is None:
+                        self.log(f"错误: 无法读取图片 {filename}")
+                        continue
+                        
+                    faces = app.get(img)
+                    if faces:
+                        whitelist_features.append({
+                            'feature': faces[0].normed_embedding,
+                            'filename': filename
+                        })
+                        self.log(f"已加载白名单人脸: {filename}")
+                    else:
+                        self.log(f"警告: 在白名单图片 {filename} 中未检测到人脸")
+                except Exception as e:
+                    self.log(f"错误: 无法加载白名单图片 {filename}: {str(e)}")
+        
+        if not whitelist_features:
+            self.log("警告: 未加载到任何白名单人脸，所有检测到的人脸都将被打码")
+            return None, similarity_threshold
+        
+        # 转换为特征矩阵（n_features × embedding_dim），加速批量计算
+        feature_matrix = np.array([item['feature'] for item in whitelist_features])
+        return {
+            'matrix': feature_matrix,
+            'entries': whitelist_features
+        }, similarity_threshold
+    
+    def precompute_image_processing_params(self, blur_type: str, blur_strength: int, 
+                                         feather_radius: int, opacity: float, 
+                                         mosaic_block_size: int) -> None:
+        """预计算图像处理参数，避免循环内重复计算"""
+        # 计算高斯模糊核
+        kernel_size = int(blur_strength // 2 * 2 + 1)
+        kernel_size = max(kernel_size, 3)
+        
+        # 存储预计算参数到全局变量
+        g_precomputed.update({
+            "kernel_size": kernel_size,
+            "blur_type": blur_type,
+            "feather_radius": feather_radius,
+            "opacity": opacity,
+            "mosaic_block_size": mosaic_block_size,
+            # 预计算羽化核（如果需要）
+            "feather_kernel": (feather_radius*2+1, feather_radius*2+1) if feather_radius > 0 else None
+        })
+    
+    def apply_mosaic(self, face_region: np.ndarray, block_size: int) -> np.ndarray:
+        """应用马赛克效果"""
+        height, width = face_region.shape[:2]
+        
+        # 缩小图像（人脸小于块大小时至少保留1个像素，整体取平均色）
+        small = cv2.resize(face_region, (max(1, width // block_size), max(1, height // block_size)),
+                           interpolation=cv2.INTER_LINEAR)
+        
+        # 放大回原尺寸
+        mosaic = cv2.resize(small, (width, height), interpolation=cv2.INTER_NEAREST)
+        return mosaic
+    
+    def apply_pixelate(self, face_region: np.ndarray, block_size: int) -> np.ndarray:
+        """应用像素化效果（比马赛克更规则）"""
+        height, width = face_region.shape[:2]
+        
+        # 遍历每个块并应用平均颜色
+        for y in range(0, height, block_size):
+            for x in range(0, width, block_size):
+                y_end = min(y + block_size, height)
+                x_end = min(x + block_size, width)
+                
+                # 获取块区域
+                block = face_region[y:y_end, x:x_end]
+                
+                # 计算块的平均颜色
+                avg_color = block.mean(axis=0).mean(axis=0)
+                
+                # 用平均颜色填充块
+                face_region[y:y_end, x:x_end] = avg_color
+        
+        return face_region
+    
+    def is_whitelisted_face(self, face: Any) -> bool:
+        """检查人脸是否在白名单中"""
+        if not self.whitelist_data:
+            return False
+        # 批量计算当前人脸与所有白名单人脸的相似度
+        similarities = np.dot(self.whitelist_data['matrix'], face.normed_embedding)
+        return bool(np.any(similarities > self.threshold))
+    
+    def process_single_face(self, frame: np.ndarray, face: Any) -> np.ndarray:
+        """处理单个人脸的打码逻辑"""
+        if self.is_whitelisted_face(face):
+            return frame  # 白名单人脸不处理
+        return self.blur_face_region(frame, face.bbox)
+    
+    def blur_face_region(self, frame: np.ndarray, bbox: np.ndarray) -> np.ndarray:
+        """对边界框内的人脸区域打码（原地修改帧）"""
+        # 人脸边界框处理
+        bbox = np.asarray(bbox[:4]).astype(int)
+        x1, y1, x2, y2 = bbox
+        x1, y1 = max(0, x1), max(0, y1)
+        x2, y2 = min(frame.shape[1], x2), min(frame.shape[0], y2)
+        
+        # 提取人脸区域
+        face_region = frame[y1:y2, x1:x2]
+        region_height, region_width = face_region.shape[:2]
+        if region_height == 0 or region_width == 0:
+            return frame
+        
+        self.blur_region(face_region)
+        return frame
+    
+    def blur_region(self, region: np.ndarray, subsampling: int = 1) -> None:
+        """对区域整体打码（原地修改）；region可以是BGR区域，也可以是单个YUV平面上的区域。
+        
+        subsampling为该平面相对原图的缩小倍数（yuv420p的色度平面为2），模糊核、马赛克块和羽化半径按比例缩小，
+        使各平面的打码范围一致。
+        """
+        region_height, region_width = region.shape[:2]
+        
+        # 1. 创建打码区域掩码
+        mask = np.zeros((region_height, region_width), dtype=np.uint8)
+        if g_precomputed["blur_type"] in ['circle', 'mosaic', 'pixelate']:
+            center = (region_width // 2, region_height // 2)
+            radius = int(max(region_width, region_height) * 0.45)
+            cv2.circle(mask, center, radius, 255, -1)
+        elif g_precomputed["blur_type"] == 'ellipse':
+            center = (region_width // 2, region_height // 2)
+            axes = (int(region_width * 0.45), int(region_height * 0.45))
+            cv2.ellipse(mask, center, axes, 0, 0, 360, 255, -1)
+        else:  # rectangle
+            cv2.rectangle(mask, (0, 0), (region_width, region_height), 255, -1)
+        
+        # 2. 羽化处理
+        feather_radius = g_precomputed["feather_radius"] // subsampling
+        if feather_radius > 0:
+            feather_kernel = g_precomputed["feather_kernel"] if subsampling == 1 else (feather_radius * 2 + 1,) * 2
+            mask = cv2.GaussianBlur(mask, feather_kernel, 0)
+        mask = mask / 255.0  # 归一化
+        if region.ndim == 3:
+            mask = mask[:, :, None]
+        
+        # 3. 应用打码效果
+        block_size = max(1, g_precomputed["mosaic_block_size"] // subsampling)
+        if g_precomputed["blur_type"] == 'mosaic':
+            processed_face = self.apply_mosaic(region.copy(), block_size)
+        elif g_precomputed["blur_type"] == 'pixelate':
+            processed_face = self.apply_pixelate(region.copy(), block_size)
+        else:  # 模糊效果
+            kernel_size = g_precomputed["kernel_size"]
+            if subsampling > 1:
+                kernel_size = max(3, kernel_size // subsampling // 2 * 2 + 1)
+            processed_face = cv2.GaussianBlur(region, (kernel_size, kernel_size), kernel_size // 2)
+        
+        # 4. 混合处理
+        opacity = g_precomputed["opacity"]
+        if opacity < 1.0:
+            region[:] = (region * (1 - mask) + 
+                         (processed_face * opacity + region * (1 - opacity)) * mask).astype(np.uint8)
+        else:
+            region[:] = (region * (1 - mask) + processed_face * mask).astype(np.uint8)
+    
+    def can_process_yuv(self, input_path: str) -> bool:
+        """YUV平面处理需要FFmpeg，且宽高为偶数（yuv420p色度平面为亮度的一半）"""
+        if not os.path.isfile(self.ffmpeg_path):
+            self.log("未找到FFmpeg，无法使用YUV平面处理，改为BGR处理")
+            return False
+        cap = cv2.VideoCapture(input_path)
+        width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        cap.release()
+        if width % 2 or height % 2:
+            self.log(f"视频尺寸 {width}x{height} 不是偶数，无法使用YUV平面处理，改为BGR处理")
+            return False
+        return True
+    
+    def yuv_planes(self, frame: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """I420排列的帧拆成Y、U、V三个平面（均为视图，修改会写回原帧）"""
+        height = frame.shape[0] * 2 // 3
+        width = frame.shape[1]
+        chroma_size = height // 4
+        u = frame[height:height + chroma_size].reshape(height // 2, width // 2)
+        v = frame[height + chroma_size:].reshape(height // 2, width // 2)
+        return frame[:height], u, v
+    
+    def yuv_detector_input(self, frame: np.ndarray) -> Tuple[np.ndarray, float, float]:
+        """由YUV平面生成检测输入：先把各平面缩小到检测尺寸以内再转BGR，返回(BGR帧, x缩放比, y缩放比)。
+        
+        检测模型本身也会把输入缩放到det_size，预先缩小不影响检测，但颜色转换只需处理很小的图。
+        """
+        y, u, v = self.yuv_planes(frame)
+        height, width = y.shape
+        det_width, det_height = self.app.det_size
+        scale = min(det_width / width, det_height / height, 1.0)
+        if scale >= 1.0:
+            return cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420), 1.0, 1.0
+        small_width = max(2, int(width * scale) // 2 * 2)
+        small_height = max(2, int(height * scale) // 2 * 2)
+        planes = [
+            cv2.resize(y, (small_width, small_height), interpolation=cv2.INTER_AREA),
+            cv2.resize(u, (small_width // 2, small_height // 2), interpolation=cv2.INTER_AREA),
+            cv2.resize(v, (small_width // 2, small_height // 2), interpolation=cv2.INTER_AREA),
+        ]
+        i420 = np.concatenate([plane.ravel() for plane in planes]).reshape(small_height * 3 // 2, small_width)
+        return cv2.cvtColor(i420, cv2.COLOR_YUV2BGR_I420), small_width / width, small_height / height
+    
+    def process_yuv_frame_with_boxes(self, frame: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """处理I420排列的yuv420p帧（原地修改），返回(处理后的帧, 人脸框)，人脸框格式同process_frame_with_boxes。
+        
+        在缩小的画面上只做检测；白名单比对需要原分辨率的人脸，只把各人脸附近的区域从YUV平面转为BGR后识别。
+        """
+        no_faces = np.zeros((0, 6), dtype=np.float32)
+        if self.cancel_event.is_set():
+            return frame, no_faces
+        try:
+            detector_input, scale_x, scale_y = self.yuv_detector_input(frame)
+            faces = self.app.detect(detector_input, self.face_filter, recognize=False,
+                                    frame_short_side=min(frame.shape[0] * 2 // 3, frame.shape[1]), scale=scale_x)
+            scale = np.array([scale_x, scale_y], dtype=np.float32)
+            for face in faces:
+                face.bbox = face.bbox / np.tile(scale, 2)
+                if face.kps is not None:
+                    face.kps = face.kps / scale
+            if faces and self.whitelist_data:
+                crops = [self.yuv_face_crop(frame, face) for face in faces]
+                self.app.recognize(crops)
+                for face, (_, crop_face) in zip(faces, crops):
+                    face.embedding = crop_face.embedding
+            boxes = self.face_boxes(faces)
+            for box in boxes:
+                if not box[5]:
+                    self.blur_face_region_yuv(frame, box)
+            return frame, boxes
+        except Exception as e:
+            self.log(f"处理帧时出错: {str(e)}", key="处理帧时出错")
+            return frame, no_faces
+    
+    def yuv_face_crop(self, frame: np.ndarray, face: Any) -> Tuple[np.ndarray, Any]:
+        """把人脸附近的区域（人脸框向外扩展一倍）从YUV平面转为BGR，返回(BGR区域, 关键点为区域坐标的人脸)。
+        
+        识别前的对齐只用到关键点附近的像素，不需要转换整帧；对返回的人脸提取的特征即原人脸的特征。
+        """
+        y, u, v = self.yuv_planes(frame)
+        height, width = y.shape
+        x1, y1, x2, y2 = face.bbox[:4]
+        margin_x, margin_y = (x2 - x1) / 2, (y2 - y1) / 2
+        left, top = max(0, int(x1 - margin_x)) & ~1, max(0, int(y1 - margin_y)) & ~1
+        right, bottom = min(width, (int(x2 + margin_x) + 2) & ~1), min(height, (int(y2 + margin_y) + 2) & ~1)
+        planes = [y[top:bottom, left:right], u[top // 2:bottom // 2, left // 2:right // 2],
+                  v[top // 2:bottom // 2, left // 2:right // 2]]
+        i420 = np.concatenate([plane.ravel() for plane in planes]).reshape((bottom - top) * 3 // 2, right - left)
+        crop_face = Face(bbox=face.bbox, kps=face.kps - np.array([left, top], dtype=np.float32),
+                         det_score=face.det_score)
+        return cv2.cvtColor(i420, cv2.COLOR_YUV2BGR_I420), crop_face
+    
+    def blur_face_region_yuv(self, frame: np.ndarray, bbox: np.ndarray) -> np.ndarray:
+        """在Y、U、V平面上分别对人脸区域打码（原地修改）；区域对齐到偶数坐标，色度平面取对应的一半"""
+        y, u, v = self.yuv_planes(frame)
+        height, width = y.shape
+        x1, y1 = max(0, int(bbox[0])) & ~1, max(0, int(bbox[1])) & ~1
+        x2, y2 = min(width, (int(bbox[2]) + 1) & ~1), min(height, (int(bbox[3]) + 1) & ~1)
+        if x2 <= x1 or y2 <= y1:
+            return frame
+        self.blur_region(y[y1:y2, x1:x2])
+        for plane in (u, v):
+            self.blur_region(plane[y1 // 2:y2 // 2, x1 // 2:x2 // 2], subsampling=2)
+        return frame
+    
+    def process_frame(self, frame: np.ndarray) -> Tuple[np.ndarray, int]:
+        """处理单帧图像，增加错误处理"""
+        frame, boxes = self.process_frame_with_boxes(frame)
+        return frame, len(boxes)
+    
+    def process_frame_with_boxes(self, frame: np.ndarray, raise_errors: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """处理单帧图像，返回(处理后的帧, 人脸框)。
+        
+        人脸框为N×6数组，每行依次为x1, y1, x2, y2, 检测置信度, 是否白名单(0/1)。
+        raise_errors为False时检测出错只记录日志并返回原始帧。
+        """
+        no_faces = np.zeros((0, 6), dtype=np.float32)
+        if self.cancel_event.is_set():
+            return frame, no_faces
+            
+        # 检查帧是否有效
+        if frame is None:
+            self.log("错误: 接收到空帧", key="接收到空帧")
+            return np.array([]), no_faces
+            
+        if not isinstance(frame, np.ndarray):
+            self.log(f"错误: 帧不是有效的numpy数组，类型为{type(frame)}", key="帧类型错误")
+            return np.array([]), no_faces
+            
+        if len(frame.shape) != 3:
+            self.log(f"错误: 帧形状不正确，应为3维，实际为{frame.shape}", key="帧形状错误")
+            return np.array([]), no_faces
+        
+        try:
+            boxes = self.detect_face_boxes(frame)
+            return self.render_face_boxes(frame, boxes), boxes
+        except Exception as e:
+            if raise_errors:
+                raise
+            self.log(f"处理帧时出错: {str(e)}", key="处理帧时出错")
+            # 返回原始帧以继续处理流程
+            return frame, no_faces
+    
+    def detect_face_boxes(self, frame: np.ndarray, scale: float = 1.0,
+                          frame_short_side: Optional[int] = None) -> np.ndarray:
+        """检测人脸并判定白名单，返回N×6的人脸框数组（格式同process_frame_with_boxes），不修改帧。
+        
+        过滤条件在识别之前生效；未加载白名单时不运行识别模型。frame是缩小后的画面或大图中的窗口时，
+        用scale和frame_short_side指明原画面，尺寸过滤按原画面计算（返回的人脸框仍为frame的坐标）。
+        """
+        faces = self.app.detect(frame, self.face_filter, recognize=bool(self.whitelist_data),
+                                frame_short_side=frame_short_side, scale=scale)
+        return self.face_boxes(faces)
+    
+    def detect_face_boxes_batch(self, frames: List[np.ndarray]) -> List[np.ndarray]:
+        """批量检测多张图片，返回各自的人脸框数组；所有人脸的识别特征一次推理得到"""
+        results = self.app.detect_batch(frames, self.face_filter, recognize=bool(self.whitelist_data))
+        return [self.face_boxes(faces) for faces in results]
+    
+    def face_boxes(self, faces: List[Any]) -> np.ndarray:
+        """把检测结果转换为N×6的人脸框数组，并判定白名单"""
+        boxes = np.zeros((len(faces), 6), dtype=np.float32)
+        for i, face in enumerate(faces):
+            boxes[i, :4] = face.bbox[:4]
+            boxes[i, 4] = face.det_score
+            boxes[i, 5] = self.is_whitelisted_face(face)
+        return boxes
+    
+    def render_face_boxes(self, frame: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+        """按人脸框打码（原地修改帧），白名单人脸保持原样"""
+        for box in boxes:
+            if not box[5]:
+                frame = self.blur_face_region(frame, box)
+        return frame
+    
+    def process_cacheable_frame(self, frame: np.ndarray) -> Tuple[np.ndarray, np.ndarray, bool]:
+        """处理单张图片，并返回结果能否写入缓存（检测出错或处理被取消时不能缓存）"""
+        try:
+            frame, boxes = self.process_frame_with_boxes(frame, raise_errors=True)
+        except Exception as e:
+            self.log(f"处理帧时出错: {str(e)}", key="处理帧时出错")
+            return frame, np.zeros((0, 6), dtype=np.float32), False
+        return frame, boxes, not self.cancel_event.is_set()
+    
+    # 图片处理函数
+    def blur_faces_in_image(self, input_path: str, output_path: str) -> bool:
+        """对图片中的人脸进行打码处理"""
+        if self.image_windowed or (self.image_windowed is None and
+                                   image_pixel_count(input_path) >= IMAGE_WINDOWED_MIN_PIXELS):
+            return self.blur_faces_in_image_windowed(input_path, output_path)
+        try:
+            # 读取图片
+            with open(input_path, "rb") as f:
+                data = f.read()
+            self.log(f"处理图片: {os.path.basename(input_path)}")
+            
+            # 输出格式由输出文件扩展名决定，不同格式的结果分别缓存
+            output_ext = os.path.splitext(output_path)[1].lower() or ".png"
+            if is_animated_blob(data):
+                if output_ext in ANIMATION_EXTENSIONS:
+                    return self.blur_faces_in_animation(data, output_path, output_ext)
+                self.log(f"提示: {output_ext} 格式不支持动画，只处理第一帧")
+            key, cached = self.cache_lookup(data, "image" + output_ext)
+            if cached is not None:
+                output_data, meta = cached
+                self.log(f"图片尺寸: {meta['width']}x{meta['height']}")
+                self.log(f"检测到 {meta['face_count']} 个人脸（结果缓存）")
+            else:
+                img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if img is None:
+                    raise Exception(f"无法读取图片: {input_path}")
+                self.log(f"图片尺寸: {img.shape[1]}x{img.shape[0]}")
+                
+                # 处理人脸
+                processed_img, boxes, cacheable = self.process_cacheable_frame(img)
+                self.log(f"检测到 {len(boxes)} 个人脸")
+                
+                success, encoded = cv2.imencode(output_ext, processed_img)
+                if not success:
+                    raise Exception(f"无法保存处理后的图片到: {output_path}")
+                output_data = encoded.tobytes()
+                if cacheable:
+                    self.cache_store(key, output_data, boxes, width=img.shape[1], height=img.shape[0])
+            
+            # 保存处理后的图片
+            with open(output_path, "wb") as f:
+                f.write(output_data)
+            return True
+        except Exception as e:
+            self.log(f"图片处理错误: {str(e)}")
+            return False
+    
+    def blur_faces_in_animation(self, data: bytes, output_path: str, output_ext: str) -> bool:
+        """逐帧处理GIF/WebP动画，保留帧时长、循环次数和调色板。
+        
+        完全相同的帧直接复用处理结果；与上一次检测的帧近似重复时复用其人脸框，只重新打码。
+        """
+        output_data = self.blur_animation_blob(data, output_ext)
+        if output_data is None:
+            return False
+        with open(output_path, "wb") as f:
+            f.write(output_data)
+        return True
+    
+    def blur_animation_blob(self, data: bytes, output_ext: str) -> Optional[bytes]:
+        """在内存中逐帧处理动画，返回编码后的数据；处理被取消时返回None"""
+        key, cached = self.cache_lookup(data, "animation" + output_ext)
+        if cached is not None:
+            output_data, meta = cached
+            self.log(f"动画: {meta['frames']} 帧，检测到 {meta['face_count']} 个人脸（结果缓存）")
+        else:
+            frames, durations, params = read_animation_frames(data)
+            height, width = frames[0].shape[:2]
+            self.log(f"图片尺寸: {width}x{height}，动画共 {len(frames)} 帧")
+            
+            outputs: List[np.ndarray] = []
+            results: Dict[bytes, np.ndarray] = {}
+            reference_signature: Optional[np.ndarray] = None
+            reference_boxes = np.zeros((0, 6), dtype=np.float32)
+            all_boxes: List[np.ndarray] = []
+            cacheable = True
+            duplicates = near_duplicates = 0
+            for index, frame in enumerate(frames):
+                if self.cancel_event.is_set():
+                    return None
+                digest = hashlib.blake2b(frame.tobytes(), digest_size=16).digest()
+                if digest in results:
+                    # 完全相同的帧：直接复用处理后的帧
+                    outputs.append(results[digest])
+                    duplicates += 1
+                    self.update_progress((index + 1) / len(frames) * 100)
+                    continue
+                bgr = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+                signature = animation_frame_signature(frame)
+                if reference_signature is not None and \
+                        np.abs(signature - reference_signature).max() <= ANIMATION_NEAR_DUPLICATE_DIFF:
+                    # 近似重复帧：沿用参考帧的人脸框
+                    processed = self.render_face_boxes(bgr, reference_boxes)
+                    near_duplicates += 1
+                else:
+                    processed, reference_boxes, frame_cacheable = self.process_cacheable_frame(bgr)
+                    reference_signature = signature
+                    cacheable = cacheable and frame_cacheable
+                    all_boxes.append(reference_boxes)
+                output = np.dstack([cv2.cvtColor(processed, cv2.COLOR_BGR2RGB), frame[:, :, 3]])
+                results[digest] = output
+                outputs.append(output)
+                self.update_progress((index + 1) / len(frames) * 100)
+            
+            boxes = np.concatenate(all_boxes) if all_boxes else np.zeros((0, 6), dtype=np.float32)
+            self.log(f"检测了 {len(all_boxes)} 帧，复用相同帧 {duplicates} 帧、近似重复帧 {near_duplicates} 帧，"
+                     f"检测到 {len(boxes)} 个人脸")
+            output_data = encode_animation(outputs, durations, params, output_ext)
+            if cacheable:
+                self.cache_store(key, output_data, boxes, width=width, height=height, frames=len(frames))
+        return output_data
+    
+    def blur_faces_in_image_windowed(self, input_path: str, output_path: str) -> bool:
+        """按窗口处理超大图片：分块检测并合并重叠区的人脸框，再逐图块打码写出。
+        
+        输入为TIFF且有tifffile时全程按窗口读取；输出为TIFF时逐图块写出，峰值内存只与窗口大小有关。
+        不使用结果缓存（计算缓存键需要读取整个文件）。
+        """
+        try:
+            image = WindowedImage(input_path)
+        except Exception as e:
+            self.log(f"图片处理错误: {str(e)}")
+            return False
+        try:
+            width, height = image.width, image.height
+            window, overlap = self.image_window_size, IMAGE_WINDOW_OVERLAP
+            step = max(window - overlap, 1)
+            self.log(f"处理图片: {os.path.basename(input_path)}，尺寸 {width}x{height}，"
+                     f"按 {window}x{window} 窗口分块检测（{'按窗口读取' if image.mapped else '整幅解码'}）")
+            if not image.mapped:
+                self.log("提示: 只有TIFF（需安装tifffile）能按窗口读取，其他格式仍需整幅解码")
+            
+            # 1. 分块检测（窗口间重叠，保证每张人脸至少完整出现在一个窗口中）
+            positions = [(y, x) for y in range(0, max(height - overlap, 1), step)
+                         for x in range(0, max(width - overlap, 1), step)]
+            detected: List[np.ndarray] = []
+            for index, (y, x) in enumerate(positions):
+                if self.cancel_event.is_set():
+                    return False
+                boxes = self.detect_face_boxes(image.read_bgr(y, min(y + window, height), x, min(x + window, width)),
+                                               frame_short_side=min(width, height))
+                if len(boxes):
+                    boxes[:, [0, 2]] += x
+                    boxes[:, [1, 3]] += y
+                    detected.append(boxes)
+                self.update_progress((index + 1) / len(positions) * 50)
+            boxes = merge_window_boxes(np.concatenate(detected)) if detected else np.zeros((0, 6), dtype=np.float32)
+            blur_boxes = boxes[boxes[:, 5] == 0]
+            self.log(f"检测到 {len(boxes)} 个人脸（{len(positions)} 个窗口）")
+            
+            # 2. 写出：没有需要打码的人脸且格式不变时直接复制
+            same_format = os.path.splitext(input_path)[1].lower() == os.path.splitext(output_path)[1].lower()
+            if not len(blur_boxes) and same_format:
+                if os.path.abspath(input_path) != os.path.abspath(output_path):
+                    shutil.copyfile(input_path, output_path)
+            elif TIFFFILE_SUPPORTED and output_path.lower().endswith((".tif", ".tiff")):
+                self.write_windowed_tiff(image, blur_boxes, output_path)
+            else:
+                self.log("提示: 只有TIFF输出能逐图块写出，当前格式需要整幅编码")
+                bgr = image.read_bgr(0, height, 0, width)
+                self.render_face_boxes(bgr, blur_boxes)
+                if not cv2.imwrite(output_path, bgr):
+                    raise Exception(f"无法保存处理后的图片到: {output_path}")
+            self.update_progress(100)
+            return not self.cancel_event.is_set()
+        except Exception as e:
+            self.log(f"图片处理错误: {str(e)}")
+            return False
+        finally:
+            image.close()
+    
+    def write_windowed_tiff(self, image: WindowedImage, blur_boxes: np.ndarray, output_path: str) -> None:
+        """逐图块打码并写出分块TIFF。
+        
+        每个图块连同与其相交的人脸框的完整范围一起读取和打码，再裁出图块本身，
+        因此跨图块的人脸在各图块中的结果一致，拼接处没有接缝。
+        """
+        tile = IMAGE_OUTPUT_TILE
+        width, height = image.width, image.height
+        channels = 1 if image.array.ndim == 2 else image.array.shape[2]
+        tile_rows = (height + tile - 1) // tile
+        
+        def tiles() -> Iterator[np.ndarray]:
+            for row, y in enumerate(range(0, height, tile)):
+                for x in range(0, width, tile):
+                    y2, x2 = min(y + tile, height), min(x + tile, width)
+                    hits = blur_boxes[(blur_boxes[:, 0] < x2) & (blur_boxes[:, 2] > x) &
+                                      (blur_boxes[:, 1] < y2) & (blur_boxes[:, 3] > y)]
+                    if len(hits):
+                        region_x1 = max(0, min(x, int(hits[:, 0].min())))
+                        region_y1 = max(0, min(y, int(hits[:, 1].min())))
+                        region_x2 = min(width, max(x2, int(hits[:, 2].max()) + 1))
+                        region_y2 = min(height, max(y2, int(hits[:, 3].max()) + 1))
+                        region = image.read_bgr(region_y1, region_y2, region_x1, region_x2)
+                        shifted = hits.copy()
+                        shifted[:, [0, 2]] -= region_x1
+                        shifted[:, [1, 3]] -= region_y1
+                        self.render_face_boxes(region, shifted)
+                        native = image.to_native(region, region_y1, region_y2, region_x1, region_x2)
+                        block = native[y - region_y1:y2 - region_y1, x - region_x1:x2 - region_x1]
+                    else:
+                        block = np.asarray(image.array[y:y2, x:x2])
+                    # 边缘图块补齐到完整尺寸
+                    padded = np.zeros((tile, tile) + block.shape[2:], dtype=np.uint8)
+                    padded[:block.shape[0], :block.shape[1]] = block
+                    yield padded
+                self.update_progress(50 + (row + 1) / tile_rows * 50)
+        
+        shape = (height, width) if channels == 1 else (height, width, channels)
+        # 估算未压缩大小超过4GB时使用BigTIFF
+        bigtiff = height * width * channels > 2 ** 32 - 2 ** 25
+        tifffile.imwrite(output_path, tiles(), shape=shape, dtype=np.uint8, tile=(tile, tile),
+                         photometric="minisblack" if channels == 1 else "rgb",
+                         extrasamples=("unassalpha",) if channels == 4 else None,
+                         compression="zlib", bigtiff=bigtiff)
+    
+    def blur_faces_in_directory(self, input_root: str, output_root: str, list_path: Optional[str] = None,
+                                force: bool = False) -> bool:
+        """批量处理目录树（或文件列表）中的图片，输出保持相对路径。
+        
+        每张图片依次经过读取解码、人脸检测、编码写出三个阶段：读写线程池提前读取和解码后续图片，
+        检测线程数与会话池实例数一致，多张图片的检测同时进行；在途图片数有界，内存与图片总数无关。
+        没有需要打码的人脸时直接复制原文件；JPEG沿用原质量并保留EXIF。
+        """
+        try:
+            jobs, up_to_date = collect_bulk_images(input_root, output_root, list_path, force)
+        except (OSError, ValueError) as e:
+            self.log(f"读取图片列表失败: {str(e)}")
+            return False
+        self.log(f"批量处理: 共 {len(jobs) + up_to_date} 张图片，已是最新 {up_to_date} 张，待处理 {len(jobs)} 张")
+        if not jobs:
+            return True
+        
+        detect_workers = self.app.size
+        io_workers = max(2, detect_workers * 2)
+        window = detect_workers * 8
+        stats = {"done": 0, "faces": 0, "blurred": 0, "failed": 0}
+        start_time = last_report = time.time()
+        next_job = 0
+        pending: set = set()
+        with ThreadPoolExecutor(max_workers=io_workers) as io_pool, \
+                ThreadPoolExecutor(max_workers=detect_workers) as detect_pool:
+            while next_job < len(jobs) or pending:
+                if self.cancel_event.is_set():
+                    for future in pending:
+                        future.cancel()
+                    self.log(f"批量处理已取消，已完成 {stats['done']} 张")
+                    return False
+                while next_job < len(jobs) and len(pending) < window:
+                    pending.add(io_pool.submit(self.load_bulk_image, jobs[next_job]))
+                    next_job += 1
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        stage, job, payload = future.result()
+                    except Exception as e:
+                        stage, job, payload = "failed", None, str(e)
+                    if stage == "decoded":
+                        pending.add(detect_pool.submit(self.detect_bulk_image, job, payload))
+                    elif stage == "detected":
+                        pending.add(io_pool.submit(self.write_bulk_image, job, payload))
+                    else:
+                        stats["done"] += 1
+                        if stage == "failed":
+                            stats["failed"] += 1
+                            self.log(f"处理失败: {job[2] if job else ''} {payload}", key="批量处理失败")
+                        else:
+                            stats["faces"] += payload
+                            stats["blurred"] += payload > 0
+                        self.update_progress(stats["done"] / len(jobs) * 100)
+                now = time.time()
+                if now - last_report >= 5:
+                    last_report = now
+                    self.log(f"已处理 {stats['done']}/{len(jobs)} 张，{stats['done'] / (now - start_time):.1f} 张/秒")
+        
+        elapsed = max(time.time() - start_time, 1e-6)
+        self.log(f"批量处理完成: {stats['done']} 张，其中 {stats['blurred']} 张包含人脸（共 {stats['faces']} 个），"
+                 f"失败 {stats['failed']} 张，用时 {elapsed:.2f} 秒，{stats['done'] / elapsed:.1f} 张/秒")
+        return stats["failed"] == 0
+    
+    def load_bulk_image(self, job: Tuple[str, str, str]) -> Tuple[str, Tuple[str, str, str], Any]:
+        """读取阶段：读取文件并查询结果缓存，未命中时解码"""
+        source, _, relative = job
+        with open(source, "rb") as f:
+            data = f.read()
+        ext = os.path.splitext(source)[1].lower().lstrip(".")
+        # 与Word中的图片使用同一缓存变体，相同图片的结果可以共用
+        key, cached = self.cache_lookup(data, "blob." + ext)
+        if cached is not None:
+            processed_blob, meta = cached
+            return "detected", job, (data, processed_blob, meta["face_count"], None)
+        img, alpha, gray = decode_image_blob(data)
+        if img is None:
+            return "failed", job, "无法解码图片"
+        return "decoded", job, (data, key, ext, img, alpha, gray)
+    
+    def detect_bulk_image(self, job: Tuple[str, str, str], payload: Any) -> Tuple[str, Tuple[str, str, str], Any]:
+        """检测阶段：检测并打码（原地修改图像）"""
+        data, key, ext, img, alpha, gray = payload
+        processed_img, boxes, cacheable = self.process_cacheable_frame(img)
+        blur_count = int((boxes[:, 5] == 0).sum()) if len(boxes) else 0
+        return "detected", job, (data, None, len(boxes), (key, ext, processed_img, boxes, cacheable, alpha, gray, blur_count))
+    
+    def write_bulk_image(self, job: Tuple[str, str, str], payload: Any) -> Tuple[str, Tuple[str, str, str], int]:
+        """写出阶段：编码并写入输出（先写临时文件再替换，中断时不会留下看似最新的残缺文件）"""
+        _, target, _ = job
+        data, processed_blob, face_count, detected = payload
+        if detected is not None:
+            key, ext, processed_img, boxes, cacheable, alpha, gray, blur_count = detected
+            if blur_count > 0:
+                processed_blob = encode_image_like(processed_img, ext, data, alpha, gray)
+            if cacheable:
+                self.cache_store(key, processed_blob, boxes)
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        temp_path = f"{target}.{generate_random_suffix()}.tmp"
+        with open(temp_path, "wb") as f:
+            # 没有需要打码的人脸时原样复制，不重新编码
+            f.write(processed_blob if processed_blob is not None else data)
+        os.replace(temp_path, target)
+        return "done", job, face_count
+    
+    # Word文档处理函数
+    def blur_faces_in_word(self, input_path: str, output_path: str) -> bool:
+        """对Word文档中的图片人脸进行打码处理，图片在内存中编解码，相同内容只处理一次"""
+        if self.word_mode == "zip":
+            return self.blur_faces_in_docx_zip(input_path, output_path)
+        if not DOCX_SUPPORTED:
+            self.log("错误: Word文档处理需要python-docx库")
+            return False
+            
+        try:
+            # 加载Word文档
+            doc = Document(input_path)
+            self.log(f"加载Word文档: {os.path.basename(input_path)}")
+            
+            # 提取文档中的所有图片，按内容哈希去重（同一图片可能被多次引用或存为多个部件）
+            self.log("从Word文档中提取图片...")
+            parts_by_digest: Dict[str, List[Any]] = {}
+            blobs: Dict[str, Tuple[bytes, str, str]] = {}
+            for rel in doc.part.rels.values():
+                if rel.is_external or "image" not in rel.target_ref:
+                    continue
+                part = rel.target_part
+                img_data = part.blob
+                digest = hashlib.sha1(img_data).hexdigest()
+                if digest not in blobs:
+                    img_ext = part.content_type.split('/')[-1].lower()
+                    blobs[digest] = (img_data, img_ext, str(part.partname))
+                if all(existing is not part for existing in parts_by_digest.setdefault(digest, [])):
+                    parts_by_digest[digest].append(part)
+            self.log(f"共 {sum(len(parts) for parts in parts_by_digest.values())} 个图片部件，去重后 {len(blobs)} 张图片")
+            
+            skip_counts = {reason: 0 for reason in PREFILTER_REASONS}
+            results = self.process_image_blobs(blobs, skip_counts)
+            if self.cancel_event.is_set():
+                return False
+            
+            # 只替换包含人脸的图片
+            modified_count = 0
+            for digest, (processed_blob, face_count) in results.items():
+                if processed_blob is None:
+                    continue
+                modified_count += 1
+                for part in parts_by_digest[digest]:
+                    part._blob = processed_blob
+            
+            self.log(f"共处理 {len(results)} 张图片，其中 {modified_count} 张包含人脸并已打码")
+            self.log(format_prefilter_summary(skip_counts))
+            
+            # 保存处理后的文档
+            doc.save(output_path)
+            return True
+            
+        except Exception as e:
+            self.log(f"Word文档处理错误: {str(e)}")
+            return False
+    
+    def blur_faces_in_docx_zip(self, input_path: str, output_path: str) -> bool:
+        """直接在OPC压缩包层面处理Word文档。
+        
+        处理所有word/media/下的图片（包括页眉、页脚等任意部件引用的图片）和文档缩略图，
+        其余条目按原压缩数据复制；图片以有界窗口并发处理，内存占用与文档大小无关。
+        """
+        if os.path.abspath(input_path) == os.path.abspath(output_path):
+            self.log("错误: zip模式下输出文件不能与输入文件相同")
+            return False
+        try:
+            with zipfile.ZipFile(input_path) as zin, open(input_path, "rb") as source:
+                infos = zin.infolist()
+                media = [i for i, info in enumerate(infos) if is_docx_image_entry(info.filename)]
+                media_position = {index: position for position, index in enumerate(media, start=1)}
+                self.log(f"加载Word文档: {os.path.basename(input_path)}，共 {len(infos)} 个条目，其中 {len(media)} 张图片")
+                
+                skip_counts = {reason: 0 for reason in PREFILTER_REASONS}
+                # 内容哈希 -> 处理结果的Future，相同图片只处理一次
+                digest_futures: Dict[str, Future] = {}
+                pending: Dict[int, Future] = {}
+                window = self.app.size * 2
+                image_count = 0
+                modified_count = 0
+                
+                def load_and_submit(index: int) -> None:
+                    nonlocal image_count
+                    info = infos[index]
+                    data = zin.read(info)
+                    digest = hashlib.sha1(data).hexdigest()
+                    if digest not in digest_futures:
+                        ext = os.path.splitext(info.filename)[1].lstrip(".").lower()
+                        width, height = image_blob_size(data)
+                        reason = image_prefilter_reason(self.prefilter, width, height, data=data)
+                        if reason:
+                            skip_counts[reason] += 1
+                            digest_futures[digest] = None
+                        else:
+                            image_count += 1
+                            digest_futures[digest] = executor.submit(
+                                self.process_image_blob, data, ext, info.filename)
+                    if digest_futures[digest] is not None:
+                        pending[index] = digest_futures[digest]
+                
+                # 先写临时文件，成功后再替换，出错或取消时不会留下残缺的文档
+                temp_path = f"{output_path}.{generate_random_suffix()}.tmp"
+                try:
+                    with ThreadPoolExecutor(max_workers=self.app.size) as executor, \
+                            RawZipWriter(temp_path) as zout:
+                        zout.comment = zin.comment
+                        next_media = 0
+                        for index, info in enumerate(infos):
+                            if self.cancel_event.is_set():
+                                break
+                            # 提前提交窗口内的图片，使检测与条目复制重叠
+                            while next_media < len(media) and len(pending) < window and media[next_media] >= index:
+                                load_and_submit(media[next_media])
+                                next_media += 1
+                            if next_media < len(media) and media[next_media] == index:
+                                load_and_submit(index)
+                                next_media += 1
+                        
+                            future = pending.pop(index, None)
+                            processed_blob = future.result()[0] if future is not None else None
+                            if processed_blob is not None:
+                                new_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                                new_info.external_attr = info.external_attr
+                                new_info.compress_type = info.compress_type
+                                zout.writestr(new_info, processed_blob)
+                                modified_count += 1
+                            else:
+                                zout.copy_raw(source, info)
+                            if index in media_position:
+                                self.update_progress(media_position[index] / len(media) * 100)
+                    if self.cancel_event.is_set():
+                        os.remove(temp_path)
+                        return False
+                    os.replace(temp_path, output_path)
+                except BaseException:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    raise
+            
+            self.log(f"共处理 {image_count} 张图片，{modified_count} 个图片条目包含人脸并已打码")
+            self.log(format_prefilter_summary(skip_counts))
+            return True
+        except Exception as e:
+            self.log(f"Word文档处理错误: {str(e)}")
+            return False
+    
+    def process_image_blobs(self, blobs: Dict[str, Tuple[bytes, str, str]],
+                            skip_counts: Dict[str, int]) -> Dict[str, Tuple[Optional[bytes], int]]:
+        """并发处理去重后的图片数据。
+        
+        blobs的键为内容哈希，值为(图片数据, 扩展名, 显示名称)；返回每张已检测图片的
+        (处理后的数据, 人脸数)，未检测到人脸时处理后的数据为None。
+        """
+        results: Dict[str, Tuple[Optional[bytes], int]] = {}
+        with ThreadPoolExecutor(max_workers=self.app.size) as executor:
+            pending: Dict[Future, str] = {}
+            for digest, (data, ext, name) in blobs.items():
+                width, height = image_blob_size(data)
+                reason = image_prefilter_reason(self.prefilter, width, height, data=data)
+                if reason:
+                    skip_counts[reason] += 1
+                    continue
+                pending[executor.submit(self.process_image_blob, data, ext, name)] = digest
+            for done_count, future in enumerate(as_completed(pending), start=1):
+                results[pending[future]] = future.result()
+                self.update_progress(done_count / len(pending) * 100)
+        return results
+    
+    def process_image_blob(self, data: bytes, ext: str, name: str) -> Tuple[Optional[bytes], int]:
+        """在内存中解码、打码并按原格式编码单张图片，优先使用结果缓存"""
+        key, cached = self.cache_lookup(data, "blob." + ext)
+        if cached is not None:
+            processed_blob, meta = cached
+            if processed_blob is None:
+                self.log(f"处理图片 {name}，没有需要打码的人脸（结果缓存）")
+            else:
+                self.log(f"处理图片 {name}，检测到 {meta['face_count']} 个人脸（结果缓存）")
+            return processed_blob, meta["face_count"]
+        
+        img, alpha, gray = decode_image_blob(data)
+        if img is None:
+            self.log(f"警告: 无法读取图片 {name}，将使用原始图片")
+            return None, 0
+        processed_img, boxes, cacheable = self.process_cacheable_frame(img)
+        face_count = len(boxes)
+        # 只有白名单人脸时像素没有变化，保留原始数据，不重新编码
+        blur_count = int((boxes[:, 5] == 0).sum())
+        processed_blob = encode_image_like(processed_img, ext, data, alpha, gray) if blur_count > 0 else None
+        if cacheable:
+            self.cache_store(key, processed_blob, boxes)
+        if face_count == 0:
+            self.log(f"处理图片 {name}，未检测到人脸")
+        elif blur_count == 0:
+            self.log(f"处理图片 {name}，检测到 {face_count} 个人脸，均为白名单人脸，保留原始图片")
+        else:
+            self.log(f"处理图片 {name}，检测到 {face_count} 个人脸")
+        return processed_blob, face_count
+    
+    # PDF文档处理函数
+    def blur_faces_in_pdf(self, input_path: str, output_path: str) -> bool:
+        """对PDF文档中的图片人脸进行打码处理，使用PyMuPDF库，不依赖Poppler。
+        
+        每个图片xref只解码和检测一次（同一图片可能出现在多页），仅把包含人脸的
+        图片流原地替换，其余对象保持原样。
+        """
+        try:
+            import fitz  # 确保导入PyMuPDF库
+        except ImportError:
+            self.log("错误: PDF文档处理需要pymupdf库，请安装: pip install pymupdf")
+            return False
+            
+        try:
+            # 加载PDF文档
+            pdf_document = fitz.open(input_path)
+            page_count = len(pdf_document)
+            self.log(f"加载PDF文档: {os.path.basename(input_path)}，共 {page_count} 页")
+            
+            # 收集唯一的图片xref及其首次出现的页码（只读取对象表，不解码图片）
+            xref_pages: Dict[int, int] = {}
+            skipped_xrefs: set = set()
+            skip_counts = {reason: 0 for reason in PREFILTER_REASONS}
+            reference_count = 0
+            for page_num in range(page_count):
+                for img in pdf_document[page_num].get_images(full=True):
+                    reference_count += 1
+                    xref, _, width, height, bpc = img[:5]
+                    if xref in xref_pages or xref in skipped_xrefs:
+                        continue
+                    # 预筛选：尺寸和位深取自图片字典；1位图通常为扫描线稿/蒙版
+                    reason = image_prefilter_reason(self.prefilter, width, height)
+                    if reason is None and self.prefilter.get("enabled") and self.prefilter.get("skip_bilevel") \
+                            and bpc == 1:
+                        reason = "bilevel"
+                    if reason:
+                        skipped_xrefs.add(xref)
+                        skip_counts[reason] += 1
+                        continue
+                    xref_pages[xref] = page_num
+            image_count = 0
+            modified_count = 0
+            self.log(f"共找到 {reference_count} 处图片引用，去重后 {len(xref_pages) + len(skipped_xrefs)} 张图片")
+            
+            pdf_workers = self.pdf_workers or min(os.cpu_count() or 1, 4)
+            if pdf_workers > 1 and page_count >= PDF_PARALLEL_MIN_PAGES:
+                pdf_document.close()
+                return self.blur_faces_in_pdf_parallel(input_path, output_path, xref_pages, pdf_workers, skip_counts)
+            
+            for index, (xref, page_num) in enumerate(xref_pages.items(), start=1):
+                if self.cancel_event.is_set():
+                    pdf_document.close()
+                    return False
+                
+                self.update_progress(index / len(xref_pages) * 100)
+                key, cached = self.cache_lookup_pdf_image(pdf_document, xref)
+                if cached is not None:
+                    image_count += 1
+                    stream, meta = cached
+                    if stream is not None:
+                        write_pdf_image_stream(pdf_document, xref, stream, meta["filter"], meta["width"], meta["height"])
+                        modified_count += 1
+                    self.log(f"处理图片 {index} (第{page_num+1}页)，检测到 {meta['face_count']} 个人脸（结果缓存）")
+                    continue
+                
+                img, image_ext, reason = self.load_pdf_image(pdf_document, xref)
+                if reason:
+                    skip_counts[reason] += 1
+                    continue
+                if img is None:
+                    self.log(f"警告: 无法读取图片 {index} (第{page_num+1}页)，将保留原始图片")
+                    continue
+                
+                image_count += 1
+                processed_img, boxes, cacheable = self.process_cacheable_frame(img)
+                face_count = len(boxes)
+                stream, stream_filter = None, None
+                if int((boxes[:, 5] == 0).sum()) > 0:
+                    # 只替换有人脸被打码的图片；直接改写xref对象，所有引用它的页面同时生效
+                    stream, stream_filter = self.replace_pdf_image_stream(pdf_document, xref, processed_img, image_ext)
+                    modified_count += 1
+                    self.log(f"处理图片 {index} (第{page_num+1}页)，检测到 {face_count} 个人脸")
+                elif face_count > 0:
+                    self.log(f"处理图片 {index} (第{page_num+1}页)，检测到 {face_count} 个人脸，均为白名单人脸，保留原始图片")
+                else:
+                    self.log(f"处理图片 {index} (第{page_num+1}页)，未检测到人脸")
+                if cacheable:
+                    self.cache_store(key, stream, boxes, filter=stream_filter,
+                                     width=processed_img.shape[1], height=processed_img.shape[0])
+            
+            if modified_count > 0:
+                # 未修改的对象原样写出，回收不再引用的对象
+                pdf_document.save(output_path, garbage=1)
+                pdf_document.close()
+            else:
+                # 没有需要替换的图片时直接复制原文件
+                pdf_document.close()
+                if os.path.abspath(input_path) != os.path.abspath(output_path):
+                    shutil.copyfile(input_path, output_path)
+            
+            self.log(f"共处理 {image_count} 张图片，其中 {modified_count} 张包含人脸并已打码")
+            self.log(format_prefilter_summary(skip_counts))
+            self.log(f"处理后的PDF文档已保存至: {output_path}")
+            return True
+            
+        except Exception as e:
+            self.log(f"PDF文档处理错误: {str(e)}")
+            return False
+    
+    def load_pdf_image(self, pdf_document: Any, xref: int) -> Tuple[Optional[np.ndarray], str, Optional[str]]:
+        """预筛选并解码PDF图片，返回(BGR图像, 原始扩展名, 跳过原因)。
+        
+        JPEG图片先用原始数据流生成缩略图做预筛选，通过后才完整解码；
+        其他格式解码代价较低，解码后再在缩略图上筛选。
+        """
+        if self.prefilter.get("enabled") and pdf_document.xref_get_key(xref, "Filter")[1] == "/DCTDecode":
+            reason = image_prefilter_reason(self.prefilter, data=pdf_document.xref_stream_raw(xref))
+            if reason:
+                return None, "jpg", reason
+            img, image_ext = self.decode_pdf_image(pdf_document, xref)
+            return img, image_ext, None
+        img, image_ext = self.decode_pdf_image(pdf_document, xref)
+        if img is not None:
+            reason = image_prefilter_reason(self.prefilter, img=img)
+            if reason:
+                return None, image_ext, reason
+        return img, image_ext, None
+    
+    def decode_pdf_image(self, pdf_document: Any, xref: int) -> Tuple[Optional[np.ndarray], str]:
+        """在内存中解码PDF图片，返回(BGR图像, 原始扩展名)"""
+        base_image = pdf_document.extract_image(xref)
+        if not base_image:
+            return None, "png"
+        image_ext = base_image["ext"]
+        img = cv2.imdecode(np.frombuffer(base_image["image"], dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            # OpenCV不支持的格式（如JPX）交给PyMuPDF转换为RGB
+            pix = fitz.Pixmap(pdf_document, xref)
+            if pix.alpha:
+                pix = fitz.Pixmap(pix, 0)
+            if pix.n != 3:
+                pix = fitz.Pixmap(fitz.csRGB, pix)
+            rgb = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+            img = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+            image_ext = "png"
+        return img, image_ext
+    
+    def replace_pdf_image_stream(self, pdf_document: Any, xref: int, img: np.ndarray, image_ext: str) -> Tuple[bytes, str]:
+        """原地替换图片对象的数据流，返回写入的(数据流, 过滤器)"""
+        stream, stream_filter = encode_pdf_image_stream(img, image_ext)
+        write_pdf_image_stream(pdf_document, xref, stream, stream_filter, img.shape[1], img.shape[0])
+        return stream, stream_filter
+    
+    def cache_lookup_pdf_image(self, pdf_document: Any, xref: int) -> Tuple[Optional[str], Optional[Tuple[Optional[bytes], Dict[str, Any]]]]:
+        """按图片原始数据流查询结果缓存，未启用缓存时不读取数据流"""
+        if self.cache is None:
+            return None, None
+        return self.cache_lookup(pdf_image_cache_material(pdf_document, xref), "pdf")
+    
+    def blur_faces_in_pdf_parallel(self, input_path: str, output_path: str, xref_pages: Dict[int, int],
+                                   pdf_workers: int, skip_counts: Dict[str, int]) -> bool:
+        """按页码区间分片，由多个工作进程各自打开文档流式处理，主进程只写回包含人脸的图片"""
+        import fitz
+        
+        pdf_document = fitz.open(input_path)
+        page_count = len(pdf_document)
+        # 每页需要处理的xref（每个xref只在首次出现的页处理）
+        page_xrefs: Dict[int, List[int]] = {}
+        for xref, page_num in xref_pages.items():
+            page_xrefs.setdefault(page_num, []).append(xref)
+        shards: List[List[Tuple[int, List[int]]]] = []
+        for shard_start in range(0, page_count, PDF_PAGES_PER_SHARD):
+            shard = [(page_num, page_xrefs[page_num])
+                     for page_num in range(shard_start, min(shard_start + PDF_PAGES_PER_SHARD, page_count))
+                     if page_num in page_xrefs]
+            if shard:
+                shards.append(shard)
+        pages_done = page_count - sum(len(shard) for shard in shards)  # 没有新图片的页直接计为完成
+        skipped_before = sum(skip_counts.values())
+        
+        self.log(f"使用 {pdf_workers} 个进程并行处理，共 {len(shards)} 个分片")
+        manager = multiprocessing.Manager()
+        messages = manager.Queue()
+        intra_op_threads = 0 if 'CUDAExecutionProvider' in self.app.providers else max(1, (os.cpu_count() or 1) // pdf_workers)
+        modified_count = 0
+        failed = False
+        try:
+            with ProcessPoolExecutor(
+                    max_workers=pdf_workers, initializer=_init_pdf_worker,
+                    initargs=(input_path, self.insightface_dir, self.app.providers, intra_op_threads,
+                              self.whitelist_data, self.threshold, dict(g_precomputed), self.prefilter,
+                              self.face_filter, messages, self.cache.cache_dir if self.cache else None, self.cache_size_mb,
+                              self.cache_context, self.app.det_size)) as executor:
+                pending: set = set()
+                next_shard = 0
+                while next_shard < len(shards) or pending:
+                    if self.cancel_event.is_set():
+                        for future in pending:
+                            future.cancel()
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        pdf_document.close()
+                        return False
+                    # 在途分片数有界，内存不随页数增长
+                    while next_shard < len(shards) and len(pending) < pdf_workers * 2:
+                        pending.add(executor.submit(_process_pdf_shard, shards[next_shard]))
+                        next_shard += 1
+                    done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                    pages_done += self._drain_pdf_worker_messages(messages, page_count, pages_done, skip_counts)
+                    for future in done:
+                        # 立即写回该分片的替换结果并释放
+                        for xref, page_num, face_count, stream, stream_filter, width, height in future.result():
+                            write_pdf_image_stream(pdf_document, xref, stream, stream_filter, width, height)
+                            modified_count += 1
+                pages_done += self._drain_pdf_worker_messages(messages, page_count, pages_done, skip_counts)
+        except Exception as e:
+            self.log(f"PDF并行处理错误: {str(e)}")
+            failed = True
+        finally:
+            manager.shutdown()
+        if failed:
+            pdf_document.close()
+            return False
+        
+        if modified_count > 0:
+            pdf_document.save(output_path, garbage=1)
+            pdf_document.close()
+        else:
+            pdf_document.close()
+            if os.path.abspath(input_path) != os.path.abspath(output_path):
+                shutil.copyfile(input_path, output_path)
+        
+        image_count = len(xref_pages) - (sum(skip_counts.values()) - skipped_before)
+        self.log(f"共处理 {image_count} 张图片，其中 {modified_count} 张包含人脸并已打码")
+        self.log(format_prefilter_summary(skip_counts))
+        self.log(f"处理后的PDF文档已保存至: {output_path}")
+        return True
+    
+    def _drain_pdf_worker_messages(self, messages: Any, page_count: int, pages_done: int,
+                                   skip_counts: Dict[str, int]) -> int:
+        """转发工作进程的逐页进度、预筛选统计和日志，返回新完成的页数"""
+        finished = 0
+        while True:
+            try:
+                kind, value = messages.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "page":
+                finished += 1
+                self.update_progress((pages_done + finished) / page_count * 100)
+            elif kind == "skip":
+                skip_counts[value] += 1
+            elif kind == "cache":
+                if self.cache is not None:
+                    if value:
+                        self.cache.hits += 1
+                    else:
+                        self.cache.misses += 1
+            else:
+                self.log(value)
+        return finished
+    
+    # 视频处理函数
+    def validate_blur_params(self) -> None:
+        """检查预计算的打码参数"""
+        if not (0 <= g_precomputed["opacity"] <= 1):
+            raise ValueError("不透明度(opacity)必须在0到1之间")
+        if g_precomputed["feather_radius"] < 0:
+            raise ValueError("羽化半径(feather_radius)不能为负数")
+        if g_precomputed["kernel_size"] < 1:
+            raise ValueError("模糊强度(blur_strength)必须大于0")
+        if g_precomputed["mosaic_block_size"] < 1:
+            raise ValueError("马赛克块大小必须大于0")
+    
+    def open_video_clip(self, input_path: str, start_time: float = 0,
+                        duration: Optional[float] = None, pix_fmt: str = "bgr24") -> Tuple[Any, Dict[str, Any]]:
+        """打开视频并定位到处理区间的起点，返回(帧读取器, 区间信息)。
+        
+        区间信息包括fps、width、height、total_frames、start_frame、frame_count（区间帧数），
+        以及按帧号换算的精确区间start_time、clip_duration（秒），音频按同一区间截取。
+        有FFmpeg时用FFmpegFrameReader在输入端跳转，否则回退到OpenCV逐帧定位（只支持bgr24）。
+        """
+        # 视频基础信息读取
+        if not os.path.exists(input_path):
+            raise FileNotFoundError(f"输入视频文件不存在: {input_path}")
+        cap = cv2.VideoCapture(input_path)
+        
+        # 检查视频是否打开成功
+        if not cap.isOpened():
+            raise Exception(f"无法打开视频文件: {input_path}")
+            
+        # 只读取容器中的元数据，不解码；OpenCV报告的尺寸已考虑旋转信息，与FFmpeg自动旋转后的输出一致
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        use_ffmpeg = os.path.isfile(self.ffmpeg_path)
+        if total_frames <= 0 and use_ffmpeg and fps > 0:
+            # 部分容器不记录帧数，按FFmpeg读取的时长估算
+            total_frames = int(self.probe_video_stream(input_path).get("duration", 0) * fps)
+        video_duration = total_frames / fps if fps > 0 else 0
+        
+        # 计算处理区间
+        # 加一个极小值，避免由帧号换算的秒数乘回fps时因浮点误差少一帧
+        start_frame = int(start_time * fps + 1e-6) if fps > 0 else 0
+        end_frame = min(start_frame + int(duration * fps + 1e-6), total_frames) if duration and fps > 0 else total_frames
+        if start_frame >= total_frames:
+            cap.release()
+            raise ValueError(f"开始时间 {start_time}s 超出视频时长 {video_duration}s")
+        if pix_fmt != "bgr24" and not use_ffmpeg:
+            cap.release()
+            raise ValueError(f"读取{pix_fmt}帧需要FFmpeg")
+        
+        if use_ffmpeg:
+            cap.release()
+            # 定位到起始帧之前一点，精确跳转会丢弃之前的帧
+            cap = FFmpegFrameReader(self.ffmpeg_path, input_path, width, height,
+                                    max(0.0, (start_frame - 0.25) / fps) if start_frame > 0 else 0.0,
+                                    end_frame - start_frame, pix_fmt=pix_fmt)
+        else:
+            # 设置起始帧位置
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+            actual_start = cap.get(cv2.CAP_PROP_POS_FRAMES)
+            if abs(actual_start - start_frame) > 10:  # 允许一定误差
+                self.log(f"警告: 无法精确跳转到起始帧 {start_frame}，实际从 {actual_start} 开始")
+        
+        return cap, {
+            "fps": fps,
+            "width": width,
+            "height": height,
+            "total_frames": total_frames,
+            "duration": video_duration,
+            "start_frame": start_frame,
+            "frame_count": end_frame - start_frame,
+            "start_time": start_frame / fps if fps > 0 else 0.0,
+            "clip_duration": (end_frame - start_frame) / fps if fps > 0 else None,
+        }
+    
+    def create_temp_video_writer(self, fps: float, width: int, height: int,
+                                 pix_fmt: Optional[str] = None) -> Tuple[Any, str]:
+        """在临时目录创建无音频的视频写入器，返回(写入器, 临时文件路径)。
+        
+        指定pix_fmt时通过FFmpeg管道编码该格式的原始帧，否则使用OpenCV写入BGR帧。
+        """
+        # 使用更稳定的临时文件创建方式
+        temp_dir = tempfile.gettempdir()
+        temp_video_name = f"temp_video_{generate_random_suffix()}.mp4"
+        temp_video_path = os.path.join(temp_dir, temp_video_name)
+        if pix_fmt is not None:
+            return FFmpegFrameWriter(self.ffmpeg_path, temp_video_path, width, height, fps, pix_fmt), temp_video_path
+        
+        # 尝试使用合适的编码器
+        try:
+            fourcc = cv2.VideoWriter_fourcc(*'avc1')  # H.264
+            if cv2.VideoWriter_fourcc(*'avc1') == -1:
+                raise ValueError("不支持avc1编码器")
+        except:
+            try:
+                fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # MPEG-4
+            except:
+                fourcc = cv2.VideoWriter_fourcc(*'XVID')  # 后备方案
+        
+        # 检查输出是否可以打开
+        out = cv2.VideoWriter(temp_video_path, fourcc, fps, (width, height))
+        if not out.isOpened():
+            raise Exception(f"无法创建视频写入器，编码器: {fourcc}")
+        return out, temp_video_path
+    
+    def map_video_frames(self, cap: cv2.VideoCapture, frame_count: int,
+                         func: Callable[[int, np.ndarray], Any],
+                         reuse: Optional[VideoFrameReuse] = None,
+                         render: Optional[Callable[[np.ndarray, np.ndarray], np.ndarray]] = None
+                         ) -> Iterator[Tuple[int, Optional[np.ndarray], Any]]:
+        """顺序读取区间内的帧并行交给func(帧序号, 帧)处理，按帧顺序产出(帧序号, 帧, 结果)。
+        
+        读取器每次返回新的数组，帧不再复制，直接交给func（func可原地修改，产出的帧即为修改后的帧）。
+        在途帧数有界，内存占用与视频长度无关；帧无效或处理出错时结果为None。
+        处理被取消时提前结束，调用方需自行检查cancel_event。
+        
+        指定reuse时func的结果须为(处理后的帧, 人脸框)：完全重复的帧不再提交，产出前一帧的结果；
+        近似重复的帧等待参考帧完成后用render(帧, 人脸框)按其人脸框打码。
+        """
+        # worker数量与会话池实例数一致，每帧交给当前空闲的实例；只渲染时按CPU核心数
+        max_workers = self.app.size if self.app else min(os.cpu_count() or 1, 4)
+        window = max_workers * 4
+        pending: "collections.deque[Tuple[int, Optional[np.ndarray], Optional[Future], Optional[str]]]" = collections.deque()
+        frame_index = 0
+        last_progress = 0
+        reference: Optional[Future] = None
+        previous_result = None
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while not self.cancel_event.is_set():
+                while frame_index < frame_count and len(pending) < window:
+                    ret, frame = cap.read()
+                    if not ret:
+                        frame_count = frame_index
+                        break
+                    # 检查帧是否有效
+                    if frame is None or not isinstance(frame, np.ndarray) or frame.ndim not in (2, 3):
+                        self.log(f"警告: 无效帧 #{frame_index}，跳过处理", key="无效帧")
+                        pending.append((frame_index, None, None, None))
+                    else:
+                        kind = reuse.match(frame) if reuse is not None else None
+                        if kind == "exact":
+                            future = None
+                        elif kind == "near" and reference is not None:
+                            future = executor.submit(self._render_with_reference, reference, frame, render)
+                        else:
+                            kind = None
+                            future = reference = executor.submit(func, frame_index, frame)
+                        pending.append((frame_index, frame, future, kind))
+                    frame_index += 1
+                if not pending:
+                    break
+                
+                idx, frame, future, kind = pending.popleft()
+                result = None
+                if future is not None:
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        if kind is None:
+                            self.log(f"处理帧 #{idx} 时出错: {str(e)}", key="处理帧出错")
+                elif frame is not None:
+                    result = previous_result
+                if result is None and kind is not None:
+                    # 前一帧或参考帧处理出错时没有可复用的结果，重新检测该帧，错误不沿重复帧传递
+                    reuse.miss(kind)
+                    try:
+                        result = func(idx, frame)
+                    except Exception as e:
+                        self.log(f"处理帧 #{idx} 时出错: {str(e)}", key="处理帧出错")
+                previous_result = result
+                yield idx, frame, result
+                
+                # 更新进度
+                progress = int(((idx + 1) / max(frame_count, 1)) * 100)
+                if progress > last_progress:
+                    self.update_progress(progress)
+                    last_progress = progress
+            if self.cancel_event.is_set():
+                for _, _, future, _ in pending:
+                    if future is not None:
+                        future.cancel()
+    
+    def _render_with_reference(self, reference: Future, frame: np.ndarray,
+                               render: Callable[[np.ndarray, np.ndarray], np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """近似重复帧：等待参考帧处理完成，按其人脸框打码"""
+        _, boxes = reference.result()
+        return render(frame, boxes), boxes
+    
+    def render_video_frame_boxes(self, frame: np.ndarray, boxes: np.ndarray, pix_fmt: str = "bgr24") -> np.ndarray:
+        """按人脸框对BGR或I420排列的yuv420p帧打码（原地修改），白名单人脸保持原样"""
+        if pix_fmt != "yuv420p":
+            return self.render_face_boxes(frame, boxes)
+        for box in boxes:
+            if not box[5]:
+                self.blur_face_region_yuv(frame, box)
+        return frame
+    
+    def map_video_frames_shared(self, cap: FFmpegFrameReader, frame_count: int, workers: int,
+                                pix_fmt: str = "bgr24",
+                                reuse: Optional[VideoFrameReuse] = None) -> Iterator[Tuple[int, np.ndarray, Any]]:
+        """多进程版本的map_video_frames：帧放在共享内存帧槽中，由工作进程原地检测并打码。
+        
+        按帧顺序产出(帧序号, 帧槽视图, (帧槽视图, 人脸框)或None)；调用方须在取下一帧之前用完帧槽，
+        之后该槽会被新帧覆盖。整个过程没有逐帧的分配、复制和序列化。
+        
+        指定reuse时重复帧不提交给工作进程：上一帧的槽保留到下一帧产出之后，完全重复的帧从中复制结果，
+        近似重复的帧在主进程中按参考帧的人脸框打码。
+        """
+        ring = SharedFrameRing(workers * 4, cap.shape)
+        free_slots = collections.deque(range(ring.slot_count))
+        pending: "collections.deque[Tuple[int, int, Optional[Future], Optional[str]]]" = collections.deque()
+        held: Optional[Tuple[int, Any]] = None
+        reference_boxes: Optional[np.ndarray] = np.zeros((0, 6), dtype=np.float32)
+        intra_op_threads = 0 if 'CUDAExecutionProvider' in self.app.providers else max(1, (os.cpu_count() or 1) // workers)
+        frame_index = 0
+        last_progress = 0
+        try:
+            with ProcessPoolExecutor(
+                    max_workers=workers, initializer=_init_video_worker,
+                    initargs=(ring.name, ring.slot_count, ring.shape, pix_fmt, self.insightface_dir,
+                              self.app.providers, intra_op_threads, self.whitelist_data, self.threshold,
+                              dict(g_precomputed), self.face_filter, self.app.det_size)) as executor:
+                while not self.cancel_event.is_set():
+                    while frame_index < frame_count and free_slots:
+                        slot = free_slots.popleft()
+                        if not cap.read_into(ring.slot(slot)):
+                            free_slots.appendleft(slot)
+                            frame_count = frame_index
+                            break
+                        kind = reuse.match(ring.slot(slot)) if reuse is not None else None
+                        future = None if kind else executor.submit(_process_video_slot, slot)
+                        pending.append((frame_index, slot, future, kind))
+                        frame_index += 1
+                    if not pending:
+                        break
+                    
+                    idx, slot, future, kind = pending.popleft()
+                    frame = ring.slot(slot)
+                    result = None
+                    if kind == "exact" and held is not None and held[1] is not None:
+                        np.copyto(frame, ring.slot(held[0]))
+                        result = (frame, held[1][1])
+                    elif kind == "near" and reference_boxes is not None:
+                        result = (self.render_video_frame_boxes(frame, reference_boxes, pix_fmt), reference_boxes)
+                    else:
+                        if kind is not None:
+                            # 前一帧或参考帧处理出错时没有可复用的结果，重新检测该帧，错误不沿重复帧传递
+                            reuse.miss(kind)
+                            future = executor.submit(_process_video_slot, slot)
+                        try:
+                            boxes, lines = future.result()
+                            for line in lines:
+                                self.log(line, key=line)
+                            result = (frame, boxes)
+                            reference_boxes = boxes
+                        except Exception as e:
+                            self.log(f"处理帧 #{idx} 时出错: {str(e)}", key="处理帧出错")
+                            reference_boxes = None
+                    yield idx, frame, result
+                    if reuse is None:
+                        free_slots.append(slot)
+                    else:
+                        # 保留本帧的槽，供紧随其后的完全重复帧复制
+                        if held is not None:
+                            free_slots.append(held[0])
+                        held = (slot, result)
+                    
+                    progress = int(((idx + 1) / max(frame_count, 1)) * 100)
+                    if progress > last_progress:
+                        self.update_progress(progress)
+                        last_progress = progress
+                if self.cancel_event.is_set():
+                    for _, _, future, _ in pending:
+                        if future is not None:
+                            future.cancel()
+        finally:
+            ring.close()
+    
+    def process_video_frames(self, input_path: str, start_time: float = 0, duration: Optional[float] = None) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """视频帧处理函数，加强错误处理；返回(无音频的临时视频, 区间信息)"""
+        # 参数验证与初始化
+        self.validate_blur_params()
+        use_yuv = self.yuv_native and self.can_process_yuv(input_path)
+        cap, clip = self.open_video_clip(input_path, start_time, duration, "yuv420p" if use_yuv else "bgr24")
+        fps, width, height = clip["fps"], clip["width"], clip["height"]
+        
+        # 临时文件与输出设置
+        try:
+            out, temp_video_path = self.create_temp_video_writer(fps, width, height, "yuv420p" if use_yuv else None)
+        except Exception as e:
+            cap.release()
+            raise Exception(f"初始化视频处理失败: {str(e)}")
+        
+        # 统计初始化
+        process_start_time = time.time()
+        total_frames_to_process = clip["frame_count"]
+        total_faces_detected = 0
+        failed_frames = 0
+        # 需要保存轨迹文件时收集每帧的人脸框
+        frame_boxes: List[Tuple[int, np.ndarray]] = []
+        
+        self.log(f"开始处理视频帧: {input_path}")
+        self.log(f"处理区间: {start_time}s ~ {min(start_time + total_frames_to_process/fps, clip['duration']):.2f}s")
+        self.log(f"打码参数: 类型={g_precomputed['blur_type']} | 相似度阈值={self.threshold} | 模糊强度={g_precomputed['kernel_size']} | "
+                f"羽化半径={g_precomputed['feather_radius']} | 不透明度={g_precomputed['opacity']}")
+        
+        if use_yuv:
+            self.log("使用YUV平面处理：解码、打码和编码全程为yuv420p，不转换整帧颜色空间")
+        
+        # 并行处理帧，按顺序写入
+        def process(frame_index: int, frame: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+            if use_yuv:
+                return self.process_yuv_frame_with_boxes(frame)
+            return self.process_frame_with_boxes(frame)
+        
+        pix_fmt = "yuv420p" if use_yuv else "bgr24"
+        reuse = VideoFrameReuse(near=self.video_reuse == "near") if self.video_reuse != "off" else None
+        if self.video_workers and self.video_workers > 1 and isinstance(cap, FFmpegFrameReader):
+            self.log(f"使用 {self.video_workers} 个进程并行处理，帧通过共享内存传递")
+            frames = self.map_video_frames_shared(cap, total_frames_to_process, self.video_workers, pix_fmt, reuse)
+        else:
+            frames = self.map_video_frames(cap, total_frames_to_process, process, reuse,
+                                           lambda frame, boxes: self.render_video_frame_boxes(frame, boxes, pix_fmt))
+        for idx, frame, result in frames:
+            if result is None:
+                failed_frames += 1
+                continue
+            processed_frame, boxes = result
+            # 检查处理后的帧是否有效
+            if isinstance(processed_frame, np.ndarray) and processed_frame.shape == frame.shape:
+                total_faces_detected += len(boxes)
+                out.write(processed_frame)
+            else:
+                self.log(f"警告: 处理后的帧 #{idx} 无效，使用原始帧", key="处理后的帧无效")
+                out.write(frame)  # 使用原始帧
+                failed_frames += 1
+            if self.video_sidecar_path:
+                frame_boxes.append((clip["start_frame"] + idx, boxes))
+        
+        # 清理资源
+        cap.release()
+        out.release()
+        if self.cancel_event.is_set():
+            if os.path.exists(temp_video_path):
+                try:
+                    os.remove(temp_video_path)
+                except:
+                    pass
+            return None, None
+        
+        # 检查是否生成了有效视频
+        if os.path.exists(temp_video_path) and os.path.getsize(temp_video_path) < 1024:  # 小于1KB的视频视为无效
+            self.log("警告: 生成的临时视频文件过小，可能处理失败")
+            try:
+                os.remove(temp_video_path)
+                return None, None
+            except:
+                pass
+        
+        if self.video_sidecar_path:
+            sidecar = FaceTrackSidecar.from_frame_boxes(frame_boxes, self.video_sidecar_metadata(input_path, clip, start_time, duration))
+            sidecar.save(self.video_sidecar_path)
+            self.log(f"人脸轨迹文件已保存至: {self.video_sidecar_path}（{len(sidecar)} 个人脸框，{sidecar.track_count} 条轨迹）")
+        
+        # 统计与输出
+        elapsed_time = time.time() - process_start_time
+        fps_processing = total_frames_to_process / elapsed_time if elapsed_time > 0 else 0
+        
+        self.log("\n视频帧处理完成！")
+        self.log(f"临时视频已保存至: {temp_video_path}")
+        self.log(f"总处理时间: {elapsed_time:.2f} 秒")
+        self.log(f"平均处理速度: {fps_processing:.2f} 帧/秒")
+        self.log(f"共检测到人脸: {total_faces_detected}")
+        self.log(f"处理失败的帧: {failed_frames}")
+        if reuse is not None:
+            self.log(reuse.summary())
+        self.log(f"白名单保留人脸: {len(self.whitelist_data['entries']) if self.whitelist_data else 0}")
+        
+        return temp_video_path, clip
+    
+    def video_sidecar_metadata(self, input_path: str, clip: Dict[str, Any], start_time: float,
+                               duration: Optional[float]) -> Dict[str, Any]:
+        """轨迹文件的元数据：源视频信息、处理区间和分析时的处理上下文"""
+        return {
+            "version": SIDECAR_VERSION,
+            "source": os.path.basename(input_path),
+            "source_size": os.path.getsize(input_path),
+            "fps": clip["fps"],
+            "width": clip["width"],
+            "height": clip["height"],
+            "total_frames": clip["total_frames"],
+            "start_frame": clip["start_frame"],
+            "frame_count": clip["frame_count"],
+            "start_time": start_time,
+            "duration": duration,
+            "threshold": self.threshold,
+            "context": self.cache_context,
+        }
+    
+    def detect_video_faces(self, input_path: str, start_time: float = 0, duration: Optional[float] = None
+                           ) -> Optional[Tuple[Dict[str, Any], List[Tuple[int, np.ndarray]]]]:
+        """只检测区间内每帧的人脸并判定白名单，返回(区间信息, [(绝对帧号, 人脸框)])；失败或取消时返回None"""
+        try:
+            cap, clip = self.open_video_clip(input_path, start_time, duration)
+        except Exception as e:
+            self.log(f"视频分析错误: {str(e)}")
+            return None
+        
+        self.log(f"开始分析视频: {input_path}，共 {clip['frame_count']} 帧")
+        process_start_time = time.time()
+        frame_boxes: List[Tuple[int, np.ndarray]] = []
+        failed_frames = 0
+        try:
+            for idx, _, boxes in self.map_video_frames(cap, clip["frame_count"],
+                                                       lambda index, frame: self.detect_face_boxes(frame)):
+                if boxes is None:
+                    failed_frames += 1
+                    continue
+                frame_boxes.append((clip["start_frame"] + idx, boxes))
+        finally:
+            cap.release()
+        if self.cancel_event.is_set():
+            return None
+        
+        elapsed_time = time.time() - process_start_time
+        self.log(f"分析完成，用时 {elapsed_time:.2f} 秒，平均 {len(frame_boxes) / max(elapsed_time, 1e-6):.2f} 帧/秒，"
+                 f"处理失败的帧: {failed_frames}")
+        return clip, frame_boxes
+    
+    def analyze_video(self, input_path: str, sidecar_path: str, start_time: float = 0,
+                      duration: Optional[float] = None) -> bool:
+        """分析阶段：只检测人脸、判定白名单并写出轨迹文件，不生成视频"""
+        detected = self.detect_video_faces(input_path, start_time, duration)
+        if detected is None:
+            return False
+        clip, frame_boxes = detected
+        try:
+            sidecar = FaceTrackSidecar.from_frame_boxes(
+                frame_boxes, self.video_sidecar_metadata(input_path, clip, start_time, duration))
+            sidecar.save(sidecar_path)
+        except Exception as e:
+            self.log(f"保存人脸轨迹文件失败: {str(e)}")
+            return False
+        
+        self.log(f"共 {len(sidecar)} 个人脸框（其中白名单 {sidecar.whitelisted_count} 个），{sidecar.track_count} 条轨迹")
+        self.log(f"人脸轨迹文件已保存至: {sidecar_path}")
+        return True
+    
+    def render_video(self, input_path: str, sidecar_path: str, output_path: str,
+                     start_time: Optional[float] = None, duration: Optional[float] = None) -> bool:
+        """渲染阶段：按轨迹文件中的人脸框和当前打码参数生成视频，不运行推理。
+        
+        未指定start_time时使用轨迹文件记录的处理区间（外部CSV没有记录时为整个视频）。
+        """
+        try:
+            sidecar = FaceTrackSidecar.load(sidecar_path)
+        except Exception as e:
+            self.log(f"读取人脸轨迹文件失败: {str(e)}")
+            return False
+        metadata = sidecar.metadata
+        if start_time is None:
+            start_time = metadata.get("start_time", 0)
+            duration = metadata.get("duration")
+        if metadata.get("source") and metadata["source"] != os.path.basename(input_path):
+            self.log(f"警告: 轨迹文件来自 {metadata['source']}，与输入视频文件名不同")
+        self.log(f"按轨迹文件渲染: {sidecar_path}，共 {len(sidecar)} 个人脸框")
+        expected_size = (metadata["width"], metadata["height"]) if metadata.get("width") else None
+        return self.render_video_boxes(input_path, output_path, sidecar.boxes_by_frame(),
+                                       start_time, duration, expected_size)
+    
+    def render_video_boxes(self, input_path: str, output_path: str, boxes_by_frame: Dict[int, np.ndarray],
+                           start_time: float = 0, duration: Optional[float] = None,
+                           expected_size: Optional[Tuple[int, int]] = None) -> bool:
+        """按已知的逐帧人脸框打码并输出视频，不运行推理。
+        
+        启用smart_render时优先只重新编码包含人脸的GOP，不支持时回退到逐帧渲染。
+        """
+        try:
+            self.validate_blur_params()
+            cap, clip = self.open_video_clip(input_path, start_time, duration)
+            if expected_size and tuple(expected_size) != (clip["width"], clip["height"]):
+                cap.release()
+                raise ValueError(f"轨迹文件记录的视频尺寸 {expected_size[0]}x{expected_size[1]} "
+                                 f"与输入视频 {clip['width']}x{clip['height']} 不一致")
+        except Exception as e:
+            self.log(f"视频渲染错误: {str(e)}")
+            return False
+        self.log(f"打码参数: 类型={g_precomputed['blur_type']} | 模糊强度={g_precomputed['kernel_size']} | "
+                 f"羽化半径={g_precomputed['feather_radius']} | 不透明度={g_precomputed['opacity']}")
+        
+        if self.smart_render:
+            cap.release()
+            temp_video_path = self.smart_render_video(input_path, boxes_by_frame, clip)
+            if self.cancel_event.is_set():
+                return False
+            if temp_video_path:
+                return self.finish_video_output(temp_video_path, input_path, output_path,
+                                                clip["start_time"], clip["clip_duration"])
+            self.log("回退到逐帧渲染")
+            cap, clip = self.open_video_clip(input_path, start_time, duration)
+        
+        try:
+            out, temp_video_path = self.create_temp_video_writer(clip["fps"], clip["width"], clip["height"])
+        except Exception as e:
+            cap.release()
+            self.log(f"视频渲染错误: {str(e)}")
+            return False
+        
+        process_start_time = time.time()
+        no_boxes = np.zeros((0, 6), dtype=np.float32)
+        failed_frames = 0
+        
+        def render(frame_index: int, frame: np.ndarray) -> np.ndarray:
+            return self.render_face_boxes(frame, boxes_by_frame.get(clip["start_frame"] + frame_index, no_boxes))
+        
+        try:
+            for _, _, rendered in self.map_video_frames(cap, clip["frame_count"], render):
+                if rendered is None:
+                    failed_frames += 1
+                    continue
+                out.write(rendered)
+        finally:
+            cap.release()
+            out.release()
+        if self.cancel_event.is_set():
+            os.remove(temp_video_path)
+            return False
+        
+        elapsed_time = time.time() - process_start_time
+        self.log(f"渲染完成，用时 {elapsed_time:.2f} 秒，平均 {clip['frame_count'] / max(elapsed_time, 1e-6):.2f} 帧/秒，"
+                 f"处理失败的帧: {failed_frames}")
+        return self.finish_video_output(temp_video_path, input_path, output_path,
+                                        clip["start_time"], clip["clip_duration"])
+    
+    def probe_video_stream(self, input_path: str, input_args: Tuple[str, ...] = ()) -> Dict[str, Any]:
+        """用FFmpeg读取视频流信息（编码、尺寸、帧率、时长），解析失败的项不返回"""
+        result = subprocess.run([self.ffmpeg_path, '-hide_banner', *input_args, '-i', input_path],
+                                check=False, capture_output=True, text=True, encoding="utf-8", errors="replace")
+        info: Dict[str, Any] = {}
+        stream = re.search(r"Stream #\d+:\d+.*?: Video: (\w+)([^\n]*)", result.stderr)
+        if stream:
+            info["codec"] = stream.group(1)
+            size = re.search(r", (\d{2,5})x(\d{2,5})", stream.group(2))
+            if size:
+                info["width"], info["height"] = int(size.group(1)), int(size.group(2))
+            fps = re.search(r"([\d.]+) fps", stream.group(2))
+            if fps:
+                info["fps"] = float(fps.group(1))
+        duration = re.search(r"Duration: (\d+):(\d+):([\d.]+)", result.stderr)
+        if duration:
+            hours, minutes, seconds = duration.groups()
+            info["duration"] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        return info
+    
+    def probe_video_keyframes(self, input_path: str, fps: float, end_time: Optional[float] = None) -> Dict[int, str]:
+        """只解码关键帧，返回{关键帧帧号: FFmpeg输出的原始时间戳文本}。
+        
+        直接复制码流时必须定位到关键帧的精确时间戳：早于它会落到前一个关键帧，
+        晚于它则关键帧本身会带负时间戳被隐藏。
+        """
+        cmd = [
+            self.ffmpeg_path, '-hide_banner', '-nostats',
+            '-skip_frame', 'nokey', '-i', input_path,
+            '-map', '0:v:0', '-vf', 'showinfo', '-f', 'null', '-'
+        ]
+        if end_time is not None:
+            # 处理区间之后的关键帧不需要，读到区间结束即可
+            cmd[-2:-2] = ['-t', f"{end_time + 1:.6f}"]
+        result = subprocess.run(cmd, check=False, capture_output=True, text=True, encoding="utf-8", errors="replace")
+        if result.returncode != 0:
+            self.log(f"FFmpeg读取关键帧错误: {result.stderr[-500:]}")
+            return {}
+        times = re.findall(r"Parsed_showinfo.*?pts_time:\s*([-\d.]+)", result.stderr)
+        return {max(0, round(float(t) * fps)): t for t in times}
+    
+    def smart_render_video(self, input_path: str, boxes_by_frame: Dict[int, np.ndarray],
+                           clip: Dict[str, Any]) -> Optional[str]:
+        """智能渲染：只解码、打码并重新编码包含需打码人脸的GOP，其余GOP直接复制原码流，最后拼接。
+        
+        返回拼接后的无音频临时视频；源编码不支持、没有关键帧信息或FFmpeg失败时返回None，
+        由调用方回退到逐帧渲染。
+        """
+        stream = self.probe_video_stream(input_path)
+        codec = stream.get("codec")
+        if codec not in SMART_RENDER_CODECS:
+            self.log(f"智能渲染暂不支持 {codec or '未知'} 编码的视频")
+            return None
+        fps = clip["fps"]
+        keyframes = self.probe_video_keyframes(input_path, fps, (clip["start_frame"] + clip["frame_count"]) / fps)
+        if not keyframes:
+            return None
+        
+        start_frame = clip["start_frame"]
+        end_frame = start_frame + clip["frame_count"]
+        dirty_frames = {frame for frame, boxes in boxes_by_frame.items()
+                        if start_frame <= frame < end_frame and np.any(boxes[:, 5] == 0)}
+        segments = plan_smart_render_segments(sorted(keyframes), start_frame, end_frame, clip["total_frames"], dirty_frames)
+        encode_frames = sum(end - start for start, end, dirty in segments if dirty)
+        self.log(f"智能渲染: {len(keyframes)} 个关键帧，{len(segments)} 个片段，"
+                 f"需重新编码 {encode_frames}/{clip['frame_count']} 帧，其余直接复制")
+        
+        temp_dir = tempfile.mkdtemp(prefix="smart_render_")
+        temp_video_path = os.path.join(tempfile.gettempdir(), f"temp_video_{generate_random_suffix()}.mp4")
+        try:
+            parts = []
+            frames_done = 0
+            for index, (start, end, dirty) in enumerate(segments):
+                if self.cancel_event.is_set():
+                    return None
+                # 片段使用MP4封装，拼接时concat会按各片段自身的参数集转换码流
+                part_path = os.path.join(temp_dir, f"part_{index:05d}.mp4")
+                if dirty:
+                    ok = self.encode_video_segment(input_path, part_path, start, end, clip, codec, boxes_by_frame)
+                else:
+                    ok = self.copy_video_segment(input_path, part_path, keyframes[start], end - start)
+                if not ok:
+                    return None
+                parts.append(part_path)
+                frames_done += end - start
+                self.update_progress(frames_done / max(clip["frame_count"], 1) * 100)
+            
+            list_path = os.path.join(temp_dir, "parts.txt")
+            with open(list_path, "w", encoding="utf-8") as f:
+                for part_path in parts:
+                    f.write(f"file '{part_path}'\n")
+            cmd = [
+                self.ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
+                '-f', 'concat', '-safe', '0', '-i', list_path,
+                '-map', '0:v', '-c', 'copy', temp_video_path
+            ]
+            result = subprocess.run(cmd, check=False, capture_output=True, text=True, encoding="utf-8", errors="replace")
+            if result.returncode != 0:
+                self.log(f"FFmpeg拼接片段错误: {result.stderr}")
+                return None
+            return temp_video_path
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    
+    def copy_video_segment(self, input_path: str, part_path: str, keyframe_time: str, frame_count: int) -> bool:
+        """从时间戳为keyframe_time的关键帧开始直接复制frame_count帧的原始码流"""
+        cmd = [
+            self.ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
+            '-ss', keyframe_time, '-i', input_path,
+            '-map', '0:v:0', '-c:v', 'copy', '-frames:v', str(frame_count), part_path
+        ]
+        result = subprocess.run(cmd, check=False, capture_output=True, text=True, encoding="utf-8", errors="replace")
+        if result.returncode != 0:
+            self.log(f"FFmpeg复制片段错误: {result.stderr}")
+            return False
+        return True
+    
+    def encode_video_segment(self, input_path: str, part_path: str, start: int, end: int,
+                             clip: Dict[str, Any], codec: str, boxes_by_frame: Dict[int, np.ndarray]) -> bool:
+        """解码[start, end)区间的帧，按人脸框打码后用与源视频相同的编码格式重新编码"""
+        fps, width, height = clip["fps"], clip["width"], clip["height"]
+        frame_rate = Fraction(fps).limit_denominator(1001)
+        encode_cmd = [
+            self.ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f"{width}x{height}",
+            '-r', f"{frame_rate.numerator}/{frame_rate.denominator}", '-i', '-',
+            '-c:v', SMART_RENDER_CODECS[codec], '-crf', '18', '-pix_fmt', 'yuv420p', part_path
+        ]
+        # 定位到起始帧之前一点，精确跳转会丢弃之前的帧
+        decoder = FFmpegFrameReader(self.ffmpeg_path, input_path, width, height,
+                                    max(0.0, (start - 0.25) / fps) if start > 0 else 0.0, end - start)
+        encoder = subprocess.Popen(encode_cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        no_boxes = np.zeros((0, 6), dtype=np.float32)
+        frame_index = start
+        try:
+            while frame_index < end:
+                ret, frame = decoder.read()
+                if not ret:
+                    break
+                frame = self.render_face_boxes(frame, boxes_by_frame.get(frame_index, no_boxes))
+                encoder.stdin.write(frame.data)
+                frame_index += 1
+        except (BrokenPipeError, OSError) as e:
+            self.log(f"重新编码片段时出错: {str(e)}")
+        finally:
+            decoder.release()
+            try:
+                encoder.stdin.close()
+            except OSError:
+                pass
+            encoder_error = encoder.stderr.read().decode("utf-8", errors="replace")
+            encoder.wait()
+        if encoder.returncode != 0:
+            self.log(f"FFmpeg重新编码片段错误: {encoder_error}")
+            return False
+        if frame_index < end:
+            self.log(f"警告: 片段 {start}~{end} 只解码到 {frame_index - start} 帧")
+            return False
+        return True
+    
+    def merge_audio_and_video(self, video_without_audio: str, original_video: str, output_path: str, 
+                            start_time: float = 0, duration: Optional[float] = None) -> bool:
+        """合并音频和视频，使用本地FFmpeg。
+        
+        start_time和duration应为视频帧实际覆盖的区间（open_video_clip返回的start_time、clip_duration），
+        音频与视频按同一区间截取；duration为None时截取到结尾。
+        """
+        self.log("\n开始合并音频和视频...")
+        try:
+            # 音频提取的时间范围与视频帧区间一致
+            audio_start = max(0, start_time)
+            audio_window = ['-ss', f"{audio_start:.6f}"]
+            if duration:
+                audio_window += ['-t', f"{duration:.6f}"]
+            
+            # 创建临时文件 - 使用更稳定的方式
+            temp_dir = tempfile.gettempdir()
+            temp_audio_name = f"temp_audio_{generate_random_suffix()}.aac"
+            temp_audio = os.path.join(temp_dir, temp_audio_name)
+            
+            # 提取音频，使用本地FFmpeg
+            cmd_extract = [
+                self.ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
+                *audio_window,
+                '-i', original_video,
+                '-vn', '-c:a', 'aac', '-b:a', '192k', temp_audio
+            ]
+            result = subprocess.run(cmd_extract, check=False, capture_output=True, text=True)
+            if result.returncode != 0:
+                self.log(f"FFmpeg提取音频错误: {result.stderr}")
+                # 尝试不带时间参数提取整个音频
+                self.log("尝试提取整个音频...")
+                cmd_extract = [
+                    self.ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
+                    '-i', original_video,
+                    '-vn', '-c:a', 'aac', '-b:a', '192k', temp_audio
+                ]
+                result = subprocess.run(cmd_extract, check=False, capture_output=True, text=True)
+                if result.returncode != 0:
+                    self.log(f"FFmpeg提取音频再次失败: {result.stderr}")
+                    raise Exception("无法提取音频")
+            
+            # 合并音视频
+            cmd_merge = [
+                self.ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
+                '-i', video_without_audio, 
+                '-i', temp_audio,
+                '-c:v', 'copy',  # 直接复制视频流，不重新编码
+                '-c:a', 'aac',
+                '-strict', 'experimental',
+                output_path
+            ]
+            result = subprocess.run(cmd_merge, check=False, capture_output=True, text=True)
+            if result.returncode != 0:
+                self.log(f"FFmpeg合并错误: {result.stderr}")
+                # 尝试重新编码视频
+                self.log("尝试重新编码视频和音频...")
+                cmd_merge = [
+                    self.ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
+                    '-i', video_without_audio, 
+                    '-i', temp_audio,
+                    '-c:v', 'libx264',
+                    '-c:a', 'aac',
+                    '-strict', 'experimental',
+                    output_path
+                ]
+                result = subprocess.run(cmd_merge, check=True, capture_output=True, text=True)
+                
+            self.log(f"音视频合并成功，输出至: {output_path}")
+            return True
+            
+        except Exception as e:
+            self.log(f"FFmpeg合并失败: {str(e)}")
+            self.log("尝试不使用FFmpeg直接保存...")
+            
+            # 尝试直接复制（无音频）
+            try:
+                shutil.copy(video_without_audio, output_path)
+                self.log(f"已保存无音频的处理结果至: {output_path}")
+                return True
+            except Exception as e2:
+                self.log(f"保存无音频视频失败: {str(e2)}")
+                return False
+        finally:
+            if 'temp_audio' in locals() and os.path.exists(temp_audio):
+                try:
+                    os.remove(temp_audio)
+                except:
+                    pass
+    
+    def blur_faces_in_video(self, input_path: str, output_path: str, start_time: float = 0, duration: Optional[float] = None) -> bool:
+        """对视频中的人脸进行打码处理"""
+        if self.resumable and not self.smart_render:
+            return self.blur_faces_in_video_resumable(input_path, output_path, start_time, duration)
+        if self.smart_render:
+            if self.resumable:
+                self.log("智能渲染模式不支持断点续传，将一次性处理整个视频")
+            # 先检测所有帧，再只重新编码包含人脸的GOP
+            detected = self.detect_video_faces(input_path, start_time, duration)
+            if detected is None:
+                return False
+            clip, frame_boxes = detected
+            if self.video_sidecar_path:
+                sidecar = FaceTrackSidecar.from_frame_boxes(
+                    frame_boxes, self.video_sidecar_metadata(input_path, clip, start_time, duration))
+                sidecar.save(self.video_sidecar_path)
+                self.log(f"人脸轨迹文件已保存至: {self.video_sidecar_path}")
+            boxes_by_frame = {frame: boxes for frame, boxes in frame_boxes if len(boxes)}
+            return self.render_video_boxes(input_path, output_path, boxes_by_frame, start_time, duration)
+        
+        # 第一步：处理视频帧（无音频）
+        temp_video_path, clip = self.process_video_frames(
+            input_path, start_time, duration
+        )
+        
+        if not temp_video_path or self.cancel_event.is_set():
+            return False
+        
+        # 第二步：合并音频和视频（与视频帧使用同一区间）
+        return self.finish_video_output(temp_video_path, input_path, output_path,
+                                        clip["start_time"], clip["clip_duration"])
+    
+    def blur_faces_in_video_resumable(self, input_path: str, output_path: str, start_time: float = 0,
+                                      duration: Optional[float] = None) -> bool:
+        """分段处理视频并记录进度，中断后重新运行相同任务时从已完成的段继续"""
+        try:
+            self.validate_blur_params()
+            cap, clip = self.open_video_clip(input_path, start_time, duration)
+            cap.release()
+            fps = clip["fps"]
+            segment_frames = max(1, int(round(self.video_segment_seconds * fps)))
+            job = VideoJob.open(self.video_jobs_dir, input_path, clip, self.detection_context(), segment_frames)
+        except Exception as e:
+            self.log(f"初始化视频任务失败: {str(e)}")
+            return False
+        
+        segments = job.segment_ranges()
+        render_params = render_params_fingerprint()
+        self.log(f"视频任务目录: {job.job_dir}，共 {len(segments)} 段，每段 {segment_frames} 帧")
+        process_start_time = time.time()
+        segment_paths: List[str] = []
+        for index, (segment_start, segment_count) in enumerate(segments):
+            segment_path = job.completed_video(index, render_params)
+            if segment_path:
+                self.log(f"第 {index + 1}/{len(segments)} 段已完成，直接复用")
+                segment_paths.append(segment_path)
+                continue
+            
+            # 打码参数变化或视频损坏时，用已保存的人脸框重新渲染，不再运行推理
+            boxes_by_frame = job.cached_detections(index)
+            self.log(f"处理第 {index + 1}/{len(segments)} 段（第 {segment_start} ~ {segment_start + segment_count - 1} 帧）"
+                     f"{'，使用已保存的人脸框' if boxes_by_frame is not None else ''}")
+            result = self.process_video_segment(input_path, fps, segment_start, segment_count, boxes_by_frame)
+            if result is None:
+                if self.cancel_event.is_set():
+                    self.log(f"已完成 {index}/{len(segments)} 段，重新运行相同任务即可继续")
+                return False
+            temp_video_path, frame_boxes = result
+            job.complete_segment(index, temp_video_path, frame_boxes, render_params)
+            segment_paths.append(job.completed_video(index, render_params))
+            self.update_progress((index + 1) / len(segments) * 100)
+        
+        self.log(f"所有分段处理完成，用时 {time.time() - process_start_time:.2f} 秒")
+        if self.video_sidecar_path:
+            sidecar = job.all_detections()
+            sidecar.metadata = self.video_sidecar_metadata(input_path, clip, start_time, duration)
+            sidecar.save(self.video_sidecar_path)
+            self.log(f"人脸轨迹文件已保存至: {self.video_sidecar_path}")
+        
+        temp_video_path = self.concat_video_segments(segment_paths, job.job_dir)
+        if not temp_video_path:
+            self.log(f"拼接分段失败，任务目录已保留: {job.job_dir}")
+            return False
+        success = self.finish_video_output(temp_video_path, input_path, output_path,
+                                           clip["start_time"], clip["clip_duration"])
+        if success:
+            job.remove()
+        return success
+    
+    def process_video_segment(self, input_path: str, fps: float, start_frame: int, frame_count: int,
+                              boxes_by_frame: Optional[Dict[int, np.ndarray]] = None
+                              ) -> Optional[Tuple[str, List[Tuple[int, np.ndarray]]]]:
+        """处理一段视频：有已保存的人脸框时只渲染，否则检测并打码。
+        
+        返回(无音频的临时视频, [(绝对帧号, 人脸框)])，失败或取消时返回None。
+        """
+        try:
+            cap, clip = self.open_video_clip(input_path, start_frame / fps, frame_count / fps)
+            try:
+                out, temp_video_path = self.create_temp_video_writer(fps, clip["width"], clip["height"])
+            except Exception:
+                cap.release()
+                raise
+        except Exception as e:
+            self.log(f"视频分段处理错误: {str(e)}")
+            return None
+        
+        no_boxes = np.zeros((0, 6), dtype=np.float32)
+        
+        def process(frame_index: int, frame: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+            if boxes_by_frame is None:
+                return self.process_frame_with_boxes(frame)
+            boxes = boxes_by_frame.get(clip["start_frame"] + frame_index, no_boxes)
+            return self.render_face_boxes(frame, boxes), boxes
+        
+        # 只渲染时人脸框逐帧给定，不复用
+        reuse = None
+        if boxes_by_frame is None and self.video_reuse != "off":
+            reuse = VideoFrameReuse(near=self.video_reuse == "near")
+        frame_boxes: List[Tuple[int, np.ndarray]] = []
+        try:
+            for idx, _, result in self.map_video_frames(cap, clip["frame_count"], process, reuse, self.render_face_boxes):
+                if result is None:
+                    continue
+                processed_frame, boxes = result
+                out.write(processed_frame)
+                frame_boxes.append((clip["start_frame"] + idx, boxes))
+        finally:
+            cap.release()
+            out.release()
+        if self.cancel_event.is_set():
+            os.remove(temp_video_path)
+            return None
+        if reuse is not None:
+            self.log(reuse.summary())
+        return temp_video_path, frame_boxes
+    
+    def concat_video_segments(self, segment_paths: List[str], work_dir: str) -> Optional[str]:
+        """用FFmpeg无损拼接分段视频，返回临时视频路径"""
+        list_path = os.path.join(work_dir, "segments.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            for segment_path in segment_paths:
+                # concat列表中的相对路径以列表文件所在目录为基准，统一写绝对路径；单引号需转义
+                escaped = os.path.abspath(segment_path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        temp_video_path = os.path.join(tempfile.gettempdir(), f"temp_video_{generate_random_suffix()}.mp4")
+        cmd = [
+            self.ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
+            '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-map', '0:v', '-c', 'copy', temp_video_path
+        ]
+        result = subprocess.run(cmd, check=False, capture_output=True, text=True, encoding="utf-8", errors="replace")
+        if result.returncode != 0:
+            self.log(f"FFmpeg拼接分段错误: {result.stderr}")
+            return None
+        return temp_video_path
+    
+    def read_preview_frames(self, input_path: str, samples: int, start_time: float = 0,
+                            duration: Optional[float] = None) -> List[Tuple[float, np.ndarray]]:
+        """在区间内均匀取样，返回[(时间, BGR帧)]。
+        
+        有FFmpeg时每个取样点只定位到之前最近的关键帧并解码一帧（-noaccurate_seek），
+        耗时与视频长度无关；否则用OpenCV按时间定位。
+        """
+        cap = cv2.VideoCapture(input_path)
+        if not cap.isOpened():
+            raise Exception(f"无法打开视频文件: {input_path}")
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        video_duration = total_frames / fps if fps > 0 else 0
+        end_time = min(start_time + duration, video_duration) if duration else video_duration
+        if end_time <= start_time:
+            cap.release()
+            raise ValueError(f"开始时间 {start_time}s 超出视频时长 {video_duration:.2f}s")
+        times = [start_time + (i + 0.5) * (end_time - start_time) / samples for i in range(samples)]
+        
+        frames: List[Tuple[float, np.ndarray]] = []
+        use_ffmpeg = os.path.isfile(self.ffmpeg_path)
+        for t in times:
+            if self.cancel_event.is_set():
+                break
+            if use_ffmpeg:
+                reader = FFmpegFrameReader(self.ffmpeg_path, input_path, width, height, t, 1,
+                                           input_args=('-noaccurate_seek',))
+                ret, frame = reader.read()
+                reader.release()
+            else:
+                cap.set(cv2.CAP_PROP_POS_MSEC, t * 1000)
+                ret, frame = cap.read()
+            if ret and frame is not None:
+                frames.append((t, frame.copy() if use_ffmpeg else frame))
+        cap.release()
+        return frames
+    
+    def preview_video(self, input_path: str, output_path: str, samples: int = PREVIEW_SAMPLES_DEFAULT,
+                      thumb_width: int = PREVIEW_THUMB_WIDTH, start_time: float = 0,
+                      duration: Optional[float] = None) -> bool:
+        """快速预览：取样少量帧，用与正式处理相同的检测和打码流程处理后缩小，
+        输出为图片时拼成带时间标注的预览图，输出为视频时生成低帧率的预览视频。
+        
+        先按原分辨率打码再缩小，模糊强度、马赛克块大小等以像素为单位的参数与正式处理的效果一致。
+        预览视频由OpenCV写出MP4，输出只支持.mp4。
+        """
+        output_is_video = detect_file_type(output_path) == "video"
+        if output_is_video and os.path.splitext(output_path)[1].lower() != ".mp4":
+            self.log(f"预览错误: 预览视频只支持.mp4格式，请改用.mp4或图片输出: {output_path}")
+            return False
+        try:
+            self.validate_blur_params()
+            process_start_time = time.time()
+            frames = self.read_preview_frames(input_path, samples, start_time, duration)
+            if not frames:
+                raise Exception(f"无法从视频中读取预览帧: {input_path}")
+            
+            thumbs: List[np.ndarray] = []
+            labels: List[str] = []
+            face_count = 0
+            for index, (t, frame) in enumerate(frames):
+                if self.cancel_event.is_set():
+                    return False
+                processed, boxes = self.process_frame_with_boxes(frame)
+                face_count += len(boxes)
+                scale = thumb_width / processed.shape[1]
+                thumb_height = max(2, int(round(processed.shape[0] * scale / 2)) * 2)
+                thumbs.append(cv2.resize(processed, (thumb_width, thumb_height),
+                                         interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR))
+                labels.append(f"{int(t // 60):02d}:{t % 60:05.2f}  faces:{len(boxes)}")
+                self.update_progress((index + 1) / len(frames) * 100)
+            
+            if output_is_video:
+                out, temp_video_path = self.create_temp_video_writer(PREVIEW_VIDEO_FPS, thumbs[0].shape[1],
+                                                                     thumbs[0].shape[0])
+                for thumb, label in zip(thumbs, labels):
+                    cv2.putText(thumb, label, (6, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.55, (255, 255, 255), 1, cv2.LINE_AA)
+                    out.write(thumb)
+                out.release()
+                shutil.move(temp_video_path, output_path)
+            elif not cv2.imwrite(output_path, build_contact_sheet(thumbs, labels)):
+                raise Exception(f"无法保存预览图到: {output_path}")
+            self.log(f"预览完成: {len(frames)} 个取样点，检测到 {face_count} 个人脸，"
+                     f"用时 {time.time() - process_start_time:.2f} 秒")
+            self.log(f"预览已保存至: {output_path}")
+            return True
+        except Exception as e:
+            self.log(f"预览错误: {str(e)}")
+            return False
+    
+    def stream_video(self, source: str, output: str, input_format: Optional[str] = None,
+                     output_format: Optional[str] = None, latency_ms: float = STREAM_LATENCY_MS_DEFAULT,
+                     box_padding: float = 0.15, duration: Optional[float] = None) -> bool:
+        """实时流模式：读取摄像头或流地址，打码后写到输出流，处理速度始终跟上实时。
+        
+        读取、检测、打码输出分别在各自的线程中进行：
+        - 只处理最新的一帧，处理不过来的帧直接丢弃；
+        - 检测在后台进行，每帧都用最近一次的检测结果（适当扩大）打码，检测慢时不会阻塞输出；
+        - 端到端延迟（读到帧到写入输出）超过目标时加大检测间隔，留有余量时逐步缩小。
+        """
+        try:
+            self.validate_blur_params()
+            reader, fps, width, height = self.open_stream_source(source, input_format)
+        except Exception as e:
+            self.log(f"打开视频源失败: {str(e)}")
+            return False
+        try:
+            writer = self.open_stream_output(output, output_format, fps, width, height)
+        except Exception as e:
+            reader.release()
+            self.log(f"打开输出失败: {str(e)}")
+            return False
+        
+        self.log(f"实时流: {source} -> {output}，{width}x{height} @ {fps:.2f}fps，延迟目标 {latency_ms:.0f}ms")
+        latency_budget = latency_ms / 1000
+        grabber = LatestFrameGrabber(reader).start()
+        detector = AsyncFaceDetector(
+            self.detect_face_boxes, lambda e: self.log(f"检测人脸时出错: {str(e)}", key="检测人脸时出错"))
+        
+        detect_interval = 1
+        last_submitted = -detect_interval
+        stale_dropped = 0
+        frames_written = 0
+        latencies: collections.deque = collections.deque(maxlen=max(int(fps * 5), 10))
+        window_latencies: List[float] = []
+        stream_start = adjust_time = time.perf_counter()
+        next_log_time = stream_start + 5
+        success = True
+        try:
+            while not self.cancel_event.is_set():
+                if duration and time.perf_counter() - stream_start >= duration:
+                    break
+                latest, finished = grabber.get()
+                if finished:
+                    break
+                if latest is None:
+                    continue
+                index, frame, read_time = latest
+                # 等待期间已超过延迟目标的帧不再输出，直接处理下一帧
+                if time.perf_counter() - read_time > latency_budget:
+                    stale_dropped += 1
+                    continue
+                
+                if index - last_submitted >= detect_interval and detector.submit(index, frame.copy()):
+                    last_submitted = index
+                _, boxes = detector.latest()
+                boxes = expand_face_boxes(boxes, box_padding, width, height)
+                frame = self.render_face_boxes(np.ascontiguousarray(frame), boxes)
+                writer.stdin.write(frame.tobytes())
+                frames_written += 1
+                
+                latency = time.perf_counter() - read_time
+                latencies.append(latency)
+                window_latencies.append(latency)
+                
+                now = time.perf_counter()
+                if now - adjust_time >= 1.0:
+                    # 按最近一秒的延迟调整检测间隔：超过目标加倍，低于目标一半时逐步减小
+                    window_p90 = float(np.percentile(window_latencies, 90))
+                    if window_p90 > latency_budget * 0.8:
+                        detect_interval = min(detect_interval * 2, max(int(fps), 1))
+                    elif window_p90 < latency_budget * 0.5 and detect_interval > 1:
+                        detect_interval -= 1
+                    window_latencies = []
+                    adjust_time = now
+                if now >= next_log_time:
+                    next_log_time = now + 5
+                    self.log(f"实时流: 已输出 {frames_written} 帧（{frames_written / (now - stream_start):.1f}fps），"
+                             f"丢帧 {grabber.dropped + stale_dropped}，检测间隔 {detect_interval} 帧，"
+                             f"延迟p90 {float(np.percentile(latencies, 90)) * 1000:.0f}ms")
+        except KeyboardInterrupt:
+            self.log("收到中断，停止实时流")
+        except (BrokenPipeError, OSError) as e:
+            self.log(f"写入输出流失败: {str(e)}")
+            success = False
+        finally:
+            grabber.stop()
+            detector.stop()
+            try:
+                writer.stdin.close()
+            except OSError:
+                pass
+            try:
+                writer.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                writer.kill()
+        
+        elapsed = max(time.perf_counter() - stream_start, 1e-6)
+        summary = (f"实时流结束: 读取 {grabber.frames_read} 帧，输出 {frames_written} 帧，"
+                   f"丢帧 {grabber.dropped + stale_dropped}，检测 {detector.detections} 次，"
+                   f"平均输出 {frames_written / elapsed:.1f}fps")
+        if latencies:
+            summary += (f"，延迟p50 {float(np.percentile(latencies, 50)) * 1000:.0f}ms"
+                        f"/p90 {float(np.percentile(latencies, 90)) * 1000:.0f}ms")
+        if detector.detections:
+            summary += f"，单次检测 {detector.detect_seconds / detector.detections * 1000:.0f}ms"
+        self.log(summary)
+        if writer.returncode not in (0, None):
+            self.log(f"FFmpeg输出进程退出码: {writer.returncode}")
+            success = False
+        return success
+    
+    def open_stream_source(self, source: str, input_format: Optional[str] = None) -> Tuple[Any, float, int, int]:
+        """打开实时流的视频源，返回(读取器, 帧率, 宽, 高)。
+        
+        纯数字视为摄像头编号，用OpenCV打开；其余（流地址、本地文件、lavfi测试源等）通过FFmpeg管道读取。
+        """
+        if source.isdigit():
+            cap = cv2.VideoCapture(int(source))
+            if not cap.isOpened():
+                raise RuntimeError(f"无法打开摄像头 {source}")
+            fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+            return cap, fps, int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        
+        input_args: Tuple[str, ...] = ('-f', input_format) if input_format else ()
+        info = self.probe_video_stream(source, input_args)
+        if "width" not in info:
+            raise RuntimeError(f"无法读取视频流信息: {source}")
+        fps = info.get("fps") or 25.0
+        # 网络流降低输入端缓冲；本地文件和lavfi测试源用-re按帧率读取，模拟实时视频源
+        # （nobuffer会使读取本地文件时丢掉末尾的帧，只用于网络流）
+        if "://" in source:
+            reader_args = ('-fflags', 'nobuffer', *input_args)
+        else:
+            reader_args = ('-re', *input_args)
+        reader = FFmpegFrameReader(self.ffmpeg_path, source, info["width"], info["height"], input_args=reader_args)
+        return reader, fps, info["width"], info["height"]
+    
+    def open_stream_output(self, output: str, output_format: Optional[str], fps: float,
+                           width: int, height: int) -> subprocess.Popen:
+        """启动FFmpeg编码进程，从stdin读取BGR帧写到输出流或文件"""
+        if output_format is None and "://" in output:
+            output_format = STREAM_OUTPUT_FORMATS.get(output.split("://", 1)[0].lower())
+        cmd = [
+            self.ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
+            # 丢帧后按实际写入时刻打时间戳，输出的播放速度与实时一致
+            '-use_wallclock_as_timestamps', '1',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f"{width}x{height}", '-i', '-',
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency',
+            '-pix_fmt', 'yuv420p', '-g', str(max(int(round(fps)), 1)),
+            '-vsync', 'cfr', '-r', f"{fps:.3f}",
+        ]
+        if output_format:
+            cmd += ['-f', output_format]
+        cmd.append(output)
+        return subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    
+    def process_raw_pipe(self, input_stream: Any, output_stream: Any, input_format: str = "rawvideo",
+                         width: int = 0, height: int = 0, pix_fmt: str = "bgr24") -> bool:
+        """管道模式：从输入流读取原始帧，打码后按相同格式写到输出流，不解析容器也不写临时文件"""
+        try:
+            self.validate_blur_params()
+            reader = PipeFrameReader(input_stream, input_format, width, height, pix_fmt)
+        except Exception as e:
+            self.log(f"读取管道输入失败: {str(e)}")
+            return False
+        pix_fmt = reader.pix_fmt
+        writer = PipeFrameWriter(output_stream, reader.y4m_header)
+        self.log(f"管道模式: {input_format}，{reader.width}x{reader.height}，{pix_fmt}")
+        
+        def process(frame_index: int, raw: np.ndarray) -> Tuple[np.ndarray, int]:
+            if pix_fmt == "yuv420p":
+                frame, boxes = self.process_yuv_frame_with_boxes(raw)
+                return frame, len(boxes)
+            frame = raw_frame_to_bgr(raw, pix_fmt)
+            boxes = self.detect_face_boxes(frame)
+            blur_boxes = boxes[boxes[:, 5] == 0]
+            if not len(blur_boxes):
+                return raw, len(boxes)
+            frame = self.render_face_boxes(frame, blur_boxes)
+            return write_back_face_regions(raw, frame, blur_boxes, pix_fmt), len(boxes)
+        
+        frames = faces = 0
+        start_time = time.time()
+        success = True
+        try:
+            # 帧数未知，读到输入结束为止
+            for _, raw, result in self.map_video_frames(reader, sys.maxsize, process):
+                if result is None:
+                    # 处理失败的帧原样输出，保持帧数不变
+                    writer.write(raw)
+                else:
+                    writer.write(result[0])
+                    faces += result[1]
+                frames += 1
+        except (BrokenPipeError, OSError) as e:
+            self.log(f"写入管道输出失败: {str(e)}")
+            success = False
+        finally:
+            reader.release()
+            writer.close()
+        if writer.error is not None:
+            if success:
+                self.log(f"写入管道输出失败: {str(writer.error)}")
+            success = False
+        elapsed = max(time.time() - start_time, 1e-6)
+        self.log(f"管道处理结束: {frames} 帧，检测到 {faces} 张人脸，{frames / elapsed:.1f}fps")
+        return success and not self.cancel_event.is_set()
+    
+    def finish_video_output(self, temp_video_path: str, input_path: str, output_path: str,
+                            start_time: float = 0, duration: Optional[float] = None) -> bool:
+        """合并原视频的音频并写出结果，完成后删除临时视频"""
+        try:
+            success = self.merge_audio_and_video(temp_video_path, input_path, output_path, start_time, duration)
+        except Exception as e:
+            self.log(f"合并音频和视频时出错: {str(e)}")
+            # 即使合并失败，也保留处理后的无音频视频作为备份
+            try:
+                shutil.copy(temp_video_path, output_path)
+                self.log(f"已保存无音频的处理结果至: {output_path}")
+                success = True
+            except:
+                success = False
+        finally:
+            # 清理临时文件
+            if os.path.exists(temp_video_path):
+                try:
+                    os.remove(temp_video_path)
+                except:
+                    self.log(f"警告: 无法删除临时文件 {temp_video_path}")
+        
+        return success
+
+# PDF并行处理：少于该页数时在当前进程顺序处理
+PDF_PARALLEL_MIN_PAGES = 32
+# 每个分片包含的页数
+PDF_PAGES_PER_SHARD = 8
+
+# 工作进程内的状态（每个进程初始化一次）
+_pdf_worker_state: Dict[str, Any] = {}
+_video_worker_state: Dict[str, Any] = {}
+
+def _init_pdf_worker(input_path: str, insightface_dir: str, providers: List[str], intra_op_threads: int,
+                     whitelist_data: Optional[Dict[str, Any]], threshold: float,
+                     precomputed: Dict[str, Any], prefilter: Dict[str, Any], face_filter: Dict[str, Any], messages: Any,
+                     cache_dir: Optional[str], cache_size_mb: int, cache_context: str,
+                     det_size: Tuple[int, int]) -> None:
+    """PDF工作进程初始化：加载模型、白名单和打码参数，并打开自己的文档句柄和结果缓存"""
+    import fitz
+    engine = FaceBlurEngine(insightface_dir, "")
+    engine.app = FaceSessionPool(insightface_dir, providers, size=1, intra_op_threads=intra_op_threads,
+                                 det_size=det_size)
+    engine.whitelist_data = whitelist_data
+    engine.threshold = threshold
+    engine.prefilter = prefilter
+    engine.face_filter = face_filter
+    g_precomputed.update(precomputed)
+    if cache_dir:
+        try:
+            engine.cache = ResultCache(cache_dir, cache_size_mb)
+            engine.cache_context = cache_context
+        except (OSError, sqlite3.Error):
+            engine.cache = None
+    _pdf_worker_state.update({
+        "engine": engine,
+        "document": fitz.open(input_path),
+        "messages": messages,
+        "encoder": ThreadPoolExecutor(max_workers=1),
+    })
+
+def _process_pdf_shard(shard: List[Tuple[int, List[int]]]) -> List[Tuple[int, int, int, bytes, str, int, int]]:
+    """处理一个页码区间：解码、检测、编码三段流水线重叠执行，只返回包含人脸的图片流"""
+    engine: FaceBlurEngine = _pdf_worker_state["engine"]
+    pdf_document = _pdf_worker_state["document"]
+    messages = _pdf_worker_state["messages"]
+    encoder: ThreadPoolExecutor = _pdf_worker_state["encoder"]
+    
+    def decode() -> Iterator[Tuple[int, int, Optional[np.ndarray], str, Optional[str], bool, Optional[str], Any]]:
+        for page_num, xrefs in shard:
+            for i, xref in enumerate(xrefs):
+                key, cached = engine.cache_lookup_pdf_image(pdf_document, xref)
+                img, image_ext, reason = None, "", None
+                if cached is None:
+                    img, image_ext, reason = engine.load_pdf_image(pdf_document, xref)
+                yield page_num, xref, img, image_ext, reason, i == len(xrefs) - 1, key, cached
+    
+    def encode(img: np.ndarray, image_ext: str, key: Optional[str], boxes: np.ndarray,
+               cacheable: bool) -> Tuple[bytes, str, int, int]:
+        stream, stream_filter = encode_pdf_image_stream(img, image_ext)
+        if cacheable:
+            engine.cache_store(key, stream, boxes, filter=stream_filter, width=img.shape[1], height=img.shape[0])
+        return stream, stream_filter, img.shape[1], img.shape[0]
+    
+    encoded: List[Tuple[int, int, int, Future]] = []
+    for page_num, xref, img, image_ext, reason, last_on_page, key, cached in iter_prefetched(decode()):
+        if engine.cache is not None:
+            messages.put(("cache", cached is not None))
+        if cached is not None:
+            stream, meta = cached
+            if stream is not None:
+                done = Future()
+                done.set_result((stream, meta["filter"], meta["width"], meta["height"]))
+                encoded.append((xref, page_num, meta["face_count"], done))
+                messages.put(("log", f"第{page_num+1}页图片 xref={xref} 检测到 {meta['face_count']} 个人脸（结果缓存）"))
+        elif reason:
+            messages.put(("skip", reason))
+        elif img is None:
+            messages.put(("log", f"警告: 无法读取图片 xref={xref} (第{page_num+1}页)，将保留原始图片"))
+        else:
+            processed_img, boxes, cacheable = engine.process_cacheable_frame(img)
+            face_count = len(boxes)
+            if int((boxes[:, 5] == 0).sum()) > 0:
+                encoded.append((xref, page_num, face_count,
+                                encoder.submit(encode, processed_img, image_ext, key, boxes, cacheable)))
+                messages.put(("log", f"第{page_num+1}页图片 xref={xref} 检测到 {face_count} 个人脸"))
+            else:
+                # 没有人脸或只有白名单人脸：不改写该xref
+                if face_count > 0:
+                    messages.put(("log", f"第{page_num+1}页图片 xref={xref} 检测到 {face_count} 个人脸，均为白名单人脸"))
+                if cacheable:
+                    engine.cache_store(key, None, boxes)
+        if last_on_page:
+            # 转发引擎内部日志（如逐帧错误），并报告该页完成
+            lines, _, _ = engine.events.drain(final=True)
+            for line in lines:
+                messages.put(("log", line))
+            messages.put(("page", page_num))
+    return [(xref, page_num, face_count) + future.result() for xref, page_num, face_count, future in encoded]
+
+def _init_video_worker(ring_name: str, slot_count: int, shape: Tuple[int, ...], pix_fmt: str,
+                       insightface_dir: str, providers: List[str], intra_op_threads: int,
+                       whitelist_data: Optional[Dict[str, Any]], threshold: float,
+                       precomputed: Dict[str, Any], face_filter: Dict[str, Any], det_size: Tuple[int, int]) -> None:
+    """视频工作进程初始化：加载模型、白名单、打码参数和人脸过滤条件，并映射主进程的共享内存帧槽"""
+    engine = FaceBlurEngine(insightface_dir, "")
+    engine.app = FaceSessionPool(insightface_dir, providers, size=1, intra_op_threads=intra_op_threads,
+                                 det_size=det_size)
+    engine.whitelist_data = whitelist_data
+    engine.threshold = threshold
+    engine.face_filter = face_filter
+    g_precomputed.update(precomputed)
+    _video_worker_state.update({
+        "engine": engine,
+        "ring": SharedFrameRing(slot_count, shape, name=ring_name),
+        "pix_fmt": pix_fmt,
+    })
+
+def _process_video_slot(slot: int) -> Tuple[np.ndarray, List[str]]:
+    """原地处理一个帧槽，返回(人脸框, 引擎日志)"""
+    engine: FaceBlurEngine = _video_worker_state["engine"]
+    frame = _video_worker_state["ring"].slot(slot)
+    if _video_worker_state["pix_fmt"] == "yuv420p":
+        _, boxes = engine.process_yuv_frame_with_boxes(frame)
+    else:
+        _, boxes = engine.process_frame_with_boxes(frame)
+    lines, _, _ = engine.events.drain(final=True)
+    return boxes, lines
+
+# 守护进程模式的默认参数
+DAEMON_POLL_INTERVAL = 2.0
+DAEMON_MAX_ATTEMPTS = 3
+DAEMON_RETRY_DELAY = 30.0
+DAEMON_HTTP_PORT = 8765
+DAEMON_JOB_STATES = ("pending", "running", "done", "failed")
+
+class DaemonJobQueue:
+    """守护进程的持久化任务队列，保存在SQLite中，进程重启后继续处理。
+    
+    同一输入文件（路径、大小、修改时间都相同）只入队一次，文件被修改后会作为新任务重新入队。
+    失败的任务按指数退避延迟重试，超过最大尝试次数后标记为失败；
+    启动时上次运行中断的任务恢复为等待状态，不计入尝试次数。
+    """
+    def __init__(self, db_path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, source TEXT NOT NULL, "
+                         "input TEXT NOT NULL, output TEXT NOT NULL, file_type TEXT NOT NULL, "
+                         "size INTEGER NOT NULL, mtime REAL NOT NULL, priority INTEGER NOT NULL, "
+                         "state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, "
+                         "not_before REAL NOT NULL DEFAULT 0, created REAL NOT NULL, started REAL, finished REAL, "
+                         "error TEXT, UNIQUE (input, size, mtime))")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (state, priority, not_before)")
+        self._db.execute("UPDATE jobs SET state = 'pending', attempts = MAX(attempts - 1, 0), started = NULL "
+                         "WHERE state = 'running'")
+        self._db.commit()
+    
+    def enqueue(self, source: str, input_path: str, output_path: str, file_type: str,
+                priority: int = 0, max_attempts: int = DAEMON_MAX_ATTEMPTS) -> Optional[int]:
+        """加入任务，返回任务编号；同一文件已在队列中时返回None"""
+        stat = os.stat(input_path)
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO jobs (source, input, output, file_type, size, mtime, priority, state, "
+                "max_attempts, created) VALUES (?, ?, ?, ?, ?, ?, ?, 'pending', ?, ?)",
+                (source, input_path, output_path, file_type, stat.st_size, stat.st_mtime, priority,
+                 max_attempts, time.time()))
+            self._db.commit()
+            return cursor.lastrowid if cursor.rowcount else None
+    
+    def known(self, input_path: str, size: int, mtime: float) -> bool:
+        """该版本的文件是否已经入过队（无论结果如何）"""
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM jobs WHERE input = ? AND size = ? AND mtime = ?",
+                                    (input_path, size, mtime)).fetchone() is not None
+    
+    def ready_candidates(self) -> List[Tuple[int, str]]:
+        """可以开始的任务：只取最高优先级，每个来源取最早入队的一个，返回[(任务编号, 来源)]"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT MAX(priority) FROM jobs WHERE state = 'pending' AND not_before <= ?",
+                                   (now,)).fetchone()
+            if row[0] is None:
+                return []
+            return self._db.execute(
+                "SELECT MIN(id), source FROM jobs WHERE state = 'pending' AND not_before <= ? AND priority = ? "
+                "GROUP BY source", (now, row[0])).fetchall()
+    
+    def claim(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """将任务标记为运行中并返回任务信息；任务已被取走时返回None"""
+        with self._lock:
+            cursor = self._db.execute("UPDATE jobs SET state = 'running', attempts = attempts + 1, started = ? "
+                                      "WHERE id = ? AND state = 'pending'", (time.time(), job_id))
+            self._db.commit()
+            if not cursor.rowcount:
+                return None
+            return self._row(job_id)
+    
+    def finish(self, job_id: int, success: bool, error: str = "", retry_delay: float = DAEMON_RETRY_DELAY) -> str:
+        """记录任务结果，返回新状态：成功为done；失败且还有尝试次数时为pending（延迟重试），否则为failed"""
+        with self._lock:
+            attempts, max_attempts = self._db.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            now = time.time()
+            if success:
+                state, not_before = "done", 0.0
+            elif attempts < max_attempts:
+                state, not_before = "pending", now + retry_delay * 2 ** (attempts - 1)
+            else:
+                state, not_before = "failed", 0.0
+            self._db.execute("UPDATE jobs SET state = ?, not_before = ?, finished = ?, error = ? WHERE id = ?",
+                             (state, not_before, now, error or None, job_id))
+            self._db.commit()
+            return state
+    
+    def release(self, job_id: int) -> None:
+        """退出时放回未完成的任务，不计入尝试次数"""
+        with self._lock:
+            self._db.execute("UPDATE jobs SET state = 'pending', attempts = MAX(attempts - 1, 0), started = NULL "
+                             "WHERE id = ? AND state = 'running'", (job_id,))
+            self._db.commit()
+    
+    def counts(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        with self._lock:
+            rows = self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        counts = {state: 0 for state in DAEMON_JOB_STATES}
+        counts.update(dict(rows))
+        return counts
+    
+    def list_jobs(self, state: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """按编号倒序列出任务"""
+        query = "SELECT * FROM jobs"
+        params: Tuple[Any, ...] = ()
+        if state:
+            query += " WHERE state = ?"
+            params = (state,)
+        with self._lock:
+            cursor = self._db.execute(query + " ORDER BY id DESC LIMIT ?", params + (limit,))
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    
+    def _row(self, job_id: int) -> Dict[str, Any]:
+        cursor = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        columns = [c[0] for c in cursor.description]
+        return dict(zip(columns, cursor.fetchone()))
+    
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+class WatchFolder:
+    """监视一个收件目录：文件在连续两次扫描中大小和修改时间都不变（已写入完成）时交给队列。
+    
+    输出保持相对路径；输出目录位于收件目录内时跳过输出目录，不会重复处理结果文件。
+    """
+    def __init__(self, input_root: str, output_root: str, priority: int = 0) -> None:
+        self.input_root = os.path.abspath(input_root)
+        self.output_root = os.path.abspath(output_root)
+        self.priority = priority
+        self._pending: Dict[str, Tuple[int, float]] = {}
+    
+    def scan(self, job_queue: DaemonJobQueue) -> List[Tuple[str, str, str]]:
+        """扫描一次，返回写入完成且尚未入队的[(输入路径, 输出路径, 文件类型)]"""
+        seen: Dict[str, Tuple[int, float]] = {}
+        ready = []
+        for dirpath, dirnames, filenames in os.walk(self.input_root):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")
+                           and os.path.abspath(os.path.join(dirpath, d)) != self.output_root]
+            for name in sorted(filenames):
+                # 跳过隐藏文件和Office的临时文件
+                if name.startswith((".", "~$")):
+                    continue
+                path = os.path.join(dirpath, name)
+                file_type = detect_file_type(path)
+                if file_type is None:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                version = (stat.st_size, stat.st_mtime)
+                seen[path] = version
+                if self._pending.get(path) != version or job_queue.known(path, *version):
+                    continue
+                output_path = os.path.join(self.output_root, os.path.relpath(path, self.input_root))
+                ready.append((path, output_path, file_type))
+        self._pending = seen
+        return ready
+
+class DaemonJobEvents(EventChannel):
+    """单个任务的事件通道：日志加上任务编号转发到守护进程的通道，进度记录下来供状态接口查询"""
+    def __init__(self, job_id: int, target: EventChannel) -> None:
+        super().__init__()
+        self.job_id = job_id
+        self.target = target
+        self.progress = 0.0
+    
+    def post(self, kind: str, value: Any, key: Optional[str] = None) -> None:
+        if kind == "progress":
+            self.progress = value
+        elif kind == "log":
+            self.target.post("log", f"[任务{self.job_id}] {value}", key)
+
+class FaceBlurDaemon:
+    """守护进程：监视收件目录，按持久化队列并发处理文件，并通过本地HTTP接口提供状态和指标。
+    
+    模型、白名单和打码参数只加载一次，所有任务共享同一个会话池；每个任务使用引擎的浅拷贝，
+    拥有独立的事件通道和结果缓存连接。调度时先选最高优先级，同一优先级内优先选择
+    正在运行任务最少、最久没有被调度的来源，一个收件目录积压大量文件时不会饿死其他目录。
+    """
+    def __init__(self, engine: FaceBlurEngine, job_queue: DaemonJobQueue, watches: List[WatchFolder],
+                 jobs: int = 2, poll_interval: float = DAEMON_POLL_INTERVAL,
+                 max_attempts: int = DAEMON_MAX_ATTEMPTS, retry_delay: float = DAEMON_RETRY_DELAY) -> None:
+        self.engine = engine
+        self.queue = job_queue
+        self.watches = watches
+        self.jobs = max(1, jobs)
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.started = time.time()
+        self._stop = threading.Event()
+        self._wakeup = threading.Condition()
+        self._lock = threading.Lock()
+        self._running: Dict[int, Tuple[Dict[str, Any], DaemonJobEvents]] = {}
+        self._running_by_source: Dict[str, int] = collections.defaultdict(int)
+        self._last_served: Dict[str, float] = {}
+        self._metrics = {"completed": 0, "failed": 0, "retried": 0, "seconds": 0.0}
+    
+    def submit(self, source: str, input_path: str, output_path: str, priority: int = 0) -> Optional[int]:
+        """加入一个任务并唤醒空闲的worker，返回任务编号（已在队列中时返回None）"""
+        file_type = detect_file_type(input_path)
+        if file_type is None:
+            raise ValueError(f"不支持的文件类型: {input_path}")
+        job_id = self.queue.enqueue(source, input_path, output_path, file_type, priority, self.max_attempts)
+        if job_id is not None:
+            self.engine.log(f"任务{job_id}入队: {input_path}（优先级 {priority}）")
+            with self._wakeup:
+                self._wakeup.notify_all()
+        return job_id
+    
+    def scan_watches(self) -> None:
+        for watch in self.watches:
+            try:
+                for input_path, output_path, _ in watch.scan(self.queue):
+                    self.submit(watch.input_root, input_path, output_path, watch.priority)
+            except OSError as e:
+                self.engine.log(f"扫描收件目录失败 {watch.input_root}: {str(e)}", key="扫描收件目录失败")
+    
+    def next_job(self) -> Optional[Dict[str, Any]]:
+        """公平调度：在最高优先级的候选中选择运行任务最少、最久未被调度的来源"""
+        with self._lock:
+            candidates = self.queue.ready_candidates()
+            candidates.sort(key=lambda c: (self._running_by_source[c[1]], self._last_served.get(c[1], 0.0), c[0]))
+            for job_id, source in candidates:
+                job = self.queue.claim(job_id)
+                if job is not None:
+                    self._running[job_id] = (job, DaemonJobEvents(job_id, self.engine.events))
+                    self._running_by_source[source] += 1
+                    self._last_served[source] = time.monotonic()
+                    return job
+        return None
+    
+    def run_job(self, job: Dict[str, Any]) -> None:
+        """在共享模型的引擎拷贝上处理一个任务"""
+        with self._lock:
+            events = self._running[job["id"]][1]
+        engine = copy.copy(self.engine)
+        engine.events = events
+        engine.cache = None
+        # 视频按段记录进度，重试或重启后从已完成的段继续
+        engine.resumable = True
+        events.post("log", f"开始处理（第 {job['attempts']} 次尝试）: {job['input']}")
+        start = time.perf_counter()
+        error = ""
+        try:
+            os.makedirs(os.path.dirname(job["output"]) or ".", exist_ok=True)
+            success = engine.run_file(job["file_type"], job["input"], job["output"])
+        except Exception as e:
+            success, error = False, str(e)
+            events.post("log", f"处理错误: {error}")
+        finally:
+            if engine.cache is not None:
+                engine.cache.close()
+        elapsed = time.perf_counter() - start
+        
+        with self._lock:
+            del self._running[job["id"]]
+            self._running_by_source[job["source"]] -= 1
+            if self._stop.is_set() and not success:
+                # 退出导致的取消，放回队列下次启动继续
+                self.queue.release(job["id"])
+                return
+            state = self.queue.finish(job["id"], success, error or ("" if success else "处理失败"), self.retry_delay)
+            self._metrics["seconds"] += elapsed
+            if state == "done":
+                self._metrics["completed"] += 1
+                events.post("log", f"处理完成，用时 {elapsed:.1f} 秒: {job['output']}")
+            elif state == "pending":
+                self._metrics["retried"] += 1
+                events.post("log", "处理失败，稍后重试")
+            else:
+                self._metrics["failed"] += 1
+                events.post("log", f"处理失败，已达最大尝试次数 {job['max_attempts']}")
+    
+    def worker_loop(self) -> None:
+        while not self._stop.is_set():
+            job = self.next_job()
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+            self.run_job(job)
+    
+    def idle(self) -> bool:
+        """没有运行中、也没有等待中的任务"""
+        with self._lock:
+            return not self._running and self.queue.counts()["pending"] == 0
+    
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            running = [{"id": job["id"], "input": job["input"], "source": job["source"],
+                        "attempt": job["attempts"], "progress": round(events.progress, 1),
+                        "elapsed": round(time.time() - job["started"], 1)}
+                       for job, events in self._running.values()]
+            metrics = dict(self._metrics)
+        return {
+            "uptime": round(time.time() - self.started, 1),
+            "workers": self.jobs,
+            "session_pool_size": self.engine.app.size if self.engine.app else 0,
+            "queue": self.queue.counts(),
+            "running": running,
+            "watch": [{"input": w.input_root, "output": w.output_root, "priority": w.priority} for w in self.watches],
+            "metrics": metrics,
+        }
+    
+    def metrics_text(self) -> str:
+        """Prometheus文本格式的指标"""
+        status = self.status()
+        metrics = status["metrics"]
+        lines = ["# TYPE faceblur_jobs gauge"]
+        lines += [f'faceblur_jobs{{state="{state}"}} {count}' for state, count in status["queue"].items()]
+        lines += [
+            "# TYPE faceblur_jobs_completed_total counter", f"faceblur_jobs_completed_total {metrics['completed']}",
+            "# TYPE faceblur_jobs_failed_total counter", f"faceblur_jobs_failed_total {metrics['failed']}",
+            "# TYPE faceblur_jobs_retried_total counter", f"faceblur_jobs_retried_total {metrics['retried']}",
+            "# TYPE faceblur_job_seconds_total counter", f"faceblur_job_seconds_total {metrics['seconds']:.3f}",
+            "# TYPE faceblur_workers gauge", f"faceblur_workers {status['workers']}",
+            "# TYPE faceblur_uptime_seconds gauge", f"faceblur_uptime_seconds {status['uptime']}",
+        ]
+        return "\n".join(lines) + "\n"
+    
+    def serve_http(self, host: str, port: int) -> ThreadingHTTPServer:
+        """在后台线程启动状态接口：GET /status、/jobs、/metrics，POST /jobs加入任务"""
+        daemon = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def send_json(self, code: int, payload: Any) -> None:
+                self.send_body(code, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json")
+            
+            def send_body(self, code: int, body: bytes, content_type: str) -> None:
+                self.send_response(code)
+                self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path == "/status":
+                    self.send_json(200, daemon.status())
+                elif url.path == "/jobs":
+                    state = query.get("state", [None])[0]
+                    try:
+                        limit = int(query.get("limit", ["100"])[0])
+                    except ValueError as e:
+                        self.send_json(400, {"error": str(e)})
+                        return
+                    self.send_json(200, daemon.queue.list_jobs(state, limit))
+                elif url.path == "/metrics":
+                    self.send_body(200, daemon.metrics_text().encode("utf-8"), "text/plain; version=0.0.4")
+                else:
+                    self.send_json(404, {"error": "not found"})
+            
+            def do_POST(self) -> None:
+                if urlparse(self.path).path != "/jobs":
+                    self.send_json(404, {"error": "not found"})
+                    return
+                try:
+                    request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                    input_path = os.path.abspath(request["input"])
+                    job_id = daemon.submit("api", input_path, os.path.abspath(request["output"]),
+                                           int(request.get("priority", 0)))
+                except KeyError as e:
+                    self.send_json(400, {"error": f"缺少字段: {e.args[0]}"})
+                    return
+                except (ValueError, OSError) as e:
+                    self.send_json(400, {"error": str(e)})
+                    return
+                self.send_json(201 if job_id is not None else 200, {"id": job_id, "queued": job_id is not None})
+            
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+        
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+    
+    def run(self, host: str = "127.0.0.1", port: Optional[int] = DAEMON_HTTP_PORT, once: bool = False) -> None:
+        """运行到Ctrl+C；once为True时处理完收件目录中现有的文件后退出"""
+        server = self.serve_http(host, port) if port is not None else None
+        if server is not None:
+            self.engine.log(f"状态接口: http://{host}:{server.server_address[1]}/status")
+        workers = [threading.Thread(target=self.worker_loop, daemon=True) for _ in range(self.jobs)]
+        for worker in workers:
+            worker.start()
+        self.engine.log(f"守护进程已启动: {len(self.watches)} 个收件目录，{self.jobs} 个并发任务")
+        try:
+            # 连续两次扫描才能确认文件写入完成，once模式至少扫描两次
+            scans = 0
+            while not self._stop.is_set():
+                self.scan_watches()
+                scans += 1
+                if once and scans >= 2 and self.idle():
+                    break
+                self._stop.wait(self.poll_interval)
+        except KeyboardInterrupt:
+            self.engine.log("收到中断，等待运行中的任务退出...")
+        finally:
+            self._stop.set()
+            self.engine.cancel_event.set()
+            with self._wakeup:
+                self._wakeup.notify_all()
+            for worker in workers:
+                worker.join()
+            if server is not None:
+                server.shutdown()
+            counts = self.queue.counts()
+            self.engine.log(f"守护进程已退出: 完成 {self._metrics['completed']} 个，失败 {self._metrics['failed']} 个，"
+                            f"队列中等待 {counts['pending']} 个")
+
+# asyncio接口：每批最多合并的图片数、等待凑批的时间窗口
+ASYNC_BATCH_SIZE = 8
+ASYNC_BATCH_WINDOW_MS = 5.0
+# 只有不超过该像素数的小图片才合并成批，大图片各自占用一个推理实例并行处理
+ASYNC_BATCH_MAX_PIXELS = 1280 * 1280
+
+class AsyncFaceBlurrer:
+    """供asyncio服务嵌入使用的异步接口，输入输出都在内存中（字节或numpy数组），不写临时文件。
+    
+    推理在有界线程池中运行（默认线程数等于会话池的实例数）；同时处理的请求超过max_pending时，
+    之后的调用在await处等待，形成背压。同一时间窗口内到达的小图片合并成一批，在同一个推理实例上
+    检测，并把所有人脸一次送入识别模型。引擎需已加载模型（prepare_models），打码参数对所有请求相同。
+    """
+    def __init__(self, engine: FaceBlurEngine, concurrency: Optional[int] = None, max_pending: Optional[int] = None,
+                 batch_size: int = ASYNC_BATCH_SIZE, batch_window_ms: float = ASYNC_BATCH_WINDOW_MS) -> None:
+        if engine.app is None:
+            raise ValueError("引擎尚未加载模型，请先调用prepare_models")
+        self.engine = engine
+        self.concurrency = max(1, concurrency or engine.app.size)
+        self.max_pending = max(1, max_pending or self.concurrency * 4)
+        self.batch_size = max(1, batch_size)
+        self.batch_window = batch_window_ms / 1000
+        self.pending = 0
+        self.batches = 0
+        self.batched_images = 0
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="face-blur-async")
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._batch: List[Tuple[np.ndarray, asyncio.Future]] = []
+        self._batch_timer: Optional[asyncio.TimerHandle] = None
+        self._batch_tasks: set = set()
+    
+    async def __aenter__(self) -> "AsyncFaceBlurrer":
+        return self
+    
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.close()
+    
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+    
+    @asynccontextmanager
+    async def _admit(self) -> AsyncIterator[None]:
+        """占用一个请求名额，名额用完时等待"""
+        async with self._slots:
+            self.pending += 1
+            try:
+                yield
+            finally:
+                self.pending -= 1
+    
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+    
+    async def _detect(self, img: np.ndarray) -> np.ndarray:
+        if self.batch_size == 1 or img.shape[0] * img.shape[1] > ASYNC_BATCH_MAX_PIXELS:
+            return await self._run(self.engine.detect_face_boxes, img)
+        future = asyncio.get_running_loop().create_future()
+        self._batch.append((img, future))
+        if len(self._batch) >= self.batch_size:
+            self._flush_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = asyncio.get_running_loop().call_later(self.batch_window, self._flush_batch)
+        return await future
+    
+    def _flush_batch(self) -> None:
+        """把当前凑到的图片作为一批提交（在事件循环线程中调用）"""
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        batch, self._batch = self._batch, []
+        if batch:
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+    
+    async def _run_batch(self, batch: List[Tuple[np.ndarray, asyncio.Future]]) -> None:
+        try:
+            results = await self._run(self.engine.detect_face_boxes_batch, [img for img, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.batched_images += len(batch)
+        for (_, future), boxes in zip(batch, results):
+            if not future.done():
+                future.set_result(boxes)
+    
+    async def detect_faces(self, img: np.ndarray) -> np.ndarray:
+        """检测人脸，返回N×6的人脸框数组（格式同process_frame_with_boxes），不修改图像"""
+        async with self._admit():
+            return await self._detect(img)
+    
+    async def blur_array(self, img: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """对BGR图像打码（原地修改），返回(图像, 人脸框)"""
+        async with self._admit():
+            boxes = await self._detect(img)
+            if np.any(boxes[:, 5] == 0):
+                img = await self._run(self.engine.render_face_boxes, img, boxes)
+            return img, boxes
+    
+    async def blur_image_bytes(self, data: bytes, ext: Optional[str] = None) -> bytes:
+        """对内存中的图片打码，返回编码后的数据。
+        
+        ext为输出格式（如"jpg"、".png"），默认与输入相同；JPEG沿用原质量并保留EXIF/ICC，
+        保留透明通道和灰度。没有需要打码的人脸且格式不变时原样返回输入。GIF/WebP动画逐帧处理。
+        """
+        source_ext = image_blob_format(data)
+        ext = (ext or source_ext or "png").lower().lstrip(".")
+        async with self._admit():
+            if f".{ext}" in ANIMATION_EXTENSIONS and is_animated_blob(data):
+                output = await self._run(self.engine.blur_animation_blob, data, f".{ext}")
+                if output is None:
+                    raise RuntimeError("处理已取消")
+                return output
+            img, alpha, gray = await self._run(decode_image_blob, data)
+            if img is None:
+                raise ValueError("无法解码图片")
+            boxes = await self._detect(img)
+            if not np.any(boxes[:, 5] == 0) and ext == source_ext:
+                return data
+            return await self._run(self._render_blob, img, boxes, ext, data, alpha, gray)
+    
+    def _render_blob(self, img: np.ndarray, boxes: np.ndarray, ext: str, data: bytes,
+                     alpha: Optional[np.ndarray], gray: bool) -> bytes:
+        return encode_image_like(self.engine.render_face_boxes(img, boxes), ext, data, alpha, gray)
+    
+    async def blur_frames(self, frames: Union[Iterable[np.ndarray], AsyncIterable[np.ndarray]],
+                          window: Optional[int] = None) -> AsyncIterator[np.ndarray]:
+        """逐帧打码的异步迭代器，按输入顺序产出处理后的帧（原地修改）。
+        
+        最多window帧（默认为并发数的2倍）同时在处理中，消费方取得慢时不再读取新的帧。
+        同步可迭代对象直接在事件循环中迭代，读取会阻塞时请传入异步迭代器。
+        """
+        window = max(1, window or self.concurrency * 2)
+        in_flight: collections.deque = collections.deque()
+        
+        async def source() -> AsyncIterator[np.ndarray]:
+            if hasattr(frames, "__aiter__"):
+                async for frame in frames:
+                    yield frame
+            else:
+                for frame in frames:
+                    yield frame
+        
+        try:
+            async for frame in source():
+                in_flight.append(asyncio.ensure_future(self.blur_array(frame)))
+                if len(in_flight) >= window:
+                    yield (await in_flight.popleft())[0]
+            while in_flight:
+                yield (await in_flight.popleft())[0]
+        finally:
+            for task in in_flight:
+                task.cancel()
+    
+    def stats(self) -> Dict[str, Any]:
+        """运行统计：处理中的请求数、已提交的批次数和平均批大小"""
+        return {
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "concurrency": self.concurrency,
+            "batches": self.batches,
+            "mean_batch_size": self.batched_images / self.batches if self.batches else 0.0,
+        }
+
+class FaceBlurApp(FaceBlurEngine):
+    def __init__(self, root: tk.Tk) -> None:
+        self.root = root
+        self.root.title("人脸打码工具")
+        self.root.geometry("950x850")
+        self.root.resizable(True, True)
+        
+        # 设置中文字体支持
+        self.style = ttk.Style()
+        self.style.configure("TLabel", font=("SimHei", 10))
+        self.style.configure("TButton", font=("SimHei", 10))
+        self.style.configure("TCombobox", font=("SimHei", 10))
+        
+        # 资源路径初始化
+        super().__init__(get_resource_path(".insightface"),
+                         get_resource_path(os.path.join("ffmpeg", "ffmpeg.exe")))
+        
+        # 验证资源是否存在
+        self.validate_resources()
+        
+        # 变量初始化 - 使用中文作为显示值
+        self.input_path = tk.StringVar()
+        self.output_path = tk.StringVar()
+        self.whitelist_dir = tk.StringVar()
+        self.blur_type = tk.StringVar(value=REVERSE_BLUR_TYPE_MAP["circle"])  # 默认圆形模糊
+        self.similarity_threshold = tk.DoubleVar(value=0.5)
+        self.blur_strength = tk.IntVar(value=50)
+        self.feather_radius = tk.IntVar(value=8)
+        self.opacity = tk.DoubleVar(value=0.95)
+        self.start_time = tk.DoubleVar(value=0)
+        self.duration = tk.DoubleVar(value=0)
+        self.mosaic_block_size = tk.IntVar(value=15)
+        # 新增：文件类型选择
+        self.file_type = tk.StringVar(value="视频文件")
+        
+        # 用于直接输入的变量
+        self.similarity_threshold_str = tk.StringVar(value="0.5")
+        self.blur_strength_str = tk.StringVar(value="50")
+        self.feather_radius_str = tk.StringVar(value="8")
+        self.opacity_str = tk.StringVar(value="0.95")
+        self.start_time_str = tk.StringVar(value="0")
+        self.duration_str = tk.StringVar(value="0")
+        self.mosaic_block_size_str = tk.StringVar(value="15")
+        
+        # 绑定变量更新事件
+        self.bind_variable_updates()
+        
+        self.processing = False
+        self.process_thread: Optional[threading.Thread] = None
+        
+        self.create_widgets()
+        self.initialize_log_messages()  # 初始化日志信息
+        self.poll_events()  # 开始定时刷新日志和进度
+    
+    def bind_variable_updates(self):
+        """绑定变量更新事件，实现滑块和输入框的双向同步"""
+        # 相似度阈值
+        def update_similarity_from_scale(value):
+            self.similarity_threshold_str.set(f"{float(value):.2f}")
+        
+        def update_similarity_from_entry(*args):
+            try:
+                value = float(self.similarity_threshold_str.get())
+                if 0.1 <= value <= 0.9:
+                    self.similarity_threshold.set(value)
+            except:
+                pass
+        
+        self.similarity_threshold.trace_add("write", lambda *args: update_similarity_from_scale(self.similarity_threshold.get()))
+        self.similarity_threshold_str.trace_add("write", update_similarity_from_entry)
+        
+        # 模糊强度
+        def update_blur_from_scale(value):
+            self.blur_strength_str.set(str(int(float(value))))
+        
+        def update_blur_from_entry(*args):
+            try:
+                value = int(self.blur_strength_str.get())
+                if 5 <= value <= 100:
+                    self.blur_strength.set(value)
+            except:
+                pass
+        
+        self.blur_strength.trace_add("write", lambda *args: update_blur_from_scale(self.blur_strength.get()))
+        self.blur_strength_str.trace_add("write", update_blur_from_entry)
+        
+        # 马赛克块大小
+        def update_mosaic_from_scale(value):
+            self.mosaic_block_size_str.set(str(int(float(value))))
+        
+        def update_mosaic_from_entry(*args):
+            try:
+                value = int(self.mosaic_block_size_str.get())
+                if 5 <= value <= 50:
+                    self.mosaic_block_size.set(value)
+            except:
+                pass
+        
+        self.mosaic_block_size.trace_add("write", lambda *args: update_mosaic_from_scale(self.mosaic_block_size.get()))
+        self.mosaic_block_size_str.trace_add("write", update_mosaic_from_entry)
+        
+        # 羽化半径
+        def update_feather_from_scale(value):
+            self.feather_radius_str.set(str(int(float(value))))
+        
+        def update_feather_from_entry(*args):
+            try:
+                value = int(self.feather_radius_str.get())
+                if 0 <= value <= 20:
+                    self.feather_radius.set(value)
+            except:
                 pass
         
         self.feather_radius.trace_add("write", lambda *args: update_feather_from_scale(self.feather_radius.get()))
@@ -461,6 +5861,9 @@ class FaceBlurApp:
         self.process_btn = ttk.Button(btn_frame, text="开始处理", command=self.start_processing)
         self.process_btn.pack(side=tk.LEFT, padx=5)
         
+        self.preview_btn = ttk.Button(btn_frame, text="快速预览", command=self.start_preview)
+        self.preview_btn.pack(side=tk.LEFT, padx=5)
+        
         self.cancel_btn = ttk.Button(btn_frame, text="取消", command=self.cancel_processing, state=tk.DISABLED)
         self.cancel_btn.pack(side=tk.LEFT, padx=5)
         
@@ -473,1111 +5876,743 @@ class FaceBlurApp:
         """初始化日志框中的提示信息"""
         self.log("📋 欢迎使用人脸打码工具！")
         self.log("")
-        self.log("⚠️ 重要提示：")
-        self.log("1. 白名单功能：请指定一个存放人脸头像截图的文件夹，工具将自动识别并保留这些人脸不打码")
-        self.log("2. GPU加速配置：")
-        self.log("   - 需要安装onnxruntime-gpu而非普通的onnxruntime")
-        
-        # 添加可点击的下载链接
-        self.log_text.config(state=tk.NORMAL)
-        self.log_text.insert(tk.END, "   - 需要安装与GPU匹配的 ")
-        
-        # 创建CUDA下载链接
-        cuda_link = HyperlinkLabel(self.log_text, text="CUDA 12.9.1", 
-                                 url="https://developer.nvidia.com/cuda-12-9-1-download-archive")
-        self.log_text.window_create(tk.END, window=cuda_link)
-        
-        self.log_text.insert(tk.END, " 和 ")
-        
-        # 创建cuDNN下载链接
-        cudnn_link = HyperlinkLabel(self.log_text, text="cuDNN 9.11.0", 
-                                  url="https://developer.nvidia.com/cudnn-9-11-0-download-archive")
-        self.log_text.window_create(tk.END, window=cudnn_link)
-        
-        self.log_text.insert(tk.END, " 工具包\n")
-        self.log_text.config(state=tk.DISABLED)
-        
-        self.log("   - 配置完成后，工具会自动检测并使用GPU加速")
-        self.log("3. 支持的文件类型：视频、图片、Word文档和PDF文档")
-        self.log("")
-        self.log("请选择文件类型并设置相关参数开始处理...")
-    
-    def on_file_type_change(self):
-        """文件类型变更时的处理"""
-        current_type = FILE_TYPE_MAP[self.file_type.get()]
-        if current_type == "video":
-            # 显示时间设置控件，放在输入文件下方的同一行
-            self.time_frame.grid(row=3, column=0, columnspan=3, sticky=tk.W, pady=5)
-        else:
-            # 隐藏时间设置控件
-            self.time_frame.grid_remove()
-    
-    def browse_input(self) -> None:
-        file_type = FILE_TYPE_MAP[self.file_type.get()]
-        file_extensions = FILE_EXTENSIONS.get(file_type, ["*.*"])
-        
-        filetypes = [(f"{self.file_type.get()}", ";".join(file_extensions))]
-        
-        filename = filedialog.askopenfilename(
-            filetypes=filetypes
-        )
-        if filename:
-            self.input_path.set(filename)
-            # 自动设置输出路径
-            if not self.output_path.get():
-                dirname, basename = os.path.split(filename)
-                name, ext = os.path.splitext(basename)
-                output_filename = os.path.join(dirname, f"{name}_blurred{ext}")
-                self.output_path.set(output_filename)
-    
-    def browse_output(self) -> None:
-        file_type = FILE_TYPE_MAP[self.file_type.get()]
-        file_extensions = FILE_EXTENSIONS.get(file_type, ["*.*"])
-        
-        # 获取默认扩展名
-        default_ext = file_extensions[0][1:] if file_extensions else "*.*"
-        
-        filename = filedialog.asksaveasfilename(
-            defaultextension=default_ext,
-            filetypes=[(f"{self.file_type.get()}", ";".join(file_extensions))]
-        )
-        if filename:
-            self.output_path.set(filename)
-    
-    def browse_whitelist(self) -> None:
-        directory = filedialog.askdirectory()
-        if directory:
-            self.whitelist_dir.set(directory)
-    
-    def log(self, message: str) -> None:
-        """向日志区域添加消息"""
-        self.log_text.config(state=tk.NORMAL)
-        self.log_text.insert(tk.END, message + "\n")
-        self.log_text.see(tk.END)
-        self.log_text.config(state=tk.DISABLED)
-        self.root.update_idletasks()
-    
-    def update_progress(self, value: float) -> None:
-        """更新进度条"""
-        self.progress_var.set(value)
-        self.root.update_idletasks()
-    
-    def handle_existing_output_file(self, output_path: str) -> Optional[str]:
-        """处理已存在的输出文件，返回新的路径或None表示取消"""
-        if not os.path.exists(output_path):
-            return output_path
-            
-        # 创建自定义对话框
-        dialog = tk.Toplevel(self.root)
-        dialog.title("文件已存在")
-        dialog.geometry("350x150")
-        dialog.resizable(False, False)
-        dialog.transient(self.root)  # 设置为主窗口的子窗口
-        dialog.grab_set()  # 模态窗口，阻止操作主窗口
-        
-        # 居中显示
-        dialog.update_idletasks()
-        width = dialog.winfo_width()
-        height = dialog.winfo_height()
-        x = (self.root.winfo_width() // 2) - (width // 2) + self.root.winfo_x()
-        y = (self.root.winfo_height() // 2) - (height // 2) + self.root.winfo_y()
-        dialog.geometry(f"+{x}+{y}")
-        
-        # 提示信息
-        ttk.Label(dialog, text=f"文件 '{os.path.basename(output_path)}' 已存在。", 
-                 font=("SimHei", 10)).pack(pady=10, padx=10)
-        
-        # 按钮框架
-        btn_frame = ttk.Frame(dialog)
-        btn_frame.pack(pady=10)
-        
-        # 结果变量
-        result = tk.StringVar(value="cancel")
-        
-        # 取消按钮
-        def on_cancel():
-            result.set("cancel")
-            dialog.destroy()
-        
-        # 重命名按钮
-        def on_rename():
-            result.set("rename")
-            dialog.destroy()
-        
-        # 覆盖按钮
-        def on_overwrite():
-            result.set("overwrite")
-            dialog.destroy()
-        
-        ttk.Button(btn_frame, text="取消操作", command=on_cancel).pack(side=tk.LEFT, padx=5)
-        ttk.Button(btn_frame, text="随机重命名", command=on_rename).pack(side=tk.LEFT, padx=5)
-        ttk.Button(btn_frame, text="覆盖", command=on_overwrite).pack(side=tk.LEFT, padx=5)
-        
-        # 等待对话框关闭
-        self.root.wait_window(dialog)
-        
-        if result.get() == "cancel":
-            return None
-        elif result.get() == "overwrite":
-            return output_path
-        
-        # 生成新的文件名
-        dirname, basename = os.path.split(output_path)
-        name, ext = os.path.splitext(basename)
-        random_suffix = generate_random_suffix()
-        new_name = f"{name}_{random_suffix}{ext}"
-        new_path = os.path.join(dirname, new_name)
-        
-        self.log(f"输出文件已存在，自动重命名为: {new_name}")
-        return new_path
-    
-    def start_processing(self) -> None:
-        """开始处理文件"""
-        # 验证输入
-        if not self.input_path.get():
-            messagebox.showerror("错误", "请选择输入文件")
-            return
-        
-        output_path = self.output_path.get()
-        if not output_path:
-            messagebox.showerror("错误", "请选择输出文件路径")
-            return
+        self.log("⚠️ 重要提示：")
+        self.log("1. 白名单功能：请指定一个存放人脸头像截图的文件夹，工具将自动识别并保留这些人脸不打码")
+        self.log("2. GPU加速配置：")
+        self.log("   - 需要安装onnxruntime-gpu而非普通的onnxruntime")
         
-        # 检查文件类型支持
-        file_type = FILE_TYPE_MAP[self.file_type.get()]
-        if file_type == "word" and not DOCX_SUPPORTED:
-            messagebox.showerror("错误", "Word文档处理需要python-docx库，请先安装：\npip install python-docx")
-            return
+        # 添加可点击的下载链接（先输出已投递的日志，保证顺序）
+        self.flush_events()
+        self.log_text.config(state=tk.NORMAL)
+        self.log_text.insert(tk.END, "   - 需要安装与GPU匹配的 ")
         
-        if file_type == "pdf" and not PDF_SUPPORTED:
-            messagebox.showerror("错误", "PDF文档处理需要pymupdf库，请先安装：\npip install pymupdf")
-            return
+        # 创建CUDA下载链接
+        cuda_link = HyperlinkLabel(self.log_text, text="CUDA 12.9.1", 
+                                 url="https://developer.nvidia.com/cuda-12-9-1-download-archive")
+        self.log_text.window_create(tk.END, window=cuda_link)
         
-        # 处理已存在的输出文件
-        new_output_path = self.handle_existing_output_file(output_path)
-        if new_output_path is None:  # 用户选择取消
-            return
-        if new_output_path != output_path:  # 文件名已更改
-            self.output_path.set(new_output_path)
-            output_path = new_output_path
+        self.log_text.insert(tk.END, " 和 ")
         
-        # 检查输入输出是否相同
-        if os.path.abspath(self.input_path.get()) == os.path.abspath(output_path):
-            if not messagebox.askyesno("警告", "输入和输出文件相同，这将覆盖原文件。是否继续？"):
-                return
+        # 创建cuDNN下载链接
+        cudnn_link = HyperlinkLabel(self.log_text, text="cuDNN 9.11.0", 
+                                  url="https://developer.nvidia.com/cudnn-9-11-0-download-archive")
+        self.log_text.window_create(tk.END, window=cudnn_link)
         
-        # 禁用按钮
-        self.process_btn.config(state=tk.DISABLED)
-        self.cancel_btn.config(state=tk.NORMAL)
-        self.processing = True
-        self.cancel_event.clear()
+        self.log_text.insert(tk.END, " 工具包\n")
+        self.log_text.config(state=tk.DISABLED)
         
-        # 在新线程中处理，避免UI冻结
-        self.process_thread = threading.Thread(target=self.process_file)
-        self.process_thread.start()
-    
-    def cancel_processing(self) -> None:
-        """取消处理"""
-        if messagebox.askyesno("确认", "确定要取消处理吗？"):
-            self.cancel_event.set()
-            self.log("正在取消处理...")
-            self.cancel_btn.config(state=tk.DISABLED)
-    
-    def process_file(self) -> None:
-        """处理文件的实际函数"""
-        try:
-            # 获取参数，将中文打码类型转换为英文
-            input_path = self.input_path.get()
-            output_path = self.output_path.get()
-            whitelist_dir = self.whitelist_dir.get() if self.whitelist_dir.get() else None
-            file_type = FILE_TYPE_MAP[self.file_type.get()]
-            
-            # 根据文件类型调用不同的处理函数
-            self.log(f"开始处理{self.file_type.get()}: {input_path}")
-            self.log(f"输出路径: {output_path}")
-            
-            success = False
-            blur_type = BLUR_TYPE_MAP[self.blur_type.get()]  # 转换为英文值
-            
-            # 初始化FaceAnalysis模型
-            self.app = self.initialize_face_analysis()
-            if not self.app:
-                raise Exception("无法初始化人脸检测模型")
-            
-            # 加载白名单
-            self.whitelist_data, self.threshold = self.load_whitelist_faces(
-                self.app, whitelist_dir, self.similarity_threshold.get())
-            
-            # 预计算图像处理参数
-            self.precompute_image_processing_params(
-                blur_type, self.blur_strength.get(), 
-                self.feather_radius.get(), self.opacity.get(), 
-                self.mosaic_block_size.get())
-            
-            # 根据文件类型处理
-            if file_type == "video":
-                start_time = self.start_time.get()
-                duration = self.duration.get() if self.duration.get() > 0 else None
-                success = self.blur_faces_in_video(
-                    input_path=input_path,
-                    output_path=output_path,
-                    start_time=start_time,
-                    duration=duration
-                )
-            elif file_type == "image":
-                success = self.blur_faces_in_image(
-                    input_path=input_path,
-                    output_path=output_path
-                )
-            elif file_type == "word":
-                success = self.blur_faces_in_word(
-                    input_path=input_path,
-                    output_path=output_path
-                )
-            elif file_type == "pdf":
-                success = self.blur_faces_in_pdf(
-                    input_path=input_path,
-                    output_path=output_path
-                )
-            
-            if success and not self.cancel_event.is_set():
-                self.log("处理完成！")
-                self.update_progress(100)
-                messagebox.showinfo("成功", f"{self.file_type.get()}处理完成，已保存至:\n{output_path}")
-                # 添加打开文件按钮功能
-                if messagebox.askyesno("完成", "是否打开输出文件？"):
-                    self.open_output_file(output_path)
-            elif self.cancel_event.is_set():
-                self.log("处理已取消")
-            else:
-                self.log("处理失败")
-                messagebox.showerror("失败", f"{self.file_type.get()}处理过程中发生错误")
-                
-        except Exception as e:
-            self.log(f"处理错误: {str(e)}")
-            messagebox.showerror("错误", f"处理过程中发生错误:\n{str(e)}")
-        finally:
-            # 恢复UI状态
-            self.processing = False
-            self.process_btn.config(state=tk.NORMAL)
-            self.cancel_btn.config(state=tk.DISABLED)
-            self.update_progress(0)
-    
-    def open_output_file(self, file_path: str) -> None:
-        """打开输出文件"""
-        try:
-            if sys.platform.startswith('win'):
-                os.startfile(file_path)  # type: ignore
-            elif sys.platform.startswith('darwin'):
-                subprocess.run(['open', file_path])
-            else:
-                subprocess.run(['xdg-open', file_path])
-        except Exception as e:
-            self.log(f"无法打开文件: {str(e)}")
-    
-    def initialize_face_analysis(self) -> Optional[FaceAnalysis]:
-        """初始化人脸分析模型"""
-        try:
-            # GPU检查与模型初始化
-            gpu_available = self.check_gpu_availability()
-            providers = ['CUDAExecutionProvider'] if gpu_available else ['CPUExecutionProvider']
-            self.log(f"使用提供者: {providers}")
-            
-            # 初始化FaceAnalysis，使用本地模型
-            app = FaceAnalysis(providers=providers, name='buffalo_l', root=self.insightface_dir)
-            app.prepare(ctx_id=0, det_size=(640, 640))
-            return app
-        except Exception as e:
-            self.log(f"初始化buffalo_l模型失败: {str(e)}")
-            return None
+        self.log("   - 配置完成后，工具会自动检测并使用GPU加速")
+        self.log("3. 支持的文件类型：视频、图片、Word文档和PDF文档")
+        self.log("")
+        self.log("请选择文件类型并设置相关参数开始处理...")
     
-    def check_gpu_availability(self) -> bool:
-        """检查系统是否支持GPU加速"""
-        self.log("检查ONNX Runtime可用提供者...")
-        available_providers = ort.get_available_providers()
-        self.log(f"可用提供者: {available_providers}")
-        
-        if 'CUDAExecutionProvider' in available_providers:
-            self.log("✅ CUDA加速可用")
-            return True
+    def on_file_type_change(self):
+        """文件类型变更时的处理"""
+        current_type = FILE_TYPE_MAP[self.file_type.get()]
+        if current_type == "video":
+            # 显示时间设置控件，放在输入文件下方的同一行
+            self.time_frame.grid(row=3, column=0, columnspan=3, sticky=tk.W, pady=5)
         else:
-            self.log("⚠️ CUDA加速不可用，将使用CPU")
-            self.log("提示: 请确保安装了onnxruntime-gpu和兼容的CUDA/cuDNN")
-            return False
+            # 隐藏时间设置控件
+            self.time_frame.grid_remove()
+        # 快速预览只用于视频
+        if not self.processing:
+            self.preview_btn.config(state=tk.NORMAL if current_type == "video" else tk.DISABLED)
     
-    def load_whitelist_faces(self, app: FaceAnalysis, whitelist_dir: Optional[str], 
-                            similarity_threshold: float = 0.5) -> Tuple[Optional[Dict[str, Any]], float]:
-        """加载人脸白名单并返回特征向量矩阵"""
-        whitelist_features: List[Dict[str, Any]] = []
-        if whitelist_dir and os.path.exists(whitelist_dir):
-            self.log(f"正在加载人脸白名单，目录: {whitelist_dir}")
-            valid_files = [f for f in os.listdir(whitelist_dir) 
-                          if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-            
-            for filename in valid_files:
-                img_path = os.path.join(whitelist_dir, filename)
-                try:
-                    img = cv2.imread(img_path)
-                    if img is None:
-                        self.log(f"错误: 无法读取图片 {filename}")
-                        continue
-                        
-                    faces = app.get(img)
-                    if faces:
-                        whitelist_features.append({
-                            'feature': faces[0].normed_embedding,
-                            'filename': filename
-                        })
-                        self.log(f"已加载白名单人脸: {filename}")
-                    else:
-                        self.log(f"警告: 在白名单图片 {filename} 中未检测到人脸")
-                except Exception as e:
-                    self.log(f"错误: 无法加载白名单图片 {filename}: {str(e)}")
-        
-        if not whitelist_features:
-            self.log("警告: 未加载到任何白名单人脸，所有检测到的人脸都将被打码")
-            return None, similarity_threshold
+    def browse_input(self) -> None:
+        file_type = FILE_TYPE_MAP[self.file_type.get()]
+        file_extensions = FILE_EXTENSIONS.get(file_type, ["*.*"])
         
-        # 转换为特征矩阵（n_features × embedding_dim），加速批量计算
-        feature_matrix = np.array([item['feature'] for item in whitelist_features])
-        return {
-            'matrix': feature_matrix,
-            'entries': whitelist_features
-        }, similarity_threshold
-    
-    def precompute_image_processing_params(self, blur_type: str, blur_strength: int, 
-                                         feather_radius: int, opacity: float, 
-                                         mosaic_block_size: int) -> None:
-        """预计算图像处理参数，避免循环内重复计算"""
-        # 计算高斯模糊核
-        kernel_size = int(blur_strength // 2 * 2 + 1)
-        kernel_size = max(kernel_size, 3)
+        filetypes = [(f"{self.file_type.get()}", ";".join(file_extensions))]
         
-        # 存储预计算参数到全局变量
-        g_precomputed.update({
-            "kernel_size": kernel_size,
-            "blur_type": blur_type,
-            "feather_radius": feather_radius,
-            "opacity": opacity,
-            "mosaic_block_size": mosaic_block_size,
-            # 预计算羽化核（如果需要）
-            "feather_kernel": (feather_radius*2+1, feather_radius*2+1) if feather_radius > 0 else None
-        })
+        filename = filedialog.askopenfilename(
+            filetypes=filetypes
+        )
+        if filename:
+            self.input_path.set(filename)
+            # 自动设置输出路径
+            if not self.output_path.get():
+                dirname, basename = os.path.split(filename)
+                name, ext = os.path.splitext(basename)
+                output_filename = os.path.join(dirname, f"{name}_blurred{ext}")
+                self.output_path.set(output_filename)
     
-    def apply_mosaic(self, face_region: np.ndarray, block_size: int) -> np.ndarray:
-        """应用马赛克效果"""
-        height, width = face_region.shape[:2]
+    def browse_output(self) -> None:
+        file_type = FILE_TYPE_MAP[self.file_type.get()]
+        file_extensions = FILE_EXTENSIONS.get(file_type, ["*.*"])
         
-        # 缩小图像
-        small = cv2.resize(face_region, (width // block_size, height // block_size), interpolation=cv2.INTER_LINEAR)
+        # 获取默认扩展名
+        default_ext = file_extensions[0][1:] if file_extensions else "*.*"
         
-        # 放大回原尺寸
-        mosaic = cv2.resize(small, (width, height), interpolation=cv2.INTER_NEAREST)
-        return mosaic
+        filename = filedialog.asksaveasfilename(
+            defaultextension=default_ext,
+            filetypes=[(f"{self.file_type.get()}", ";".join(file_extensions))]
+        )
+        if filename:
+            self.output_path.set(filename)
     
-    def apply_pixelate(self, face_region: np.ndarray, block_size: int) -> np.ndarray:
-        """应用像素化效果（比马赛克更规则）"""
-        height, width = face_region.shape[:2]
-        
-        # 遍历每个块并应用平均颜色
-        for y in range(0, height, block_size):
-            for x in range(0, width, block_size):
-                y_end = min(y + block_size, height)
-                x_end = min(x + block_size, width)
-                
-                # 获取块区域
-                block = face_region[y:y_end, x:x_end]
-                
-                # 计算块的平均颜色
-                avg_color = block.mean(axis=0).mean(axis=0)
-                
-                # 用平均颜色填充块
-                face_region[y:y_end, x:x_end] = avg_color
-        
-        return face_region
+    def browse_whitelist(self) -> None:
+        directory = filedialog.askdirectory()
+        if directory:
+            self.whitelist_dir.set(directory)
     
-    def process_single_face(self, frame: np.ndarray, face: Any) -> np.ndarray:
-        """处理单个人脸的打码逻辑"""
-        # 检查是否在白名单中
-        is_whitelisted = False
-        if self.whitelist_data:
-            # 批量计算当前人脸与所有白名单人脸的相似度
-            similarities = np.dot(self.whitelist_data['matrix'], face.normed_embedding)
-            if np.any(similarities > self.threshold):
-                is_whitelisted = True
-        
-        if is_whitelisted:
-            return frame  # 白名单人脸不处理
+    def poll_events(self) -> None:
+        """定时从事件通道取出日志和进度，合并后一次性刷新界面"""
+        self.flush_events()
+        self.root.after(EVENT_POLL_INTERVAL_MS, self.poll_events)
+    
+    def flush_events(self) -> None:
+        """在主线程中处理所有待处理事件"""
+        lines, progress, callbacks = self.events.drain()
+        if lines:
+            self.log_text.config(state=tk.NORMAL)
+            self.log_text.insert(tk.END, "\n".join(lines) + "\n")
+            self.log_text.see(tk.END)
+            self.log_text.config(state=tk.DISABLED)
+        if progress is not None:
+            self.progress_var.set(progress)
+        for callback in callbacks:
+            callback()
+    
+    def handle_existing_output_file(self, output_path: str) -> Optional[str]:
+        """处理已存在的输出文件，返回新的路径或None表示取消"""
+        if not os.path.exists(output_path):
+            return output_path
+            
+        # 创建自定义对话框
+        dialog = tk.Toplevel(self.root)
+        dialog.title("文件已存在")
+        dialog.geometry("350x150")
+        dialog.resizable(False, False)
+        dialog.transient(self.root)  # 设置为主窗口的子窗口
+        dialog.grab_set()  # 模态窗口，阻止操作主窗口
         
-        # 人脸边界框处理
-        bbox = face.bbox.astype(int)
-        x1, y1, x2, y2 = bbox
-        x1, y1 = max(0, x1), max(0, y1)
-        x2, y2 = min(frame.shape[1], x2), min(frame.shape[0], y2)
+        # 居中显示
+        dialog.update_idletasks()
+        width = dialog.winfo_width()
+        height = dialog.winfo_height()
+        x = (self.root.winfo_width() // 2) - (width // 2) + self.root.winfo_x()
+        y = (self.root.winfo_height() // 2) - (height // 2) + self.root.winfo_y()
+        dialog.geometry(f"+{x}+{y}")
         
-        # 提取人脸区域
-        face_region = frame[y1:y2, x1:x2]
-        region_height, region_width = face_region.shape[:2]
-        if region_height == 0 or region_width == 0:
-            return frame
+        # 提示信息
+        ttk.Label(dialog, text=f"文件 '{os.path.basename(output_path)}' 已存在。", 
+                 font=("SimHei", 10)).pack(pady=10, padx=10)
         
-        # 1. 创建打码区域掩码
-        mask = np.zeros((region_height, region_width, 3), dtype=np.uint8)
-        if g_precomputed["blur_type"] in ['circle', 'mosaic', 'pixelate']:
-            center = (region_width // 2, region_height // 2)
-            radius = int(max(region_width, region_height) * 0.45)
-            cv2.circle(mask, center, radius, (255, 255, 255), -1)
-        elif g_precomputed["blur_type"] == 'ellipse':
-            center = (region_width // 2, region_height // 2)
-            axes = (int(region_width * 0.45), int(region_height * 0.45))
-            cv2.ellipse(mask, center, axes, 0, 0, 360, (255, 255, 255), -1)
-        else:  # rectangle
-            cv2.rectangle(mask, (0, 0), (region_width, region_height), (255, 255, 255), -1)
+        # 按钮框架
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(pady=10)
         
-        # 2. 羽化处理
-        if g_precomputed["feather_radius"] > 0:
-            gray_mask = cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY)
-            blurred_mask = cv2.GaussianBlur(gray_mask, g_precomputed["feather_kernel"], 0)
-            mask = cv2.cvtColor(blurred_mask, cv2.COLOR_GRAY2BGR) / 255.0  # 归一化
-        else:
-            mask = mask / 255.0
+        # 结果变量
+        result = tk.StringVar(value="cancel")
         
-        # 3. 应用打码效果
-        if g_precomputed["blur_type"] == 'mosaic':
-            processed_face = self.apply_mosaic(face_region.copy(), g_precomputed["mosaic_block_size"])
-        elif g_precomputed["blur_type"] == 'pixelate':
-            processed_face = self.apply_pixelate(face_region.copy(), g_precomputed["mosaic_block_size"])
-        else:  # 模糊效果
-            processed_face = cv2.GaussianBlur(face_region, 
-                                           (g_precomputed["kernel_size"], g_precomputed["kernel_size"]), 
-                                           g_precomputed["kernel_size"] // 2)
+        # 取消按钮
+        def on_cancel():
+            result.set("cancel")
+            dialog.destroy()
         
-        # 4. 混合处理
-        opacity = g_precomputed["opacity"]
-        if opacity < 1.0:
-            face_region[:] = (face_region * (1 - mask) + 
-                             (processed_face * opacity + face_region * (1 - opacity)) * mask).astype(np.uint8)
-        else:
-            face_region[:] = (face_region * (1 - mask) + processed_face * mask).astype(np.uint8)
+        # 重命名按钮
+        def on_rename():
+            result.set("rename")
+            dialog.destroy()
         
-        return frame
-    
-    def process_frame(self, frame: np.ndarray) -> Tuple[np.ndarray, int]:
-        """处理单帧图像，增加错误处理"""
-        if self.cancel_event.is_set():
-            return frame, 0
-            
-        # 检查帧是否有效
-        if frame is None:
-            self.log("错误: 接收到空帧")
-            return np.array([]), 0
-            
-        if not isinstance(frame, np.ndarray):
-            self.log(f"错误: 帧不是有效的numpy数组，类型为{type(frame)}")
-            return np.array([]), 0
-            
-        if len(frame.shape) != 3:
-            self.log(f"错误: 帧形状不正确，应为3维，实际为{frame.shape}")
-            return np.array([]), 0
+        # 覆盖按钮
+        def on_overwrite():
+            result.set("overwrite")
+            dialog.destroy()
         
-        try:
-            faces = self.app.get(frame)
-            for face in faces:
-                frame = self.process_single_face(frame, face)
-            return frame, len(faces)
-        except Exception as e:
-            self.log(f"处理帧时出错: {str(e)}")
-            # 返回原始帧以继续处理流程
-            return frame, 0
-    
-    # 图片处理函数
-    def blur_faces_in_image(self, input_path: str, output_path: str) -> bool:
-        """对图片中的人脸进行打码处理"""
-        try:
-            # 读取图片
-            img = cv2.imread(input_path)
-            if img is None:
-                raise Exception(f"无法读取图片: {input_path}")
-            
-            self.log(f"处理图片: {os.path.basename(input_path)}")
-            self.log(f"图片尺寸: {img.shape[1]}x{img.shape[0]}")
-            
-            # 处理人脸
-            processed_img, face_count = self.process_frame(img)
-            self.log(f"检测到 {face_count} 个人脸")
-            
-            # 保存处理后的图片
-            success = cv2.imwrite(output_path, processed_img)
-            if not success:
-                raise Exception(f"无法保存处理后的图片到: {output_path}")
-                
-            return True
-        except Exception as e:
-            self.log(f"图片处理错误: {str(e)}")
-            return False
-    
-    # Word文档处理函数
-    def blur_faces_in_word(self, input_path: str, output_path: str) -> bool:
-        """对Word文档中的图片人脸进行打码处理"""
-        if not DOCX_SUPPORTED:
-            self.log("错误: Word文档处理需要python-docx库")
-            return False
-            
-        try:
-            # 加载Word文档
-            doc = Document(input_path)
-            self.log(f"加载Word文档: {os.path.basename(input_path)}")
-            
-            # 创建临时目录存储处理后的图片
-            with tempfile.TemporaryDirectory() as temp_dir:
-                image_count = 0
-                modified_count = 0
-                processed_images = []  # 存储处理后的图片信息
-                
-                # 提取文档中的所有图片
-                self.log("从Word文档中提取图片...")
-                for rel in doc.part.rels.values():
-                    if "image" in rel.target_ref:
-                        image_count += 1
-                        # 获取图片数据和扩展名
-                        img_data = rel.target_part._blob
-                        content_type = rel.target_part.content_type
-                        img_ext = content_type.split('/')[-1].lower()
-                        if img_ext == 'jpeg':
-                            img_ext = 'jpg'
-                        if img_ext not in ['png', 'jpg', 'jpeg', 'gif', 'bmp']:
-                            img_ext = 'png'
-                            
-                        # 保存原始图片到临时文件
-                        temp_img_path = os.path.join(temp_dir, f"img_{image_count}.{img_ext}")
-                        with open(temp_img_path, 'wb') as f:
-                            f.write(img_data)
-                            
-                        # 处理图片
-                        img = cv2.imread(temp_img_path)
-                        if img is not None:
-                            processed_img, face_count = self.process_frame(img)
-                            
-                            # 保存处理后的图片
-                            processed_img_path = os.path.join(temp_dir, f"processed_img_{image_count}.{img_ext}")
-                            cv2.imwrite(processed_img_path, processed_img)
-                            
-                            # 记录需要替换的图片信息
-                            processed_images.append({
-                                'rel_id': rel.rId,
-                                'processed_path': processed_img_path,
-                                'face_count': face_count
-                            })
-                            
-                            if face_count > 0:
-                                modified_count += 1
-                                self.log(f"处理图片 {image_count}，检测到 {face_count} 个人脸")
-                            else:
-                                self.log(f"处理图片 {image_count}，未检测到人脸")
-                        else:
-                            self.log(f"警告: 无法读取图片 {image_count}，将使用原始图片")
-                            processed_images.append({
-                                'rel_id': rel.rId,
-                                'processed_path': temp_img_path,
-                                'face_count': 0
-                            })
-                
-                # 替换文档中的图片 - 将此操作移至with块内部
-                self.log("替换Word文档中的图片...")
-                for img_info in processed_images:
-                    # 检查文件是否存在
-                    if not os.path.exists(img_info['processed_path']):
-                        self.log(f"警告: 处理后的图片不存在 {img_info['processed_path']}")
-                        continue
-                        
-                    rel = doc.part.rels[img_info['rel_id']]
-                    # 读取处理后的图片
-                    with open(img_info['processed_path'], 'rb') as f:
-                        processed_blob = f.read()
-                    # 直接替换图片二进制数据
-                    rel.target_part._blob = processed_blob
-            
-            self.log(f"共处理 {image_count} 张图片，其中 {modified_count} 张包含人脸并已打码")
-            
-            # 保存处理后的文档
-            doc.save(output_path)
-            return True
-            
-        except Exception as e:
-            self.log(f"Word文档处理错误: {str(e)}")
-            return False
-    
-    # PDF文档处理函数
-    def blur_faces_in_pdf(self, input_path: str, output_path: str) -> bool:
-        """对PDF文档中的图片人脸进行打码处理，使用PyMuPDF库，不依赖Poppler"""
-        try:
-            import fitz  # 确保导入PyMuPDF库
-        except ImportError:
-            self.log("错误: PDF文档处理需要pymupdf库，请安装: pip install pymupdf")
-            return False
-            
-        try:
-            # 加载PDF文档
-            pdf_document = fitz.open(input_path)
-            page_count = len(pdf_document)
-            self.log(f"加载PDF文档: {os.path.basename(input_path)}，共 {page_count} 页")
-            
-            # 创建临时目录存储处理后的图片
-            with tempfile.TemporaryDirectory() as temp_dir:
-                image_count = 0
-                modified_count = 0
-                processed_images = []  # 存储处理后的图片信息
-                
-                # 提取文档中的所有图片
-                self.log("从PDF文档中提取图片...")
-                for page_num in range(page_count):
-                    page = pdf_document[page_num]
-                    images = page.get_images(full=True)
-                    
-                    for img_index, img in enumerate(images):
-                        image_count += 1
-                        xref = img[0]
-                        
-                        # 提取图片数据
-                        base_image = pdf_document.extract_image(xref)
-                        image_bytes = base_image["image"]
-                        image_ext = base_image["ext"]
-                        
-                        # 保存原始图片到临时文件
-                        temp_img_path = os.path.join(temp_dir, f"page_{page_num}_img_{img_index}.{image_ext}")
-                        with open(temp_img_path, "wb") as f:
-                            f.write(image_bytes)
-                            
-                        # 获取图片在页面中的位置
-                        img_rects = page.get_image_rects(xref)
-                        img_rect = img_rects[0] if img_rects else None
-                        
-                        # 处理图片
-                        img = cv2.imread(temp_img_path)
-                        if img is not None:
-                            processed_img, face_count = self.process_frame(img)
-                            
-                            # 保存处理后的图片
-                            processed_img_path = os.path.join(temp_dir, f"processed_page_{page_num}_img_{img_index}.{image_ext}")
-                            cv2.imwrite(processed_img_path, processed_img)
-                            
-                            # 记录需要替换的图片信息
-                            processed_images.append({
-                                'xref': xref,
-                                'page_num': page_num,
-                                'rect': img_rect,
-                                'ext': image_ext,
-                                'processed_path': processed_img_path,
-                                'face_count': face_count
-                            })
-                            
-                            if face_count > 0:
-                                modified_count += 1
-                                self.log(f"处理图片 {image_count} (第{page_num+1}页)，检测到 {face_count} 个人脸")
-                            else:
-                                self.log(f"处理图片 {image_count} (第{page_num+1}页)，未检测到人脸")
-                        else:
-                            self.log(f"警告: 无法读取图片 {image_count} (第{page_num+1}页)，将使用原始图片")
-                            processed_images.append({
-                                'xref': xref,
-                                'page_num': page_num,
-                                'rect': img_rect,
-                                'ext': image_ext,
-                                'processed_path': temp_img_path,
-                                'face_count': 0
-                            })
-                
-                # 关闭原始PDF文档
-                pdf_document.close()
-                
-                # 创建新的PDF文档并替换图片
-                self.log("替换PDF文档中的图片...")
-                new_pdf = fitz.open()
-                original_pdf = fitz.open(input_path)
-                
-                # 按页面分组处理后的图片
-                page_image_map = {}
-                for img in processed_images:
-                    page_num = img['page_num']
-                    if page_num not in page_image_map:
-                        page_image_map[page_num] = []
-                    page_image_map[page_num].append(img)
-                
-                # 处理每一页
-                for page_num in range(page_count):
-                    # 复制原始页面
-                    original_page = original_pdf.load_page(page_num)
-                    new_page = new_pdf.new_page(
-                        width=original_page.rect.width,
-                        height=original_page.rect.height
-                    )
-                    
-                    # 将原始页面内容绘制到新页面
-                    new_page.show_pdf_page(new_page.rect, original_pdf, page_num)
-                    
-                    # 如果当前页没有图片需要处理，继续下一页
-                    if page_num not in page_image_map:
-                        continue
-                        
-                    images = page_image_map[page_num]
-                    
-                    # 先覆盖原始图片
-                    for img in images:
-                        if img['rect']:
-                            # 绘制白色矩形覆盖原始图片
-                            new_page.draw_rect(
-                                img['rect'], 
-                                color=(1, 1, 1), 
-                                fill=(1, 1, 1), 
-                                width=0
-                            )
-                    
-                    # 插入处理后的图片
-                    for img in images:
-                        if not img['rect']:
-                            self.log(f"警告: 无法确定图片位置，跳过替换: {os.path.basename(img['processed_path'])}")
-                            continue
-                        
-                        try:
-                            # 插入处理后的图片
-                            new_page.insert_image(
-                                img['rect'],  # 图片位置和大小
-                                filename=img['processed_path']  # 图片文件路径
-                            )
-                        except Exception as e:
-                            self.log(f"插入图片时出错: {str(e)}，尝试备选方法")
-                            # 备选方法：使用PIL处理图片
-                            try:
-                                from PIL import Image
-                                with Image.open(img['processed_path']) as pil_img:
-                                    img_byte_arr = io.BytesIO()
-                                    pil_img.save(img_byte_arr, format=img['ext'].upper())
-                                    img_byte_arr = img_byte_arr.getvalue()
-                                    
-                                    new_page.insert_image(
-                                        img['rect'],
-                                        stream=img_byte_arr
-                                    )
-                            except Exception as e2:
-                                self.log(f"备选方法也失败: {str(e2)}，跳过此图片")
-                
-                # 保存处理后的文档
-                new_pdf.save(output_path)
-                new_pdf.close()
-                original_pdf.close()
-            
-            self.log(f"共处理 {image_count} 张图片，其中 {modified_count} 张包含人脸并已打码")
-            self.log(f"处理后的PDF文档已保存至: {output_path}")
-            return True
-            
-        except Exception as e:
-            self.log(f"PDF文档处理错误: {str(e)}")
-            return False
-    
-    # 视频处理函数
-    def process_video_frames(self, input_path: str, start_time: float = 0, duration: Optional[float] = None) -> Tuple[Optional[str], Optional[float], Optional[int], Optional[int]]:
-        """视频帧处理函数，加强错误处理"""
-        # 参数验证与初始化
-        if not (0 <= g_precomputed["opacity"] <= 1):
-            raise ValueError("不透明度(opacity)必须在0到1之间")
-        if g_precomputed["feather_radius"] < 0:
-            raise ValueError("羽化半径(feather_radius)不能为负数")
-        if g_precomputed["kernel_size"] < 1:
-            raise ValueError("模糊强度(blur_strength)必须大于0")
-        if g_precomputed["mosaic_block_size"] < 1:
-            raise ValueError("马赛克块大小必须大于0")
+        ttk.Button(btn_frame, text="取消操作", command=on_cancel).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="随机重命名", command=on_rename).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="覆盖", command=on_overwrite).pack(side=tk.LEFT, padx=5)
         
-        # 视频基础信息读取
-        if not os.path.exists(input_path):
-            raise FileNotFoundError(f"输入视频文件不存在: {input_path}")
-        cap = cv2.VideoCapture(input_path)
+        # 等待对话框关闭
+        self.root.wait_window(dialog)
         
-        # 检查视频是否打开成功
-        if not cap.isOpened():
-            raise Exception(f"无法打开视频文件: {input_path}")
-            
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        video_duration = total_frames / fps if fps > 0 else 0
+        if result.get() == "cancel":
+            return None
+        elif result.get() == "overwrite":
+            return output_path
         
-        # 计算处理区间
-        start_frame = int(start_time * fps) if fps > 0 else 0
-        end_frame = min(start_frame + int(duration * fps), total_frames) if duration and fps > 0 else total_frames
-        if start_frame >= total_frames:
-            raise ValueError(f"开始时间 {start_time}s 超出视频时长 {video_duration}s")
+        # 生成新的文件名
+        dirname, basename = os.path.split(output_path)
+        name, ext = os.path.splitext(basename)
+        random_suffix = generate_random_suffix()
+        new_name = f"{name}_{random_suffix}{ext}"
+        new_path = os.path.join(dirname, new_name)
         
-        # 设置起始帧位置
-        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
-        actual_start = cap.get(cv2.CAP_PROP_POS_FRAMES)
-        if abs(actual_start - start_frame) > 10:  # 允许一定误差
-            self.log(f"警告: 无法精确跳转到起始帧 {start_frame}，实际从 {actual_start} 开始")
+        self.log(f"输出文件已存在，自动重命名为: {new_name}")
+        return new_path
+    
+    def start_processing(self) -> None:
+        """开始处理文件"""
+        # 验证输入
+        if not self.input_path.get():
+            messagebox.showerror("错误", "请选择输入文件")
+            return
         
-        # 临时文件与输出设置
-        try:
-            # 使用更稳定的临时文件创建方式
-            temp_dir = tempfile.gettempdir()
-            temp_video_name = f"temp_video_{generate_random_suffix()}.mp4"
-            temp_video_path = os.path.join(temp_dir, temp_video_name)
-            
-            # 尝试使用合适的编码器
-            try:
-                fourcc = cv2.VideoWriter_fourcc(*'avc1')  # H.264
-                if cv2.VideoWriter_fourcc(*'avc1') == -1:
-                    raise ValueError("不支持avc1编码器")
-            except:
-                try:
-                    fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # MPEG-4
-                except:
-                    fourcc = cv2.VideoWriter_fourcc(*'XVID')  # 后备方案
-            
-            # 检查输出是否可以打开
-            out = cv2.VideoWriter(temp_video_path, fourcc, fps, (width, height))
-            if not out.isOpened():
-                raise Exception(f"无法创建视频写入器，编码器: {fourcc}")
-        except Exception as e:
-            cap.release()
-            raise Exception(f"初始化视频处理失败: {str(e)}")
+        output_path = self.output_path.get()
+        if not output_path:
+            messagebox.showerror("错误", "请选择输出文件路径")
+            return
         
-        # 统计初始化
-        process_start_time = time.time()
-        total_frames_to_process = end_frame - start_frame
-        total_faces_detected = 0
-        failed_frames = 0
+        # 检查文件类型支持
+        file_type = FILE_TYPE_MAP[self.file_type.get()]
+        if file_type == "word" and self.word_mode == "docx" and not DOCX_SUPPORTED:
+            messagebox.showerror("错误", "Word文档处理需要python-docx库，请先安装：\npip install python-docx")
+            return
         
-        self.log(f"开始处理视频帧: {input_path}")
-        self.log(f"处理区间: {start_time}s ~ {min(start_time + (end_frame - start_frame)/fps, video_duration):.2f}s")
-        self.log(f"打码参数: 类型={g_precomputed['blur_type']} | 相似度阈值={self.threshold} | 模糊强度={g_precomputed['kernel_size']} | "
-                f"羽化半径={g_precomputed['feather_radius']} | 不透明度={g_precomputed['opacity']}")
+        if file_type == "pdf" and not PDF_SUPPORTED:
+            messagebox.showerror("错误", "PDF文档处理需要pymupdf库，请先安装：\npip install pymupdf")
+            return
         
-        # 并行处理帧
-        max_workers = min(os.cpu_count() or 4, 4)  # 减少worker数量，降低内存占用
-        executor = ThreadPoolExecutor(max_workers=max_workers)
-        futures: List[Tuple[int, Any]] = []
+        # 处理已存在的输出文件
+        new_output_path = self.handle_existing_output_file(output_path)
+        if new_output_path is None:  # 用户选择取消
+            return
+        if new_output_path != output_path:  # 文件名已更改
+            self.output_path.set(new_output_path)
+            output_path = new_output_path
         
-        # 帧处理和写入的批处理大小
-        batch_size = 15  # 减小批处理大小，降低内存占用
+        # 检查输入输出是否相同
+        if os.path.abspath(self.input_path.get()) == os.path.abspath(output_path):
+            if not messagebox.askyesno("警告", "输入和输出文件相同，这将覆盖原文件。是否继续？"):
+                return
         
-        # 处理视频帧
-        frame_index = 0
-        last_progress = 0
+        # 禁用按钮
+        self.process_btn.config(state=tk.DISABLED)
+        self.preview_btn.config(state=tk.DISABLED)
+        self.cancel_btn.config(state=tk.NORMAL)
+        self.processing = True
+        self.cancel_event.clear()
         
-        while True:
-            if self.cancel_event.is_set():
-                # 清理资源
-                executor.shutdown(wait=False)
-                cap.release()
-                out.release()
-                if os.path.exists(temp_video_path):
-                    try:
-                        os.remove(temp_video_path)
-                    except:
-                        pass
-                return None, None, None, None
-            
-            ret, frame = cap.read()
-            if not ret or frame_index >= total_frames_to_process:
-                break
-                
-            # 检查帧是否有效
-            if frame is None or not isinstance(frame, np.ndarray) or len(frame.shape) != 3:
-                self.log(f"警告: 无效帧 #{frame_index}，跳过处理")
-                failed_frames += 1
-                frame_index += 1
-                continue
-                
-            # 提交帧处理任务
-            future = executor.submit(self.process_frame, frame.copy())
-            futures.append((frame_index, future))
-            
-            # 按批处理和写入
-            if len(futures) >= batch_size or frame_index == total_frames_to_process - 1:
-                # 按顺序处理结果
-                for idx, future in sorted(futures, key=lambda x: x[0]):
-                    try:
-                        processed_frame, face_count = future.result()
-                        # 检查处理后的帧是否有效
-                        if processed_frame is not None and isinstance(processed_frame, np.ndarray) and len(processed_frame.shape) == 3:
-                            total_faces_detected += face_count
-                            out.write(processed_frame)
-                        else:
-                            self.log(f"警告: 处理后的帧 #{idx} 无效，使用原始帧")
-                            out.write(frame)  # 使用原始帧
-                            failed_frames += 1
-                    except Exception as e:
-                        self.log(f"处理帧 #{idx} 时出错: {str(e)}")
-                        failed_frames += 1
-                
-                # 更新进度
-                progress = int((frame_index / total_frames_to_process) * 100)
-                if progress > last_progress:
-                    self.update_progress(progress)
-                    last_progress = progress
-                
-                futures.clear()
-                
-            frame_index += 1
-            # 定期释放资源
-            if frame_index % 100 == 0:
-                self.root.update_idletasks()
+        # 在新线程中处理，避免UI冻结
+        self.process_thread = threading.Thread(target=self.process_file)
+        self.process_thread.start()
     
-        # 清理资源
-        executor.shutdown()
-        cap.release()
-        out.release()
-        
-        # 检查是否生成了有效视频
-        if os.path.exists(temp_video_path) and os.path.getsize(temp_video_path) < 1024:  # 小于1KB的视频视为无效
-            self.log("警告: 生成的临时视频文件过小，可能处理失败")
+    def start_preview(self) -> None:
+        """快速预览：取样少量帧按当前参数打码，在窗口中显示预览图"""
+        if not self.input_path.get():
+            messagebox.showerror("错误", "请选择输入文件")
+            return
+        self.process_btn.config(state=tk.DISABLED)
+        self.preview_btn.config(state=tk.DISABLED)
+        self.cancel_btn.config(state=tk.NORMAL)
+        self.processing = True
+        self.cancel_event.clear()
+        self.process_thread = threading.Thread(target=self.preview_file)
+        self.process_thread.start()
+    
+    def preview_file(self) -> None:
+        """生成预览图（在工作线程中运行）"""
+        preview_path = os.path.join(tempfile.gettempdir(), f"face_blur_preview_{generate_random_suffix()}.png")
+        try:
+            whitelist_dir = self.whitelist_dir.get() if self.whitelist_dir.get() else None
+            self.prepare_models(
+                whitelist_dir, self.similarity_threshold.get(), BLUR_TYPE_MAP[self.blur_type.get()],
+                self.blur_strength.get(), self.feather_radius.get(),
+                self.opacity.get(), self.mosaic_block_size.get())
+            duration = self.duration.get() if self.duration.get() > 0 else None
+            if self.preview_video(self.input_path.get(), preview_path, thumb_width=320,
+                                  start_time=self.start_time.get(), duration=duration):
+                self.events.post("call", lambda: self.show_preview_window(preview_path))
+        except Exception as e:
+            self.log(f"预览错误: {str(e)}")
+        finally:
+            self.processing = False
+            self.events.post("call", self.reset_controls)
+    
+    def show_preview_window(self, preview_path: str) -> None:
+        """在新窗口中显示预览图（主线程），图片读入后删除临时文件"""
+        try:
+            image = tk.PhotoImage(file=preview_path)
+        except tk.TclError as e:
+            self.log(f"无法显示预览图: {str(e)}")
+            return
+        finally:
             try:
-                os.remove(temp_video_path)
-                return None, None, None, None
-            except:
+                os.remove(preview_path)
+            except OSError:
                 pass
-        
-        # 统计与输出
-        elapsed_time = time.time() - process_start_time
-        fps_processing = total_frames_to_process / elapsed_time if elapsed_time > 0 else 0
-        
-        self.log("\n视频帧处理完成！")
-        self.log(f"临时视频已保存至: {temp_video_path}")
-        self.log(f"总处理时间: {elapsed_time:.2f} 秒")
-        self.log(f"平均处理速度: {fps_processing:.2f} 帧/秒")
-        self.log(f"共检测到人脸: {total_faces_detected}")
-        self.log(f"处理失败的帧: {failed_frames}")
-        self.log(f"白名单保留人脸: {len(self.whitelist_data['entries']) if self.whitelist_data else 0}")
-        
-        return temp_video_path, fps, width, height
+        window = tk.Toplevel(self.root)
+        window.title(f"预览 - {os.path.basename(self.input_path.get())}")
+        label = ttk.Label(window, image=image)
+        label.image = image  # 保留引用，避免图片被回收
+        label.pack()
     
-    def merge_audio_and_video(self, video_without_audio: str, original_video: str, output_path: str, 
-                            start_time: float = 0, duration: Optional[float] = None) -> bool:
-        """合并音频和视频，使用本地FFmpeg"""
-        self.log("\n开始合并音频和视频...")
+    def cancel_processing(self) -> None:
+        """取消处理"""
+        if messagebox.askyesno("确认", "确定要取消处理吗？"):
+            self.cancel_event.set()
+            self.log("正在取消处理...")
+            self.cancel_btn.config(state=tk.DISABLED)
+    
+    def process_file(self) -> None:
+        """处理文件的实际函数（在工作线程中运行，界面操作通过事件通道交给主线程）"""
+        file_type_label = self.file_type.get()
         try:
-            # 获取原始视频信息
-            cap = cv2.VideoCapture(original_video)
-            original_fps = cap.get(cv2.CAP_PROP_FPS)
-            original_duration = cap.get(cv2.CAP_PROP_FRAME_COUNT) / original_fps if original_fps > 0 else 0
-            cap.release()
+            # 获取参数，将中文打码类型转换为英文
+            input_path = self.input_path.get()
+            output_path = self.output_path.get()
+            whitelist_dir = self.whitelist_dir.get() if self.whitelist_dir.get() else None
+            file_type = FILE_TYPE_MAP[file_type_label]
             
-            # 计算音频提取的时间范围
-            audio_start = max(0, start_time)
-            audio_end = min(original_duration, start_time + (duration if duration else float('inf')))
-            audio_duration = audio_end - audio_start
+            # 根据文件类型调用不同的处理函数
+            self.log(f"开始处理{file_type_label}: {input_path}")
+            self.log(f"输出路径: {output_path}")
             
-            # 创建临时文件 - 使用更稳定的方式
-            temp_dir = tempfile.gettempdir()
-            temp_audio_name = f"temp_audio_{generate_random_suffix()}.aac"
-            temp_audio = os.path.join(temp_dir, temp_audio_name)
+            blur_type = BLUR_TYPE_MAP[self.blur_type.get()]  # 转换为英文值
             
-            # 提取音频，使用本地FFmpeg
-            cmd_extract = [
-                self.ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
-                '-ss', str(audio_start),
-                '-t', str(audio_duration),
-                '-i', original_video,
-                '-vn', '-c:a', 'aac', '-b:a', '192k', temp_audio
-            ]
-            result = subprocess.run(cmd_extract, check=False, capture_output=True, text=True)
-            if result.returncode != 0:
-                self.log(f"FFmpeg提取音频错误: {result.stderr}")
-                # 尝试不带时间参数提取整个音频
-                self.log("尝试提取整个音频...")
-                cmd_extract = [
-                    self.ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
-                    '-i', original_video,
-                    '-vn', '-c:a', 'aac', '-b:a', '192k', temp_audio
-                ]
-                result = subprocess.run(cmd_extract, check=False, capture_output=True, text=True)
-                if result.returncode != 0:
-                    self.log(f"FFmpeg提取音频再次失败: {result.stderr}")
-                    raise Exception("无法提取音频")
+            # 初始化模型、白名单和打码参数
+            self.prepare_models(
+                whitelist_dir, self.similarity_threshold.get(), blur_type,
+                self.blur_strength.get(), self.feather_radius.get(),
+                self.opacity.get(), self.mosaic_block_size.get())
             
-            # 合并音视频
-            cmd_merge = [
-                self.ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
-                '-i', video_without_audio, 
-                '-i', temp_audio,
-                '-c:v', 'copy',  # 直接复制视频流，不重新编码
-                '-c:a', 'aac',
-                '-strict', 'experimental',
-                output_path
-            ]
-            result = subprocess.run(cmd_merge, check=False, capture_output=True, text=True)
-            if result.returncode != 0:
-                self.log(f"FFmpeg合并错误: {result.stderr}")
-                # 尝试重新编码视频
-                self.log("尝试重新编码视频和音频...")
-                cmd_merge = [
-                    self.ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
-                    '-i', video_without_audio, 
-                    '-i', temp_audio,
-                    '-c:v', 'libx264',
-                    '-c:a', 'aac',
-                    '-strict', 'experimental',
-                    output_path
-                ]
-                result = subprocess.run(cmd_merge, check=True, capture_output=True, text=True)
-                
-            self.log(f"音视频合并成功，输出至: {output_path}")
-            return True
+            start_time = self.start_time.get()
+            duration = self.duration.get() if self.duration.get() > 0 else None
+            success = self.run_file(file_type, input_path, output_path, start_time, duration)
             
+            if success and not self.cancel_event.is_set():
+                self.log("处理完成！")
+                self.update_progress(100)
+                
+                def on_success() -> None:
+                    messagebox.showinfo("成功", f"{file_type_label}处理完成，已保存至:\n{output_path}")
+                    # 添加打开文件按钮功能
+                    if messagebox.askyesno("完成", "是否打开输出文件？"):
+                        self.open_output_file(output_path)
+                self.events.post("call", on_success)
+            elif self.cancel_event.is_set():
+                self.log("处理已取消")
+            else:
+                self.log("处理失败")
+                self.events.post("call", lambda: messagebox.showerror(
+                    "失败", f"{file_type_label}处理过程中发生错误"))
+                
         except Exception as e:
-            self.log(f"FFmpeg合并失败: {str(e)}")
-            self.log("尝试不使用FFmpeg直接保存...")
-            
-            # 尝试直接复制（无音频）
-            try:
-                shutil.copy(video_without_audio, output_path)
-                self.log(f"已保存无音频的处理结果至: {output_path}")
-                return True
-            except Exception as e2:
-                self.log(f"保存无音频视频失败: {str(e2)}")
-                return False
+            self.log(f"处理错误: {str(e)}")
+            error_message = str(e)
+            self.events.post("call", lambda: messagebox.showerror(
+                "错误", f"处理过程中发生错误:\n{error_message}"))
         finally:
-            if 'temp_audio' in locals() and os.path.exists(temp_audio):
-                try:
-                    os.remove(temp_audio)
-                except:
-                    pass
+            # 恢复UI状态
+            self.processing = False
+            self.events.post("call", self.reset_controls)
     
-    def blur_faces_in_video(self, input_path: str, output_path: str, start_time: float = 0, duration: Optional[float] = None) -> bool:
-        """对视频中的人脸进行打码处理"""
-        # 第一步：处理视频帧（无音频）
-        temp_video_path, fps, width, height = self.process_video_frames(
-            input_path, start_time, duration
-        )
-        
-        if not temp_video_path or self.cancel_event.is_set():
-            return False
-        
-        # 第二步：合并音频和视频
+    def reset_controls(self) -> None:
+        """恢复按钮和进度条状态（主线程）"""
+        self.process_btn.config(state=tk.NORMAL)
+        self.cancel_btn.config(state=tk.DISABLED)
+        self.progress_var.set(0)
+        self.on_file_type_change()
+    
+    def open_output_file(self, file_path: str) -> None:
+        """打开输出文件"""
         try:
-            success = self.merge_audio_and_video(temp_video_path, input_path, output_path, start_time, duration)
+            if sys.platform.startswith('win'):
+                os.startfile(file_path)  # type: ignore
+            elif sys.platform.startswith('darwin'):
+                subprocess.run(['open', file_path])
+            else:
+                subprocess.run(['xdg-open', file_path])
         except Exception as e:
-            self.log(f"合并音频和视频时出错: {str(e)}")
-            # 即使合并失败，也保留处理后的无音频视频作为备份
+            self.log(f"无法打开文件: {str(e)}")
+
+def detect_file_type(path: str) -> Optional[str]:
+    """根据扩展名判断文件类型"""
+    ext = os.path.splitext(path)[1].lower()
+    for file_type, patterns in FILE_EXTENSIONS.items():
+        if f"*{ext}" in patterns:
+            return file_type
+    return None
+
+def add_whitelist_arguments(parser: argparse.ArgumentParser) -> None:
+    """添加白名单参数（默认值与GUI一致）"""
+    parser.add_argument("--whitelist", help="人脸白名单目录")
+    parser.add_argument("--threshold", type=float, default=0.5, help="人脸相似度阈值(0.1-0.9)")
+
+def add_face_filter_arguments(parser: argparse.ArgumentParser) -> None:
+    """添加人脸过滤参数（在识别之前过滤，被过滤的人脸不打码）"""
+    parser.add_argument("--min-face-size", type=float, default=0,
+                        help="人脸框短边下限：不小于1为像素，小于1为占画面短边的比例（0表示不限制）")
+    parser.add_argument("--min-score", type=float, default=0.0, help="检测置信度下限（0表示使用模型默认阈值）")
+    parser.add_argument("--max-faces", type=int, default=0, help="每帧最多打码的人脸数，优先保留大的人脸（0表示不限制）")
+
+def add_blur_arguments(parser: argparse.ArgumentParser) -> None:
+    """添加打码参数（默认值与GUI一致）"""
+    parser.add_argument("--blur-type", choices=list(BLUR_TYPE_MAP.values()), default="circle", help="打码类型")
+    parser.add_argument("--blur-strength", type=int, default=50, help="模糊强度(5-100)")
+    parser.add_argument("--mosaic-block-size", type=int, default=15, help="马赛克块大小(5-50)")
+    parser.add_argument("--feather-radius", type=int, default=8, help="羽化半径(0-20)")
+    parser.add_argument("--opacity", type=float, default=0.95, help="不透明度(0.1-1.0)")
+
+def create_cli_engine(args: argparse.Namespace, events: EventChannel, load_models: bool = True) -> FaceBlurEngine:
+    """创建命令行使用的处理引擎并加载模型；load_models为False时只预计算打码参数。
+    
+    参数中有sessions时用作会话池的推理实例数，有人脸过滤参数时设置过滤条件。
+    """
+    engine = FaceBlurEngine(get_resource_path(".insightface"),
+                            get_resource_path(os.path.join("ffmpeg", "ffmpeg.exe")), events)
+    engine.session_pool_size = getattr(args, "sessions", None)
+    if hasattr(args, "min_face_size"):
+        engine.face_filter.update({
+            "min_face_size": args.min_face_size,
+            "min_score": args.min_score,
+            "max_faces": args.max_faces,
+        })
+    if not load_models:
+        engine.precompute_image_processing_params(args.blur_type, args.blur_strength, args.feather_radius,
+                                                  args.opacity, args.mosaic_block_size)
+        return engine
+    engine.prepare_models(args.whitelist, args.threshold, args.blur_type, args.blur_strength,
+                          args.feather_radius, args.opacity, args.mosaic_block_size)
+    return engine
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    """命令行参数定义（不带参数启动时进入GUI）"""
+    parser = argparse.ArgumentParser(prog="face-blur", description="人脸打码工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    process = subparsers.add_parser("process", help="处理单个视频/图片/Word/PDF文件")
+    process.add_argument("input", help="输入文件")
+    process.add_argument("output", help="输出文件")
+    process.add_argument("--type", choices=list(FILE_EXTENSIONS.keys()), help="文件类型（默认按扩展名判断）")
+    process.add_argument("--start-time", type=float, default=0, help="视频开始时间(秒)")
+    process.add_argument("--duration", type=float, default=0, help="视频处理时长(秒，0表示全部)")
+    process.add_argument("--word-mode", choices=["zip", "docx"], default="zip",
+                         help="Word处理方式：zip直接处理压缩包（默认），docx通过python-docx加载")
+    process.add_argument("--no-prefilter", action="store_true", help="Word/PDF中的所有图片都进行人脸检测")
+    process.add_argument("--min-image-size", type=int, default=PREFILTER_DEFAULTS["min_image_size"],
+                         help="预筛选：宽或高小于该像素数的图片跳过检测")
+    process.add_argument("--min-colors", type=int, default=PREFILTER_DEFAULTS["min_colors"],
+                         help="预筛选：缩略图颜色数少于该值的图片跳过检测（0表示不检查）")
+    process.add_argument("--min-entropy", type=float, default=PREFILTER_DEFAULTS["min_entropy"],
+                         help="预筛选：缩略图信息熵低于该值的图片跳过检测（0表示不检查）")
+    process.add_argument("--skip-bilevel", action="store_true", help="预筛选：跳过PDF中的1位图（扫描线稿/蒙版）")
+    process.add_argument("--cache-dir", default=os.path.join(get_user_cache_dir(), "results"),
+                         help="图片/Word/PDF结果缓存目录")
+    process.add_argument("--cache-size", type=int, default=RESULT_CACHE_DEFAULT_SIZE_MB,
+                         help="结果缓存容量上限(MB)，超出后淘汰最久未使用的结果")
+    process.add_argument("--no-cache", action="store_true", help="不读取也不写入结果缓存")
+    process.add_argument("--windowed", choices=["auto", "on", "off"], default="auto",
+                         help="超大图片按窗口分块处理（auto: 超过6400万像素时启用）")
+    process.add_argument("--window-size", type=int, default=IMAGE_WINDOW_SIZE, help="分块检测的窗口边长(像素)")
+    process.add_argument("--sidecar", help="处理视频时同时保存人脸轨迹文件(.npz)，供render重新打码")
+    process.add_argument("--smart", action="store_true",
+                         help="视频智能渲染：只重新编码包含人脸的GOP，其余直接复制（H.264/HEVC）")
+    process.add_argument("--yuv", action="store_true",
+                         help="视频在yuv420p平面上解码、打码和编码，不转换整帧颜色空间（需要FFmpeg）")
+    process.add_argument("--video-workers", type=int, default=0,
+                         help="视频处理的进程数（大于1时各进程独立加载模型，帧通过共享内存传递；默认在当前进程内用线程处理）")
+    process.add_argument("--reuse-frames", choices=VIDEO_REUSE_MODES, default="exact",
+                         help="视频重复帧复用（exact: 与前一帧完全相同时复用结果；near: 近似相同时还复用人脸框）")
+    process.add_argument("--resume", action="store_true",
+                         help="视频分段处理并记录进度，中断后重新运行相同命令从已完成的段继续")
+    process.add_argument("--job-dir", default=os.path.join(get_user_cache_dir(), "jobs"),
+                         help="断点续传任务的存放目录")
+    process.add_argument("--segment-seconds", type=float, default=VIDEO_JOB_SEGMENT_SECONDS,
+                         help="断点续传时每段的时长(秒)")
+    add_whitelist_arguments(process)
+    add_face_filter_arguments(process)
+    add_blur_arguments(process)
+    
+    analyze = subparsers.add_parser("analyze", help="视频分析阶段：只检测人脸并保存轨迹文件(.npz)")
+    analyze.add_argument("input", help="输入视频")
+    analyze.add_argument("sidecar", help="输出的人脸轨迹文件(.npz)")
+    analyze.add_argument("--start-time", type=float, default=0, help="开始时间(秒)")
+    analyze.add_argument("--duration", type=float, default=0, help="处理时长(秒，0表示全部)")
+    add_whitelist_arguments(analyze)
+    add_face_filter_arguments(analyze)
+    add_blur_arguments(analyze)
+    
+    render = subparsers.add_parser("render", help="视频渲染阶段：按轨迹文件打码，不运行人脸检测")
+    render.add_argument("input", help="输入视频")
+    render.add_argument("sidecar", help="人脸轨迹文件：analyze生成的.npz，或外部工具导出的CSV"
+                                       "（列为frame,x1,y1,x2,y2，可选score,track_id,whitelisted）")
+    render.add_argument("output", help="输出视频")
+    render.add_argument("--start-time", type=float, help="开始时间(秒，默认使用轨迹文件记录的区间)")
+    render.add_argument("--duration", type=float, default=0, help="处理时长(秒，0表示全部)")
+    render.add_argument("--smart", action="store_true",
+                        help="只重新编码包含人脸的GOP，其余直接复制（H.264/HEVC）")
+    add_blur_arguments(render)
+    
+    batch = subparsers.add_parser("batch", help="批量处理目录中的图片，输出保持相对路径")
+    batch.add_argument("input", help="输入目录")
+    batch.add_argument("output", help="输出目录")
+    batch.add_argument("--list", help="只处理该文件中列出的图片（每行一个路径，相对路径以输入目录为基准）")
+    batch.add_argument("--force", action="store_true", help="重新处理所有图片（默认跳过输出已是最新的图片）")
+    batch.add_argument("--sessions", type=int, help="并行检测的推理实例数（默认按CPU核心数，最多4个）")
+    batch.add_argument("--cache-dir", default=os.path.join(get_user_cache_dir(), "results"), help="结果缓存目录")
+    batch.add_argument("--no-cache", action="store_true", help="不读取也不写入结果缓存")
+    add_whitelist_arguments(batch)
+    add_face_filter_arguments(batch)
+    add_blur_arguments(batch)
+    
+    stream = subparsers.add_parser("stream", help="实时流模式：读取摄像头或流地址，打码后输出到流或文件")
+    stream.add_argument("source", help="视频源：摄像头编号、流地址（如udp://@:1234）或本地文件（按帧率模拟实时）")
+    stream.add_argument("output", help="输出：流地址（如udp://127.0.0.1:1235）或文件")
+    stream.add_argument("--input-format", help="视频源的FFmpeg输入格式，如lavfi（配合testsrc测试）")
+    stream.add_argument("--output-format", help="输出的封装格式（默认按协议或扩展名判断）")
+    stream.add_argument("--latency", type=float, default=STREAM_LATENCY_MS_DEFAULT,
+                        help="端到端延迟目标(毫秒)，超过时减少检测、丢弃过期的帧")
+    stream.add_argument("--box-padding", type=float, default=0.15,
+                        help="人脸框向外扩大的比例，覆盖两次检测之间人脸的移动")
+    stream.add_argument("--duration", type=float, default=0, help="运行时长(秒，0表示直到视频源结束或按Ctrl+C)")
+    add_whitelist_arguments(stream)
+    add_face_filter_arguments(stream)
+    add_blur_arguments(stream)
+    
+    pipe = subparsers.add_parser("pipe", help="管道模式：从stdin读取原始帧，打码后写到stdout（日志输出到stderr）")
+    pipe.add_argument("--format", choices=["rawvideo", "y4m"], default="rawvideo", help="输入输出格式")
+    pipe.add_argument("--size", help="rawvideo的帧尺寸，如1920x1080（y4m从文件头读取）")
+    pipe.add_argument("--pix-fmt", choices=list(PIPE_PIX_FMTS), default="bgr24", help="rawvideo的像素格式")
+    add_whitelist_arguments(pipe)
+    add_face_filter_arguments(pipe)
+    add_blur_arguments(pipe)
+    
+    preview = subparsers.add_parser("preview", help="快速预览：视频中均匀取样少量帧打码，输出预览图或低帧率预览视频")
+    preview.add_argument("input", help="输入视频")
+    preview.add_argument("output", help="输出：图片（如preview.png，拼成预览图）或.mp4视频（低帧率预览视频）")
+    preview.add_argument("--samples", type=int, default=PREVIEW_SAMPLES_DEFAULT, help="取样帧数")
+    preview.add_argument("--width", type=int, default=PREVIEW_THUMB_WIDTH, help="缩略图宽度(像素)")
+    preview.add_argument("--start-time", type=float, default=0, help="取样区间的开始时间(秒)")
+    preview.add_argument("--duration", type=float, default=0, help="取样区间的时长(秒，0表示到视频结尾)")
+    add_whitelist_arguments(preview)
+    add_face_filter_arguments(preview)
+    add_blur_arguments(preview)
+    
+    calibrate = subparsers.add_parser("calibrate", help="硬件调优：测量本机各推理配置的吞吐量，保存最佳配置供之后的任务自动使用")
+    calibrate.add_argument("--input", default=get_resource_path(os.path.join("example", "input.mp4")),
+                           help="用于测试的视频或图片（不存在时使用合成画面）")
+    calibrate.add_argument("--frames", type=int, default=60, help="每种配置测试的帧数")
+    calibrate.add_argument("--target-fps", type=float,
+                           help="目标吞吐量(帧/秒)：达不到时依次缩小检测尺寸（默认只追求最大吞吐量，不改变检测尺寸）")
+    calibrate.add_argument("--profile", default=default_hardware_profile_path(), help="硬件配置的保存路径")
+    calibrate.add_argument("--cpu", action="store_true", help="强制使用CPU推理")
+    calibrate.add_argument("--reset", action="store_true", help="删除已保存的硬件配置，恢复默认设置")
+    
+    daemon = subparsers.add_parser("daemon", help="守护进程模式：监视收件目录，自动排队处理放入的文件，提供本地HTTP状态接口")
+    daemon.add_argument("--watch", nargs="+", action="append", required=True, metavar="DIR",
+                        help="收件目录 输出目录 [优先级]，可重复指定多个；优先级高的目录先处理（默认0）")
+    daemon.add_argument("--queue", default=os.path.join(get_user_cache_dir(), "daemon", "queue.sqlite"),
+                        help="任务队列数据库路径")
+    daemon.add_argument("--jobs", type=int, default=2, help="同时处理的任务数（共享同一组推理实例）")
+    daemon.add_argument("--sessions", type=int, help="推理实例数（默认使用硬件配置或按CPU核心数，最多4个）")
+    daemon.add_argument("--poll-interval", type=float, default=DAEMON_POLL_INTERVAL, help="扫描收件目录的间隔(秒)")
+    daemon.add_argument("--max-attempts", type=int, default=DAEMON_MAX_ATTEMPTS, help="每个任务的最大尝试次数")
+    daemon.add_argument("--retry-delay", type=float, default=DAEMON_RETRY_DELAY,
+                        help="首次重试的延迟(秒)，之后每次加倍")
+    daemon.add_argument("--host", default="127.0.0.1", help="状态接口的监听地址")
+    daemon.add_argument("--port", type=int, default=DAEMON_HTTP_PORT, help="状态接口的端口")
+    daemon.add_argument("--no-http", action="store_true", help="不启动状态接口")
+    daemon.add_argument("--once", action="store_true", help="处理完收件目录中现有的文件后退出")
+    daemon.add_argument("--cache-dir", default=os.path.join(get_user_cache_dir(), "results"), help="结果缓存目录")
+    daemon.add_argument("--no-cache", action="store_true", help="不读取也不写入结果缓存")
+    add_whitelist_arguments(daemon)
+    add_face_filter_arguments(daemon)
+    add_blur_arguments(daemon)
+    
+    bench = subparsers.add_parser("benchmark", help="测试推理吞吐量随worker数量的变化")
+    bench.add_argument("--input", default=get_resource_path(os.path.join("example", "input.mp4")),
+                       help="用于测试的视频或图片")
+    bench.add_argument("--workers", default="1,2,4", help="逗号分隔的worker数量列表")
+    bench.add_argument("--frames", type=int, default=120, help="每轮测试的帧数")
+    bench.add_argument("--cpu", action="store_true", help="强制使用CPU推理")
+    return parser
+
+def run_cli(argv: List[str]) -> int:
+    """命令行入口"""
+    args = build_arg_parser().parse_args(argv)
+    insightface_dir = get_resource_path(".insightface")
+    
+    if args.command == "process":
+        file_type = args.type or detect_file_type(args.input)
+        if file_type is None:
+            print(f"无法判断文件类型，请使用 --type 指定: {args.input}")
+            return 2
+        events = EventChannel()
+        with ConsoleEventLogger(events):
             try:
-                shutil.copy(temp_video_path, output_path)
-                self.log(f"已保存无音频的处理结果至: {output_path}")
-                success = True
-            except:
+                engine = create_cli_engine(args, events)
+                engine.word_mode = args.word_mode
+                engine.prefilter.update({
+                    "enabled": not args.no_prefilter,
+                    "min_image_size": args.min_image_size,
+                    "min_colors": args.min_colors,
+                    "min_entropy": args.min_entropy,
+                    "skip_bilevel": args.skip_bilevel,
+                })
+                engine.cache_dir = None if args.no_cache else args.cache_dir
+                engine.cache_size_mb = args.cache_size
+                engine.video_sidecar_path = args.sidecar
+                engine.smart_render = args.smart
+                engine.yuv_native = args.yuv
+                engine.image_windowed = {"auto": None, "on": True, "off": False}[args.windowed]
+                engine.image_window_size = args.window_size
+                engine.video_workers = args.video_workers or None
+                engine.video_reuse = args.reuse_frames
+                engine.resumable = args.resume
+                engine.video_jobs_dir = args.job_dir
+                engine.video_segment_seconds = args.segment_seconds
+                success = engine.run_file(file_type, args.input, args.output,
+                                          args.start_time, args.duration if args.duration > 0 else None)
+            except Exception as e:
+                events.post("log", f"处理错误: {str(e)}")
                 success = False
-        finally:
-            # 清理临时文件
-            if os.path.exists(temp_video_path):
-                try:
-                    os.remove(temp_video_path)
-                except:
-                    self.log(f"警告: 无法删除临时文件 {temp_video_path}")
-        
-        return success
+            events.post("log", "处理完成！" if success else "处理失败")
+        return 0 if success else 1
+    
+    if args.command in ("analyze", "render"):
+        events = EventChannel()
+        with ConsoleEventLogger(events):
+            try:
+                if args.command == "analyze":
+                    engine = create_cli_engine(args, events)
+                    success = engine.analyze_video(args.input, args.sidecar, args.start_time,
+                                                   args.duration if args.duration > 0 else None)
+                else:
+                    engine = create_cli_engine(args, events, load_models=False)
+                    engine.smart_render = args.smart
+                    success = engine.render_video(args.input, args.sidecar, args.output, args.start_time,
+                                                  args.duration if args.duration > 0 else None)
+            except Exception as e:
+                events.post("log", f"处理错误: {str(e)}")
+                success = False
+            events.post("log", "处理完成！" if success else "处理失败")
+        return 0 if success else 1
+    
+    if args.command == "batch":
+        events = EventChannel()
+        with ConsoleEventLogger(events):
+            try:
+                engine = create_cli_engine(args, events)
+                engine.cache_dir = None if args.no_cache else args.cache_dir
+                engine.open_result_cache()
+                success = engine.blur_faces_in_directory(args.input, args.output, args.list, args.force)
+                if engine.cache is not None and engine.cache.hits + engine.cache.misses > 0:
+                    events.post("log", f"结果缓存: 命中 {engine.cache.hits} 张，未命中 {engine.cache.misses} 张")
+            except Exception as e:
+                events.post("log", f"处理错误: {str(e)}")
+                success = False
+        return 0 if success else 1
+    
+    if args.command == "stream":
+        events = EventChannel()
+        with ConsoleEventLogger(events):
+            try:
+                engine = create_cli_engine(args, events)
+                success = engine.stream_video(args.source, args.output, args.input_format, args.output_format,
+                                              args.latency, args.box_padding,
+                                              args.duration if args.duration > 0 else None)
+            except Exception as e:
+                events.post("log", f"处理错误: {str(e)}")
+                success = False
+        return 0 if success else 1
+    
+    if args.command == "pipe":
+        width = height = 0
+        if args.format == "rawvideo":
+            match = re.fullmatch(r"(\d+)x(\d+)", args.size or "")
+            if not match:
+                print("rawvideo格式需要用 --size 指定帧尺寸，如 --size 1920x1080", file=sys.stderr)
+                return 2
+            width, height = int(match.group(1)), int(match.group(2))
+        # stdout只用于输出帧，模型加载等过程中的打印全部转到stderr
+        frame_output = sys.stdout.buffer
+        sys.stdout = sys.stderr
+        events = EventChannel()
+        with ConsoleEventLogger(events, output=sys.stderr):
+            try:
+                engine = create_cli_engine(args, events)
+                success = engine.process_raw_pipe(sys.stdin.buffer, frame_output, args.format,
+                                                  width, height, args.pix_fmt)
+            except Exception as e:
+                events.post("log", f"处理错误: {str(e)}")
+                success = False
+        return 0 if success else 1
+    
+    if args.command == "preview":
+        events = EventChannel()
+        with ConsoleEventLogger(events):
+            try:
+                engine = create_cli_engine(args, events)
+                success = engine.preview_video(args.input, args.output, args.samples, args.width, args.start_time,
+                                               args.duration if args.duration > 0 else None)
+            except Exception as e:
+                events.post("log", f"处理错误: {str(e)}")
+                success = False
+        return 0 if success else 1
+    
+    if args.command == "daemon":
+        watches = []
+        for spec in args.watch:
+            if len(spec) not in (2, 3):
+                print(f"--watch 需要 收件目录 输出目录 [优先级]: {' '.join(spec)}")
+                return 2
+            if not os.path.isdir(spec[0]):
+                print(f"收件目录不存在: {spec[0]}")
+                return 2
+            watches.append(WatchFolder(spec[0], spec[1], int(spec[2]) if len(spec) == 3 else 0))
+        events = EventChannel()
+        with ConsoleEventLogger(events):
+            try:
+                engine = create_cli_engine(args, events)
+                engine.cache_dir = None if args.no_cache else args.cache_dir
+                job_queue = DaemonJobQueue(args.queue)
+            except Exception as e:
+                events.post("log", f"启动失败: {str(e)}")
+                return 1
+            daemon = FaceBlurDaemon(engine, job_queue, watches, args.jobs, args.poll_interval,
+                                    args.max_attempts, args.retry_delay)
+            try:
+                daemon.run(args.host, None if args.no_http else args.port, args.once)
+            finally:
+                job_queue.close()
+        return 0
+    
+    if args.command == "calibrate":
+        if args.reset:
+            if os.path.exists(args.profile):
+                os.remove(args.profile)
+                print(f"已删除硬件配置: {args.profile}")
+            return 0
+        available = ort.get_available_providers()
+        providers = ['CUDAExecutionProvider'] if 'CUDAExecutionProvider' in available and not args.cpu \
+            else ['CPUExecutionProvider']
+        if os.path.exists(args.input):
+            frames = load_benchmark_frames(args.input, args.frames)
+        else:
+            print(f"未找到测试输入 {args.input}，使用合成画面（不含人脸，识别耗时不计入）")
+            rng = np.random.default_rng(0)
+            frames = [rng.integers(0, 256, (720, 1280, 3), dtype=np.uint8) for _ in range(args.frames)]
+        print(f"硬件调优: {len(frames)} 帧，提供者: {providers}，CPU核心数: {os.cpu_count()}")
+        profile = calibrate_hardware(insightface_dir, providers, frames, args.target_fps)
+        save_hardware_profile(args.profile, profile)
+        print(f"最佳配置: 推理实例 {profile['session_pool_size']}，intra-op线程 {profile['intra_op_threads'] or '默认'}，"
+              f"检测尺寸 {profile['det_size'][0]}，吞吐量 {profile['fps']:.2f} 帧/秒")
+        print(f"硬件配置已保存至: {args.profile}（之后的任务自动使用）")
+        return 0
+    
+    if args.command == "benchmark":
+        available = ort.get_available_providers()
+        use_gpu = 'CUDAExecutionProvider' in available and not args.cpu
+        providers = ['CUDAExecutionProvider'] if use_gpu else ['CPUExecutionProvider']
+        worker_counts = [int(w) for w in args.workers.split(",") if w.strip()]
+        frames = load_benchmark_frames(args.input, args.frames)
+        print(f"基准测试: {args.input}，{len(frames)} 帧，提供者: {providers}，CPU核心数: {os.cpu_count()}")
+        benchmark_session_pool(insightface_dir, providers, frames, worker_counts)
+    return 0
 
 def main() -> None:
+    # 打包后的程序启动多进程worker时需要
+    multiprocessing.freeze_support()
     # 确保中文显示正常
     os.environ["PYTHONUTF8"] = "1"
     
+    # 带参数时使用命令行模式
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
+    
     # 启动GUI
     root = tk.Tk()
     app = FaceBlurApp(root)
@@ -0,0 +1,117 @@
+"""测试公共夹具：用按颜色识别人脸的假模型代替buffalo_l，不需要下载模型。
+
+假检测模型把纯红(0,0,255)和纯绿(0,255,0)的方块当作人脸；假识别模型的特征为对齐后人脸图的
+平均颜色，白名单设为红色特征，因此红色人脸是白名单人脸，绿色人脸需要打码。
+"""
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+RED = (0, 0, 255)
+GREEN = (0, 255, 0)
+
+
+class FakeDetector:
+    def __init__(self):
+        self.calls = 0
+
+    def detect(self, img, input_size=None, max_num=0, metric="default"):
+        self.calls += 1
+        boxes, kpss = [], []
+        for color in (RED, GREEN):
+            mask = cv2.inRange(img, color, color)
+            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            for contour in contours:
+                x, y, w, h = cv2.boundingRect(contour)
+                if w < 8 or h < 8:
+                    continue
+                boxes.append([x, y, x + w, y + h, 0.9])
+                kpss.append([[x + w * 0.35, y + h * 0.4], [x + w * 0.65, y + h * 0.4], [x + w * 0.5, y + h * 0.55],
+                             [x + w * 0.38, y + h * 0.7], [x + w * 0.62, y + h * 0.7]])
+        return (np.array(boxes, dtype=np.float32).reshape(-1, 5),
+                np.array(kpss, dtype=np.float32).reshape(-1, 5, 2))
+
+
+class FakeRecognizer:
+    input_size = (112, 112)
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def get_feat(self, imgs):
+        if not isinstance(imgs, list):
+            imgs = [imgs]
+        self.batch_sizes.append(len(imgs))
+        return np.array([img.reshape(-1, 3).mean(axis=0) for img in imgs], dtype=np.float32)
+
+    def get(self, img, face):
+        from insightface.utils import face_align
+        aimg = face_align.norm_crop(img, landmark=face.kps, image_size=self.input_size[0])
+        face.embedding = self.get_feat(aimg).flatten()
+        return face.embedding
+
+
+class FakeFaceAnalysis:
+    instances = []
+
+    def __init__(self):
+        self.det_model = FakeDetector()
+        self.models = {"detection": self.det_model, "recognition": FakeRecognizer()}
+        FakeFaceAnalysis.instances.append(self)
+
+
+def face_image(width=320, height=240, red=(), green=(), seed=0):
+    """噪声背景上画红色（白名单）和绿色（需打码）的人脸方块，方块为(x1, y1, x2, y2)。
+    
+    方块中央留一小块噪声，打码后像素一定会变化。
+    """
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 200, (height, width, 3), dtype=np.uint8)
+    for color, boxes in ((RED, red), (GREEN, green)):
+        for (x1, y1, x2, y2) in boxes:
+            patch = img[y1:y2, x1:x2].copy()
+            img[y1:y2, x1:x2] = color
+            h, w = y2 - y1, x2 - x1
+            img[y1 + h * 2 // 5:y1 + h * 3 // 5, x1 + w * 2 // 5:x1 + w * 3 // 5] = \
+                patch[h * 2 // 5:h * 3 // 5, w * 2 // 5:w * 3 // 5]
+    return img
+
+
+@pytest.fixture
+def fake_models(monkeypatch):
+    FakeFaceAnalysis.instances = []
+    monkeypatch.setattr(main, "create_face_analysis", lambda *args, **kwargs: FakeFaceAnalysis())
+    return FakeFaceAnalysis
+
+
+@pytest.fixture
+def engine(fake_models, tmp_path):
+    """已加载假模型的引擎：两个推理实例，不使用结果缓存和硬件配置，红色人脸在白名单中"""
+    engine = main.FaceBlurEngine(str(tmp_path / "insightface"), "")
+    engine.hardware_profile_path = None
+    engine.session_pool_size = 2
+    engine.cache_dir = None
+    engine.pdf_workers = 1
+    engine.prepare_models(None, 0.5, "mosaic", 51, 0, 1.0, 8)
+    engine.whitelist_data = {"matrix": np.array([[0.0, 0.0, 1.0]], dtype=np.float32), "entries": []}
+    engine.cache_context = engine.result_cache_context()
+    return engine
+
+
+@pytest.fixture
+def tolerant_detector(monkeypatch):
+    """有损编码（JPEG、YUV420）后颜色不再是纯色，检测时放宽颜色范围"""
+    in_range = cv2.inRange
+
+    def tolerant(img, lower, upper):
+        return in_range(img, tuple(max(0, c - 60) for c in lower), tuple(min(255, c + 60) for c in upper))
+
+    monkeypatch.setattr(cv2, "inRange", tolerant)
+    return FakeDetector
@@ -0,0 +1,96 @@
+import io
+
+import numpy as np
+import pytest
+
+import main
+
+PILImage = pytest.importorskip("PIL.Image")
+
+
+def ramp(channel, height=40):
+    """某一通道从0到255渐变的画面"""
+    rgb = np.zeros((height, 256, 3), dtype=np.uint8)
+    rgb[:, :, channel] = np.arange(256, dtype=np.uint8)[None, :]
+    return rgb
+
+
+def make_gif(frames, **options):
+    images = [PILImage.fromarray(frame).quantize(256, dither=PILImage.Dither.NONE) if frame.shape[2] == 3
+              else PILImage.fromarray(frame) for frame in frames]
+    buffer = io.BytesIO()
+    images[0].save(buffer, format="GIF", save_all=True, append_images=images[1:], duration=80, loop=0, **options)
+    return buffer.getvalue()
+
+
+def round_trip(data):
+    frames, durations, params = main.read_animation_frames(data)
+    output = main.encode_animation(frames, durations, params, ".gif")
+    return frames, main.read_animation_frames(output)
+
+
+def test_frames_with_local_palettes_keep_exact_colors():
+    # 两帧各自使用256色的局部调色板（红色渐变、蓝色渐变）
+    frames, (output, durations, params) = round_trip(make_gif([ramp(0), ramp(2)]))
+    for original, written in zip(frames, output):
+        np.testing.assert_array_equal(original, written)
+    assert durations == [80, 80]
+    assert params["loop"] == 0
+
+
+def test_transparent_pixels_stay_transparent():
+    frames = []
+    for channel in (0, 1):
+        rgba = np.dstack([ramp(channel)[:, ::2].repeat(2, axis=1), np.full((40, 256), 255, np.uint8)])
+        rgba[:10, :, 3] = 0
+        indexed = PILImage.fromarray(rgba[:, :, :3]).quantize(255, dither=PILImage.Dither.NONE)
+        indices = np.array(indexed)
+        indices[:10] = 255
+        image = PILImage.fromarray(indices, "P")
+        image.putpalette(indexed.getpalette()[:255 * 3] + [0, 0, 0])
+        image.info["transparency"] = 255
+        frames.append(image)
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format="GIF", save_all=True, append_images=frames[1:], transparency=255, disposal=2)
+
+    original, (output, _, params) = round_trip(buffer.getvalue())
+    assert params["transparency"] == main.GIF_TRANSPARENT_INDEX
+    for source, written in zip(original, output):
+        assert (written[:10, :, 3] == 0).all()
+        np.testing.assert_array_equal(source[10:], written[10:])
+
+
+def test_frames_with_too_many_colors_fall_back_to_adaptive_palette():
+    params = {"format": "GIF", "transparency": None, "palettes": [None]}
+    rng = np.random.default_rng(0)
+    frame = np.dstack([rng.integers(0, 256, (64, 64, 3), dtype=np.uint8), np.full((64, 64), 255, np.uint8)])
+    output = main.encode_animation([frame, frame], [50, 50], dict(params, palettes=[None, None]), ".gif")
+    decoded, _, _ = main.read_animation_frames(output)
+    assert decoded[0].shape == frame.shape
+    assert np.abs(decoded[0].astype(int) - frame.astype(int)).mean() < 40
+
+
+def test_map_to_palette_is_exact_for_palette_colors():
+    palette = np.array([[0, 0, 0], [255, 0, 0], [0, 0, 255]], dtype=np.uint8)
+    rgb = np.array([[[255, 0, 0], [0, 0, 255], [250, 10, 5], [1, 1, 1]]], dtype=np.uint8)
+    assert main.map_to_palette(rgb, palette).tolist() == [[1, 2, 1, 0]]
+
+
+def test_blurred_animation_keeps_colors_outside_faces(engine):
+    frames = []
+    for channel in (0, 2):
+        rgb = ramp(channel, height=160)
+        rgb[40:120, 60:140] = (0, 255, 0)  # 需打码的人脸
+        rgb[60:100, 80:120:2] = (30, 60, 90)
+        rgb[60:100, 81:120:2] = (200, 100, 50)
+        frames.append(rgb)
+    data = make_gif(frames)
+
+    output = engine.blur_animation_blob(data, ".gif")
+    original, _, _ = main.read_animation_frames(data)
+    written, _, _ = main.read_animation_frames(output)
+    for source, blurred in zip(original, written):
+        assert not np.array_equal(source[40:120, 60:140], blurred[40:120, 60:140])
+        outside = np.ones(source.shape[:2], dtype=bool)
+        outside[20:140, 40:160] = False
+        np.testing.assert_array_equal(source[outside], blurred[outside])
@@ -0,0 +1,103 @@
+import asyncio
+
+import cv2
+import numpy as np
+
+import main
+from conftest import face_image
+
+
+def encode_png(img):
+    return cv2.imencode(".png", img)[1].tobytes()
+
+
+def test_concurrent_small_images_are_batched(engine, fake_models):
+    images = [face_image(green=[(20 + n, 30, 90 + n, 110)], red=[(180, 40, 260, 130)], seed=n) for n in range(16)]
+    expected = [engine.detect_face_boxes(img.copy()) for img in images]
+    for instance in fake_models.instances:
+        instance.models["recognition"].batch_sizes.clear()
+
+    async def run():
+        async with main.AsyncFaceBlurrer(engine, batch_window_ms=50) as blurrer:
+            results = await asyncio.gather(*(blurrer.detect_faces(img) for img in images))
+            return results, blurrer.stats()
+
+    results, stats = asyncio.run(run())
+    for boxes, expected_boxes in zip(results, expected):
+        np.testing.assert_allclose(boxes, expected_boxes)
+    assert 0 < stats["batches"] < len(images)
+    assert stats["mean_batch_size"] > 1
+    # 同一批中所有人脸一次送入识别模型
+    batch_sizes = [size for instance in fake_models.instances for size in instance.models["recognition"].batch_sizes]
+    assert max(batch_sizes) > 2
+
+
+def test_large_images_bypass_batching(engine, monkeypatch):
+    monkeypatch.setattr(main, "ASYNC_BATCH_MAX_PIXELS", 100 * 100)
+
+    async def run():
+        async with main.AsyncFaceBlurrer(engine) as blurrer:
+            await asyncio.gather(*(blurrer.detect_faces(face_image(seed=n)) for n in range(4)))
+            return blurrer.stats()
+
+    assert asyncio.run(run())["batches"] == 0
+
+
+def test_blur_image_bytes_matches_sync_path(engine):
+    data = encode_png(face_image(green=[(40, 40, 120, 130)], red=[(180, 40, 260, 130)]))
+    expected, _ = engine.process_image_blob(data, "png", "face.png")
+
+    async def run():
+        async with main.AsyncFaceBlurrer(engine) as blurrer:
+            return await blurrer.blur_image_bytes(data)
+
+    assert asyncio.run(run()) == expected
+
+
+def test_images_without_blurred_faces_are_returned_unchanged(engine):
+    no_face = encode_png(face_image(seed=1))
+    whitelisted = cv2.imencode(".jpg", face_image(red=[(60, 50, 140, 140)], seed=2))[1].tobytes()
+
+    async def run():
+        async with main.AsyncFaceBlurrer(engine) as blurrer:
+            return await asyncio.gather(blurrer.blur_image_bytes(no_face), blurrer.blur_image_bytes(whitelisted),
+                                        blurrer.blur_image_bytes(no_face, ext="jpg"))
+
+    same_png, same_jpg, converted = asyncio.run(run())
+    assert same_png is no_face
+    assert same_jpg is whitelisted
+    assert main.image_blob_format(converted) == "jpg"
+
+
+def test_pending_requests_are_bounded(engine, monkeypatch):
+    peak = []
+    detect_batch = engine.detect_face_boxes_batch
+
+    async def run():
+        async with main.AsyncFaceBlurrer(engine, max_pending=3, batch_size=2) as blurrer:
+            def recording(imgs):
+                peak.append(blurrer.pending)
+                return detect_batch(imgs)
+
+            monkeypatch.setattr(engine, "detect_face_boxes_batch", recording)
+            await asyncio.gather(*(blurrer.detect_faces(face_image(seed=n)) for n in range(12)))
+            return blurrer.stats()
+
+    stats = asyncio.run(run())
+    assert max(peak) <= 3
+    assert stats["pending"] == 0
+
+
+def test_blur_frames_keeps_input_order(engine):
+    frames = [face_image(green=[(40, 40, 120, 130)] if n % 2 else (), seed=n) for n in range(10)]
+    originals = [frame.copy() for frame in frames]
+
+    async def run():
+        async with main.AsyncFaceBlurrer(engine) as blurrer:
+            return [frame async for frame in blurrer.blur_frames(iter(frames), window=3)]
+
+    output = asyncio.run(run())
+    assert len(output) == len(frames)
+    for n, (frame, original) in enumerate(zip(output, originals)):
+        assert frame is frames[n]
+        assert np.array_equal(frame, original) == (n % 2 == 0)
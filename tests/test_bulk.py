@@ -0,0 +1,91 @@
+import os
+
+import cv2
+import pytest
+
+import main
+from conftest import face_image
+
+
+def make_file(path, data=b"data", mtime=1000):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "in"
+    for name in ("a.jpg", "sub/b.PNG", "sub/deeper/c.webp", "notes.txt", "out/old.jpg"):
+        make_file(root / name)
+    return root
+
+
+def relatives(jobs):
+    return [relative.replace(os.sep, "/") for _, _, relative in jobs]
+
+
+def test_tree_is_walked_in_order_and_output_dir_is_skipped(tree):
+    jobs, up_to_date = main.collect_bulk_images(str(tree), str(tree / "out"))
+    assert relatives(jobs) == ["a.jpg", "sub/b.PNG", "sub/deeper/c.webp"]
+    assert up_to_date == 0
+    assert jobs[1][1] == os.path.join(str(tree / "out"), "sub", "b.PNG")
+
+
+def test_up_to_date_outputs_are_skipped_unless_forced(tree, tmp_path):
+    output = tmp_path / "out"
+    make_file(output / "a.jpg", mtime=1000)          # 不早于输入：已是最新
+    make_file(output / "sub" / "b.PNG", mtime=999)   # 早于输入：重新处理
+    jobs, up_to_date = main.collect_bulk_images(str(tree), str(output))
+    assert relatives(jobs) == ["out/old.jpg", "sub/b.PNG", "sub/deeper/c.webp"]
+    assert up_to_date == 1
+    jobs, up_to_date = main.collect_bulk_images(str(tree), str(output), force=True)
+    assert (len(jobs), up_to_date) == (4, 0)
+
+
+def test_list_file_paths_are_relative_to_input_root(tree, tmp_path):
+    list_path = tmp_path / "list.txt"
+    list_path.write_text("sub/b.PNG\n\n%s\n" % (tree / "a.jpg"), encoding="utf-8")
+    jobs, _ = main.collect_bulk_images(str(tree), str(tmp_path / "out"), str(list_path))
+    assert relatives(jobs) == ["sub/b.PNG", "a.jpg"]
+
+    list_path.write_text("../elsewhere.jpg\n", encoding="utf-8")
+    with pytest.raises(ValueError):
+        main.collect_bulk_images(str(tree), str(tmp_path / "out"), str(list_path))
+
+
+def exif_jpeg(img):
+    encoded = cv2.imencode(".jpg", img)[1].tobytes()
+    exif = b"Exif\x00\x00II*\x00\x08\x00\x00\x00\x00\x00"
+    segment = b"\xff\xe1" + (len(exif) + 2).to_bytes(2, "big") + exif
+    return encoded[:2] + segment + encoded[2:], segment
+
+
+def test_reencoded_jpeg_keeps_exif():
+    data, segment = exif_jpeg(face_image(seed=1))
+    assert main.jpeg_metadata_segments(data) == segment
+    encoded = cv2.imencode(".jpg", face_image(seed=2))[1].tobytes()
+    merged = main.copy_jpeg_metadata(data, encoded)
+    assert main.jpeg_metadata_segments(merged) == segment
+    # JFIF段仍在最前
+    assert merged[2:4] == b"\xff\xe0"
+    assert main.copy_jpeg_metadata(encoded, encoded) == encoded
+
+
+def test_directory_is_processed_and_rerun_skips_finished_images(engine, tolerant_detector, tmp_path):
+    root, output = tmp_path / "in", tmp_path / "out"
+    blurred, _ = exif_jpeg(face_image(green=[(40, 40, 120, 130)], seed=1))
+    make_file(root / "blur.jpg", blurred)
+    kept = make_file(root / "sub" / "keep.png", cv2.imencode(".png", face_image(red=[(60, 50, 140, 140)]))[1].tobytes())
+
+    assert engine.blur_faces_in_directory(str(root), str(output))
+    result = (output / "blur.jpg").read_bytes()
+    assert result != blurred
+    assert main.jpeg_metadata_segments(result) == main.jpeg_metadata_segments(blurred)
+    assert (output / "sub" / "keep.png").read_bytes() == kept.read_bytes()
+
+    engine.events.drain(final=True)
+    assert engine.blur_faces_in_directory(str(root), str(output))
+    lines, _, _ = engine.events.drain(final=True)
+    assert any("已是最新 2 张，待处理 0 张" in line for line in lines)
@@ -0,0 +1,157 @@
+import json
+import os
+import urllib.error
+import urllib.request
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可手动推进的时钟，代替time.time"""
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def job_queue(tmp_path):
+    job_queue = main.DaemonJobQueue(str(tmp_path / "queue" / "jobs.sqlite"))
+    yield job_queue
+    job_queue.close()
+
+
+def make_file(path, data=b"data"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_same_file_version_is_enqueued_once(job_queue, tmp_path):
+    path = make_file(tmp_path / "a.jpg")
+    assert job_queue.enqueue("inbox", path, "out/a.jpg", "image") is not None
+    assert job_queue.enqueue("inbox", path, "out/a.jpg", "image") is None
+    # 文件被修改后作为新任务入队
+    make_file(tmp_path / "a.jpg", b"changed")
+    os.utime(path, (2000, 2000))
+    assert job_queue.enqueue("inbox", path, "out/a.jpg", "image") is not None
+    assert job_queue.counts()["pending"] == 2
+
+
+def test_failed_job_is_retried_with_exponential_backoff(job_queue, tmp_path, clock):
+    job_id = job_queue.enqueue("inbox", make_file(tmp_path / "a.jpg"), "out/a.jpg", "image", max_attempts=3)
+    delays = []
+    for attempt in range(1, 4):
+        assert job_queue.ready_candidates() == [(job_id, "inbox")]
+        assert job_queue.claim(job_id)["attempts"] == attempt
+        state = job_queue.finish(job_id, False, "出错", retry_delay=10)
+        if attempt < 3:
+            assert state == "pending"
+            not_before = job_queue.list_jobs()[0]["not_before"]
+            delays.append(not_before - clock[0])
+            # 退避期间不会被调度
+            assert job_queue.ready_candidates() == []
+            clock[0] = not_before
+    assert delays == [10, 20]
+    assert state == "failed"
+    job = job_queue.list_jobs()[0]
+    assert (job["state"], job["attempts"], job["error"]) == ("failed", 3, "出错")
+    assert job_queue.ready_candidates() == []
+
+
+def test_successful_retry_marks_job_done(job_queue, tmp_path, clock):
+    job_id = job_queue.enqueue("inbox", make_file(tmp_path / "a.jpg"), "out/a.jpg", "image")
+    job_queue.claim(job_id)
+    job_queue.finish(job_id, False, retry_delay=5)
+    clock[0] += 5
+    job_queue.claim(job_id)
+    assert job_queue.finish(job_id, True) == "done"
+    assert job_queue.counts() == dict.fromkeys(main.DAEMON_JOB_STATES, 0) | {"done": 1}
+
+
+def test_claimed_job_cannot_be_claimed_twice(job_queue, tmp_path):
+    job_id = job_queue.enqueue("inbox", make_file(tmp_path / "a.jpg"), "out/a.jpg", "image")
+    assert job_queue.claim(job_id) is not None
+    assert job_queue.claim(job_id) is None
+
+
+def test_released_and_interrupted_jobs_do_not_use_attempts(job_queue, tmp_path):
+    first = job_queue.enqueue("inbox", make_file(tmp_path / "a.jpg"), "out/a.jpg", "image")
+    second = job_queue.enqueue("inbox", make_file(tmp_path / "b.jpg"), "out/b.jpg", "image")
+    job_queue.claim(first)
+    job_queue.release(first)
+    job_queue.claim(first)
+    job_queue.claim(second)
+    job_queue.close()
+
+    # 重新打开时，上次运行中断的任务恢复为等待状态
+    reopened = main.DaemonJobQueue(str(tmp_path / "queue" / "jobs.sqlite"))
+    jobs = {job["id"]: job for job in reopened.list_jobs()}
+    assert [(jobs[n]["state"], jobs[n]["attempts"]) for n in (first, second)] == [("pending", 0), ("pending", 0)]
+    reopened.close()
+
+
+def test_candidates_take_highest_priority_and_oldest_job_per_source(job_queue, tmp_path):
+    a1 = job_queue.enqueue("a", make_file(tmp_path / "a1.jpg"), "o", "image")
+    job_queue.enqueue("a", make_file(tmp_path / "a2.jpg"), "o", "image")
+    b1 = job_queue.enqueue("b", make_file(tmp_path / "b1.jpg"), "o", "image")
+    assert sorted(job_queue.ready_candidates()) == [(a1, "a"), (b1, "b")]
+    urgent = job_queue.enqueue("b", make_file(tmp_path / "b2.jpg"), "o", "image", priority=5)
+    assert job_queue.ready_candidates() == [(urgent, "b")]
+
+
+def test_watch_folder_waits_until_file_is_stable(job_queue, tmp_path):
+    inbox, outbox = tmp_path / "inbox", tmp_path / "inbox" / "out"
+    path = make_file(inbox / "sub" / "a.jpg")
+    make_file(inbox / "notes.txt")
+    make_file(outbox / "done.jpg")
+    watch = main.WatchFolder(str(inbox), str(outbox))
+
+    assert watch.scan(job_queue) == []
+    ready = watch.scan(job_queue)
+    assert ready == [(path, str(outbox / "sub" / "a.jpg"), "image")]
+
+    # 文件仍在写入（大小或修改时间变化）时重新等待
+    make_file(inbox / "sub" / "a.jpg", b"more data")
+    assert watch.scan(job_queue) == []
+    job_queue.enqueue("inbox", *watch.scan(job_queue)[0])
+    assert watch.scan(job_queue) == []
+
+
+@pytest.fixture
+def daemon(engine, job_queue):
+    return main.FaceBlurDaemon(engine, job_queue, [])
+
+
+def test_next_job_alternates_between_sources(daemon, tmp_path):
+    a = [daemon.submit("a", make_file(tmp_path / f"a{n}.jpg"), "o") for n in range(3)]
+    b = daemon.submit("b", make_file(tmp_path / "b1.jpg"), "o")
+    # 积压较多的来源不会连续占用worker：运行任务更少、更久未被调度的来源优先
+    assert [daemon.next_job()["id"] for _ in range(4)] == [a[0], b, a[1], a[2]]
+    assert daemon.next_job() is None
+
+
+def test_next_job_prefers_higher_priority(daemon, tmp_path):
+    daemon.submit("a", make_file(tmp_path / "a1.jpg"), "o")
+    urgent = daemon.submit("a", make_file(tmp_path / "a2.jpg"), "o", priority=5)
+    daemon.submit("b", make_file(tmp_path / "b1.jpg"), "o")
+    assert daemon.next_job()["id"] == urgent
+
+
+def test_jobs_endpoint_rejects_bad_limit(daemon, tmp_path):
+    daemon.submit("a", make_file(tmp_path / "a1.jpg"), "o")
+    daemon.submit("a", make_file(tmp_path / "a2.jpg"), "o")
+    server = daemon.serve_http("127.0.0.1", 0)
+    url = "http://127.0.0.1:%d/jobs" % server.server_address[1]
+    try:
+        with urllib.request.urlopen(url + "?limit=1") as response:
+            assert len(json.load(response)) == 1
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url + "?limit=abc")
+        assert error.value.code == 400
+        assert "error" in json.load(error.value)
+    finally:
+        server.shutdown()
+        server.server_close()
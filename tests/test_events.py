@@ -0,0 +1,85 @@
+import io
+import threading
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可手动推进的时钟，代替time.monotonic"""
+    now = [100.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_progress_is_coalesced_to_latest_value():
+    events = main.EventChannel()
+    for value in (10, 20, 30):
+        events.post("progress", value)
+    events.post("log", "完成")
+    assert events.drain() == (["完成"], 30, [])
+    assert events.drain() == ([], None, [])
+
+
+def test_callbacks_are_returned_in_order():
+    events = main.EventChannel()
+    calls = []
+    events.post("call", lambda: calls.append(1))
+    events.post("call", lambda: calls.append(2))
+    _, _, callbacks = events.drain()
+    for callback in callbacks:
+        callback()
+    assert calls == [1, 2]
+
+
+def test_keyed_messages_are_rate_limited_and_summarized(clock):
+    events = main.EventChannel(repeat_window=5.0)
+    for n in range(4):
+        events.post("log", f"跳过{n}", key="跳过")
+    events.post("log", "普通消息")
+    assert events.drain()[0] == ["跳过0", "普通消息"]
+
+    # 窗口内的新消息继续被省略，窗口结束时汇总
+    clock[0] += 2
+    events.post("log", "跳过4", key="跳过")
+    assert events.drain()[0] == []
+    clock[0] += 3
+    assert events.drain()[0] == ["（“跳过”类消息重复 4 次，已省略）"]
+
+    # 窗口过期后同类消息重新输出一次
+    events.post("log", "跳过5", key="跳过")
+    assert events.drain()[0] == ["跳过5"]
+
+
+def test_final_drain_flushes_open_windows(clock):
+    events = main.EventChannel(repeat_window=5.0)
+    for n in range(3):
+        events.post("log", f"重试{n}", key="重试")
+    assert events.drain(final=True)[0] == ["重试0", "（“重试”类消息重复 2 次，已省略）"]
+
+
+def test_posting_from_many_threads_loses_nothing():
+    events = main.EventChannel()
+
+    def worker(n):
+        for i in range(200):
+            events.post("log", f"{n}-{i}")
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(events.drain()[0]) == 800
+
+
+def test_console_logger_prints_progress_in_steps():
+    events = main.EventChannel()
+    output = io.StringIO()
+    with main.ConsoleEventLogger(events, interval=60, output=output) as logger:
+        for value in (2, 5, 7, 11, 100):
+            events.post("progress", value)
+            logger._flush()
+    assert output.getvalue().splitlines() == ["进度: 5%", "进度: 11%", "进度: 100%"]
@@ -0,0 +1,49 @@
+import numpy as np
+
+import main
+from conftest import face_image
+
+# 短边分别为20、60、100的检测框
+BBOXES = np.array([
+    [0, 0, 20, 30, 0.95],
+    [100, 100, 160, 160, 0.6],
+    [200, 0, 300, 120, 0.9],
+], dtype=np.float32)
+
+
+def keep(face_filter, frame_short_side=400, scale=1.0):
+    return main.filter_face_detections(BBOXES, dict(main.FACE_FILTER_DEFAULTS, **face_filter),
+                                       frame_short_side, scale).tolist()
+
+
+def test_defaults_keep_everything():
+    assert keep({}) == [0, 1, 2]
+
+
+def test_min_face_size_in_pixels_and_as_ratio():
+    assert keep({"min_face_size": 50}) == [1, 2]
+    assert keep({"min_face_size": 0.2}) == [2]  # 400 * 0.2 = 80像素
+
+
+def test_min_face_size_is_measured_on_original_frame():
+    # 检测输入缩小为原画面的一半，框在原画面中的短边为40、120、200
+    assert keep({"min_face_size": 50}, scale=0.5) == [1, 2]
+    assert keep({"min_face_size": 0.1}, frame_short_side=800, scale=0.5) == [1, 2]
+
+
+def test_min_score():
+    assert keep({"min_score": 0.8}) == [0, 2]
+
+
+def test_max_faces_keeps_largest_in_original_order():
+    assert keep({"max_faces": 2}) == [1, 2]
+    assert keep({"max_faces": 1, "min_score": 0.8}) == [2]
+
+
+def test_filtered_faces_are_not_recognized(fake_models):
+    pool = main.FaceSessionPool("", ["CPUExecutionProvider"], size=1)
+    img = face_image(green=[(20, 20, 40, 40), (100, 60, 200, 180)])
+    faces = pool.detect(img, {"min_face_size": 50})
+    assert len(faces) == 1
+    np.testing.assert_allclose(faces[0].bbox, [100, 60, 200, 180])
+    assert fake_models.instances[0].models["recognition"].batch_sizes == [1]
@@ -0,0 +1,98 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import main
+
+CPU = ["CPUExecutionProvider"]
+
+
+def profile(**overrides):
+    return {"version": main.HARDWARE_PROFILE_VERSION, "cpu_count": os.cpu_count(), "providers": CPU,
+            "session_pool_size": 3, "intra_op_threads": 2, "det_size": [416, 416],
+            "created": "2026-01-01 00:00:00", **overrides}
+
+
+def test_profile_round_trips_and_leaves_no_temp_files(tmp_path):
+    path = str(tmp_path / "cache" / "hardware_profile.json")
+    main.save_hardware_profile(path, profile())
+    assert main.load_hardware_profile(path, CPU) == profile()
+    assert os.listdir(tmp_path / "cache") == ["hardware_profile.json"]
+
+
+@pytest.mark.parametrize("overrides", [
+    {"version": main.HARDWARE_PROFILE_VERSION + 1},
+    {"cpu_count": (os.cpu_count() or 1) + 1},
+    {"providers": ["CUDAExecutionProvider"]},
+])
+def test_profile_from_another_machine_or_version_is_ignored(tmp_path, overrides):
+    path = str(tmp_path / "hardware_profile.json")
+    main.save_hardware_profile(path, profile(**overrides))
+    assert main.load_hardware_profile(path, CPU) is None
+
+
+def test_missing_or_damaged_profile_is_ignored(tmp_path):
+    path = tmp_path / "hardware_profile.json"
+    assert main.load_hardware_profile(str(path), CPU) is None
+    path.write_text("{", encoding="utf-8")
+    assert main.load_hardware_profile(str(path), CPU) is None
+
+
+def test_engine_applies_profile_unless_pool_size_is_given(fake_models, tmp_path):
+    path = str(tmp_path / "hardware_profile.json")
+    main.save_hardware_profile(path, profile())
+    engine = main.FaceBlurEngine(str(tmp_path / "insightface"), "")
+    engine.hardware_profile_path = path
+    pool = engine.initialize_face_analysis()
+    assert (pool.size, pool.intra_op_threads, pool.det_size) == (3, 2, (416, 416))
+
+    # 显式指定的实例数优先，检测尺寸仍取自配置
+    engine.session_pool_size = 1
+    pool = engine.initialize_face_analysis()
+    assert (pool.size, pool.det_size) == (1, (416, 416))
+
+
+@pytest.fixture
+def measured(monkeypatch):
+    """按(实例数, 线程数, 检测尺寸)查表返回吞吐量，代替实际测量"""
+    calls = []
+
+    def measure(insightface_dir, providers, frames, workers, intra_op_threads=None, det_size=(640, 640)):
+        calls.append((workers, intra_op_threads, det_size[0]))
+        fps = workers * 10.0 + (intra_op_threads or 0) + (640 - det_size[0]) / 8
+        return {"workers": workers, "intra_op_threads": intra_op_threads, "det_size": list(det_size), "fps": fps}
+
+    monkeypatch.setattr(main, "measure_pool_throughput", measure)
+    monkeypatch.setattr(main.os, "cpu_count", lambda: 4)
+    return calls
+
+
+def frames():
+    return [np.zeros((8, 8, 3), dtype=np.uint8)]
+
+
+def test_calibration_picks_fastest_pool_without_shrinking_detection(measured):
+    result = main.calibrate_hardware("", CPU, frames(), log=lambda line: None)
+    assert {det_size for _, _, det_size in measured} == {640}
+    assert (result["session_pool_size"], result["intra_op_threads"], result["det_size"]) == (4, 1, [640, 640])
+    assert len(result["results"]) == len(main.calibration_candidates(CPU))
+
+
+def test_calibration_shrinks_detection_until_target_is_met(measured):
+    result = main.calibrate_hardware("", CPU, frames(), target_fps=55, log=lambda line: None)
+    # 4个实例下各尺寸的吞吐量：640→41，512→57
+    assert [det_size for _, _, det_size in measured if det_size != 640] == [512]
+    assert result["det_size"] == [512, 512]
+
+
+def test_calibration_falls_back_to_fastest_when_target_is_out_of_reach(measured):
+    lines = []
+    result = main.calibrate_hardware("", CPU, frames(), target_fps=1000, log=lines.append)
+    assert result["det_size"] == [320, 320]
+    assert any("无法达到目标" in line for line in lines)
+
+
+def test_gpu_calibration_only_compares_instance_counts():
+    assert main.calibration_candidates(["CUDAExecutionProvider"]) == [(1, 0), (2, 0), (4, 0)]
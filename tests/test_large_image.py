@@ -0,0 +1,30 @@
+import numpy as np
+
+import main
+
+
+def boxes(*rows):
+    return np.array(rows, dtype=np.float32).reshape(-1, 6)
+
+
+def test_truncated_duplicate_is_absorbed_by_full_box():
+    full = [100, 100, 200, 220, 0.9, 0]
+    truncated = [100, 100, 160, 220, 0.8, 0]  # 窗口边缘截断的同一张人脸
+    np.testing.assert_array_equal(main.merge_window_boxes(boxes(truncated, full)), boxes(full))
+
+
+def test_separate_and_slightly_overlapping_faces_are_kept_in_order():
+    rows = [[0, 0, 50, 50, 0.9, 0], [300, 300, 380, 380, 0.9, 1], [40, 40, 100, 100, 0.9, 0]]
+    np.testing.assert_array_equal(main.merge_window_boxes(boxes(*rows)), boxes(*rows))
+
+
+def test_containment_threshold():
+    full = [0, 0, 100, 100, 0.9, 0]
+    partial = [60, 0, 140, 100, 0.9, 0]  # 自身面积的一半在full内
+    assert len(main.merge_window_boxes(boxes(full, partial), containment=0.5)) == 2
+    assert len(main.merge_window_boxes(boxes(full, partial), containment=0.4)) == 1
+
+
+def test_fewer_than_two_boxes_are_returned_unchanged():
+    empty = boxes()
+    assert main.merge_window_boxes(empty) is empty
@@ -0,0 +1,133 @@
+import io
+import multiprocessing
+
+import cv2
+import numpy as np
+import pytest
+
+import main
+from conftest import face_image
+
+fitz = pytest.importorskip("fitz")
+
+
+def make_pdf(path, images):
+    """生成每页一张图片的PDF，返回各图片的xref"""
+    document = fitz.open()
+    xrefs = []
+    for image in images:
+        page = document.new_page(width=400, height=300)
+        xrefs.append(page.insert_image(fitz.Rect(20, 20, 340, 260), stream=cv2.imencode(".png", image)[1].tobytes()))
+    document.save(str(path))
+    document.close()
+    return xrefs
+
+
+def raw_streams(path, xrefs):
+    with fitz.open(str(path)) as document:
+        return [document.xref_stream_raw(xref) for xref in xrefs]
+
+
+def test_only_images_with_blurred_faces_are_replaced(engine, tmp_path):
+    images = [
+        face_image(green=[(40, 40, 120, 130)], seed=1),  # 需打码
+        face_image(red=[(60, 50, 140, 140)], seed=2),    # 只有白名单人脸
+        face_image(seed=3),                              # 没有人脸
+    ]
+    source, output = tmp_path / "in.pdf", tmp_path / "out.pdf"
+    xrefs = make_pdf(source, images)
+
+    assert engine.blur_faces_in_pdf(str(source), str(output))
+    before, after = raw_streams(source, xrefs), raw_streams(output, xrefs)
+    assert before[0] != after[0]
+    assert before[1:] == after[1:]
+
+
+def test_whitelisted_only_pdf_is_copied_unchanged(engine, tmp_path):
+    source, output = tmp_path / "in.pdf", tmp_path / "out.pdf"
+    make_pdf(source, [face_image(red=[(60, 50, 140, 140)], seed=2), face_image(seed=3)])
+
+    assert engine.blur_faces_in_pdf(str(source), str(output))
+    assert output.read_bytes() == source.read_bytes()
+
+
+def test_icc_colorspace_is_kept(engine, tmp_path):
+    from PIL import Image, ImageCms
+    rgb = cv2.cvtColor(face_image(green=[(40, 40, 120, 130)]), cv2.COLOR_BGR2RGB)
+    buffer = io.BytesIO()
+    Image.fromarray(rgb).save(buffer, format="PNG",
+                              icc_profile=ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes())
+    source, output = tmp_path / "in.pdf", tmp_path / "out.pdf"
+    document = fitz.open()
+    xref = document.new_page().insert_image(fitz.Rect(0, 0, 320, 240), stream=buffer.getvalue())
+    document.save(str(source))
+    colorspace = document.xref_get_key(xref, "ColorSpace")
+    document.close()
+    assert "ICCBased" in str(colorspace) or colorspace[0] == "xref"
+
+    assert engine.blur_faces_in_pdf(str(source), str(output))
+    with fitz.open(str(output)) as document:
+        assert document.xref_get_key(xref, "ColorSpace") == colorspace
+        assert main.pdf_image_rgb_colorspace(document, xref) != "/DeviceRGB"
+    assert raw_streams(source, [xref]) != raw_streams(output, [xref])
+
+
+def test_color_key_mask_becomes_soft_mask(engine, tmp_path):
+    rgb = cv2.cvtColor(face_image(green=[(40, 40, 120, 130)]), cv2.COLOR_BGR2RGB)
+    rgb[:, :20] = (250, 250, 250)  # 颜色键范围内的像素透明
+    source, output = tmp_path / "in.pdf", tmp_path / "out.pdf"
+    document = fitz.open()
+    page = document.new_page()
+    xref = document.get_new_xref()
+    document.update_object(xref, "<< /Type /XObject /Subtype /Image /Width 320 /Height 240 /ColorSpace /DeviceRGB "
+                                 "/BitsPerComponent 8 /Mask [250 255 250 255 250 255] >>")
+    document.update_stream(xref, rgb.tobytes())
+    page.insert_image(fitz.Rect(0, 0, 320, 240), xref=xref)
+    document.save(str(source))
+    document.close()
+
+    assert engine.blur_faces_in_pdf(str(source), str(output))
+    with fitz.open(str(output)) as document:
+        assert document.xref_get_key(xref, "Mask")[0] == "null"
+        smask = int(document.xref_get_key(xref, "SMask")[1].split()[0])
+        alpha = np.frombuffer(document.xref_stream(smask), dtype=np.uint8).reshape(240, 320)
+        assert (alpha[:, :20] == 0).all()
+        assert (alpha[:, 20:] == 255).all()
+
+
+@pytest.mark.parametrize("skip_bilevel", [False, True])
+def test_bilevel_images_are_skipped_only_when_enabled(engine, tmp_path, skip_bilevel):
+    from PIL import Image
+    bilevel = Image.fromarray(np.random.default_rng(0).random((120, 160)) > 0.5).convert("1")
+    buffer = io.BytesIO()
+    bilevel.save(buffer, format="PNG")
+    source, output = tmp_path / "in.pdf", tmp_path / "out.pdf"
+    document = fitz.open()
+    document.new_page().insert_image(fitz.Rect(0, 0, 160, 120), stream=buffer.getvalue())
+    document.save(str(source))
+    document.close()
+    engine.prefilter["skip_bilevel"] = skip_bilevel
+
+    assert engine.blur_faces_in_pdf(str(source), str(output))
+    lines, _, _ = engine.events.drain(final=True)
+    assert any("1位图 1 张" in line for line in lines) == skip_bilevel
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="工作进程需要继承假模型")
+def test_parallel_pdf_keeps_whitelisted_only_images(engine, tmp_path):
+    engine.pdf_workers = 2
+    images = []
+    for page in range(main.PDF_PARALLEL_MIN_PAGES):
+        kind = page % 3
+        images.append(face_image(green=[(40, 40, 120, 130)] if kind == 0 else (),
+                                 red=[(60, 50, 140, 140)] if kind == 1 else (), seed=page))
+    source, output = tmp_path / "in.pdf", tmp_path / "out.pdf"
+    xrefs = make_pdf(source, images)
+
+    assert engine.blur_faces_in_pdf(str(source), str(output))
+    before, after = raw_streams(source, xrefs), raw_streams(output, xrefs)
+    for page, (old, new) in enumerate(zip(before, after)):
+        if page % 3 == 0:
+            assert old != new
+        else:
+            assert old == new
@@ -0,0 +1,90 @@
+import io
+
+import numpy as np
+import pytest
+
+import main
+from conftest import face_image
+
+
+@pytest.mark.parametrize("header, expected", [
+    (b"YUV4MPEG2 W640 H360 F30000:1001 Ip A1:1 C420jpeg\n", (640, 360, 30000 / 1001, "yuv420p")),
+    (b"YUV4MPEG2 W320 H240 F25:1 C420mpeg2 XYSCSS=420MPEG2\n", (320, 240, 25.0, "yuv420p")),
+    (b"YUV4MPEG2 W16 H8 Cmono\n", (16, 8, 25.0, "gray")),
+    (b"YUV4MPEG2 W16 H8\n", (16, 8, 25.0, "yuv420p")),
+])
+def test_y4m_header_is_parsed(header, expected):
+    assert main.parse_y4m_header(header) == expected
+
+
+@pytest.mark.parametrize("header", [b"RIFF W16 H8\n", b"YUV4MPEG2 W16 H8 C444\n"])
+def test_unsupported_y4m_input_is_rejected(header):
+    with pytest.raises(ValueError):
+        main.parse_y4m_header(header)
+
+
+def test_raw_frame_shapes():
+    assert main.raw_frame_shape("bgr24", 6, 4) == (4, 6, 3)
+    assert main.raw_frame_shape("gray", 6, 4) == (4, 6)
+    assert main.raw_frame_shape("yuv420p", 6, 4) == (6, 6)
+    with pytest.raises(ValueError):
+        main.raw_frame_shape("yuv420p", 5, 4)
+
+
+def y4m_stream(frames, width=6, height=4, colorspace="mono"):
+    header = f"YUV4MPEG2 W{width} H{height} F10:1 C{colorspace}\n".encode()
+    return header, header + b"".join(b"FRAME\n" + frame.tobytes() for frame in frames)
+
+
+def test_reader_reads_y4m_frames_until_end():
+    frames = [np.full((4, 6), n, dtype=np.uint8) for n in range(3)]
+    header, data = y4m_stream(frames)
+    reader = main.PipeFrameReader(io.BufferedReader(io.BytesIO(data)), "y4m")
+    assert (reader.width, reader.height, reader.fps, reader.pix_fmt) == (6, 4, 10.0, "gray")
+    assert reader.y4m_header == header
+    for expected in frames:
+        ok, frame = reader.read()
+        assert ok and np.array_equal(frame, expected)
+    assert reader.read() == (False, None)
+
+
+def test_reader_drops_truncated_last_frame():
+    data = np.zeros((2, 4, 6, 3), dtype=np.uint8).tobytes()[:-1]
+    reader = main.PipeFrameReader(io.BytesIO(data), "rawvideo", 6, 4, "bgr24")
+    assert reader.read()[0]
+    assert reader.read() == (False, None)
+
+
+def test_rawvideo_requires_frame_size():
+    with pytest.raises(ValueError):
+        main.PipeFrameReader(io.BytesIO(b""), "rawvideo")
+
+
+def test_writer_repeats_y4m_header_and_frame_markers():
+    output = io.BytesIO()
+    writer = main.PipeFrameWriter(output, b"YUV4MPEG2 W2 H1 Cmono\n")
+    writer.write(np.array([[1, 2]], dtype=np.uint8))
+    writer.write(np.array([[3, 4]], dtype=np.uint8))
+    writer.close()
+    assert output.getvalue() == b"YUV4MPEG2 W2 H1 Cmono\nFRAME\n\x01\x02FRAME\n\x03\x04"
+
+
+def test_raw_pipe_blurs_only_non_whitelisted_faces(engine):
+    frames = [face_image(red=[(40, 40, 120, 130)], green=[(180, 60, 260, 150)], seed=n) for n in range(3)]
+    output = io.BytesIO()
+
+    assert engine.process_raw_pipe(io.BytesIO(b"".join(f.tobytes() for f in frames)), output,
+                                   "rawvideo", 320, 240, "bgr24")
+    result = np.frombuffer(output.getvalue(), dtype=np.uint8).reshape(3, 240, 320, 3)
+    for source, blurred in zip(frames, result):
+        assert np.array_equal(blurred[40:130, 40:120], source[40:130, 40:120])
+        assert not np.array_equal(blurred[60:150, 180:260], source[60:150, 180:260])
+
+
+def test_y4m_pipe_passes_frames_without_faces_through(engine):
+    # 灰度帧转为BGR后三通道相同，不含假模型识别的红绿人脸
+    header, data = y4m_stream([face_image(seed=n)[:, :, 1].copy() for n in range(2)], 320, 240)
+    output = io.BytesIO()
+
+    assert engine.process_raw_pipe(io.BufferedReader(io.BytesIO(data)), output, "y4m")
+    assert output.getvalue() == data
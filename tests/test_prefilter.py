@@ -0,0 +1,60 @@
+import cv2
+import numpy as np
+
+import main
+from conftest import face_image
+
+
+def config(**overrides):
+    """启用全部检查的预筛选参数"""
+    return dict(main.PREFILTER_DEFAULTS, **{"min_colors": 24, "min_entropy": 3.0, **overrides})
+
+
+def test_photo_is_not_skipped():
+    img = face_image(green=[(40, 40, 120, 130)])
+    data = cv2.imencode(".jpg", img)[1].tobytes()
+    assert main.image_prefilter_reason(config(), 320, 240, img=img) is None
+    assert main.image_prefilter_reason(config(), 320, 240, data=data) is None
+
+
+def test_small_image_is_skipped_by_metadata_size():
+    assert main.image_prefilter_reason(config(), 16, 300) == "size"
+    assert main.image_prefilter_reason(config(min_image_size=0), 16, 300) is None
+
+
+def test_size_is_checked_on_decoded_image_without_metadata():
+    img = face_image(width=20, height=200)
+    assert main.image_prefilter_reason(config(), img=img) == "size"
+    data = cv2.imencode(".png", img)[1].tobytes()
+    assert main.image_prefilter_reason(config(), data=data) == "size"
+
+
+def test_flat_chart_is_skipped_for_few_colors():
+    img = np.full((200, 300, 3), 255, dtype=np.uint8)
+    cv2.rectangle(img, (20, 20), (120, 180), (200, 80, 30), -1)
+    cv2.rectangle(img, (150, 60), (250, 180), (30, 80, 200), -1)
+    assert main.image_prefilter_reason(config(), 300, 200, img=img) == "colors"
+    assert main.image_prefilter_reason(config(min_colors=0, min_entropy=0), 300, 200, img=img) is None
+
+
+def test_many_colors_with_uniform_brightness_is_skipped_for_low_entropy():
+    # 蓝色通道逐行变化、红色通道反向补偿，颜色很多但灰度几乎不变
+    blue = np.repeat(np.arange(0, 256, 4, dtype=np.float32)[:, None], 64, axis=1)
+    red = 200 - blue * 0.114 / 0.299
+    img = np.stack([blue, np.full_like(blue, 100), red], axis=2).round().astype(np.uint8)
+    assert main.image_prefilter_reason(config(), 64, 64, img=img) == "entropy"
+    assert main.image_prefilter_reason(config(min_entropy=0), 64, 64, img=img) is None
+
+
+def test_defaults_only_check_size():
+    img = np.full((200, 300, 3), 255, dtype=np.uint8)
+    assert main.image_prefilter_reason(main.PREFILTER_DEFAULTS, 300, 200, img=img) is None
+    assert main.image_prefilter_reason(main.PREFILTER_DEFAULTS, 16, 200, img=img) == "size"
+
+
+def test_disabled_prefilter_never_skips():
+    assert main.image_prefilter_reason(config(enabled=False), 1, 1) is None
+
+
+def test_undecodable_data_is_left_to_full_pipeline():
+    assert main.image_prefilter_reason(config(), 300, 200, data=b"not an image") is None
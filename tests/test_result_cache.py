@@ -0,0 +1,65 @@
+import cv2
+
+import main
+from conftest import face_image
+
+
+def test_make_key_depends_on_context_and_part_boundaries():
+    key = main.ResultCache.make_key("ctx", b"ab", "c")
+    assert key == main.ResultCache.make_key("ctx", b"ab", b"c")
+    assert key != main.ResultCache.make_key("ctx", b"a", b"bc")
+    assert key != main.ResultCache.make_key("other", b"ab", b"c")
+
+
+def test_put_and_get_persist_across_instances(tmp_path):
+    cache = main.ResultCache(str(tmp_path))
+    assert cache.get("a" * 64) is None
+    cache.put("a" * 64, b"processed", {"face_count": 1, "boxes": [[0, 0, 10, 10, 0.9, 0]]})
+    cache.put("b" * 64, None, {"face_count": 0, "boxes": []})
+    cache.close()
+
+    cache = main.ResultCache(str(tmp_path))
+    assert cache.get("a" * 64) == (b"processed", {"face_count": 1, "boxes": [[0, 0, 10, 10, 0.9, 0]]})
+    # 数据为None表示保留原图，与未命中不同
+    assert cache.get("b" * 64) == (None, {"face_count": 0, "boxes": []})
+    assert (cache.hits, cache.misses) == (2, 0)
+    cache.close()
+
+
+def test_missing_data_file_counts_as_miss(tmp_path):
+    cache = main.ResultCache(str(tmp_path))
+    key = "c" * 64
+    cache.put(key, b"data", {})
+    (tmp_path / key[:2] / (key[2:] + ".bin")).unlink()
+    assert cache.get(key) is None
+    assert cache.misses == 1
+    cache.close()
+
+
+def test_eviction_removes_least_recently_used_entries(tmp_path):
+    cache = main.ResultCache(str(tmp_path), max_size_mb=1)
+    keys = [str(n) * 64 for n in range(3)]
+    chunk = b"x" * 400 * 1024
+    cache.put(keys[0], chunk, {})
+    cache.put(keys[1], chunk, {})
+    cache.get(keys[0])
+    cache.put(keys[2], chunk, {})
+
+    assert cache.get(keys[1]) is None
+    assert not (tmp_path / keys[1][:2] / (keys[1][2:] + ".bin")).exists()
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+    cache.close()
+
+
+def test_cached_whitelisted_only_image_keeps_original(engine, tmp_path):
+    engine.cache = main.ResultCache(str(tmp_path / "cache"))
+    data = cv2.imencode(".png", face_image(red=[(60, 50, 140, 140)]))[1].tobytes()
+    blurred = cv2.imencode(".png", face_image(green=[(40, 40, 120, 130)]))[1].tobytes()
+
+    for _ in range(2):
+        assert engine.process_image_blob(data, "png", "white.png") == (None, 1)
+        processed, face_count = engine.process_image_blob(blurred, "png", "face.png")
+        assert processed is not None and face_count == 1
+    assert (engine.cache.hits, engine.cache.misses) == (2, 2)
+    engine.cache.close()
@@ -0,0 +1,85 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+import main
+from conftest import FakeFaceAnalysis, face_image
+
+
+def test_pool_creates_instances_on_demand_up_to_size(fake_models):
+    pool = main.FaceSessionPool("", ["CPUExecutionProvider"], size=2)
+    pool.warmup(1)
+    assert len(fake_models.instances) == 1
+
+    acquired = threading.Event()
+
+    def third():
+        with pool.acquire():
+            acquired.set()
+
+    with pool.acquire(), pool.acquire():
+        thread = threading.Thread(target=third)
+        thread.start()
+        # 两个实例都被占用时，第三个调用方等待归还，不会创建第三个实例
+        assert not acquired.wait(0.2)
+    thread.join(timeout=5)
+    assert acquired.is_set()
+    assert len(fake_models.instances) == 2
+
+
+def test_failed_instance_creation_does_not_exhaust_pool(monkeypatch):
+    attempts = []
+
+    def flaky_create(*args, **kwargs):
+        attempts.append(1)
+        if len(attempts) <= 3:
+            raise RuntimeError("provider error")
+        return FakeFaceAnalysis()
+
+    monkeypatch.setattr(main, "create_face_analysis", flaky_create)
+    pool = main.FaceSessionPool("", ["CPUExecutionProvider"], size=2)
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            with pool.acquire():
+                pass
+    assert pool._created == 0
+
+    # 之后创建成功时可以正常取得实例，不会因计数错误而永远等待
+    faces = pool.detect(face_image(green=[(40, 40, 100, 100)]), recognize=False)
+    assert len(faces) == 1
+    np.testing.assert_allclose(faces[0].bbox, [40, 40, 100, 100])
+
+
+def test_thread_budget_is_applied_when_sessions_are_created(tmp_path, monkeypatch):
+    model_dir = tmp_path / "models" / "buffalo_l"
+    model_dir.mkdir(parents=True)
+    tasks = {"det_10g.onnx": "detection", "w600k_r50.onnx": "recognition", "genderage.onnx": "genderage"}
+    for name in tasks:
+        (model_dir / name).write_bytes(b"")
+    created = []
+    prepared = []
+
+    class FakeModel:
+        def __init__(self, taskname):
+            self.taskname = taskname
+
+        def prepare(self, ctx_id, **kwargs):
+            prepared.append(self.taskname)
+
+    class FakeRouter:
+        def __init__(self, onnx_file):
+            self.onnx_file = onnx_file
+
+        def get_model(self, **kwargs):
+            created.append((os.path.basename(self.onnx_file), kwargs["sess_options"].intra_op_num_threads))
+            return FakeModel(tasks[os.path.basename(self.onnx_file)])
+
+    monkeypatch.setattr(main.model_zoo, "ModelRouter", FakeRouter)
+    app = main.create_face_analysis(str(tmp_path), ["CPUExecutionProvider"], intra_op_threads=2,
+                                    allowed_modules=main.FaceSessionPool.ALLOWED_MODULES)
+    # 每个模型只按线程预算创建一次会话
+    assert sorted(created) == sorted((name, 2) for name in tasks)
+    assert sorted(app.models) == ["detection", "recognition"]
+    assert sorted(prepared) == ["detection", "recognition"]
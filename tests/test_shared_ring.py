@@ -0,0 +1,71 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import main
+from conftest import face_image
+
+
+def fill_slot(name, slot_count, shape, index, value):
+    ring = main.SharedFrameRing(slot_count, shape, name=name)
+    ring.slot(index)[:] = value
+    ring.close()
+
+
+def test_slots_are_shared_with_other_processes():
+    ring = main.SharedFrameRing(3, (4, 6, 3))
+    try:
+        ring.slot(1)[:] = 7
+        process = multiprocessing.get_context().Process(target=fill_slot, args=(ring.name, 3, (4, 6, 3), 2, 9))
+        process.start()
+        process.join(30)
+        assert process.exitcode == 0
+        assert (ring.slot(0) == 0).all() and (ring.slot(1) == 7).all() and (ring.slot(2) == 9).all()
+    finally:
+        ring.close()
+
+
+def test_only_the_owner_unlinks_shared_memory():
+    ring = main.SharedFrameRing(2, (8,))
+    attached = main.SharedFrameRing(2, (8,), name=ring.name)
+    assert not attached.owner
+    attached.close()
+    # 映射方关闭后共享内存仍然存在
+    main.SharedFrameRing(2, (8,), name=ring.name).close()
+    ring.close()
+    with pytest.raises(FileNotFoundError):
+        main.SharedFrameRing(2, (8,), name=ring.name)
+
+
+def test_close_tolerates_outstanding_views():
+    ring = main.SharedFrameRing(2, (8,))
+    view = ring.slot(0)
+    ring.close()
+    del view
+
+
+class ListFrameReader:
+    """按read_into接口逐帧读入调用方的帧槽"""
+    def __init__(self, frames):
+        self.frames = list(frames)
+        self.shape = self.frames[0].shape
+
+    def read_into(self, frame):
+        if not self.frames:
+            return False
+        frame[:] = self.frames.pop(0)
+        return True
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="工作进程需要继承假模型")
+def test_workers_blur_frames_in_place_and_keep_order(engine):
+    frames = [face_image(green=[(40, 40, 120, 130)] if n % 2 else (), seed=n) for n in range(6)]
+    results = []
+    for idx, frame, result in engine.map_video_frames_shared(ListFrameReader(frames), 10, 2):
+        results.append((idx, frame.copy(), None if result is None else len(result[1])))
+
+    assert [idx for idx, _, _ in results] == list(range(6))
+    for (idx, frame, faces), source in zip(results, frames):
+        assert faces == idx % 2
+        assert np.array_equal(frame, source) == (idx % 2 == 0)
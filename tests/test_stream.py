@@ -0,0 +1,89 @@
+import threading
+import time
+
+import numpy as np
+
+import main
+
+
+class ListReader:
+    def __init__(self, count):
+        self.frames = [np.full((2, 2, 3), n, dtype=np.uint8) for n in range(count)]
+        self.released = False
+
+    def read(self):
+        if not self.frames:
+            return False, None
+        return True, self.frames.pop(0)
+
+    def release(self):
+        self.released = True
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_grabber_keeps_only_the_latest_frame():
+    reader = ListReader(5)
+    grabber = main.LatestFrameGrabber(reader).start()
+    grabber._thread.join(5)
+
+    latest, finished = grabber.get()
+    assert latest[0] == 4 and latest[1][0, 0, 0] == 4 and not finished
+    assert (grabber.frames_read, grabber.dropped) == (5, 4)
+    assert grabber.get(timeout=0.01) == (None, True)
+    grabber.stop()
+    assert reader.released
+
+
+def test_detector_skips_frames_while_busy():
+    release = threading.Event()
+    boxes = np.ones((1, 6), dtype=np.float32)
+
+    def detect(frame):
+        release.wait(5)
+        return boxes
+
+    detector = main.AsyncFaceDetector(detect, lambda e: None)
+    try:
+        assert detector.submit(0, np.zeros(1))
+        # 检测未完成时新帧不排队，打码沿用上一次的结果
+        assert not detector.submit(1, np.zeros(1))
+        assert detector.latest()[0] == -1
+        release.set()
+        wait_for(lambda: detector.latest()[0] == 0)
+        assert detector.latest()[1] is boxes
+        wait_for(lambda: detector.submit(2, np.zeros(1)))
+        wait_for(lambda: detector.latest()[0] == 2)
+        assert detector.detections == 2
+    finally:
+        detector.stop()
+
+
+def test_detector_errors_keep_previous_boxes():
+    errors = []
+
+    def detect(frame):
+        raise RuntimeError("推理失败")
+
+    detector = main.AsyncFaceDetector(detect, errors.append)
+    try:
+        assert detector.submit(0, np.zeros(1))
+        wait_for(lambda: errors)
+        wait_for(lambda: detector.submit(1, np.zeros(1)))
+        assert detector.latest()[0] == -1
+        assert detector.detections == 0
+    finally:
+        detector.stop()
+
+
+def test_expand_face_boxes_is_clamped_to_frame():
+    boxes = np.array([[10, 10, 30, 50, 0.9, 0], [80, 0, 100, 20, 0.8, 1]], dtype=np.float32)
+    expanded = main.expand_face_boxes(boxes, 0.25, 100, 60)
+    assert expanded[:, :4].tolist() == [[5, 0, 35, 60], [75, 0, 100, 25]]
+    assert expanded[:, 4:].tolist() == boxes[:, 4:].tolist()
+    assert main.expand_face_boxes(boxes, 0, 100, 60) is boxes
@@ -0,0 +1,351 @@
+import io
+import subprocess
+
+import cv2
+import numpy as np
+import pytest
+
+import main
+from conftest import face_image
+
+KEYFRAMES = [0, 10, 20, 30]
+
+
+def test_clean_video_is_copied_as_one_segment():
+    assert main.plan_smart_render_segments(KEYFRAMES, 0, 40, 40, set()) == [(0, 40, False)]
+
+
+def test_only_gops_with_faces_are_reencoded():
+    assert main.plan_smart_render_segments(KEYFRAMES, 0, 40, 40, {15}) == [
+        (0, 10, False), (10, 20, True), (20, 40, False)]
+
+
+def test_adjacent_dirty_gops_are_merged():
+    assert main.plan_smart_render_segments(KEYFRAMES, 0, 40, 40, {5, 15}) == [(0, 20, True), (20, 40, False)]
+
+
+def test_partial_gops_at_range_edges_are_reencoded():
+    assert main.plan_smart_render_segments(KEYFRAMES, 5, 25, 40, set()) == [
+        (5, 10, True), (10, 20, False), (20, 25, True)]
+    # 区间结束于视频末尾时，最后一个GOP是完整的
+    assert main.plan_smart_render_segments(KEYFRAMES, 20, 40, 40, set()) == [(20, 40, False)]
+
+
+def frame(value):
+    return np.full((72, 128, 3), value, dtype=np.uint8)
+
+
+def test_exact_duplicates_are_matched_against_previous_frame():
+    reuse = main.VideoFrameReuse()
+    assert [reuse.match(frame(v)) for v in (7, 7, 7, 9, 7)] == [None, "exact", "exact", None, None]
+    assert (reuse.frames, reuse.exact_hits, reuse.near_hits) == (5, 2, 0)
+
+
+def test_near_duplicates_need_near_mode_and_stop_after_max_run():
+    assert main.VideoFrameReuse().match(frame(7)) is None
+    reuse = main.VideoFrameReuse()
+    reuse.match(frame(7))
+    assert reuse.match(frame(8)) is None
+
+    reuse = main.VideoFrameReuse(near=True)
+    values = [7 + index % 2 for index in range(main.VIDEO_REUSE_MAX_RUN + 2)]
+    results = [reuse.match(frame(v)) for v in values]
+    # 连续近似重复达到上限后重新检测，避免缓慢变化的画面一直沿用旧的人脸框
+    assert results == [None] + ["near"] * main.VIDEO_REUSE_MAX_RUN + [None]
+    assert reuse.match(frame(values[-1] + main.VIDEO_REUSE_NEAR_DIFF + 1)) is None
+
+
+def test_miss_removes_hit_from_statistics():
+    reuse = main.VideoFrameReuse(near=True)
+    for value in (7, 7, 8):
+        reuse.match(frame(value))
+    reuse.miss("exact")
+    reuse.miss("near")
+    assert (reuse.exact_hits, reuse.near_hits) == (0, 0)
+    assert reuse.summary().endswith("实际检测 3/3 帧")
+
+
+class FrameList:
+    """按顺序返回给定帧的读取器，接口与cv2.VideoCapture.read相同"""
+    def __init__(self, frames):
+        self.frames = list(frames)
+
+    def read(self):
+        return (True, self.frames.pop(0).copy()) if self.frames else (False, None)
+
+
+@pytest.mark.parametrize("near", [False, True])
+def test_failed_frame_is_not_reused_for_duplicates(near):
+    engine = main.FaceBlurEngine("", "")
+    frames = [frame(7)] * 4 + [frame(8)] * 2
+    calls = []
+
+    def process(index, img):
+        calls.append(index)
+        if index == 0:
+            raise RuntimeError("推理失败")
+        return img, np.zeros((0, 6), dtype=np.float32)
+
+    reuse = main.VideoFrameReuse(near=near)
+    results = list(engine.map_video_frames(FrameList(frames), len(frames), process, reuse, lambda img, boxes: img))
+    assert [index for index, _, _ in results] == list(range(len(frames)))
+    # 第0帧失败后，与其重复的第1帧重新检测，之后的重复帧复用第1帧的结果
+    assert [result is not None for _, _, result in results] == [False] + [True] * 5
+    assert calls[:2] == [0, 1]
+    assert reuse.exact_hits + reuse.near_hits == len(frames) - len(calls)
+
+
+def test_cancel_stops_mapping_cleanly():
+    engine = main.FaceBlurEngine("", "")
+    frames = [frame(value) for value in range(40)]
+
+    def process(index, img):
+        if index == 3:
+            engine.cancel_event.set()
+        return img, np.zeros((0, 6), dtype=np.float32)
+
+    results = list(engine.map_video_frames(FrameList(frames), len(frames), process, main.VideoFrameReuse()))
+    assert engine.cancel_event.is_set()
+    assert len(results) < len(frames)
+    assert [index for index, _, _ in results] == list(range(len(results)))
+
+
+def box(x, y, size=40, whitelisted=0):
+    return [x, y, x + size, y + size, 0.9, whitelisted]
+
+
+def test_track_ids_follow_overlapping_boxes_across_gaps():
+    frames = np.array([0, 0, 1, 1, 3, 10])
+    boxes = np.array([box(0, 0), box(200, 0), box(205, 2), box(4, 2), box(8, 4), box(8, 4)], dtype=np.float32)
+    ids = main.assign_track_ids(frames, boxes, max_gap=5)
+    # 第1帧两个人脸的顺序与第0帧相反，仍按交并比接上；中断超过max_gap后开始新轨迹
+    assert ids[0] == ids[3] == ids[4]
+    assert ids[1] == ids[2]
+    assert ids[0] != ids[1]
+    assert ids[5] not in ids[:5]
+
+
+def test_sidecar_round_trips_through_npz(tmp_path):
+    sidecar = main.FaceTrackSidecar.from_frame_boxes(
+        [(5, np.array([box(0, 0)], dtype=np.float32)), (6, np.array([box(2, 2), box(100, 100, whitelisted=1)],
+                                                                    dtype=np.float32))],
+        {"source": "a.mp4"})
+    path = str(tmp_path / "a.faces.npz")
+    sidecar.save(path)
+    loaded = main.FaceTrackSidecar.load(path)
+    assert np.array_equal(loaded.frames, [5, 6, 6])
+    assert np.array_equal(loaded.boxes, sidecar.boxes)
+    assert np.array_equal(loaded.track_ids, sidecar.track_ids)
+    assert loaded.metadata == {"source": "a.mp4"}
+    assert (loaded.track_count, loaded.whitelisted_count) == (2, 1)
+    assert {frame: len(boxes) for frame, boxes in loaded.boxes_by_frame().items()} == {5: 1, 6: 2}
+
+
+def test_csv_sidecar_without_track_ids_is_associated(tmp_path):
+    path = tmp_path / "faces.csv"
+    path.write_text("﻿frame,x1,y1,x2,y2\n0,0,0,40,40\n1,2,2,42,42\n1,300,300,340,340\n", encoding="utf-8")
+    sidecar = main.FaceTrackSidecar.load(str(path))
+    assert sidecar.boxes[:, 4].tolist() == [1.0, 1.0, 1.0]
+    assert sidecar.whitelisted_count == 0
+    assert sidecar.track_ids[0] == sidecar.track_ids[1] != sidecar.track_ids[2]
+
+
+def test_csv_sidecar_keeps_given_track_ids(tmp_path):
+    path = tmp_path / "faces.csv"
+    path.write_text("frame,x1,y1,x2,y2,score,track_id,whitelisted\n0,0,0,40,40,0.8,7,1\n9,0,0,40,40,0.7,7,0\n")
+    sidecar = main.FaceTrackSidecar.load(str(path))
+    assert sidecar.track_ids.tolist() == [7, 7]
+    assert sidecar.boxes[:, 4:].tolist() == [[pytest.approx(0.8), 1.0], [pytest.approx(0.7), 0.0]]
+
+
+def test_csv_sidecar_requires_box_columns(tmp_path):
+    path = tmp_path / "faces.csv"
+    path.write_text("frame,x1,y1\n0,0,0\n")
+    with pytest.raises(ValueError, match="x2"):
+        main.FaceTrackSidecar.load(str(path))
+
+
+def write_test_video(path, frames=30, fps=10):
+    """第n帧为灰度n*8的纯色帧"""
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), fps, (64, 48))
+    for n in range(frames):
+        writer.write(np.full((48, 64, 3), n * 8, dtype=np.uint8))
+    writer.release()
+    return str(path)
+
+
+def test_clip_window_is_derived_from_frame_numbers(engine, tmp_path):
+    path = write_test_video(tmp_path / "a.avi")
+    cap, info = engine.open_video_clip(path, start_time=1.23, duration=0.96)
+    try:
+        assert (info["start_frame"], info["frame_count"]) == (12, 9)
+        # 音频按同一区间截取，区间按帧号换算
+        assert info["start_time"] == pytest.approx(1.2)
+        assert info["clip_duration"] == pytest.approx(0.9)
+        ok, frame = cap.read()
+        assert ok and abs(frame.mean() - 12 * 8) < 4
+    finally:
+        cap.release()
+
+
+def test_clip_window_is_clamped_to_video_end(engine, tmp_path):
+    path = write_test_video(tmp_path / "a.avi")
+    cap, info = engine.open_video_clip(path, start_time=2.5, duration=10)
+    cap.release()
+    assert (info["start_frame"], info["frame_count"]) == (25, 5)
+    with pytest.raises(ValueError):
+        engine.open_video_clip(path, start_time=3.0)
+
+
+class FakeProcess:
+    def __init__(self, cmd, data):
+        self.cmd = cmd
+        self.stdout = io.BufferedReader(ChunkedStream(data), buffer_size=7)
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.returncode = -15
+
+    def wait(self):
+        return self.returncode
+
+
+class ChunkedStream(io.RawIOBase):
+    """每次最多返回5字节，模拟管道的短读"""
+    def __init__(self, data):
+        self.data = data
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = min(5, len(buffer), len(self.data))
+        buffer[:count] = self.data[:count]
+        self.data = self.data[count:]
+        return count
+
+
+def test_ffmpeg_reader_seeks_on_input_and_reads_whole_frames(monkeypatch):
+    frames = np.arange(2 * 4 * 6 * 3, dtype=np.uint8).reshape(2, 4, 6, 3)
+    processes = []
+
+    def popen(cmd, **kwargs):
+        processes.append(FakeProcess(cmd, frames.tobytes() + b"\x00" * 10))
+        return processes[-1]
+
+    monkeypatch.setattr(subprocess, "Popen", popen)
+    reader = main.FFmpegFrameReader("ffmpeg", "in.mp4", 6, 4, start_time=1.5, frame_count=2)
+    cmd = processes[0].cmd
+    # -ss在-i之前：输入端跳转
+    assert cmd.index("-ss") < cmd.index("-i")
+    assert cmd[cmd.index("-frames:v") + 1] == "2"
+    for expected in frames:
+        ok, frame = reader.read()
+        assert ok and np.array_equal(frame, expected)
+    # 不足一帧的尾部数据不返回
+    assert reader.read() == (False, None)
+    reader.release()
+    assert processes[0].returncode == -15
+
+
+CLIP = {"start_frame": 10, "frame_count": 25, "fps": 10.0}
+
+
+@pytest.fixture
+def video_job(tmp_path):
+    source = tmp_path / "in.mp4"
+    source.write_bytes(b"video")
+    return lambda **clip: main.VideoJob.open(str(tmp_path / "jobs"), str(source), {**CLIP, **clip}, "ctx", 10)
+
+
+def complete(job, tmp_path, index, render="r1"):
+    temp = tmp_path / f"temp{index}.mp4"
+    temp.write_bytes(b"segment %d" % index)
+    boxes = np.array([box(0, 0)], dtype=np.float32)
+    job.complete_segment(index, str(temp), [(10 + index * 10, boxes)], render)
+
+
+def test_video_job_splits_clip_into_segments(video_job):
+    assert video_job().segment_ranges() == [(10, 10), (20, 10), (30, 5)]
+
+
+def test_completed_segments_survive_reopening(video_job, tmp_path):
+    job = video_job()
+    complete(job, tmp_path, 0)
+    complete(job, tmp_path, 2)
+
+    reopened = video_job()
+    assert reopened.job_dir == job.job_dir
+    assert reopened.completed_video(0, "r1") is not None
+    assert reopened.completed_video(1, "r1") is None
+    # 打码参数变化时视频需重新渲染，人脸框仍可复用
+    assert reopened.completed_video(0, "r2") is None
+    assert list(reopened.cached_detections(0)) == [10]
+    assert reopened.all_detections().frames.tolist() == [10, 30]
+
+
+def test_corrupted_segment_files_are_not_reused(video_job, tmp_path):
+    job = video_job()
+    complete(job, tmp_path, 0)
+    with open(job.completed_video(0, "r1"), "ab") as f:
+        f.write(b"truncated")
+    assert job.completed_video(0, "r1") is None
+    assert job.cached_detections(0) is not None
+    with open(f"{job.job_dir}/segment_00000.npz", "wb"):
+        pass
+    assert job.cached_detections(0) is None
+
+
+def test_different_clip_or_context_uses_another_job(video_job, tmp_path):
+    job = video_job()
+    assert video_job(start_frame=20).job_dir != job.job_dir
+    assert main.VideoJob.open(str(tmp_path / "jobs"), str(tmp_path / "in.mp4"), CLIP, "ctx2", 10).job_dir != job.job_dir
+
+
+def test_damaged_manifest_starts_a_fresh_job(video_job, tmp_path):
+    job = video_job()
+    complete(job, tmp_path, 0)
+    with open(f"{job.job_dir}/{main.VideoJob.MANIFEST_NAME}", "w") as f:
+        f.write("{")
+    assert video_job().manifest["segments"] == {}
+
+
+def test_contact_sheet_lays_thumbnails_out_in_a_grid():
+    thumbs = [np.full((20, 30, 3), 50 * n, dtype=np.uint8) for n in range(5)]
+    sheet = main.build_contact_sheet(thumbs, [""] * 5)
+    # 5张缩略图排成3列2行，间隔4像素
+    assert sheet.shape == (2 * 24 + 4, 3 * 34 + 4, 3)
+    assert (sheet[28:48, 4:34] == 150).all()
+    assert (sheet[28:48, 72:102] == 32).all()
+
+
+def test_preview_samples_are_spread_over_the_clip(engine, tmp_path):
+    path = write_test_video(tmp_path / "a.avi")
+    frames = engine.read_preview_frames(path, 4, start_time=1.0, duration=2.0)
+    assert [t for t, _ in frames] == pytest.approx([1.25, 1.75, 2.25, 2.75])
+    # 取样点落在两帧之间，定位到相邻的任一帧都可以
+    assert all(abs(frame.mean() / 8 - t * 10) <= 1 for t, frame in frames)
+    with pytest.raises(ValueError):
+        engine.read_preview_frames(path, 4, start_time=5.0)
+
+
+def test_preview_sheet_uses_the_full_blur_pipeline(engine, tolerant_detector, tmp_path):
+    path = tmp_path / "a.avi"
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 10, (320, 240))
+    for n in range(20):
+        writer.write(face_image(green=[(40, 40, 120, 130)], seed=n))
+    writer.release()
+    output = tmp_path / "preview.png"
+
+    assert engine.preview_video(str(path), str(output), samples=4, thumb_width=160)
+    sheet = cv2.imread(str(output))
+    assert sheet.shape == (2 * 124 + 4, 2 * 164 + 4, 3)
+    lines, _, _ = engine.events.drain(final=True)
+    assert any("预览完成: 4 个取样点，检测到 4 个人脸" in line for line in lines)
+
+
+def test_preview_video_output_must_be_mp4(engine, tmp_path):
+    assert not engine.preview_video(str(write_test_video(tmp_path / "a.avi")), str(tmp_path / "preview.avi"))
@@ -0,0 +1,156 @@
+import io
+import struct
+import zipfile
+
+import cv2
+import numpy as np
+import pytest
+
+import main
+from conftest import face_image
+
+
+def encode(img, ext, quality=90):
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if ext == "jpg" else []
+    return cv2.imencode("." + ext, img, params)[1].tobytes()
+
+
+@pytest.mark.parametrize("quality", [30, 50, 75, 90])
+def test_estimate_jpeg_quality_reads_luminance_table(quality):
+    data = encode(face_image(), "jpg", quality)
+    assert abs(main.estimate_jpeg_quality(data) - quality) <= 1
+
+
+def test_estimate_jpeg_quality_rejects_other_formats():
+    assert main.estimate_jpeg_quality(encode(face_image(), "png")) is None
+    assert main.estimate_jpeg_quality(b"") is None
+
+
+def test_encode_image_like_keeps_jpeg_quality():
+    source = encode(face_image(), "jpg", 60)
+    encoded = main.encode_image_like(face_image(seed=1), "jpg", source)
+    assert abs(main.estimate_jpeg_quality(encoded) - 60) <= 1
+
+
+# zip模式下的图片条目：需打码、只有白名单人脸、没有人脸
+MEDIA = {
+    "word/media/image1.png": encode(face_image(green=[(40, 40, 120, 130)], seed=1), "png"),
+    "word/media/image2.jpeg": encode(face_image(red=[(60, 50, 140, 140)], seed=2), "jpg"),
+    "word/media/image3.png": encode(face_image(seed=3), "png"),
+}
+
+
+def make_docx_zip(path):
+    with zipfile.ZipFile(path, "w") as zout:
+        zout.writestr("[Content_Types].xml", "<Types/>", compress_type=zipfile.ZIP_DEFLATED)
+        zout.writestr("word/document.xml", "<w:document/>" * 50, compress_type=zipfile.ZIP_DEFLATED)
+        for name, data in MEDIA.items():
+            zout.writestr(name, data, compress_type=zipfile.ZIP_DEFLATED)
+
+
+def raw_entry(path, name):
+    """读取条目的原始压缩数据"""
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as source:
+        info = archive.getinfo(name)
+        source.seek(info.header_offset)
+        header = source.read(30)
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        source.seek(name_length + extra_length, io.SEEK_CUR)
+        return source.read(info.compress_size)
+
+
+def test_docx_zip_replaces_only_images_with_blurred_faces(engine, tmp_path):
+    source, output = tmp_path / "in.docx", tmp_path / "out.docx"
+    make_docx_zip(source)
+
+    assert engine.blur_faces_in_docx_zip(str(source), str(output))
+    with zipfile.ZipFile(source) as zin, zipfile.ZipFile(output) as zout:
+        assert zin.namelist() == zout.namelist()
+        assert zout.read("word/media/image1.png") != MEDIA["word/media/image1.png"]
+        for name in zin.namelist():
+            if name != "word/media/image1.png":
+                assert zout.read(name) == zin.read(name)
+                assert raw_entry(output, name) == raw_entry(source, name)
+    assert list(tmp_path.glob("*.tmp")) == []
+
+
+def write_raw_zip(source, output):
+    with zipfile.ZipFile(source) as zin, open(source, "rb") as raw, main.RawZipWriter(str(output)) as zout:
+        zout.comment = zin.comment
+        for info in zin.infolist():
+            zout.copy_raw(raw, info)
+        new_info = zipfile.ZipInfo("新建/图片.png", date_time=(2024, 5, 6, 7, 8, 10))
+        new_info.compress_type = zipfile.ZIP_DEFLATED
+        zout.writestr(new_info, b"new data" * 100)
+        zout.writestr(zipfile.ZipInfo("stored.bin"), b"stored")
+
+
+def test_raw_zip_writer_copies_entries_and_writes_new_ones(tmp_path):
+    source, output = tmp_path / "in.zip", tmp_path / "out.zip"
+    make_docx_zip(source)
+    with zipfile.ZipFile(source, "a") as archive:
+        archive.comment = b"archive comment"
+        info = zipfile.ZipInfo("extra.txt", date_time=(2020, 1, 2, 3, 4, 6))
+        info.extra = struct.pack("<HHB", 0x5455, 1, 0)  # 非zip64的扩展字段原样保留
+        archive.writestr(info, "text", compress_type=zipfile.ZIP_STORED)
+    write_raw_zip(source, output)
+
+    with zipfile.ZipFile(source) as zin, zipfile.ZipFile(output) as zout:
+        assert zout.testzip() is None
+        assert zout.comment == b"archive comment"
+        for info in zin.infolist():
+            copied = zout.getinfo(info.filename)
+            assert zout.read(info.filename) == zin.read(info)
+            assert raw_entry(output, info.filename) == raw_entry(source, info.filename)
+            assert (copied.date_time, copied.compress_type, copied.extra) == \
+                (info.date_time, info.compress_type, info.extra)
+        assert zout.read("新建/图片.png") == b"new data" * 100
+        assert zout.getinfo("新建/图片.png").compress_type == zipfile.ZIP_DEFLATED
+        assert zout.read("stored.bin") == b"stored"
+
+
+def test_raw_zip_writer_uses_zip64_fields_past_limits(tmp_path, monkeypatch):
+    source, output = tmp_path / "in.zip", tmp_path / "out.zip"
+    make_docx_zip(source)
+    # 降低上限，使大小、偏移量和条目数都需要zip64字段
+    monkeypatch.setattr(main, "ZIP_32BIT_LIMIT", 64)
+    monkeypatch.setattr(main, "ZIP_16BIT_LIMIT", 2)
+    write_raw_zip(source, output)
+
+    with zipfile.ZipFile(source) as zin, zipfile.ZipFile(output) as zout:
+        assert zout.testzip() is None
+        assert len(zout.infolist()) == len(zin.infolist()) + 2
+        for info in zin.infolist():
+            assert zout.read(info.filename) == zin.read(info)
+        assert zout.read("新建/图片.png") == b"new data" * 100
+
+
+def test_docx_zip_failure_leaves_no_partial_output(engine, tmp_path, monkeypatch):
+    source, output = tmp_path / "in.docx", tmp_path / "out.docx"
+    make_docx_zip(source)
+
+    def broken_copy(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(main.RawZipWriter, "copy_raw", broken_copy)
+    assert not engine.blur_faces_in_docx_zip(str(source), str(output))
+    assert sorted(path.name for path in tmp_path.iterdir() if path.is_file()) == ["in.docx"]
+
+
+@pytest.mark.skipif(not main.DOCX_SUPPORTED, reason="需要python-docx")
+def test_docx_mode_keeps_whitelisted_only_images(engine, tmp_path):
+    import docx
+    source, output = tmp_path / "in.docx", tmp_path / "out.docx"
+    document = docx.Document()
+    for data in MEDIA.values():
+        document.add_picture(io.BytesIO(data))
+    document.save(str(source))
+    engine.word_mode = "docx"
+
+    assert engine.blur_faces_in_word(str(source), str(output))
+    with zipfile.ZipFile(output) as archive:
+        images = [archive.read(name) for name in archive.namelist() if name.startswith("word/media/")]
+    assert len(images) == 3
+    assert MEDIA["word/media/image1.png"] not in images
+    assert MEDIA["word/media/image2.jpeg"] in images
+    assert MEDIA["word/media/image3.png"] in images
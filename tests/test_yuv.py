@@ -0,0 +1,129 @@
+import cv2
+import numpy as np
+import pytest
+
+import main
+from conftest import face_image
+
+
+def i420(bgr):
+    return cv2.cvtColor(bgr, cv2.COLOR_BGR2YUV_I420)
+
+
+def detector_calls(fake_models):
+    return sum(instance.det_model.calls for instance in fake_models.instances)
+
+
+def test_whitelist_check_recognizes_only_face_crops(engine, fake_models, tolerant_detector, monkeypatch):
+    frame = i420(face_image(1280, 720, red=[(200, 160, 400, 400)], green=[(800, 200, 1000, 440)], seed=4))
+    original = frame.copy()
+    converted = []
+    cvt_color = cv2.cvtColor
+
+    def recording_cvt_color(src, code, *args, **kwargs):
+        if code == cv2.COLOR_YUV2BGR_I420:
+            converted.append(src.shape)
+        return cvt_color(src, code, *args, **kwargs)
+
+    monkeypatch.setattr(cv2, "cvtColor", recording_cvt_color)
+    calls = detector_calls(fake_models)
+
+    result, boxes = engine.process_yuv_frame_with_boxes(frame)
+
+    assert detector_calls(fake_models) == calls + 1
+    assert frame.shape not in converted
+    assert sorted(boxes[:, 5].tolist()) == [0.0, 1.0]
+    green = boxes[boxes[:, 5] == 0][0]
+    assert abs(green[0] - 800) < 8 and abs(green[3] - 440) < 8
+    y, y_original = result[:720], original[:720]
+    assert (y[160:400, 200:400] == y_original[160:400, 200:400]).all()
+    assert (y[200:440, 800:1000] != y_original[200:440, 800:1000]).any()
+
+
+def test_without_whitelist_no_region_is_converted(engine, tolerant_detector, monkeypatch):
+    engine.whitelist_data = None
+    frame = i420(face_image(1280, 720, red=[(200, 160, 400, 400)], seed=5))
+    monkeypatch.setattr(engine, "yuv_face_crop", lambda *args: pytest.fail("不需要识别"))
+
+    _, boxes = engine.process_yuv_frame_with_boxes(frame)
+
+    assert boxes[:, 5].tolist() == [0.0]
+
+
+def test_face_crop_matches_full_frame_conversion(engine):
+    bgr = face_image(320, 240, green=[(101, 61, 181, 151)], seed=6)
+    frame = i420(bgr)
+    face = main.Face(bbox=np.array([101, 61, 181, 151], dtype=np.float32),
+                     kps=np.array([[130, 90], [150, 90], [140, 110], [130, 130], [150, 130]], dtype=np.float32),
+                     det_score=0.9)
+
+    crop, crop_face = engine.yuv_face_crop(frame, face)
+
+    full = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420)
+    left, top = (face.kps - crop_face.kps)[0].astype(int)
+    assert left % 2 == 0 and top % 2 == 0
+    assert np.array_equal(crop, full[top:top + crop.shape[0], left:left + crop.shape[1]])
+    assert crop.shape[0] > 90 and crop.shape[1] > 80
+
+
+@pytest.fixture
+def fill_regions(engine, monkeypatch):
+    """打码改为把区域填满，记录各平面区域的尺寸和缩小倍数"""
+    calls = []
+
+    def fill(region, subsampling=1):
+        calls.append((region.shape, subsampling))
+        region[:] = 255
+
+    monkeypatch.setattr(engine, "blur_region", fill)
+    return calls
+
+
+def changed_bounds(before, after):
+    rows, cols = np.nonzero(before != after)
+    return rows.min(), rows.max() + 1, cols.min(), cols.max() + 1
+
+
+def test_planes_are_views_of_the_frame(engine):
+    frame = np.zeros((12, 8), dtype=np.uint8)
+    y, u, v = engine.yuv_planes(frame)
+    assert (y.shape, u.shape, v.shape) == ((8, 8), (4, 4), (4, 4))
+    u[:] = 1
+    v[:] = 2
+    assert (frame[8:10] == 1).all() and (frame[10:12] == 2).all() and (frame[:8] == 0).all()
+
+
+def test_region_is_aligned_to_even_coordinates_on_every_plane(engine, fill_regions):
+    frame = np.zeros((240 * 3 // 2, 320), dtype=np.uint8)
+
+    engine.blur_face_region_yuv(frame, np.array([11, 21, 51, 61, 0.9, 0], dtype=np.float32))
+
+    assert fill_regions == [((42, 42), 1), ((21, 21), 2), ((21, 21), 2)]
+    y, u, v = engine.yuv_planes(frame)
+    assert changed_bounds(np.zeros_like(y), y) == (20, 62, 10, 52)
+    for plane in (u, v):
+        assert changed_bounds(np.zeros_like(plane), plane) == (10, 31, 5, 26)
+
+
+def test_region_is_clamped_to_frame(engine, fill_regions):
+    frame = np.zeros((60 * 3 // 2, 80), dtype=np.uint8)
+
+    engine.blur_face_region_yuv(frame, np.array([-5, 50, 30, 200], dtype=np.float32))
+    y = engine.yuv_planes(frame)[0]
+    assert changed_bounds(np.zeros_like(y), y) == (50, 60, 0, 30)
+
+    fill_regions.clear()
+    engine.blur_face_region_yuv(frame, np.array([90, 10, 120, 30], dtype=np.float32))
+    assert fill_regions == []
+
+
+def test_chroma_blur_covers_the_same_area(engine):
+    frame = np.random.default_rng(0).integers(0, 256, (240 * 3 // 2, 320), dtype=np.uint8)
+    original = frame.copy()
+
+    engine.blur_face_region_yuv(frame, np.array([100, 60, 200, 180], dtype=np.float32))
+
+    # 色度平面上的打码范围是亮度平面的一半
+    y_bounds = changed_bounds(engine.yuv_planes(original)[0], engine.yuv_planes(frame)[0])
+    for before, after in zip(engine.yuv_planes(original)[1:], engine.yuv_planes(frame)[1:]):
+        assert all(abs(c * 2 - y) <= 2 for c, y in zip(changed_bounds(before, after), y_bounds))